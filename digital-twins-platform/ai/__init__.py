@@ -8,6 +8,9 @@ for digital twin operations.
 Modules:
     - predictor: ML models for failure prediction and time series forecasting
     - anomaly: Anomaly detection in sensor data
+    - baseline: Streaming, mergeable sensor baselines from history
+    - multivariate: Joint anomaly models per twin type, saved to models/pretrained
+    - spectral: Batched FFT features of vibration waveforms
     - simulator: What-if scenario simulation engine
     - llm_interface: Natural language interface for twin queries
 """
@@ -25,28 +28,40 @@ from .predictor import (
 )
 from .anomaly import (
     detect_anomalies,
+    detect_anomalies_batch,
     get_anomaly_score,
     AnomalyDetector,
     AnomalyError,
     InvalidInputError as AnomalyInputError,
     InsufficientDataError as AnomalyInsufficientError,
 )
+from .baseline import (
+    build_baselines,
+    build_seasonal_baselines,
+    BaselineBuilder,
+    KLLSketch,
+    SeasonalBaselines,
+)
+from .multivariate import (
+    MultivariateDetector,
+    MultivariateModels,
+)
+from .spectral import (
+    SpectralAnalyzer,
+    SpectralBaseline,
+)
 from .simulator import (
     simulate_scenario,
     generate_scenarios,
-    SimulationEngine,
-    SimulationError,
-    InvalidStateError,
-    InvalidScenarioError,
+    ScenarioType,
+    SimulationResult,
 )
 from .llm_interface import (
     query_twin,
     generate_insights,
     explain_anomaly,
-    LLMInterface,
-    LLMError,
-    ConfigurationError,
-    APIError,
+    LLMProvider,
+    LLMConfig,
 )
 
 __all__ = [
@@ -59,24 +74,33 @@ __all__ = [
     "PredictorInputError",
     # Anomaly
     "detect_anomalies",
+    "detect_anomalies_batch",
     "get_anomaly_score",
     "AnomalyDetector",
     "AnomalyError",
     "AnomalyInputError",
     "AnomalyInsufficientError",
+    # Baseline
+    "build_baselines",
+    "build_seasonal_baselines",
+    "BaselineBuilder",
+    "KLLSketch",
+    "SeasonalBaselines",
+    # Multivariate
+    "MultivariateDetector",
+    "MultivariateModels",
+    # Spectral
+    "SpectralAnalyzer",
+    "SpectralBaseline",
     # Simulator
     "simulate_scenario",
     "generate_scenarios",
-    "SimulationEngine",
-    "SimulationError",
-    "InvalidStateError",
-    "InvalidScenarioError",
+    "ScenarioType",
+    "SimulationResult",
     # LLM
     "query_twin",
     "generate_insights",
     "explain_anomaly",
-    "LLMInterface",
-    "LLMError",
-    "ConfigurationError",
-    "APIError",
+    "LLMProvider",
+    "LLMConfig",
 ]
@@ -4,15 +4,30 @@ Detects anomalies in sensor data using statistical and ML methods
 """
 
 import numpy as np
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Sequence, Tuple
 from enum import Enum
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class AnomalyError(Exception):
+    """Base exception for anomaly detection errors."""
+    pass
+
+
+class InvalidInputError(AnomalyError):
+    """Raised when input data is invalid or malformed."""
+    pass
+
+
+class InsufficientDataError(AnomalyError):
+    """Raised when there's not enough data for detection."""
+    pass
+
+
 class AnomalyType(Enum):
     SPIKE = "spike"
     DROP = "drop"
@@ -45,6 +60,29 @@ class AnomalyResult:
     possible_causes: List[str] = field(default_factory=list)
 
 
+# Sensitivity thresholds (in standard deviations)
+SENSITIVITY_THRESHOLDS = {
+    "low": 3.0,
+    "medium": 2.0,
+    "high": 1.5,
+}
+
+# Rules in order of precedence; a reading is reported for the first it matches
+_OUT_OF_RANGE, _CRITICAL, _WARNING, _STATISTICAL = 1, 2, 3, 4
+
+# Rules only the streaming AnomalyDetector can check
+_STUCK, _DRIFT = 5, 6
+
+_POSSIBLE_CAUSES = {
+    _OUT_OF_RANGE: ["Sensor malfunction", "Calibration error", "Actual system fault"],
+    _CRITICAL: ["Equipment malfunction", "Process upset", "Safety concern"],
+    _WARNING: ["Approaching limits", "Increased load", "Environmental factors"],
+    _STATISTICAL: ["Unusual operating conditions", "Sensor noise", "Emerging issue"],
+    _STUCK: ["Frozen sensor", "Communication loss", "Stale cached value"],
+    _DRIFT: ["Sensor drift", "Gradual wear", "Changed operating point"],
+}
+
+
 def detect_anomalies(
     sensor_data: List[Dict[str, Any]],
     baseline: Optional[Dict[str, Dict]] = None,
@@ -61,114 +99,182 @@ def detect_anomalies(
     Returns:
         List of detected anomalies
     """
-    anomalies = []
-    
-    # Sensitivity thresholds (in standard deviations)
-    thresholds = {
-        "low": 3.0,
-        "medium": 2.0,
-        "high": 1.5,
-    }
-    threshold = thresholds.get(sensitivity, 2.0)
-    
+    readings = []
     for reading in sensor_data:
-        sensor_id = reading.get("id", reading.get("sensor_id", "unknown"))
-        sensor_name = reading.get("name", sensor_id)
         value = reading.get("value", reading.get("current_value"))
-        min_val = reading.get("min", 0)
-        max_val = reading.get("max", 100)
-        warning_threshold = reading.get("warning_threshold")
-        critical_threshold = reading.get("critical_threshold")
-        
-        if value is None:
-            continue
-        
-        # Get or calculate baseline
-        if baseline and sensor_id in baseline:
-            base = baseline[sensor_id]
-            mean = base.get("mean", (min_val + max_val) / 2)
-            std = base.get("std", (max_val - min_val) / 6)
-        else:
-            # Use sensor range as baseline
-            mean = (min_val + max_val) / 2
-            std = (max_val - min_val) / 6 if max_val > min_val else 1
-        
-        # Calculate deviation
-        deviation = abs(value - mean) / (std + 1e-6)
-        
-        # Check for different anomaly types
-        anomaly = None
-        
-        # Out of range check
-        if value < min_val or value > max_val:
-            anomaly = AnomalyResult(
-                is_anomaly=True,
-                anomaly_type=AnomalyType.OUT_OF_RANGE,
-                severity=AnomalySeverity.CRITICAL,
-                sensor_id=sensor_id,
-                sensor_name=sensor_name,
-                value=value,
-                expected_range=(min_val, max_val),
-                deviation=deviation,
-                timestamp=datetime.utcnow(),
-                description=f"Value {value} is outside valid range [{min_val}, {max_val}]",
-                possible_causes=["Sensor malfunction", "Calibration error", "Actual system fault"],
-            )
-        
-        # Threshold-based checks
-        elif critical_threshold and value > critical_threshold:
-            anomaly = AnomalyResult(
-                is_anomaly=True,
-                anomaly_type=AnomalyType.SPIKE,
-                severity=AnomalySeverity.CRITICAL,
-                sensor_id=sensor_id,
-                sensor_name=sensor_name,
-                value=value,
-                expected_range=(min_val, critical_threshold),
-                deviation=deviation,
-                timestamp=datetime.utcnow(),
-                description=f"Value {value} exceeds critical threshold {critical_threshold}",
-                possible_causes=["Equipment malfunction", "Process upset", "Safety concern"],
-            )
-        
-        elif warning_threshold and value > warning_threshold:
-            anomaly = AnomalyResult(
-                is_anomaly=True,
-                anomaly_type=AnomalyType.SPIKE,
-                severity=AnomalySeverity.WARNING,
-                sensor_id=sensor_id,
-                sensor_name=sensor_name,
-                value=value,
-                expected_range=(min_val, warning_threshold),
-                deviation=deviation,
-                timestamp=datetime.utcnow(),
-                description=f"Value {value} exceeds warning threshold {warning_threshold}",
-                possible_causes=["Approaching limits", "Increased load", "Environmental factors"],
-            )
-        
-        # Statistical anomaly check
-        elif deviation > threshold:
-            anomaly_type = AnomalyType.SPIKE if value > mean else AnomalyType.DROP
-            severity = AnomalySeverity.CRITICAL if deviation > threshold * 1.5 else AnomalySeverity.WARNING
-            
-            anomaly = AnomalyResult(
-                is_anomaly=True,
-                anomaly_type=anomaly_type,
-                severity=severity,
-                sensor_id=sensor_id,
-                sensor_name=sensor_name,
-                value=value,
-                expected_range=(mean - 2*std, mean + 2*std),
-                deviation=deviation,
-                timestamp=datetime.utcnow(),
-                description=f"Value {value} deviates {deviation:.1f} std devs from normal",
-                possible_causes=["Unusual operating conditions", "Sensor noise", "Emerging issue"],
-            )
-        
-        if anomaly:
-            anomalies.append(anomaly)
+        if value is not None:
+            readings.append((reading, value))
+    if not readings:
+        return []
+
+    nan = float("nan")
+    sensor_ids = [r.get("id", r.get("sensor_id", "unknown")) for r, _ in readings]
+    base = [(baseline or {}).get(sensor_id, {}) for sensor_id in sensor_ids]
+    return detect_anomalies_batch(
+        sensor_ids,
+        [value for _, value in readings],
+        [r.get("min", 0) for r, _ in readings],
+        [r.get("max", 100) for r, _ in readings],
+        warning_thresholds=[r.get("warning_threshold") or nan for r, _ in readings],
+        critical_thresholds=[r.get("critical_threshold") or nan for r, _ in readings],
+        means=[b.get("mean", nan) for b in base],
+        stds=[b.get("std", nan) for b in base],
+        sensitivity=sensitivity,
+        sensor_names=[r.get("name", sensor_id) for (r, _), sensor_id in zip(readings, sensor_ids)],
+    )
+
+
+def _column(values: Any, size: int, name: str) -> np.ndarray:
+    """One float per reading; None and scalars are broadcast"""
+    column = np.asarray(np.nan if values is None else values, dtype=float)
+    if column.ndim == 0:
+        return np.full(size, float(column))
+    if column.shape != (size,):
+        raise InvalidInputError(f"{name} has shape {column.shape}, expected ({size},)")
+    return column
+
+
+def detect_anomalies_batch(
+    sensor_ids: Sequence[str],
+    values: Any,
+    min_values: Any = 0.0,
+    max_values: Any = 100.0,
+    warning_thresholds: Any = None,
+    critical_thresholds: Any = None,
+    means: Any = None,
+    stds: Any = None,
+    sensitivity: str = "medium",
+    sensor_names: Optional[Sequence[str]] = None,
+    timestamp: Optional[datetime] = None,
+) -> List[AnomalyResult]:
+    """
+    Detect anomalies in a fleet of readings given as columns.
+    
+    Applies the rules of ``detect_anomalies`` to whole arrays at once and
+    builds results only for the flagged readings. Every column but
+    ``sensor_ids`` may also be a scalar shared by all readings. NaN marks
+    a missing value (skipped), threshold (not checked) or baseline mean
+    or std (derived from the sensor range).
     
-    return anomalies
+    Args:
+        sensor_ids: Sensor ID of each reading
+        values: Current values
+        min_values: Lower end of each sensor's valid range
+        max_values: Upper end of each sensor's valid range
+        warning_thresholds: Optional warning thresholds
+        critical_thresholds: Optional critical thresholds
+        means: Optional baseline means
+        stds: Optional baseline standard deviations
+        sensitivity: Detection sensitivity (low, medium, high)
+        sensor_names: Optional display names, defaulting to the IDs
+        timestamp: Detection time of all results, defaulting to now
+        
+    Returns:
+        List of detected anomalies, in input order
+    """
+    size = len(sensor_ids)
+    value = _column(values, size, "values")
+    low = _column(min_values, size, "min_values")
+    high = _column(max_values, size, "max_values")
+    warning = _column(warning_thresholds, size, "warning_thresholds")
+    critical = _column(critical_thresholds, size, "critical_thresholds")
+    mean = _column(means, size, "means")
+    std = _column(stds, size, "stds")
+    if sensor_names is not None and len(sensor_names) != size:
+        raise InvalidInputError(f"sensor_names has {len(sensor_names)} entries, expected {size}")
+    threshold = SENSITIVITY_THRESHOLDS.get(sensitivity, 2.0)
+
+    # Use sensor range as baseline where none is given
+    mean = np.where(np.isnan(mean), (low + high) / 2, mean)
+    std = np.where(np.isnan(std), np.where(high > low, (high - low) / 6, 1.0), std)
+    deviation = np.abs(value - mean) / (std + 1e-6)
+
+    # Comparisons with NaN are False, so missing values and thresholds never match
+    with np.errstate(invalid="ignore"):
+        rule = np.select(
+            [
+                (value < low) | (value > high),
+                (critical != 0) & (value > critical),
+                (warning != 0) & (value > warning),
+                deviation > threshold,
+            ],
+            [_OUT_OF_RANGE, _CRITICAL, _WARNING, _STATISTICAL],
+            default=0,
+        )
+    flagged = np.flatnonzero(rule)
+    if flagged.size == 0:
+        return []
+
+    timestamp = timestamp or datetime.utcnow()
+    return [
+        _make_result(
+            kind,
+            sensor_ids[i],
+            sensor_names[i] if sensor_names is not None else sensor_ids[i],
+            v, lo, hi, warn, crit, m, s, dev, threshold, timestamp,
+        )
+        for i, kind, v, lo, hi, warn, crit, m, s, dev in zip(
+            flagged.tolist(),
+            rule[flagged].tolist(),
+            value[flagged].tolist(),
+            low[flagged].tolist(),
+            high[flagged].tolist(),
+            warning[flagged].tolist(),
+            critical[flagged].tolist(),
+            mean[flagged].tolist(),
+            std[flagged].tolist(),
+            deviation[flagged].tolist(),
+        )
+    ]
+
+
+def _make_result(
+    kind: int,
+    sensor_id: str,
+    sensor_name: str,
+    value: float,
+    min_val: float,
+    max_val: float,
+    warning_threshold: float,
+    critical_threshold: float,
+    mean: float,
+    std: float,
+    deviation: float,
+    threshold: float,
+    timestamp: datetime,
+) -> AnomalyResult:
+    """The result for a reading that matched ``kind`` (one of the rules above)"""
+    if kind == _OUT_OF_RANGE:
+        anomaly_type, severity = AnomalyType.OUT_OF_RANGE, AnomalySeverity.CRITICAL
+        expected_range = (min_val, max_val)
+        description = f"Value {value} is outside valid range [{min_val}, {max_val}]"
+    elif kind == _CRITICAL:
+        anomaly_type, severity = AnomalyType.SPIKE, AnomalySeverity.CRITICAL
+        expected_range = (min_val, critical_threshold)
+        description = f"Value {value} exceeds critical threshold {critical_threshold}"
+    elif kind == _WARNING:
+        anomaly_type, severity = AnomalyType.SPIKE, AnomalySeverity.WARNING
+        expected_range = (min_val, warning_threshold)
+        description = f"Value {value} exceeds warning threshold {warning_threshold}"
+    else:
+        anomaly_type = AnomalyType.SPIKE if value > mean else AnomalyType.DROP
+        severity = AnomalySeverity.CRITICAL if deviation > threshold * 1.5 else AnomalySeverity.WARNING
+        expected_range = (mean - 2*std, mean + 2*std)
+        description = f"Value {value} deviates {deviation:.1f} std devs from normal"
+
+    return AnomalyResult(
+        is_anomaly=True,
+        anomaly_type=anomaly_type,
+        severity=severity,
+        sensor_id=sensor_id,
+        sensor_name=sensor_name,
+        value=value,
+        expected_range=expected_range,
+        deviation=deviation,
+        timestamp=timestamp,
+        description=description,
+        possible_causes=list(_POSSIBLE_CAUSES[kind]),
+    )
 
 
 def get_anomaly_score(
@@ -214,6 +320,9 @@ def detect_patterns(
     """
     Detect patterns and changes in time series data.
     
+    Compares the last two windows; ``label_patterns`` does the same for
+    every position of a series at once.
+    
     Args:
         time_series: List of sequential values
         window_size: Size of comparison windows
@@ -224,60 +333,180 @@ def detect_patterns(
     if len(time_series) < window_size * 2:
         return {"status": "insufficient_data"}
     
-    patterns = {
-        "trend": "stable",
-        "volatility": "normal",
-        "oscillation": False,
-        "stuck": False,
-        "change_point": None,
-    }
-    
-    # Detect trend
-    recent = time_series[-window_size:]
-    previous = time_series[-2*window_size:-window_size]
-    
-    recent_mean = np.mean(recent)
-    previous_mean = np.mean(previous)
-    
-    change = (recent_mean - previous_mean) / (abs(previous_mean) + 1e-6)
-    
-    if change > 0.1:
-        patterns["trend"] = "increasing"
-    elif change < -0.1:
-        patterns["trend"] = "decreasing"
-    
-    # Detect volatility change
-    recent_std = np.std(recent)
-    previous_std = np.std(previous)
+    labels = label_patterns(time_series[-2*window_size:], window_size)
+    change_point = None
+    if labels["change_point"][-1]:
+        change_point = len(time_series) - window_size
     
-    if recent_std > previous_std * 2:
-        patterns["volatility"] = "high"
-    elif recent_std < previous_std * 0.5:
-        patterns["volatility"] = "low"
-    
-    # Detect oscillation
-    diffs = np.diff(recent)
-    sign_changes = np.sum(np.diff(np.sign(diffs)) != 0)
-    if sign_changes > len(diffs) * 0.4:
-        patterns["oscillation"] = True
+    return {
+        "trend": _TREND_LABELS[labels["trend"][-1]],
+        "volatility": _VOLATILITY_LABELS[labels["volatility"][-1]],
+        "oscillation": bool(labels["oscillation"][-1]),
+        "stuck": bool(labels["stuck"][-1]),
+        "change_point": change_point,
+    }
+
+
+_TREND_LABELS = {-1: "decreasing", 0: "stable", 1: "increasing"}
+_VOLATILITY_LABELS = {-1: "low", 0: "normal", 1: "high"}
+
+
+def label_patterns(
+    time_series: Any,
+    window_size: int = 10,
+) -> Dict[str, Any]:
+    """
+    Label trend, volatility, oscillation, stuck values and change points
+    at every position of a series in one vectorized pass.
     
-    # Detect stuck value
-    if len(set(np.round(recent, 3))) <= 2:
-        patterns["stuck"] = True
+    Position ``i`` gets the labels ``detect_patterns`` gives the series
+    up to and including ``i``, comparing its last window with the one
+    before. The first ``2 * window_size - 1`` positions have no labels.
     
-    # Detect change point (simplified)
-    if abs(change) > 0.3:
-        patterns["change_point"] = len(time_series) - window_size
+    Args:
+        time_series: Sequential values (list or 1-D array)
+        window_size: Size of comparison windows
+        
+    Returns:
+        Dictionary of per-position arrays: ``trend`` and ``volatility``
+        (-1, 0, 1 for decreasing/low, stable/normal, increasing/high),
+        ``change`` (relative change of the window mean), boolean
+        ``oscillation``, ``stuck`` and ``change_point``, plus
+        ``segments``, the runs of non-normal labels
+    """
+    series = np.asarray(time_series, dtype=float)
+    if series.ndim != 1:
+        raise InvalidInputError("time_series must be one-dimensional")
+    if window_size < 2:
+        raise InvalidInputError("window_size must be at least 2")
+    size = len(series)
+    first = 2 * window_size - 1
+    labels = {
+        "trend": np.zeros(size, dtype=np.int8),
+        "volatility": np.zeros(size, dtype=np.int8),
+        "change": np.zeros(size),
+        "oscillation": np.zeros(size, dtype=bool),
+        "stuck": np.zeros(size, dtype=bool),
+        "change_point": np.zeros(size, dtype=bool),
+    }
+    if size < 2 * window_size:
+        labels["segments"] = []
+        return labels
+
+    windows = np.lib.stride_tricks.sliding_window_view(series, window_size)
+    means = windows.mean(axis=1)
+    stds = windows.std(axis=1)
+    # Window ending at each labelled position, and the one before it
+    recent, previous = slice(window_size, None), slice(None, -window_size)
+
+    change = (means[recent] - means[previous]) / (np.abs(means[previous]) + 1e-6)
+    labels["change"][first:] = change
+    labels["trend"][first:] = (change > 0.1).astype(np.int8) - (change < -0.1)
+    labels["volatility"][first:] = (
+        (stds[recent] > stds[previous] * 2).astype(np.int8) - (stds[recent] < stds[previous] * 0.5)
+    )
+    labels["change_point"][first:] = np.abs(change) > 0.3
+
+    # Sign changes among the window's differences
+    if window_size > 2:
+        turns = (np.diff(np.sign(np.diff(series))) != 0).astype(np.int64)
+        counts = np.lib.stride_tricks.sliding_window_view(turns, window_size - 2).sum(axis=1)
+        labels["oscillation"][first:] = counts[window_size:] > (window_size - 1) * 0.4
+
+    # At most two distinct values (to 3 decimals) in the window
+    labels["stuck"][first:] = _two_valued(series, window_size)[window_size:]
+
+    labels["segments"] = _segments(labels, first)
+    return labels
+
+
+def _window_sums(values: np.ndarray, size: int) -> np.ndarray:
+    """Sum of every window of ``size`` values, from one cumulative sum"""
+    total = np.concatenate(([0], np.cumsum(values)))
+    return total[size:] - total[:-size]
+
+
+def _window_extremes(values: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Min and max of every window of ``size`` values in O(n): each window
+    spans at most two blocks of ``size``, so it is the better of a suffix
+    extreme of one block and a prefix extreme of the next (van Herk).
+    """
+    n = len(values)
+    blocks = -(-n // size)
+    padded = np.concatenate((values, np.repeat(values[-1:], blocks * size - n)))
+    padded = padded.reshape(blocks, size)
+    extremes = []
+    for ufunc in (np.minimum, np.maximum):
+        prefix = ufunc.accumulate(padded, axis=1).ravel()
+        suffix = ufunc.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+        extremes.append(ufunc(suffix[: n - size + 1], prefix[size - 1 : n]))
+    return extremes[0], extremes[1]
+
+
+def _two_valued(series: np.ndarray, size: int) -> np.ndarray:
+    """
+    Whether every window of ``size`` values holds at most two distinct
+    values (to 3 decimals), without sorting the windows.
     
-    return patterns
+    Every value of such a window is its min ``lo`` or max ``hi``, which
+    holds exactly when ``sum((x - lo) * (hi - x))`` is zero, as no term
+    is negative. Expanded, the sum needs only rolling sums of ``x`` and
+    ``x²`` besides ``lo`` and ``hi``. Values are taken as integer
+    thousandths, so the sums are exact: int64 arithmetic may wrap, but
+    the result is still exact modulo 2**64, and a window's true sum is
+    far smaller unless its range exceeds about a million units. Windows
+    with a missing value are never two-valued.
+    """
+    finite = np.isfinite(series)
+    thousandths = np.rint(np.where(finite, series, 0.0) * 1000)
+    thousandths = np.clip(thousandths, -(2.0 ** 62), 2.0 ** 62).astype(np.int64)
+    lo, hi = _window_extremes(thousandths, size)
+    with np.errstate(over="ignore"):
+        spread = (
+            (lo + hi) * _window_sums(thousandths, size)
+            - _window_sums(thousandths * thousandths, size)
+            - size * lo * hi
+        )
+    return (spread == 0) & (_window_sums(~finite, size) == 0)
+
+
+def _segments(labels: Dict[str, np.ndarray], first: int) -> List[Dict[str, Any]]:
+    """Runs of equal non-normal labels as ``{pattern, label, start, end}`` (end inclusive)"""
+    names = {
+        "trend": _TREND_LABELS,
+        "volatility": _VOLATILITY_LABELS,
+        "oscillation": {1: "oscillation"},
+        "stuck": {1: "stuck"},
+    }
+    segments = []
+    for pattern, label_names in names.items():
+        values = labels[pattern][first:].astype(np.int8)
+        edges = np.flatnonzero(np.diff(values)) + 1
+        starts = np.concatenate(([0], edges))
+        ends = np.concatenate((edges, [len(values)])) - 1
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            value = int(values[start])
+            if value:
+                segments.append({
+                    "pattern": pattern,
+                    "label": label_names[value],
+                    "start": start + first,
+                    "end": end + first,
+                })
+    segments.sort(key=lambda segment: segment["start"])
+    return segments
 
 
 def calculate_baseline(
-    historical_data: List[Dict[str, List[float]]],
+    historical_data: Dict[str, List[float]],
 ) -> Dict[str, Dict[str, float]]:
     """
     Calculate baseline statistics from historical sensor data.
     
+    Needs all values in memory; ``baseline.build_baselines`` computes
+    the same statistics from history files in chunks, in parallel.
+    
     Args:
         historical_data: Dict mapping sensor_id to list of historical values
         
@@ -298,3 +527,392 @@ def calculate_baseline(
             }
     
     return baseline
+
+
+@dataclass
+class SensorState:
+    """Running statistics of one sensor, updated in constant time per reading"""
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0  # Sum of squared differences from the mean (Welford)
+    ewma: float = 0.0
+    last_value: Optional[float] = None
+    run_length: int = 0  # Consecutive readings equal to last_value
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    def update(
+        self,
+        value: float,
+        alpha: float,
+        tolerance: float,
+        bounds: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        """Add a reading; ``bounds`` clip what it contributes to the EWMA"""
+        if self.last_value is not None and abs(value - self.last_value) <= tolerance:
+            self.run_length += 1
+        else:
+            self.run_length = 1
+        self.last_value = value
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.count == 1:
+            self.ewma = value
+        else:
+            smoothed = min(max(value, bounds[0]), bounds[1]) if bounds else value
+            self.ewma += alpha * (smoothed - self.ewma)
+
+
+class AnomalyDetector:
+    """
+    Streaming anomaly detector keeping running statistics per sensor.
+    
+    Each reading is scored against the sensor's history so far (Welford
+    mean and variance), then folded into it, in constant time and memory.
+    Besides the range, threshold and deviation rules of ``detect_anomalies``
+    it flags stuck values (``stuck_run`` identical readings in a row) and
+    drift (an EWMA that strays from the long-run mean). State round-trips
+    through ``snapshot`` and ``restore``.
+    """
+
+    SNAPSHOT_VERSION = 1
+
+    def __init__(
+        self,
+        sensitivity: str = "medium",
+        alpha: float = 0.1,
+        warmup: int = 30,
+        stuck_run: int = 20,
+        tolerance: float = 1e-9,
+    ):
+        """
+        Args:
+            sensitivity: Detection sensitivity (low, medium, high)
+            alpha: EWMA smoothing factor in (0, 1]
+            warmup: Readings per sensor before statistical rules apply
+            stuck_run: Identical readings in a row reported as stuck
+            tolerance: Largest change still counted as identical
+        """
+        if sensitivity not in SENSITIVITY_THRESHOLDS:
+            raise InvalidInputError(f"Unknown sensitivity: {sensitivity}")
+        if not 0 < alpha <= 1:
+            raise InvalidInputError("alpha must be in (0, 1]")
+        if warmup < 2 or stuck_run < 2:
+            raise InvalidInputError("warmup and stuck_run must be at least 2")
+        self.sensitivity = sensitivity
+        self.alpha = alpha
+        self.warmup = warmup
+        self.stuck_run = stuck_run
+        self.tolerance = tolerance
+        self.threshold = SENSITIVITY_THRESHOLDS[sensitivity]
+        # Std of an EWMA of independent readings, relative to theirs
+        self._ewma_scale = float(np.sqrt(alpha / (2 - alpha)))
+        self.sensors: Dict[str, SensorState] = {}
+
+    def update(
+        self,
+        sensor_id: str,
+        value: float,
+        sensor_name: Optional[str] = None,
+        min_val: Optional[float] = None,
+        max_val: Optional[float] = None,
+        warning_threshold: Optional[float] = None,
+        critical_threshold: Optional[float] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> Optional[AnomalyResult]:
+        """
+        Score a reading, then add it to the sensor's statistics.
+        
+        Returns:
+            The anomaly the reading shows, or None
+        """
+        value = float(value)
+        if np.isnan(value):
+            return None
+        state = self.sensors.get(sensor_id)
+        if state is None:
+            state = self.sensors[sensor_id] = SensorState()
+
+        # Deviation is measured against the history before this reading
+        mean, std = state.mean, state.std
+        warmed_up = state.count >= self.warmup and std > 0
+        deviation = abs(value - mean) / (std + 1e-6) if warmed_up else 0.0
+        # Clipping keeps single spikes from registering as drift
+        margin = self.threshold * std
+        state.update(
+            value, self.alpha, self.tolerance, (mean - margin, mean + margin) if warmed_up else None
+        )
+
+        kind = self._classify(
+            state, value, deviation, warmed_up,
+            min_val, max_val, warning_threshold, critical_threshold,
+        )
+        if kind is None:
+            return None
+
+        sensor_name = sensor_name or sensor_id
+        timestamp = timestamp or datetime.utcnow()
+        if kind in (_STUCK, _DRIFT):
+            return self._stream_result(
+                kind, sensor_id, sensor_name, value, state, deviation, timestamp
+            )
+        nan = float("nan")
+        return _make_result(
+            kind,
+            sensor_id,
+            sensor_name,
+            value,
+            nan if min_val is None else min_val,
+            nan if max_val is None else max_val,
+            nan if warning_threshold is None else warning_threshold,
+            nan if critical_threshold is None else critical_threshold,
+            mean,
+            std,
+            deviation,
+            self.threshold,
+            timestamp,
+        )
+
+    def _classify(
+        self,
+        state: SensorState,
+        value: float,
+        deviation: float,
+        warmed_up: bool,
+        min_val: Optional[float],
+        max_val: Optional[float],
+        warning_threshold: Optional[float],
+        critical_threshold: Optional[float],
+    ) -> Optional[int]:
+        """The first rule the reading matches"""
+        if (min_val is not None and value < min_val) or (max_val is not None and value > max_val):
+            return _OUT_OF_RANGE
+        if critical_threshold and value > critical_threshold:
+            return _CRITICAL
+        if warning_threshold and value > warning_threshold:
+            return _WARNING
+        if state.run_length >= self.stuck_run:
+            return _STUCK
+        if not warmed_up:
+            return None
+        if deviation > self.threshold:
+            return _STATISTICAL
+        if self._drift(state) > self.threshold * 1.5:
+            return _DRIFT
+        return None
+
+    def _drift(self, state: SensorState) -> float:
+        """Distance of the EWMA from the mean, in std devs of the EWMA"""
+        return abs(state.ewma - state.mean) / (state.std * self._ewma_scale + 1e-6)
+
+    def _stream_result(
+        self,
+        kind: int,
+        sensor_id: str,
+        sensor_name: str,
+        value: float,
+        state: SensorState,
+        deviation: float,
+        timestamp: datetime,
+    ) -> AnomalyResult:
+        mean, std = state.mean, state.std
+        if kind == _STUCK:
+            anomaly_type = AnomalyType.STUCK_VALUE
+            description = f"Value {value} unchanged for {state.run_length} readings"
+        else:
+            anomaly_type = AnomalyType.DRIFT
+            deviation = self._drift(state)
+            direction = "above" if state.ewma > mean else "below"
+            description = f"Recent average {state.ewma:.3g} drifted {direction} normal {mean:.3g}"
+        return AnomalyResult(
+            is_anomaly=True,
+            anomaly_type=anomaly_type,
+            severity=AnomalySeverity.WARNING,
+            sensor_id=sensor_id,
+            sensor_name=sensor_name,
+            value=value,
+            expected_range=(mean - 2*std, mean + 2*std),
+            deviation=deviation,
+            timestamp=timestamp,
+            description=description,
+            possible_causes=list(_POSSIBLE_CAUSES[kind]),
+        )
+
+    def score(self, sensor_id: str, value: float) -> float:
+        """
+        Anomaly score of a value against a sensor's statistics (0-1 scale),
+        without updating them; 0 until the sensor is warmed up.
+        """
+        state = self.sensors.get(sensor_id)
+        if state is None or state.count < self.warmup:
+            return 0.0
+        return get_anomaly_score(value, {"mean": state.mean, "std": state.std})
+
+    def baseline(self) -> Dict[str, Dict[str, float]]:
+        """Mean and std per sensor, in the format ``detect_anomalies`` accepts"""
+        return {
+            sensor_id: {"mean": state.mean, "std": state.std, "count": state.count}
+            for sensor_id, state in self.sensors.items()
+        }
+
+    def reset(self, sensor_id: Optional[str] = None) -> None:
+        """Forget one sensor's statistics, or all of them"""
+        if sensor_id is None:
+            self.sensors.clear()
+        else:
+            self.sensors.pop(sensor_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serializable configuration and state"""
+        return {
+            "version": self.SNAPSHOT_VERSION,
+            "config": {
+                "sensitivity": self.sensitivity,
+                "alpha": self.alpha,
+                "warmup": self.warmup,
+                "stuck_run": self.stuck_run,
+                "tolerance": self.tolerance,
+            },
+            "sensors": {sensor_id: asdict(state) for sensor_id, state in self.sensors.items()},
+        }
+
+    @classmethod
+    def restore(cls, snapshot: Dict[str, Any]) -> "AnomalyDetector":
+        """Rebuild a detector from ``snapshot()`` output"""
+        if snapshot.get("version") != cls.SNAPSHOT_VERSION:
+            raise InvalidInputError(f"Unsupported snapshot version: {snapshot.get('version')}")
+        try:
+            detector = cls(**snapshot["config"])
+            detector.sensors = {
+                sensor_id: SensorState(**state)
+                for sensor_id, state in snapshot["sensors"].items()
+            }
+        except (KeyError, TypeError) as e:
+            raise InvalidInputError(f"Invalid detector snapshot: {e}") from e
+        return detector
+
+
+@dataclass
+class CusumDetector:
+    """
+    Streaming two-sided CUSUM change-point detector.
+    
+    The reference mean and std are learned from the first ``warmup``
+    readings; afterwards each standardized reading moves an upper and a
+    lower cumulative sum, and a change is reported when either exceeds
+    ``threshold``. ``slack`` is the shift (in std devs) ignored as noise.
+    After a change the reference is learned anew. Constant work per
+    reading; state round-trips through ``dataclasses.asdict``.
+    """
+    threshold: float = 5.0
+    slack: float = 0.5
+    warmup: int = 30
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    upper: float = 0.0
+    lower: float = 0.0
+
+    def update(self, value: float) -> int:
+        """Add a reading; returns 1 for an upward change, -1 for downward, else 0"""
+        if self.count < self.warmup:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+            return 0
+
+        std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+        z = (value - self.mean) / (std + 1e-6)
+        self.upper = max(0.0, self.upper + z - self.slack)
+        self.lower = max(0.0, self.lower - z - self.slack)
+        if self.upper > self.threshold or self.lower > self.threshold:
+            direction = 1 if self.upper > self.threshold else -1
+            self.reset()
+            return direction
+        return 0
+
+    def reset(self) -> None:
+        self.count, self.mean, self.m2, self.upper, self.lower = 0, 0.0, 0.0, 0.0, 0.0
+
+
+@dataclass
+class PageHinkleyDetector:
+    """
+    Streaming Page-Hinkley change-point detector.
+    
+    Accumulates each reading's difference from the running mean, less a
+    ``delta`` tolerance, and reports a change when the accumulation rises
+    (or, two-sided, falls) more than ``threshold`` from its extreme.
+    Unlike CUSUM it needs no warmup, but ``delta`` and ``threshold`` are
+    in the units of the readings. Constant work per reading; state
+    round-trips through ``dataclasses.asdict``.
+    """
+    threshold: float = 50.0
+    delta: float = 0.005
+    min_readings: int = 30
+    count: int = 0
+    mean: float = 0.0
+    rise: float = 0.0
+    rise_min: float = 0.0
+    fall: float = 0.0
+    fall_max: float = 0.0
+
+    def update(self, value: float) -> int:
+        """Add a reading; returns 1 for an upward change, -1 for downward, else 0"""
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+        self.rise += value - self.mean - self.delta
+        self.fall += value - self.mean + self.delta
+        self.rise_min = min(self.rise_min, self.rise)
+        self.fall_max = max(self.fall_max, self.fall)
+        if self.count < self.min_readings:
+            return 0
+        if self.rise - self.rise_min > self.threshold:
+            self.reset()
+            return 1
+        if self.fall_max - self.fall > self.threshold:
+            self.reset()
+            return -1
+        return 0
+
+    def reset(self) -> None:
+        self.count, self.mean = 0, 0.0
+        self.rise, self.rise_min, self.fall, self.fall_max = 0.0, 0.0, 0.0, 0.0
+
+
+def find_change_points(
+    time_series: Any,
+    method: str = "cusum",
+    **params: float,
+) -> List[Dict[str, int]]:
+    """
+    Run a streaming change-point detector over a whole series.
+    
+    Args:
+        time_series: Sequential values
+        method: ``cusum`` or ``page_hinkley``
+        **params: Detector parameters (e.g. threshold)
+        
+    Returns:
+        List of ``{index, direction}`` for each detected change
+    """
+    detectors = {"cusum": CusumDetector, "page_hinkley": PageHinkleyDetector}
+    if method not in detectors:
+        raise InvalidInputError(f"Unknown change-point method: {method}")
+    detector = detectors[method](**params)
+    changes = []
+    for index, value in enumerate(np.asarray(time_series, dtype=float).tolist()):
+        direction = detector.update(value)
+        if direction:
+            changes.append({"index": index, "direction": direction})
+    return changes
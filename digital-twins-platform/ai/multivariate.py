@@ -0,0 +1,345 @@
+"""
+Multivariate Module - Joint anomaly detection across a twin's sensors
+
+Failures rarely move one sensor alone: temperature, vibration and power
+shift together. ``MultivariateDetector`` learns the joint distribution of
+a twin type's sensors with a robust covariance estimate (Minimum
+Covariance Determinant) and scores readings by squared Mahalanobis
+distance, so a combination that is unusual is flagged even when every
+sensor is within its own range.
+
+Twins run through daily and weekly cycles (shifts, weekends), so one
+Gaussian over raw readings mistakes the busiest hours for anomalies.
+Given timestamps, a detector first subtracts each feature's hour-of-week
+mean, as in ``baseline.SeasonalBaseline``, and models what is left.
+
+Models are saved as ``.npz`` files in ``models/pretrained`` and loaded
+lazily by ``MultivariateModels``. Scoring a fleet is one matrix product
+per twin type.
+"""
+
+import logging
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.stats import chi2
+from sklearn.covariance import MinCovDet
+
+from .anomaly import InsufficientDataError, InvalidInputError
+from .baseline import SeasonalBaseline, read_history_chunks, seasonal_bins
+from .models import PRETRAINED_DIR
+
+logger = logging.getLogger(__name__)
+
+# Model names become file names
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+class MultivariateDetector:
+    """
+    Robust Mahalanobis-distance detector over a fixed list of features.
+
+    A reading is anomalous when its squared distance from the robust
+    centre exceeds the chi-squared ``quantile`` for the number of
+    features. Each feature's share of the distance is reported, pointing
+    at the sensors that moved. A detector fitted with timestamps is
+    seasonal: ``seasonal`` holds hour-of-week means (168 x features) that
+    readings are compared against, so scoring needs their timestamps too.
+    """
+
+    def __init__(self, features: Sequence[str], quantile: float = 0.999):
+        if not features:
+            raise InvalidInputError("features cannot be empty")
+        if len(set(features)) != len(features):
+            raise InvalidInputError("features must be unique")
+        if not 0 < quantile < 1:
+            raise InvalidInputError("quantile must be in (0, 1)")
+        self.features = list(features)
+        self.quantile = quantile
+        self.location: Optional[np.ndarray] = None
+        self.precision: Optional[np.ndarray] = None
+        self.seasonal: Optional[np.ndarray] = None
+        self.threshold = float(chi2.ppf(quantile, df=len(self.features)))
+        self.n_samples = 0
+        self.trained_at: Optional[str] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.location is not None
+
+    def fit(
+        self,
+        X: np.ndarray,
+        timestamps: Any = None,
+        random_state: int = 42,
+    ) -> "MultivariateDetector":
+        """
+        Fit on normal operation: one row per reading time, one column per
+        feature. Rows with missing values are dropped. With ``timestamps``
+        (one per row) the model is seasonal.
+        """
+        X = self._matrix(X)
+        complete = ~np.isnan(X).any(axis=1)
+        X = X[complete]
+        needed = 2 * (len(self.features) + 1)
+        if len(X) < needed:
+            raise InsufficientDataError(f"Need at least {needed} complete rows, got {len(X)}")
+        self.seasonal = None
+        if timestamps is not None:
+            bins = seasonal_bins(timestamps)
+            if len(bins) != len(complete):
+                raise InvalidInputError("Need one timestamp per row")
+            X = self._fit_seasonal(X, bins[complete])
+
+        estimator = MinCovDet(random_state=random_state).fit(X)
+        covariance = estimator.covariance_
+        # Constant sensors make the covariance singular; a tiny ridge keeps it invertible
+        ridge = 1e-9 * max(float(np.trace(covariance)) / len(self.features), 1e-12)
+        self.location = estimator.location_
+        self.precision = np.linalg.pinv(covariance + ridge * np.eye(len(self.features)))
+        self.n_samples = len(X)
+        self.trained_at = datetime.now(timezone.utc).isoformat()
+        logger.info(f"Fitted multivariate model on {len(X)} rows x {len(self.features)} features")
+        return self
+
+    def _fit_seasonal(self, X: np.ndarray, bins: np.ndarray) -> np.ndarray:
+        """Learn hour-of-week means per feature and return the training residuals"""
+        means, support = [], []
+        for column in X.T:
+            baseline = SeasonalBaseline()
+            baseline.update(bins, column)
+            means.append(baseline.table()[0])
+            support.append(baseline.support())
+        self.seasonal = np.column_stack(means)
+        # A row is part of the few-reading mean it is compared with, which
+        # pulls its residual in; scaled to the leave-one-out residual it
+        # spreads like a new reading's
+        count = np.column_stack(support)[bins]
+        return (X - self.seasonal[bins]) * count / np.maximum(count - 1, 1)
+
+    def _residuals(self, X: Any, timestamps: Any) -> np.ndarray:
+        X = self._matrix(X)
+        if self.seasonal is None:
+            return X
+        if timestamps is None:
+            raise InvalidInputError("Seasonal model needs the readings' timestamps")
+        bins = seasonal_bins(timestamps)
+        if len(bins) not in (1, len(X)):
+            raise InvalidInputError("Need one timestamp, or one per row")
+        return X - self.seasonal[bins]
+
+    def _matrix(self, X: Any) -> np.ndarray:
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.ndim != 2 or X.shape[1] != len(self.features):
+            raise InvalidInputError(
+                f"Expected rows of {len(self.features)} features, got shape {X.shape}"
+            )
+        return X
+
+    def distances(self, X: Any, timestamps: Any = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Squared Mahalanobis distance of each row, and each feature's share
+        of it (rows sum to the distance). A missing value counts as the
+        centre, adding nothing. Seasonal models need the ``timestamps`` of
+        the rows, or one timestamp for all of them.
+        """
+        if not self.is_fitted:
+            raise InvalidInputError("Model must be fitted before scoring")
+        centred = np.nan_to_num(self._residuals(X, timestamps) - self.location)
+        contributions = (centred @ self.precision) * centred
+        return contributions.sum(axis=1), contributions
+
+    def score(self, X: Any, timestamps: Any = None) -> np.ndarray:
+        """Anomaly scores (0-1): the chi-squared probability of each distance"""
+        distance, _ = self.distances(X, timestamps)
+        return chi2.cdf(distance, df=len(self.features))
+
+    def detect(
+        self,
+        twin_ids: Sequence[str],
+        X: Any,
+        top: int = 3,
+        timestamps: Any = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Score one row per twin in a single pass and describe only the
+        anomalous twins, with their ``top`` contributing features.
+        """
+        if len(twin_ids) != len(self._matrix(X)):
+            raise InvalidInputError("Need one row per twin")
+        distance, contributions = self.distances(X, timestamps)
+        flagged = np.flatnonzero(distance > self.threshold)
+        if flagged.size == 0:
+            return []
+
+        scores = chi2.cdf(distance[flagged], df=len(self.features))
+        shares = contributions[flagged] / distance[flagged, None]
+        ranked = np.argsort(-shares, axis=1)[:, :top]
+        return [
+            {
+                "twin_id": twin_ids[i],
+                "distance": float(distance[i]),
+                "threshold": self.threshold,
+                "score": float(score),
+                "contributions": {self.features[f]: float(row_shares[f]) for f in order},
+            }
+            for i, score, row_shares, order in zip(flagged.tolist(), scores, shares, ranked)
+        ]
+
+    def save(self, path: Path) -> None:
+        if not self.is_fitted:
+            raise InvalidInputError("Only fitted models can be saved")
+        arrays = {} if self.seasonal is None else {"seasonal": self.seasonal}
+        np.savez(
+            path,
+            features=np.asarray(self.features),
+            quantile=self.quantile,
+            location=self.location,
+            precision=self.precision,
+            n_samples=self.n_samples,
+            trained_at=self.trained_at,
+            **arrays,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "MultivariateDetector":
+        with np.load(path, allow_pickle=False) as data:
+            detector = cls(data["features"].tolist(), float(data["quantile"]))
+            detector.location = data["location"]
+            detector.precision = data["precision"]
+            detector.n_samples = int(data["n_samples"])
+            detector.trained_at = str(data["trained_at"])
+            if "seasonal" in data.files:
+                detector.seasonal = data["seasonal"]
+        return detector
+
+
+class MultivariateModels:
+    """
+    Multivariate detectors saved under a directory, one file per name
+    (e.g. a twin type), loaded on first use and then kept in memory.
+    """
+
+    def __init__(self, directory: Path = PRETRAINED_DIR):
+        self.directory = Path(directory)
+        self._loaded: Dict[str, MultivariateDetector] = {}
+
+    def path(self, name: str) -> Path:
+        if not _NAME_PATTERN.match(name):
+            raise InvalidInputError(f"Invalid model name: {name}")
+        return self.directory / f"multivariate-{name}.npz"
+
+    def get(self, name: str) -> MultivariateDetector:
+        detector = self._loaded.get(name)
+        if detector is None:
+            path = self.path(name)
+            if not path.exists():
+                raise InvalidInputError(f"No multivariate model named {name}")
+            detector = self._loaded[name] = MultivariateDetector.load(path)
+            logger.info(f"Loaded multivariate model {name} ({len(detector.features)} features)")
+        return detector
+
+    def save(self, name: str, detector: MultivariateDetector) -> Path:
+        path = self.path(name)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        detector.save(path)
+        self._loaded[name] = detector
+        return path
+
+    def names(self) -> List[str]:
+        prefix = len("multivariate-")
+        return sorted(p.stem[prefix:] for p in self.directory.glob("multivariate-*.npz"))
+
+    def train(
+        self,
+        name: str,
+        features: Sequence[str],
+        histories: Sequence[Tuple[str, Sequence[str]]],
+        quantile: float = 0.999,
+        seasonal: bool = True,
+    ) -> MultivariateDetector:
+        """
+        Fit and save a model on the history of one or more twins.
+
+        Args:
+            name: Model name, e.g. the twin type
+            features: Feature names, e.g. ["temp", "vib", "power"]
+            histories: Per twin, a history CSV and its sensor IDs in
+                       feature order
+            quantile: Chi-squared quantile above which readings are anomalous
+            seasonal: Model readings relative to their hour-of-week means
+                      (the histories need timestamps)
+        """
+        for _, sensor_ids in histories:
+            if len(sensor_ids) != len(features):
+                raise InvalidInputError(f"Expected {len(features)} sensor IDs, got {sensor_ids}")
+        timestamps: List[str] = []
+        matrices = []
+        for path, sensor_ids in histories:
+            row_timestamps, matrix = history_rows(path, sensor_ids)
+            timestamps += row_timestamps
+            matrices.append(matrix)
+        detector = MultivariateDetector(features, quantile).fit(
+            np.vstack(matrices), timestamps if seasonal else None
+        )
+        path = self.save(name, detector)
+        logger.info(f"Saved multivariate model {name} to {path}")
+        return detector
+
+    def scan(
+        self,
+        fleet: Dict[str, Tuple[Sequence[str], Any]],
+        top: int = 3,
+        timestamp: Any = None,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Detect anomalous twins across a fleet.
+
+        Args:
+            fleet: Per model name, the twin IDs and their current readings
+                   as a matrix (one row per twin, columns in the model's
+                   feature order)
+            top: Contributing features reported per anomalous twin
+            timestamp: When the readings were taken (default now), for
+                       seasonal models
+
+        Returns:
+            Anomalous twins per model name
+        """
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc)
+        return {
+            name: self.get(name).detect(twin_ids, X, top=top, timestamps=timestamp)
+            for name, (twin_ids, X) in fleet.items()
+        }
+
+
+def history_matrix(path: str, sensor_ids: Sequence[str]) -> np.ndarray:
+    """
+    Readings of the given sensors from a history CSV, pivoted to one row
+    per timestamp and one column per sensor (NaN where a reading is missing).
+    """
+    return history_rows(path, sensor_ids)[1]
+
+
+def history_rows(path: str, sensor_ids: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    """``history_matrix`` and the timestamp of each of its rows"""
+    columns = {sensor_id: i for i, sensor_id in enumerate(sensor_ids)}
+    rows: Dict[str, int] = {}
+    cells: List[Tuple[int, int, float]] = []
+    for ids, values, timestamps in read_history_chunks(path):
+        for sensor_id, value, timestamp in zip(ids.tolist(), values.tolist(), timestamps):
+            column = columns.get(sensor_id)
+            if column is not None:
+                cells.append((rows.setdefault(timestamp, len(rows)), column, value))
+
+    matrix = np.full((len(rows), len(sensor_ids)), np.nan)
+    if cells:
+        row, column, value = (np.asarray(part) for part in zip(*cells))
+        matrix[row.astype(int), column.astype(int)] = value
+    return list(rows), matrix
@@ -123,7 +123,7 @@ def _validate_sensor_history(
     return readings
 
 
-def predict_failure(sensor_history: list[dict]) -> dict:
+def predict_failure(sensor_history: list[dict], spectral: Optional[dict] = None) -> dict:
     """
     Predict equipment failure probability based on sensor history.
     
@@ -134,6 +134,9 @@ def predict_failure(sensor_history: list[dict]) -> dict:
         sensor_history: List of dicts with 'timestamp' and 'value' keys.
                        Each dict represents a sensor reading over time.
                        Expected to include multiple sensor types.
+        spectral: Optional spectral trend of a vibration waveform, as
+                  returned by SpectralAnalyzer.trend_indicators
+                  (high_band_growth, dominant_shift, rms_growth).
         
     Returns:
         dict containing:
@@ -204,6 +207,17 @@ def predict_failure(sensor_history: list[dict]) -> dict:
         if recent_mean > mean_value + std_value:
             risk_factors.append("Sustained elevated readings")
         
+        # Risk factors: Changes in vibration frequency content
+        if spectral:
+            if spectral.get("high_band_growth", 1.0) > 2.0:
+                risk_factors.append("Rising high-frequency vibration energy")
+                recommended_actions.append("Inspect bearings and lubrication")
+            if spectral.get("dominant_shift", 0.0) > 0.1:
+                risk_factors.append("Shift in dominant vibration frequency")
+                recommended_actions.append("Check balance and alignment")
+            if spectral.get("rms_growth", 1.0) > 1.5:
+                risk_factors.append("Growing overall vibration level")
+        
         # Calculate base probability from risk factors
         base_probability = min(0.9, len(risk_factors) * 0.15)
         
@@ -0,0 +1,316 @@
+"""
+Spectral Module - FFT features for vibration and other sampled signals
+
+Bearing wear and imbalance show up in the frequency content of vibration
+long before its level rises. ``SpectralAnalyzer`` cuts many sensors'
+waveforms into overlapping windows and transforms them all in one batched
+``rfft``, then derives band energies, the dominant frequency and its
+drift. Window functions and band matrices are cached per configuration;
+``scipy.fft`` keeps its own cache of FFT plans.
+
+``SpectralBaseline`` scores band energies with ``detect_anomalies_batch``,
+and ``SpectralAnalyzer.trend_indicators`` feeds ``predict_failure``.
+"""
+
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.fft
+from scipy.signal import get_window
+from scipy.stats import mannwhitneyu
+
+from .anomaly import (
+    AnomalyResult,
+    InsufficientDataError,
+    InvalidInputError,
+    detect_anomalies_batch,
+)
+
+logger = logging.getLogger(__name__)
+
+# Default bands as fractions of the Nyquist frequency
+DEFAULT_BANDS = ((0.0, 0.1), (0.1, 0.25), (0.25, 0.5), (0.5, 1.0))
+
+# Smallest spread of log10 band energy (about 12%), so that perfectly
+# steady bands do not flag every tiny change
+MIN_LOG_STD = 0.05
+
+# trend_indicators needs this many windows per half, and a change between
+# the halves this unlikely under no change
+MIN_TREND_WINDOWS = 5
+TREND_P_VALUE = 0.01
+
+
+@lru_cache(maxsize=32)
+def _window(name: str, size: int) -> np.ndarray:
+    window = get_window(name, size, fftbins=True)
+    window.setflags(write=False)
+    return window
+
+
+@lru_cache(maxsize=32)
+def _band_matrix(
+    size: int, sample_rate: float, bands: Tuple[Tuple[float, float], ...]
+) -> np.ndarray:
+    """0/1 matrix mapping rfft bins to bands (each bin counted once)"""
+    frequencies = scipy.fft.rfftfreq(size, d=1 / sample_rate)
+    matrix = np.zeros((len(frequencies), len(bands)))
+    for i, (low, high) in enumerate(bands):
+        last = i == len(bands) - 1
+        matrix[:, i] = (frequencies >= low) & ((frequencies <= high) if last else (frequencies < high))
+    matrix.setflags(write=False)
+    return matrix
+
+
+class SpectralAnalyzer:
+    """
+    Batched short-time spectra of many equally sampled signals.
+
+    Signals are rows of a matrix (one per sensor, same sample rate and
+    length). Each is split into windows of ``window_size`` samples every
+    ``hop`` samples, mean-removed, tapered and transformed together.
+    """
+
+    def __init__(
+        self,
+        window_size: int = 256,
+        hop: Optional[int] = None,
+        sample_rate: float = 1.0,
+        window: str = "hann",
+        bands: Optional[Sequence[Tuple[float, float]]] = None,
+        workers: Optional[int] = None,
+    ):
+        """
+        Args:
+            window_size: Samples per FFT window
+            hop: Samples between window starts (default half a window)
+            sample_rate: Samples per second
+            window: Window function name (see scipy.signal.get_window)
+            bands: Frequency bands in Hz (default: 0-10-25-50-100% of Nyquist)
+            workers: Threads for the FFT (default: scipy's, -1 for all cores)
+        """
+        if window_size < 8:
+            raise InvalidInputError("window_size must be at least 8")
+        if sample_rate <= 0:
+            raise InvalidInputError("sample_rate must be positive")
+        self.window_size = window_size
+        self.hop = hop or window_size // 2
+        if not 0 < self.hop <= window_size:
+            raise InvalidInputError("hop must be between 1 and window_size")
+        self.sample_rate = float(sample_rate)
+        self.window_name = window
+        nyquist = self.sample_rate / 2
+        if bands is None:
+            bands = [(low * nyquist, high * nyquist) for low, high in DEFAULT_BANDS]
+        self.bands = tuple((float(low), float(high)) for low, high in bands)
+        if any(low >= high for low, high in self.bands):
+            raise InvalidInputError("Each band needs low < high")
+        self.band_names = [f"band_{low:g}_{high:g}hz" for low, high in self.bands]
+        self.workers = workers
+        self.frequencies = scipy.fft.rfftfreq(window_size, d=1 / self.sample_rate)
+        # Validates the window name up front
+        _window(window, window_size)
+
+    def _signals(self, signals: Any) -> np.ndarray:
+        x = np.asarray(signals, dtype=float)
+        if x.ndim == 1:
+            x = x[np.newaxis]
+        if x.ndim != 2:
+            raise InvalidInputError("signals must be one row per sensor")
+        if x.shape[1] < self.window_size:
+            raise InsufficientDataError(
+                f"Need at least {self.window_size} samples, got {x.shape[1]}"
+            )
+        if np.isnan(x).any():
+            raise InvalidInputError("signals must not contain NaN")
+        return x
+
+    def power_spectra(self, signals: Any) -> np.ndarray:
+        """
+        One-sided power spectral density per sensor and window, shaped
+        (sensors, windows, frequencies), in units²/Hz.
+        """
+        x = self._signals(signals)
+        frames = np.lib.stride_tricks.sliding_window_view(x, self.window_size, axis=1)
+        frames = frames[:, ::self.hop]
+        window = _window(self.window_name, self.window_size)
+        tapered = (frames - frames.mean(axis=2, keepdims=True)) * window
+        spectrum = scipy.fft.rfft(tapered, axis=2, workers=self.workers)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2) / (
+            self.sample_rate * float(window @ window)
+        )
+        # Fold negative frequencies into the one-sided spectrum
+        last = -1 if self.window_size % 2 == 0 else None
+        power[..., 1:last] *= 2
+        return power
+
+    def band_energies(self, power: np.ndarray) -> np.ndarray:
+        """Energy per band, shaped (sensors, windows, bands)"""
+        matrix = _band_matrix(self.window_size, self.sample_rate, self.bands)
+        return (power @ matrix) * (self.sample_rate / self.window_size)
+
+    def dominant(self, power: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Frequency and power of the strongest non-DC peak per sensor and
+        window, refined between bins by parabolic interpolation.
+        """
+        peak = np.argmax(power[..., 1:], axis=-1) + 1
+        inner = np.clip(peak, 1, power.shape[-1] - 2)
+        log_power = np.log(power + 1e-300)
+        a, b, c = (np.take_along_axis(log_power, (inner + k)[..., None], -1)[..., 0]
+                   for k in (-1, 0, 1))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            offset = np.where(peak == inner, 0.5 * (a - c) / (a - 2 * b + c), 0.0)
+        offset = np.clip(np.nan_to_num(offset), -0.5, 0.5)
+        frequency = (peak + offset) * (self.sample_rate / self.window_size)
+        return frequency, np.take_along_axis(power, peak[..., None], -1)[..., 0]
+
+    def features(self, signals: Any) -> Dict[str, np.ndarray]:
+        """
+        Features per sensor and window, each shaped (sensors, windows):
+        ``rms`` (of the mean-removed signal), ``centroid`` (Hz),
+        ``dominant_frequency``, ``dominant_power`` and one energy per band.
+        """
+        power = self.power_spectra(signals)
+        total = power.sum(axis=-1)
+        energies = self.band_energies(power)
+        frequency, peak_power = self.dominant(power)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            centroid = np.nan_to_num((power @ self.frequencies) / total)
+        features = {
+            "rms": np.sqrt(total * (self.sample_rate / self.window_size)),
+            "centroid": centroid,
+            "dominant_frequency": frequency,
+            "dominant_power": peak_power,
+        }
+        for i, name in enumerate(self.band_names):
+            features[name] = energies[..., i]
+        return features
+
+    def feature_matrix(self, signals: Any) -> Tuple[List[str], np.ndarray]:
+        """
+        One row of features per sensor for models such as
+        ``PredictorModel``: the latest window's features plus the drift
+        of the dominant frequency across windows (Hz per window).
+        """
+        features = self.features(signals)
+        names = list(features) + ["dominant_drift"]
+        columns = [values[:, -1] for values in features.values()]
+        columns.append(_slopes(features["dominant_frequency"]))
+        return names, np.column_stack(columns)
+
+    def trend_indicators(self, signal: Any) -> Dict[str, float]:
+        """
+        How one sensor's spectrum changed from the start to the end of its
+        signal, as consumed by ``predict_failure(spectral=...)``: growth
+        of the highest band's share of energy, relative shift of the
+        dominant frequency, and growth of overall RMS.
+
+        Each compares the medians of the first and the second half of the
+        windows, and only when a Mann-Whitney test finds the halves
+        different (otherwise it reports no change), so noise and the odd
+        spike do not read as a trend.
+        """
+        features = self.features(signal)
+        windows = features["rms"].shape[1]
+        if windows < 2 * MIN_TREND_WINDOWS:
+            raise InsufficientDataError(
+                f"Need at least {2 * MIN_TREND_WINDOWS} windows for a trend, got {windows}"
+            )
+        top = features[self.band_names[-1]][0]
+        total = sum(features[name][0] for name in self.band_names)
+        share_start, share_end = _halves(top / np.maximum(total, 1e-300))
+        frequency_start, frequency_end = _halves(features["dominant_frequency"][0])
+        rms_start, rms_end = _halves(features["rms"][0])
+        return {
+            "high_band_growth": share_end / max(share_start, 1e-12),
+            "dominant_shift": abs(frequency_end - frequency_start) / max(frequency_start, 1e-12),
+            "rms_growth": rms_end / max(rms_start, 1e-12),
+        }
+
+
+def _halves(series: np.ndarray) -> Tuple[float, float]:
+    """
+    Medians of the first and second half of a series, or its overall
+    median twice if a Mann-Whitney test finds no difference
+    """
+    half = len(series) // 2
+    start, end = series[:half], series[-half:]
+    if mannwhitneyu(start, end).pvalue >= TREND_P_VALUE:
+        median = float(np.median(series))
+        return median, median
+    return float(np.median(start)), float(np.median(end))
+
+
+def _slopes(series: np.ndarray) -> np.ndarray:
+    """Least-squares slope of each row against its index"""
+    n = series.shape[-1]
+    if n < 2:
+        return np.zeros(series.shape[:-1])
+    x = np.arange(n) - (n - 1) / 2
+    return (series @ x) / float(x @ x)
+
+
+class SpectralBaseline:
+    """
+    Normal band energies per sensor, learned from healthy signals.
+
+    Energies are compared on a log scale, so a band whose energy grows
+    tenfold deviates by the same amount whatever its absolute level.
+    """
+
+    def __init__(self, analyzer: SpectralAnalyzer):
+        self.analyzer = analyzer
+        self.sensors: Dict[str, int] = {}
+        self.mean: Optional[np.ndarray] = None
+        self.std: Optional[np.ndarray] = None
+
+    def fit(self, sensor_ids: Sequence[str], signals: Any) -> "SpectralBaseline":
+        """Learn each sensor's log band energies over all windows of its signal"""
+        energies = self._log_energies(signals)
+        if len(sensor_ids) != len(energies):
+            raise InvalidInputError("Need one signal per sensor")
+        if energies.shape[1] < 2:
+            raise InsufficientDataError("Need at least two windows per signal")
+        self.sensors = {sensor_id: i for i, sensor_id in enumerate(sensor_ids)}
+        self.mean = energies.mean(axis=1)
+        self.std = np.maximum(energies.std(axis=1), MIN_LOG_STD)
+        return self
+
+    def _log_energies(self, signals: Any) -> np.ndarray:
+        power = self.analyzer.power_spectra(signals)
+        return np.log10(self.analyzer.band_energies(power) + 1e-12)
+
+    def detect(
+        self,
+        sensor_ids: Sequence[str],
+        signals: Any,
+        sensitivity: str = "medium",
+    ) -> List[AnomalyResult]:
+        """
+        Flag bands whose energy in the latest window of each signal
+        deviates from the sensor's baseline (no range check applies).
+        Results are per band, with ``sensor_id`` set to
+        ``"<sensor>:<band>"`` and values in log10 energy.
+        """
+        if self.mean is None:
+            raise InvalidInputError("Baseline must be fitted before detection")
+        missing = [sensor_id for sensor_id in sensor_ids if sensor_id not in self.sensors]
+        if missing:
+            raise InvalidInputError(f"No spectral baseline for {missing}")
+        latest = self._log_energies(signals)[:, -1]
+        if len(sensor_ids) != len(latest):
+            raise InvalidInputError("Need one signal per sensor")
+        rows = [self.sensors[sensor_id] for sensor_id in sensor_ids]
+        names = self.analyzer.band_names
+        return detect_anomalies_batch(
+            [f"{sensor_id}:{band}" for sensor_id in sensor_ids for band in names],
+            latest.ravel(),
+            np.nan,
+            np.nan,
+            means=self.mean[rows].ravel(),
+            stds=self.std[rows].ravel(),
+            sensitivity=sensitivity,
+        )
@@ -0,0 +1,423 @@
+"""
+Tests for anomaly detection
+"""
+
+import json
+import math
+import random
+from dataclasses import asdict
+
+import numpy as np
+import pytest
+
+from ai.anomaly import (
+    AnomalyDetector,
+    CusumDetector,
+    PageHinkleyDetector,
+    AnomalySeverity,
+    AnomalyType,
+    InvalidInputError,
+    SENSITIVITY_THRESHOLDS,
+    SensorState,
+    detect_anomalies,
+    detect_anomalies_batch,
+    detect_patterns,
+    find_change_points,
+    label_patterns,
+)
+
+
+def _reference(reading, baseline, sensitivity):
+    """The rules of ``detect_anomalies``, one reading at a time"""
+    threshold = SENSITIVITY_THRESHOLDS[sensitivity]
+    value = reading["value"]
+    low, high = reading.get("min", 0), reading.get("max", 100)
+    warning, critical = reading.get("warning_threshold"), reading.get("critical_threshold")
+    base = baseline.get(reading["id"], {})
+    mean = base.get("mean", (low + high) / 2)
+    std = base.get("std", (high - low) / 6 if high > low else 1)
+    deviation = abs(value - mean) / (std + 1e-6)
+
+    if value < low or value > high:
+        return AnomalyType.OUT_OF_RANGE, AnomalySeverity.CRITICAL, (low, high)
+    if critical and value > critical:
+        return AnomalyType.SPIKE, AnomalySeverity.CRITICAL, (low, critical)
+    if warning and value > warning:
+        return AnomalyType.SPIKE, AnomalySeverity.WARNING, (low, warning)
+    if deviation > threshold:
+        kind = AnomalyType.SPIKE if value > mean else AnomalyType.DROP
+        severity = (
+            AnomalySeverity.CRITICAL if deviation > threshold * 1.5 else AnomalySeverity.WARNING
+        )
+        return kind, severity, (mean - 2 * std, mean + 2 * std)
+    return None
+
+
+def _fleet(size, seed=7):
+    rng = random.Random(seed)
+    readings, baseline = [], {}
+    for i in range(size):
+        low = rng.choice([0.0, -20.0, 10.0])
+        high = low + rng.choice([10.0, 50.0, 100.0])
+        reading = {"id": f"s{i}", "name": f"Sensor {i}", "min": low, "max": high}
+        reading["value"] = rng.uniform(low - 5, high + 5)
+        if rng.random() < 0.4:
+            reading["warning_threshold"] = low + 0.7 * (high - low)
+        if rng.random() < 0.3:
+            reading["critical_threshold"] = low + 0.9 * (high - low)
+        if rng.random() < 0.5:
+            baseline[reading["id"]] = {
+                "mean": rng.uniform(low, high),
+                "std": rng.uniform(0.5, 10.0),
+            }
+        readings.append(reading)
+    return readings, baseline
+
+
+def _rounded(expected_range):
+    return tuple(round(float(bound), 9) for bound in expected_range)
+
+
+def _summary(result):
+    return result.sensor_id, result.anomaly_type, result.severity, _rounded(result.expected_range)
+
+
+class TestBatchMatchesScalarRules:
+    """Tests that the columnar path applies the per-reading rules exactly"""
+
+    @pytest.mark.parametrize("sensitivity", ["low", "medium", "high"])
+    def test_random_fleet_with_mixed_severities(self, sensitivity):
+        readings, baseline = _fleet(500)
+        expected = [
+            (reading["id"], *outcome)
+            for reading in readings
+            if (outcome := _reference(reading, baseline, sensitivity)) is not None
+        ]
+        results = detect_anomalies(readings, baseline, sensitivity)
+        assert [_summary(r) for r in results] == [
+            (i, kind, severity, _rounded(expected_range))
+            for i, kind, severity, expected_range in expected
+        ]
+        # Every rule and both severities occur in the sample
+        assert {r.anomaly_type for r in results} >= {
+            AnomalyType.OUT_OF_RANGE,
+            AnomalyType.SPIKE,
+            AnomalyType.DROP,
+        }
+        assert {r.severity for r in results} == {AnomalySeverity.WARNING, AnomalySeverity.CRITICAL}
+
+    def test_columns_give_the_same_results_as_dicts(self):
+        readings, baseline = _fleet(200, seed=11)
+        nan = math.nan
+        base = [baseline.get(r["id"], {}) for r in readings]
+        batch = detect_anomalies_batch(
+            [r["id"] for r in readings],
+            np.array([r["value"] for r in readings]),
+            [r["min"] for r in readings],
+            [r["max"] for r in readings],
+            warning_thresholds=[r.get("warning_threshold", nan) for r in readings],
+            critical_thresholds=[r.get("critical_threshold", nan) for r in readings],
+            means=[b.get("mean", nan) for b in base],
+            stds=[b.get("std", nan) for b in base],
+            sensor_names=[r["name"] for r in readings],
+        )
+        scalar = detect_anomalies(readings, baseline)
+        assert [_summary(r) for r in batch] == [_summary(r) for r in scalar]
+        assert [r.description for r in batch] == [r.description for r in scalar]
+        assert [r.possible_causes for r in batch] == [r.possible_causes for r in scalar]
+
+    def test_threshold_edges(self):
+        # A wide baseline for the range and threshold rules, a narrow one
+        # (std 10, about 1e-6 less after the epsilon) for the deviation rule
+        wide, narrow = {"mean": 50.0, "std": 30.0}, {"mean": 50.0, "std": 10.0}
+        cases = [
+            (100.0, wide, None, None, None),  # at the range limit
+            (0.0, wide, None, None, None),
+            (100.0000001, wide, None, None, AnomalyType.OUT_OF_RANGE),
+            (80.0, wide, 80.0, None, None),  # equal to the warning threshold
+            (80.0001, wide, 80.0, None, AnomalyType.SPIKE),
+            (90.0, wide, None, 90.0, None),
+            (90.0001, wide, 70.0, 90.0, AnomalyType.SPIKE),
+            (95.0, wide, 0.0, 0.0, None),  # zero thresholds are ignored
+            (70.0, narrow, None, None, None),  # exactly 2 std is not beyond 2 std
+            (70.001, narrow, None, None, AnomalyType.SPIKE),
+            (29.999, narrow, None, None, AnomalyType.DROP),
+        ]
+        for value, base, warning, critical, kind in cases:
+            baseline = {"s": base}
+            reading = {"id": "s", "value": value, "min": 0.0, "max": 100.0}
+            if warning is not None:
+                reading["warning_threshold"] = warning
+            if critical is not None:
+                reading["critical_threshold"] = critical
+            results = detect_anomalies([reading], baseline)
+            outcome = _reference(reading, baseline, "medium")
+            assert [r.anomaly_type for r in results] == ([kind] if kind else []), value
+            assert [(r.anomaly_type, r.severity) for r in results] == (
+                [outcome[:2]] if outcome else []
+            )
+
+        # Severity turns critical beyond 1.5 times the threshold (3 std)
+        severities = [
+            detect_anomalies([{"id": "s", "value": v, "min": 0, "max": 100}], {"s": narrow})[
+                0
+            ].severity
+            for v in (79.99, 80.01)
+        ]
+        assert severities == [AnomalySeverity.WARNING, AnomalySeverity.CRITICAL]
+
+    def test_nan_values_and_thresholds(self):
+        nan = math.nan
+        results = detect_anomalies_batch(
+            ["a", "b", "c", "d"],
+            [nan, 150.0, 85.0, 99.0],
+            0.0,
+            100.0,
+            warning_thresholds=[80.0, 80.0, nan, 80.0],
+            critical_thresholds=[nan, nan, nan, 95.0],
+            means=[nan, 50.0, nan, nan],
+            stds=nan,
+        )
+        # A NaN value is skipped, NaN thresholds and baselines are not checked
+        assert [(r.sensor_id, r.anomaly_type, r.severity) for r in results] == [
+            ("b", AnomalyType.OUT_OF_RANGE, AnomalySeverity.CRITICAL),
+            ("c", AnomalyType.SPIKE, AnomalySeverity.WARNING),
+            ("d", AnomalyType.SPIKE, AnomalySeverity.CRITICAL),
+        ]
+        assert results[1].description == "Value 85.0 deviates 2.1 std devs from normal"
+
+        readings = [
+            {"id": "a", "value": None},
+            {"id": "b", "current_value": 150.0},
+            {"id": "c", "value": 85.0},
+            {"id": "d", "value": 99.0, "warning_threshold": 80.0, "critical_threshold": 95.0},
+        ]
+        assert [_summary(r) for r in detect_anomalies(readings)] == [_summary(r) for r in results]
+
+    def test_scalar_columns_and_shape_errors(self):
+        results = detect_anomalies_batch(["a", "b"], [5.0, 120.0], 0.0, 100.0)
+        assert [r.sensor_id for r in results] == ["a", "b"]
+        assert results[0].anomaly_type is AnomalyType.DROP
+        assert detect_anomalies_batch([], []) == []
+        with pytest.raises(InvalidInputError):
+            detect_anomalies_batch(["a", "b"], [1.0, 2.0], [0.0, 0.0, 0.0])
+        with pytest.raises(InvalidInputError):
+            detect_anomalies_batch(["a"], [1.0], sensor_names=["x", "y"])
+
+
+class TestSensorState:
+    """Tests for the constant-time running statistics"""
+
+    def test_welford_matches_numpy(self):
+        values = np.random.default_rng(3).normal(20.0, 4.0, 1000)
+        state = SensorState()
+        for value in values:
+            state.update(float(value), alpha=0.1, tolerance=1e-9)
+        assert state.count == 1000
+        assert state.mean == pytest.approx(values.mean(), rel=1e-12)
+        assert state.variance == pytest.approx(values.var(ddof=1), rel=1e-9)
+        assert state.std == pytest.approx(values.std(ddof=1), rel=1e-9)
+
+    def test_run_length_and_clipped_ewma(self):
+        state = SensorState()
+        for value in (5.0, 5.0, 5.0):
+            state.update(value, alpha=0.5, tolerance=1e-9)
+        assert state.run_length == 3
+        state.update(5.0 + 1e-12, alpha=0.5, tolerance=1e-9)
+        assert state.run_length == 4
+        state.update(100.0, alpha=0.5, tolerance=1e-9, bounds=(0.0, 7.0))
+        assert state.run_length == 1
+        # Only the clipped 7.0 reaches the EWMA, the full value the mean
+        assert state.ewma == pytest.approx(6.0)
+        assert state.mean == pytest.approx(24.0)
+
+
+def _stream(detector, sensor_id, values, **kwargs):
+    return [detector.update(sensor_id, float(value), **kwargs) for value in values]
+
+
+class TestAnomalyDetector:
+    """Tests for the streaming detector"""
+
+    def test_warmup_suppresses_statistical_rules_only(self):
+        detector = AnomalyDetector(warmup=30)
+        _stream(detector, "t", np.random.default_rng(5).uniform(49.0, 51.0, 29))
+        assert detector.score("t", 80.0) == 0.0
+        # A wild swing while warming up is learned, not flagged...
+        assert detector.update("t", 80.0) is None
+        assert detector.score("t", 80.0) > 0
+        # ...but the range still applies
+        result = detector.update("t", 120.0, min_val=0.0, max_val=100.0)
+        assert result.anomaly_type is AnomalyType.OUT_OF_RANGE
+
+        detector = AnomalyDetector(warmup=30)
+        _stream(detector, "t", np.random.default_rng(5).uniform(49.0, 51.0, 30))
+        spike = detector.update("t", 60.0)
+        assert spike.anomaly_type is AnomalyType.SPIKE
+        assert spike.severity is AnomalySeverity.CRITICAL
+        assert detector.score("t", 60.0) > 0.7
+
+    def test_drift_is_flagged_then_absorbed(self):
+        rng = np.random.default_rng(11)
+        detector = AnomalyDetector()
+        before = _stream(detector, "t", rng.uniform(-1.7, 1.7, 200))
+        assert not any(before)
+        # A shift of one std is mostly within the deviation limit...
+        shifted = _stream(detector, "t", rng.uniform(-0.7, 2.7, 800))
+        drift = np.array([bool(r) and r.anomaly_type is AnomalyType.DRIFT for r in shifted])
+        assert drift[:100].sum() >= 30
+        # ...and once the long-run mean has followed it, only stray alarms remain
+        assert drift[400:].sum() <= 10
+        assert detector.baseline()["t"]["mean"] == pytest.approx(0.8, abs=0.1)
+
+    def test_single_spike_is_not_drift(self):
+        rng = np.random.default_rng(13)
+        detector = AnomalyDetector()
+        _stream(detector, "t", rng.uniform(-1.7, 1.7, 200))
+        assert detector.update("t", 25.0).anomaly_type is AnomalyType.SPIKE
+        after = _stream(detector, "t", rng.uniform(-1.7, 1.7, 100))
+        assert not any(r and r.anomaly_type is AnomalyType.DRIFT for r in after)
+
+    def test_stuck_value(self):
+        detector = AnomalyDetector(stuck_run=20)
+        _stream(detector, "t", np.random.default_rng(17).normal(0.0, 1.0, 50))
+        results = _stream(detector, "t", [0.5] * 20)
+        assert not any(results[:19])
+        assert results[19].anomaly_type is AnomalyType.STUCK_VALUE
+        assert results[19].description == "Value 0.5 unchanged for 20 readings"
+
+    def test_state_is_kept_per_sensor(self):
+        rng = np.random.default_rng(19)
+        detector = AnomalyDetector()
+        low, high = rng.uniform(9.0, 11.0, 300), rng.uniform(990.0, 1010.0, 300)
+        for a, b in zip(low, high):
+            assert detector.update("low", float(a)) is None
+            assert detector.update("high", float(b)) is None
+        baseline = detector.baseline()
+        assert baseline["low"]["mean"] == pytest.approx(low.mean())
+        assert baseline["high"]["std"] == pytest.approx(high.std(ddof=1))
+        assert baseline["low"]["count"] == baseline["high"]["count"] == 300
+
+        # Normal for one sensor is an anomaly for the other
+        assert detector.score("high", 1000.0) < 0.1
+        assert detector.score("low", 1000.0) > 0.9
+        assert detector.update("low", 1000.0).anomaly_type is AnomalyType.SPIKE
+
+        detector.reset("low")
+        assert set(detector.sensors) == {"high"}
+        assert detector.update("low", 1000.0) is None
+
+    def test_snapshot_round_trip(self):
+        rng = np.random.default_rng(23)
+        detector = AnomalyDetector(sensitivity="high", warmup=10)
+        _stream(detector, "a", rng.normal(0.0, 1.0, 100))
+        _stream(detector, "b", rng.normal(5.0, 2.0, 100))
+        restored = AnomalyDetector.restore(json.loads(json.dumps(detector.snapshot())))
+        assert restored.baseline() == detector.baseline()
+        for value in rng.normal(0.0, 3.0, 50):
+            expected, actual = detector.update("a", value), restored.update("a", value)
+            assert (expected and expected.anomaly_type) == (actual and actual.anomaly_type)
+
+        with pytest.raises(InvalidInputError):
+            AnomalyDetector.restore({"version": 99})
+        with pytest.raises(InvalidInputError):
+            AnomalyDetector(alpha=0.0)
+
+
+def _steps(rng, levels, length=300, noise=1.0):
+    return np.concatenate([rng.normal(level, noise, length) for level in levels])
+
+
+class TestChangePoints:
+    """Tests for the streaming change-point detectors"""
+
+    @pytest.mark.parametrize(
+        "method,params",
+        [("cusum", {"threshold": 10.0}), ("page_hinkley", {"threshold": 20.0})],
+    )
+    def test_step_changes_are_found_quickly(self, method, params):
+        series = _steps(np.random.default_rng(29), [10.0, 13.0, 8.0])
+        changes = find_change_points(series, method, **params)
+        assert [c["direction"] for c in changes] == [1, -1]
+        for change, step in zip(changes, (300, 600)):
+            assert step <= change["index"] < step + 15
+
+    @pytest.mark.parametrize(
+        "method,params,max_alarms",
+        [
+            ("cusum", {}, 25),  # in-control run length of a few hundred readings
+            ("cusum", {"threshold": 10.0}, 2),
+            ("page_hinkley", {}, 6),
+        ],
+    )
+    def test_false_alarms_on_stationary_noise(self, method, params, max_alarms):
+        for seed in range(5):
+            series = np.random.default_rng(seed).normal(0.0, 1.0, 5000)
+            assert len(find_change_points(series, method, **params)) <= max_alarms
+
+    def test_cusum_learns_reference_after_each_change(self):
+        detector = CusumDetector(threshold=5.0, warmup=20)
+        series = _steps(np.random.default_rng(31), [0.0, 50.0], length=100)
+        directions = [detector.update(value) for value in series.tolist()]
+        # One alarm for the step; the new level then becomes the reference
+        assert directions.index(1) in range(100, 103)
+        assert not any(directions[103:])
+        assert detector.mean == pytest.approx(50.0, abs=1.0)
+
+        restored = CusumDetector(**asdict(detector))
+        assert restored.update(80.0) == detector.update(80.0)
+
+    def test_page_hinkley_detects_in_reading_units(self):
+        detector = PageHinkleyDetector(threshold=5.0, delta=0.1, min_readings=10)
+        directions = [detector.update(v) for v in [1.0] * 50 + [2.0] * 50]
+        assert not any(directions[:50])
+        assert directions.index(1) in range(50, 60)
+        with pytest.raises(InvalidInputError):
+            find_change_points([1.0, 2.0], method="bayesian")
+
+
+def _stuck_by_sorting(series, window_size):
+    """The original stuck rule: sort every window and count distinct values"""
+    windows = np.lib.stride_tricks.sliding_window_view(np.round(series, 3), window_size)
+    distinct = 1 + np.count_nonzero(np.diff(np.sort(windows), axis=1), axis=1)
+    return distinct[window_size:] <= 2
+
+
+class TestLabelPatterns:
+    """Tests for whole-series pattern labels"""
+
+    def test_stuck_matches_sorted_windows(self):
+        rng = np.random.default_rng(37)
+        for values in (
+            [1.0, 2.0, 3.0],
+            [1e5, 1e5 + 0.001, -3.0004],
+            [5.0, 5.0004, 5.0006, 7.25],
+        ):
+            for window_size in (2, 3, 10, 25):
+                series = rng.choice(values, 400)
+                # Stretches of one and two values among the noise
+                series[100:160] = values[0]
+                series[250:330:2] = values[-1]
+                labels = label_patterns(series, window_size)
+                first = 2 * window_size - 1
+                assert not labels["stuck"][:first].any()
+                np.testing.assert_array_equal(
+                    labels["stuck"][first:], _stuck_by_sorting(series, window_size)
+                )
+
+    def test_missing_values_are_never_stuck(self):
+        series = np.full(40, 3.0)
+        series[25] = np.nan
+        stuck = label_patterns(series, 5)["stuck"]
+        assert stuck[9:25].all()
+        assert not stuck[25:30].any()
+        assert stuck[30:].all()
+
+    def test_labels_and_segments(self):
+        series = np.concatenate([np.full(20, 10.0), np.linspace(10.0, 30.0, 20), np.full(20, 30.0)])
+        labels = label_patterns(series, window_size=5)
+        assert labels["trend"][25] == 1 and labels["change_point"][25]
+        assert {"pattern": "stuck", "label": "stuck", "start": 9, "end": 21} in labels["segments"]
+        assert detect_patterns(series.tolist(), window_size=5)["stuck"]
+        with pytest.raises(InvalidInputError):
+            label_patterns(series, window_size=1)
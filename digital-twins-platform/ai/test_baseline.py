@@ -0,0 +1,276 @@
+"""
+Tests for streaming, mergeable sensor baselines
+"""
+
+import csv
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from ai.anomaly import InvalidInputError, calculate_baseline
+from ai.baseline import (
+    HOURS_PER_WEEK,
+    BaselineBuilder,
+    KLLSketch,
+    SeasonalBaseline,
+    SeasonalBaselines,
+    SensorBaseline,
+    build_baselines,
+    seasonal_bins,
+)
+
+QUANTILES = np.linspace(0.01, 0.99, 99)
+
+
+def _rank_error(sketch, data):
+    """Largest distance between requested and actual rank of the estimates"""
+    estimates = np.asarray(sketch.quantiles(QUANTILES))
+    ranks = np.searchsorted(np.sort(data), estimates) / len(data)
+    return float(np.abs(ranks - QUANTILES).max())
+
+
+def _items(sketch):
+    return sum(len(items) for items in sketch.levels)
+
+
+class TestKLLSketch:
+    """Tests for the quantile sketch"""
+
+    @pytest.mark.parametrize("size,max_error", [(1_000, 0.0125), (100_000, 0.015)])
+    def test_rank_error_and_memory(self, size, max_error):
+        for seed in range(5):
+            data = np.random.default_rng(seed).lognormal(0.0, 1.0, size)
+            sketch = KLLSketch(200, seed=seed)
+            for chunk in np.array_split(data, 20):
+                sketch.update(chunk)
+            assert sketch.count == size
+            assert _rank_error(sketch, data) <= max_error
+            assert _items(sketch) <= 3 * sketch.k
+
+    def test_small_streams_are_exact(self):
+        data = np.random.default_rng(1).normal(0.0, 1.0, 150)
+        sketch = KLLSketch(200)
+        sketch.update(data)
+        # Below k items nothing is compacted away
+        assert _items(sketch) == len(data)
+        np.testing.assert_array_equal(
+            sketch.quantiles(QUANTILES), np.quantile(data, QUANTILES, method="lower")
+        )
+
+    def test_merge_matches_one_sketch(self):
+        rng = np.random.default_rng(2)
+        parts = [rng.normal(mean, 1.0, 25_000) for mean in (0.0, 5.0, 10.0, 15.0)]
+        merged = KLLSketch(200, seed=0)
+        for i, part in enumerate(parts):
+            sketch = KLLSketch(200, seed=i + 1)
+            sketch.update(part)
+            merged.merge(sketch)
+        data = np.concatenate(parts)
+        assert merged.count == len(data)
+        assert _rank_error(merged, data) <= 0.015
+        assert _items(merged) <= 3 * merged.k
+
+        with pytest.raises(InvalidInputError):
+            merged.merge(KLLSketch(100))
+
+    def test_nan_empty_and_snapshot(self):
+        sketch = KLLSketch(50, seed=3)
+        assert np.isnan(sketch.quantiles([0.5])[0])
+        sketch.update([1.0, np.nan, 2.0, 3.0])
+        assert sketch.count == 3
+        sketch.update(np.arange(10_000.0))
+        restored = KLLSketch.restore(json.loads(json.dumps(sketch.snapshot())))
+        assert restored.quantiles([0.05, 0.5, 0.95]) == sketch.quantiles([0.05, 0.5, 0.95])
+        with pytest.raises(InvalidInputError):
+            KLLSketch(4)
+
+
+class TestMergeableMoments:
+    """Tests for Chan's pairwise merge of count, mean and M2"""
+
+    def test_chunks_and_merges_match_numpy(self):
+        rng = np.random.default_rng(4)
+        # Very different scales and sizes stress the pairwise update
+        parts = [rng.normal(1e6, 0.01, 3), rng.normal(-50.0, 20.0, 10_000), np.array([7.0])]
+        merged = SensorBaseline()
+        for part in parts:
+            partial = SensorBaseline()
+            for chunk in np.array_split(part, 3):
+                partial.update(chunk)
+            merged.merge(partial)
+        merged.merge(SensorBaseline())
+
+        data = np.concatenate(parts)
+        result = merged.result()
+        assert result["count"] == len(data)
+        assert result["mean"] == pytest.approx(data.mean(), rel=1e-12)
+        assert result["std"] == pytest.approx(data.std(), rel=1e-9)
+        assert (result["min"], result["max"]) == (data.min(), data.max())
+
+    def test_builder_matches_calculate_baseline(self):
+        rng = np.random.default_rng(5)
+        history = {f"s{i}": rng.normal(10.0 * i, 1.0 + i, 5_000) for i in range(4)}
+        ids = np.concatenate([[sensor_id] * len(v) for sensor_id, v in history.items()])
+        values = np.concatenate(list(history.values()))
+        shuffle = rng.permutation(len(ids))
+        ids, values = ids[shuffle], values[shuffle]
+
+        # Two builders over halves of the history, merged through snapshots
+        first, second = BaselineBuilder(), BaselineBuilder()
+        first.update_columns(ids[:7_000], values[:7_000])
+        second.update_columns(ids[7_000:], values[7_000:])
+        first.merge(BaselineBuilder.restore(json.loads(json.dumps(second.snapshot()))))
+
+        expected = calculate_baseline({k: v.tolist() for k, v in history.items()})
+        for sensor_id, result in first.baselines().items():
+            reference = expected[sensor_id]
+            assert result["count"] == 5_000
+            for key in ("mean", "std", "min", "max"):
+                assert result[key] == pytest.approx(reference[key], rel=1e-9)
+            spread = reference["p95"] - reference["p5"]
+            assert result["p5"] == pytest.approx(reference["p5"], abs=0.05 * spread)
+            assert result["p95"] == pytest.approx(reference["p95"], abs=0.05 * spread)
+
+        with pytest.raises(InvalidInputError):
+            first.update_columns(["a", "b"], [1.0])
+
+    def test_build_baselines_from_files(self, tmp_path):
+        rng = np.random.default_rng(6)
+        values = {"pump-temp": rng.normal(60.0, 3.0, 900), "pump-rpm": rng.normal(1450, 25, 900)}
+        paths = []
+        for part in range(3):
+            path = tmp_path / f"part{part}_history.csv"
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["timestamp", "sensor_id", "value"])
+                for sensor_id, series in values.items():
+                    for value in series[part * 300 : (part + 1) * 300]:
+                        writer.writerow(["2024-05-06T14:00:00+00:00", sensor_id, value])
+                writer.writerow(["2024-05-06T14:00:00+00:00", "pump-temp", ""])
+            paths.append(str(path))
+
+        baselines = build_baselines(paths, workers=1, chunk_rows=250)
+        for sensor_id, series in values.items():
+            assert baselines[sensor_id]["count"] == 900
+            assert baselines[sensor_id]["mean"] == pytest.approx(series.mean(), rel=1e-9)
+            assert baselines[sensor_id]["std"] == pytest.approx(series.std(), rel=1e-6)
+
+
+# Monday 2024-05-06 00:00 UTC
+MONDAY = 1714953600
+
+
+class TestSeasonalBins:
+    """Tests for the 24 x 7 hour-of-week mapping"""
+
+    def test_every_hour_of_a_week(self):
+        seconds = MONDAY + 3600 * np.arange(2 * HOURS_PER_WEEK) + 1800
+        expected = np.tile(np.arange(HOURS_PER_WEEK), 2)
+        np.testing.assert_array_equal(seasonal_bins(seconds), expected)
+        np.testing.assert_array_equal(seasonal_bins(seconds.astype(float)), expected)
+        np.testing.assert_array_equal(seasonal_bins(seconds.astype("datetime64[s]")), expected)
+        moments = [datetime.fromtimestamp(int(s), timezone.utc) for s in seconds]
+        np.testing.assert_array_equal(seasonal_bins(moments), expected)
+        np.testing.assert_array_equal(seasonal_bins([m.isoformat() for m in moments]), expected)
+
+    def test_edges_offsets_and_errors(self):
+        assert seasonal_bins(MONDAY - 1).tolist() == [HOURS_PER_WEEK - 1]  # Sunday 23:59:59
+        assert seasonal_bins(MONDAY).tolist() == [0]
+        assert seasonal_bins(MONDAY + 0.999).tolist() == [0]
+        # Strings and datetimes are binned in their own (local) time
+        assert seasonal_bins("2024-05-06T14:30:00+02:00").tolist() == [14]
+        assert seasonal_bins("2024-05-12T23:00:00").tolist() == [6 * 24 + 23]
+        with pytest.raises(InvalidInputError):
+            seasonal_bins(["yesterday"])
+
+
+def _week(rng, readings_per_bin, level=lambda b: 10.0 * (b % 24)):
+    bins = np.repeat(np.arange(HOURS_PER_WEEK), readings_per_bin)
+    return bins, rng.normal([level(b) for b in bins], 1.0)
+
+
+class TestSeasonalBaseline:
+    """Tests for per-bin moments, fallbacks and merging"""
+
+    def test_bins_use_their_own_statistics(self):
+        bins, values = _week(np.random.default_rng(7), 20)
+        baseline = SeasonalBaseline(min_count=3)
+        baseline.update(bins, values)
+        for hour_bin in (0, 14, 24 + 14, HOURS_PER_WEEK - 1):
+            own = values[bins == hour_bin]
+            assert baseline.lookup(hour_bin) == pytest.approx((own.mean(), own.std()))
+
+    def test_min_count_falls_back_to_hour_then_overall(self):
+        rng = np.random.default_rng(8)
+        baseline = SeasonalBaseline(min_count=3)
+        # Monday 14:00 has two readings, other days' 14:00 have plenty
+        baseline.update([14, 14], [500.0, 520.0])
+        afternoons = [day * 24 + 14 for day in range(1, 7)]
+        values = rng.normal(140.0, 2.0, (6, 10))
+        baseline.update(np.repeat(afternoons, 10), values.ravel())
+        # Tuesday 03:00 has readings, but 03:00 too few over the week
+        baseline.update([24 + 3], [30.0])
+
+        hour = np.concatenate([[500.0, 520.0], values.ravel()])
+        assert baseline.lookup(14) == pytest.approx((hour.mean(), hour.std()))
+        assert baseline.lookup(24 + 14) == pytest.approx((values[0].mean(), values[0].std()))
+        everything = np.concatenate([hour, [30.0]])
+        assert baseline.lookup(24 + 3) == pytest.approx((everything.mean(), everything.std()))
+        assert baseline.lookup(5) == baseline.lookup(24 + 3)
+        np.testing.assert_array_equal(baseline.support()[[14, 24 + 14, 24 + 3, 5]], [62, 10, 63, 63])
+
+        assert np.isnan(SeasonalBaseline().lookup(0)[0])
+
+    def test_merge_matches_one_pass(self):
+        rng = np.random.default_rng(9)
+        bins, values = _week(rng, 12)
+        shuffle = rng.permutation(len(bins))
+        bins, values = bins[shuffle], values[shuffle]
+        whole = SeasonalBaseline(min_count=5)
+        whole.update(bins, values)
+
+        merged = SeasonalBaseline(min_count=5)
+        # Parts that leave some bins empty or below min_count on their own
+        for part in np.array_split(np.arange(len(bins)), 7):
+            partial = SeasonalBaseline(min_count=5)
+            partial.update(bins[part], values[part])
+            merged.merge(SeasonalBaseline.restore(json.loads(json.dumps(partial.snapshot()))))
+        merged.merge(SeasonalBaseline(min_count=5))
+
+        np.testing.assert_array_equal(merged.count, whole.count)
+        for got, expected in zip(merged.table(), whole.table()):
+            np.testing.assert_allclose(got, expected, rtol=1e-9)
+
+        with pytest.raises(InvalidInputError):
+            SeasonalBaseline.restore({"min_count": 3, "count": [0], "mean": [0], "m2": [0]})
+
+    def test_many_sensors_and_lookups(self):
+        rng = np.random.default_rng(10)
+        seconds = MONDAY + rng.integers(0, 4 * 7 * 86400, 20_000)
+        sensor_ids = rng.choice(["a", "b"], len(seconds))
+        hours = (seconds // 3600) % 24
+        values = np.where(sensor_ids == "a", 0.0, 100.0) + hours + rng.normal(0.0, 0.5, len(seconds))
+
+        columns = SeasonalBaselines()
+        columns.update_columns(sensor_ids, seasonal_bins(seconds), values)
+        first, second = SeasonalBaselines(), SeasonalBaselines()
+        for sensor_id in ("a", "b"):
+            mine = sensor_ids == sensor_id
+            half = np.flatnonzero(mine)[: mine.sum() // 2]
+            rest = np.flatnonzero(mine)[mine.sum() // 2 :]
+            first.update(sensor_id, seconds[half], values[half])
+            second.update(sensor_id, seconds[rest], values[rest])
+        first.merge(SeasonalBaselines.restore(json.loads(json.dumps(second.snapshot()))))
+
+        at = "2024-05-07T09:15:00+00:00"
+        assert first.lookup("a", at) == pytest.approx(columns.lookup("a", at))
+        assert first.lookup("b", at)["mean"] == pytest.approx(109.0, abs=0.3)
+        assert first.lookup("c", at) is None
+        assert first.score("a", 9.0, at) < 0.3 < first.score("a", 30.0, at)
+        assert first.score("c", 1e6, at) == 0.0
+        assert set(first.baselines_at(at)) == {"a", "b"}
+        means, stds = first.columns(["b", "c"], at)
+        assert means[0] == pytest.approx(109.0, abs=0.3) and np.isnan(means[1])
+        assert stds[0] == pytest.approx(0.5, abs=0.1)
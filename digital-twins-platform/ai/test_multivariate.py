@@ -0,0 +1,249 @@
+"""
+Tests for joint anomaly detection across a twin's sensors
+"""
+
+import csv
+import importlib.util
+import json
+import random
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from ai.anomaly import InsufficientDataError, InvalidInputError
+from ai.multivariate import MultivariateDetector, MultivariateModels, history_matrix, history_rows
+
+FEATURES = ["temp", "power", "vib"]
+DEMO_DIR = Path(__file__).resolve().parent.parent / "demo"
+
+
+def _normal_operation(rows=2000, seed=0):
+    """Temperature and power move together; vibration is independent"""
+    rng = np.random.default_rng(seed)
+    covariance = [[1.0, 0.95, 0.0], [0.95, 1.0, 0.0], [0.0, 0.0, 1.0]]
+    return rng.multivariate_normal([60.0, 20.0, 3.0], covariance, rows)
+
+
+def _demo_history(output_dir, seed, incidents=True):
+    """twin-001's history from ``demo/generate_history.py`` and its sensor IDs"""
+    spec = importlib.util.spec_from_file_location("generate_history", DEMO_DIR / "generate_history.py")
+    generate_history = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(generate_history)
+    with open(DEMO_DIR / "demo_twins.json") as f:
+        config = next(t for t in json.load(f)["twins"] if t["id"] == "twin-001")
+
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        generator = generate_history.TwinHistoryGenerator(config, days=30)
+        if incidents:
+            generator.generate_incidents()
+        result = generator.generate(datetime(2024, 5, 6, tzinfo=timezone.utc), str(output_dir))
+    finally:
+        random.setstate(state)
+    return result["file"], [sensor["id"] for sensor in config["sensors"]]
+
+
+def _incident_free(path):
+    """Per history row, whether every reading in it has a normal status"""
+    normal = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            normal[row["timestamp"]] = normal.get(row["timestamp"], True) and row["status"] == "normal"
+    return np.array(list(normal.values()))
+
+
+class TestMultivariateDetector:
+    """Tests for the robust Mahalanobis-distance detector"""
+
+    def test_flags_combinations_no_single_sensor_would(self):
+        detector = MultivariateDetector(FEATURES).fit(_normal_operation())
+        readings = np.array(
+            [
+                [62.0, 22.0, 3.0],  # both high together: normal for this twin
+                [62.0, 18.0, 3.0],  # hot but drawing little power
+                [60.0, 20.0, 3.5],
+            ]
+        )
+        # Every sensor stays within 2.5 std devs of its own mean
+        assert (np.abs(readings - [60.0, 20.0, 3.0]) < 2.5).all()
+
+        anomalies = detector.detect(["a", "b", "c"], readings)
+        assert [a["twin_id"] for a in anomalies] == ["b"]
+        contributions = anomalies[0]["contributions"]
+        assert list(contributions)[:2] in (["temp", "power"], ["power", "temp"])
+        assert contributions["temp"] + contributions["power"] > 0.99
+        assert anomalies[0]["distance"] > anomalies[0]["threshold"]
+
+        distance, shares = detector.distances(readings)
+        np.testing.assert_allclose(shares.sum(axis=1), distance)
+        scores = detector.score(readings)
+        assert scores[1] > 0.999 > scores[0]
+
+    def test_false_alarm_rate_matches_quantile(self):
+        detector = MultivariateDetector(FEATURES, quantile=0.99).fit(_normal_operation())
+        fresh = _normal_operation(rows=20_000, seed=1)
+        flagged = detector.detect([str(i) for i in range(len(fresh))], fresh)
+        assert 0.005 < len(flagged) / len(fresh) < 0.02
+
+    def test_outliers_in_training_data_do_not_inflate_the_model(self):
+        training = _normal_operation()
+        training[:100] = [90.0, 0.0, 30.0]
+        detector = MultivariateDetector(FEATURES).fit(training)
+        np.testing.assert_allclose(detector.location, [60.0, 20.0, 3.0], atol=0.1)
+        assert detector.detect(["x"], [[62.0, 18.0, 3.0]])
+
+    @pytest.mark.filterwarnings("ignore:The covariance matrix associated to your dataset")
+    def test_singular_covariance(self):
+        rng = np.random.default_rng(2)
+        temp = rng.normal(60.0, 1.0, 500)
+        # A constant setpoint and a sensor duplicating another
+        X = np.column_stack([temp, np.full(500, 1450.0), temp * 2.0, rng.normal(3.0, 1.0, 500)])
+        detector = MultivariateDetector(["temp", "setpoint", "temp_f", "vib"]).fit(X)
+        assert np.isfinite(detector.precision).all()
+
+        distance, _ = detector.distances([[60.0, 1450.0, 120.0, 3.0], [60.0, 1451.0, 120.0, 3.0]])
+        assert np.isfinite(distance).all()
+        assert distance[0] < detector.threshold < distance[1]
+        readings = [[61.0, 1450.0, 122.0, 3.5], [60.0, 1451.0, 120.0, 3.0]]
+        assert [a["twin_id"] for a in detector.detect(["ok", "moved"], readings)] == ["moved"]
+
+    def test_missing_values_and_validation(self):
+        detector = MultivariateDetector(FEATURES)
+        with pytest.raises(InvalidInputError):
+            detector.distances([[1.0, 2.0, 3.0]])
+        X = _normal_operation(rows=200)
+        X[::10, 1] = np.nan
+        detector.fit(X)
+        assert detector.n_samples == 180
+        # A missing value adds nothing to the distance
+        assert detector.distances([[np.nan, np.nan, np.nan]])[0][0] == 0.0
+        with pytest.raises(InvalidInputError):
+            detector.distances([[1.0, 2.0]])
+        with pytest.raises(InsufficientDataError):
+            MultivariateDetector(FEATURES).fit(X[:7])
+        with pytest.raises(InvalidInputError):
+            MultivariateDetector(["a", "a"])
+        with pytest.raises(InvalidInputError):
+            MultivariateDetector(FEATURES, quantile=1.0)
+
+
+class TestSeasonalDetector:
+    """Tests for models of twins with daily and weekly cycles"""
+
+    def test_demo_history_false_alarm_rate(self, tmp_path):
+        path, sensor_ids = _demo_history(tmp_path / "train", seed=0)
+        timestamps, X = history_rows(path, sensor_ids)
+        incident_free = _incident_free(path)
+        assert 0 < (~incident_free).sum() < 50
+        features = ["temp", "vib", "rpm", "power", "load"]
+
+        # One Gaussian over all hours flags the working hours
+        flat = MultivariateDetector(features).fit(X)
+        assert (flat.distances(X)[0] > flat.threshold)[incident_free].mean() > 0.03
+
+        detector = MultivariateModels(tmp_path).train("machine", features, [(path, sensor_ids)])
+        assert detector.seasonal.shape == (168, 5)
+        flagged = detector.distances(X, timestamps)[0] > detector.threshold
+        assert flagged[incident_free].mean() < 0.01
+        assert flagged[~incident_free].mean() > 0.3
+
+        fresh_path, _ = _demo_history(tmp_path / "fresh", seed=1, incidents=False)
+        fresh_timestamps, fresh = history_rows(fresh_path, sensor_ids)
+        flagged = detector.distances(fresh, fresh_timestamps)[0] > detector.threshold
+        assert flagged.mean() < 0.02
+
+    def test_seasonal_scoring_and_round_trip(self, tmp_path):
+        hours = np.arange(24 * 28)
+        timestamps = hours * 3600
+        # Busy from 08:00 to 18:00: hotter and drawing more power
+        busy = ((hours % 24 >= 8) & (hours % 24 < 18))[:, None]
+        X = _normal_operation(rows=len(hours), seed=4) + busy * [15.0, 10.0, 0.0]
+        detector = MultivariateDetector(FEATURES).fit(X, timestamps)
+        with pytest.raises(InvalidInputError):
+            detector.distances(X[:2])
+        with pytest.raises(InvalidInputError):
+            detector.distances(X[:3], timestamps[:2])
+
+        # A busy-hours reading at night is anomalous, in the day it is not
+        reading = [[75.0, 30.0, 3.0]]
+        night, day = "2024-05-08T02:00:00+00:00", "2024-05-08T11:00:00+00:00"
+        assert detector.detect(["a"], reading, timestamps=night)
+        assert not detector.detect(["a"], reading, timestamps=day)
+
+        models = MultivariateModels(tmp_path)
+        models.save("press", detector)
+        loaded = MultivariateModels(tmp_path).get("press")
+        np.testing.assert_array_equal(loaded.seasonal, detector.seasonal)
+        assert [a["twin_id"] for a in loaded.detect(["a", "b"], reading * 2, timestamps=night)] == ["a", "b"]
+        assert MultivariateModels(tmp_path).scan({"press": (["a"], reading)}, timestamp=day) == {"press": []}
+
+
+class TestMultivariateModels:
+    """Tests for saving, loading and scanning named models"""
+
+    def test_npz_round_trip_without_pickle(self, tmp_path):
+        detector = MultivariateDetector(FEATURES, quantile=0.995).fit(_normal_operation())
+        path = MultivariateModels(tmp_path).save("pump", detector)
+        assert path == tmp_path / "multivariate-pump.npz"
+        with np.load(path, allow_pickle=False) as data:
+            assert all(data[name].dtype.kind != "O" for name in data.files)
+
+        loaded = MultivariateModels(tmp_path).get("pump")
+        assert loaded is not detector
+        assert loaded.features == FEATURES
+        assert (loaded.quantile, loaded.threshold) == (detector.quantile, detector.threshold)
+        assert (loaded.n_samples, loaded.trained_at) == (detector.n_samples, detector.trained_at)
+        readings = _normal_operation(rows=50, seed=3)
+        np.testing.assert_array_equal(loaded.distances(readings)[0], detector.distances(readings)[0])
+
+    def test_names_lazy_loading_and_scan(self, tmp_path):
+        models = MultivariateModels(tmp_path)
+        assert models.names() == []
+        models.save("pump", MultivariateDetector(FEATURES).fit(_normal_operation()))
+        models.save("fan.v2", MultivariateDetector(["rpm", "amps"]).fit(_normal_operation()[:, :2]))
+        assert models.names() == ["fan.v2", "pump"]
+
+        fresh = MultivariateModels(tmp_path)
+        result = fresh.scan(
+            {
+                "pump": (["p1", "p2"], [[60.0, 20.0, 3.0], [62.0, 18.0, 3.0]]),
+                "fan.v2": (["f1"], [[60.0, 20.0]]),
+            }
+        )
+        assert [a["twin_id"] for a in result["pump"]] == ["p2"]
+        assert result["fan.v2"] == []
+        assert fresh.get("pump") is fresh.get("pump")
+
+        for name in ("../pump", "pump/x", ""):
+            with pytest.raises(InvalidInputError):
+                fresh.path(name)
+        with pytest.raises(InvalidInputError):
+            fresh.get("valve")
+        with pytest.raises(InvalidInputError):
+            MultivariateModels(tmp_path).save("pump", MultivariateDetector(FEATURES))
+
+    def test_train_from_history(self, tmp_path):
+        X = _normal_operation(rows=300)
+        path = tmp_path / "pump-1_history.csv"
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["timestamp", "sensor_id", "value"])
+            for i, row in enumerate(X):
+                for sensor_id, value in zip(("t1", "p1", "v1"), row):
+                    writer.writerow([f"2024-05-06T{i // 60:02d}:{i % 60:02d}:00", sensor_id, value])
+            writer.writerow(["2024-05-06T23:59:00", "t1", 60.0])
+
+        matrix = history_matrix(str(path), ["t1", "p1", "v1"])
+        assert matrix.shape == (301, 3)
+        np.testing.assert_allclose(matrix[:300], X)
+        assert np.isnan(matrix[300, 1:]).all()
+
+        models = MultivariateModels(tmp_path)
+        detector = models.train("pump", FEATURES, [(str(path), ["t1", "p1", "v1"])])
+        assert detector.n_samples == 300
+        assert models.names() == ["pump"]
+        with pytest.raises(InvalidInputError):
+            models.train("pump", FEATURES, [(str(path), ["t1", "p1"])])
@@ -0,0 +1,211 @@
+"""
+Tests for FFT features of vibration signals
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from ai.anomaly import InsufficientDataError, InvalidInputError
+from ai.predictor import predict_failure
+from ai.spectral import SpectralAnalyzer, SpectralBaseline
+
+SAMPLE_RATE = 1000.0
+BANDS = [(0.0, 50.0), (50.0, 150.0), (150.0, 500.0)]
+
+
+def _sine(frequency, amplitude=1.0, seconds=4.0, phase=0.3):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return amplitude * np.sin(2 * np.pi * frequency * t + phase)
+
+
+def _vibration(high_amplitude=0.1, seed=0, seconds=4.0):
+    """A 100.3 Hz running tone, a weaker 320 Hz tone and a little noise"""
+    rng = np.random.default_rng(seed)
+    signal = _sine(100.3, seconds=seconds) + _sine(320.0, high_amplitude, seconds=seconds)
+    return signal + rng.normal(0.0, 0.01, len(signal))
+
+
+def _noisy_vibration(seed, seconds=4.0, running=0.3, high=0.2, frequency=100.3):
+    """Built like the demo VibrationSensor: offset, two tones, noise and 0.5% spikes"""
+    rng = np.random.default_rng(seed)
+    signal = 2.8 + _sine(frequency, running, seconds, rng.uniform(0, 2 * np.pi))
+    signal += _sine(250.0, high, seconds) + rng.normal(0.0, 0.2, len(signal))
+    spikes = rng.random(len(signal)) < 0.005
+    signal[spikes] += rng.normal(5.0, 2.0, spikes.sum())
+    return np.maximum(signal, 0.0)
+
+
+def _worn():
+    """A healthy second, then a slower, louder running tone and a tenfold 320 Hz tone"""
+    worn = _sine(85.0, 1.5, seconds=1.0) + _sine(320.0, seconds=1.0)
+    return np.concatenate([_vibration(seconds=1.0), worn])
+
+
+class TestSpectralAnalyzer:
+    """Tests for batched spectra of known signals"""
+
+    def test_dominant_frequency_between_bins(self):
+        analyzer = SpectralAnalyzer(window_size=256, sample_rate=SAMPLE_RATE)
+        # Bins are 3.90625 Hz apart; neither tone falls on one
+        signals = np.vstack([_sine(100.3), _sine(123.4, amplitude=3.0)])
+        features = analyzer.features(signals)
+
+        np.testing.assert_allclose(features["dominant_frequency"][0], 100.3, atol=0.2)
+        np.testing.assert_allclose(features["dominant_frequency"][1], 123.4, atol=0.2)
+        assert features["dominant_frequency"].shape == (2, 30)
+        # Power scales with amplitude squared
+        np.testing.assert_allclose(
+            features["dominant_power"][1] / features["dominant_power"][0],
+            9.0 * np.ones(30),
+            rtol=0.2,
+        )
+
+    def test_band_energy_of_a_sine(self):
+        analyzer = SpectralAnalyzer(window_size=256, sample_rate=SAMPLE_RATE, bands=BANDS)
+        assert analyzer.band_names == ["band_0_50hz", "band_50_150hz", "band_150_500hz"]
+        amplitude = 2.0
+        features = analyzer.features(_sine(100.3, amplitude))
+
+        energy = np.stack([features[name][0] for name in analyzer.band_names])
+        # A sine of amplitude A carries power A²/2, all near its frequency
+        np.testing.assert_allclose(energy.sum(axis=0), amplitude ** 2 / 2, rtol=0.02)
+        assert (energy[1] / energy.sum(axis=0) > 0.999).all()
+        np.testing.assert_allclose(features["rms"][0], amplitude / np.sqrt(2), rtol=0.01)
+        np.testing.assert_allclose(features["centroid"][0], 100.3, atol=1.0)
+
+    def test_default_bands_split_nyquist(self):
+        analyzer = SpectralAnalyzer(window_size=64, sample_rate=SAMPLE_RATE)
+        assert analyzer.bands == ((0.0, 50.0), (50.0, 125.0), (125.0, 250.0), (250.0, 500.0))
+        energies = analyzer.band_energies(analyzer.power_spectra(_sine(400.0)))
+        assert energies.shape == (1, 124, 4)
+        assert np.argmax(energies[0], axis=-1).tolist() == [3] * 124
+
+    def test_feature_matrix_and_trend_indicators(self):
+        analyzer = SpectralAnalyzer(window_size=256, sample_rate=SAMPLE_RATE, bands=BANDS)
+        names, matrix = analyzer.feature_matrix(_vibration())
+        assert names[-1] == "dominant_drift"
+        assert matrix.shape == (1, len(names))
+        assert abs(matrix[0, -1]) < 0.01
+
+        healthy = analyzer.trend_indicators(_vibration(seconds=2.0))
+        assert healthy["high_band_growth"] == pytest.approx(1.0, rel=0.1)
+        assert healthy["dominant_shift"] < 0.01
+        assert healthy["rms_growth"] == pytest.approx(1.0, rel=0.05)
+
+        indicators = analyzer.trend_indicators(_worn())
+        # The 320 Hz share of energy goes from 1% to 31%
+        assert indicators["high_band_growth"] == pytest.approx((1 / 3.25) / (0.01 / 1.01), rel=0.1)
+        assert indicators["dominant_shift"] == pytest.approx(15.3 / 100.3, abs=0.01)
+        assert indicators["rms_growth"] == pytest.approx(np.sqrt(3.25 / 1.01), rel=0.05)
+
+    def test_noisy_healthy_signals_show_no_trend(self):
+        analyzer = SpectralAnalyzer(window_size=256, sample_rate=SAMPLE_RATE, bands=BANDS)
+        indicators = [analyzer.trend_indicators(_noisy_vibration(seed)) for seed in range(200)]
+        # The thresholds predict_failure applies
+        for name, threshold in (
+            ("high_band_growth", 2.0),
+            ("dominant_shift", 0.1),
+            ("rms_growth", 1.5),
+        ):
+            crossed = sum(i[name] > threshold for i in indicators) / len(indicators)
+            assert crossed < 0.02, name
+
+        # A slower, louder running tone still stands out from the noise
+        worn = np.concatenate(
+            [
+                _noisy_vibration(1, seconds=2.0),
+                _noisy_vibration(2, seconds=2.0, running=0.9, frequency=85.0),
+            ]
+        )
+        indicators = analyzer.trend_indicators(worn)
+        assert indicators["dominant_shift"] == pytest.approx(15.3 / 100.3, abs=0.02)
+        assert indicators["rms_growth"] > 1.5
+
+        with pytest.raises(InsufficientDataError):
+            analyzer.trend_indicators(_vibration(seconds=1.4))
+
+    def test_validation(self):
+        with pytest.raises(InvalidInputError):
+            SpectralAnalyzer(window_size=4)
+        with pytest.raises(InvalidInputError):
+            SpectralAnalyzer(hop=300)
+        with pytest.raises(InvalidInputError):
+            SpectralAnalyzer(bands=[(10.0, 5.0)])
+        with pytest.raises(ValueError):
+            SpectralAnalyzer(window="no-such-window")
+        analyzer = SpectralAnalyzer(window_size=64)
+        with pytest.raises(InsufficientDataError):
+            analyzer.features(np.zeros(32))
+        with pytest.raises(InvalidInputError):
+            analyzer.features(np.full(64, np.nan))
+
+
+class TestSpectralBaseline:
+    """Tests for band-energy anomaly detection"""
+
+    def test_flags_the_band_that_grew(self):
+        analyzer = SpectralAnalyzer(window_size=256, sample_rate=SAMPLE_RATE, bands=BANDS)
+        healthy = np.vstack([_vibration(seed=1), _vibration(seed=2)])
+        baseline = SpectralBaseline(analyzer).fit(["pump", "fan"], healthy)
+
+        assert baseline.detect(["pump", "fan"], np.vstack([_vibration(seed=3), _vibration(seed=4)])) == []
+
+        worn = np.vstack([_vibration(seed=3), _vibration(high_amplitude=1.0, seed=4)])
+        anomalies = baseline.detect(["pump", "fan"], worn)
+        assert [a.sensor_id for a in anomalies] == ["fan:band_150_500hz"]
+        # Ten times the amplitude is a hundred times the energy
+        assert anomalies[0].value - baseline.mean[1, 2] == pytest.approx(2.0, abs=0.1)
+
+        # Sensors may be checked in any order or subset
+        assert [a.sensor_id for a in baseline.detect(["fan"], worn[1])] == ["fan:band_150_500hz"]
+
+    def test_validation(self):
+        analyzer = SpectralAnalyzer(window_size=256, sample_rate=SAMPLE_RATE, bands=BANDS)
+        baseline = SpectralBaseline(analyzer)
+        with pytest.raises(InvalidInputError):
+            baseline.detect(["pump"], _vibration())
+        with pytest.raises(InsufficientDataError):
+            baseline.fit(["pump"], _vibration(seconds=0.3))
+        with pytest.raises(InvalidInputError):
+            baseline.fit(["pump", "fan"], _vibration())
+        baseline.fit(["pump"], _vibration())
+        with pytest.raises(InvalidInputError):
+            baseline.detect(["valve"], _vibration())
+
+
+class TestPredictFailureSpectral:
+    """Tests for spectral risk factors in predict_failure"""
+
+    @staticmethod
+    def _history():
+        start = datetime(2024, 5, 6)
+        return [
+            {"timestamp": (start + timedelta(minutes=5 * i)).isoformat(), "value": 46.0 - 0.05 * i}
+            for i in range(20)
+        ]
+
+    def test_without_spectral(self):
+        result = predict_failure(self._history())
+        assert result["risk_factors"] == ["No significant risk factors detected"]
+        assert result["recommended_actions"] == ["Continue monitoring"]
+        assert result["probability"] == 0.0
+        assert predict_failure(self._history(), spectral={}) == result
+
+    def test_with_spectral(self):
+        analyzer = SpectralAnalyzer(window_size=256, sample_rate=SAMPLE_RATE, bands=BANDS)
+        healthy = predict_failure(self._history(), spectral=analyzer.trend_indicators(_vibration()))
+        assert healthy == predict_failure(self._history())
+
+        result = predict_failure(self._history(), spectral=analyzer.trend_indicators(_worn()))
+        assert result["risk_factors"] == [
+            "Rising high-frequency vibration energy",
+            "Shift in dominant vibration frequency",
+            "Growing overall vibration level",
+        ]
+        assert result["recommended_actions"] == [
+            "Inspect bearings and lubrication",
+            "Check balance and alignment",
+        ]
+        assert result["probability"] == pytest.approx(0.45)
@@ -0,0 +1,212 @@
+"""
+Load benchmark for the Digital Twins Platform backend
+
+Drives create / get / patch / search against the API at a configurable
+concurrency and reports p50/p99 latency and requests per second per route.
+
+By default everything runs in-process: the FastAPI app is called through
+``httpx.ASGITransport`` and ``DittoClient`` talks to ``FakeDitto``, so no
+Docker stack is needed. Use ``--target`` to benchmark a running backend.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --things 5000 --concurrency 64 --routes get,search
+    python benchmark.py --target http://localhost:8000 --json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+ROUTES = ("create", "get", "patch", "search")
+TYPES = ("temperature-sensor", "pump", "valve", "meter")
+NAMESPACE = "bench"
+
+RequestSpec = Tuple[str, str, Optional[Dict[str, Any]]]
+
+
+@dataclass
+class RouteResult:
+    """Latencies and errors for one route"""
+
+    route: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + self.errors
+
+    def percentile(self, pct: float) -> float:
+        """Nearest-rank percentile in milliseconds"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered))))
+        return ordered[rank - 1] * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "route": self.route,
+            "requests": self.requests,
+            "errors": self.errors,
+            "rps": round(self.requests / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p99_ms": round(self.percentile(99), 3),
+        }
+
+
+def thing_id(index: int) -> str:
+    return f"{NAMESPACE}:twin-{index:06d}"
+
+
+def request_for(route: str, index: int, things: int) -> RequestSpec:
+    """Method, URL and JSON body of the ``index``-th request of a route"""
+    if route == "create":
+        return (
+            "POST",
+            "/things/",
+            {
+                "thing_id": thing_id(index),
+                "attributes": {"type": TYPES[index % len(TYPES)], "floor": index % 10},
+                "features": {"temperature": {"properties": {"value": 20.0 + index % 15}}},
+            },
+        )
+    target = thing_id(random.randrange(things))
+    if route == "get":
+        return "GET", f"/things/{target}", None
+    if route == "patch":
+        return (
+            "PATCH",
+            f"/things/{target}",
+            {"features": {"temperature": {"properties": {"value": random.uniform(15, 35)}}}},
+        )
+    if route == "search":
+        kind = random.choice(TYPES)
+        query = f'and(eq(attributes/type,"{kind}"),gt(attributes/floor,{random.randrange(10)}))'
+        return "GET", f"/search/things?limit=25&q={query}", None
+    raise ValueError(f"Unknown route {route!r}")
+
+
+async def run_route(
+    client: httpx.AsyncClient,
+    route: str,
+    requests: int,
+    concurrency: int,
+    make_request: Callable[[str, int], RequestSpec],
+) -> RouteResult:
+    """Issue ``requests`` requests for one route from ``concurrency`` workers"""
+    result = RouteResult(route)
+    counter = iter(range(requests))
+
+    async def worker():
+        for index in counter:
+            method, url, body = make_request(route, index)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                result.latencies.append(time.perf_counter() - started)
+            else:
+                result.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def run_benchmark(
+    routes: List[str],
+    things: int = 1000,
+    requests: int = 2000,
+    concurrency: int = 32,
+    target: Optional[str] = None,
+) -> List[RouteResult]:
+    """
+    Run every route in order. ``create`` provisions ``things`` twins; the
+    other routes issue ``requests`` requests against them.
+    """
+    fake_ditto = None
+    if target is None:
+        import main as backend
+        from fake_ditto import FakeDitto
+
+        fake_ditto = FakeDitto()
+        backend.ditto_client.transport = httpx.ASGITransport(app=fake_ditto.app)
+        await backend.ditto_client.connect()
+        transport = httpx.ASGITransport(app=backend.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0)
+    else:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        client = httpx.AsyncClient(base_url=target, timeout=60.0, limits=limits)
+
+    make_request = lambda route, index: request_for(route, index, things)  # noqa: E731
+    results = []
+    try:
+        for route in routes:
+            count = things if route == "create" else requests
+            results.append(await run_route(client, route, count, concurrency, make_request))
+    finally:
+        await client.aclose()
+        if fake_ditto is not None:
+            await backend.ditto_client.disconnect()
+            backend.ditto_client.transport = None
+    return results
+
+
+def format_table(results: List[RouteResult]) -> str:
+    header = f"{'route':<8} {'requests':>9} {'errors':>7} {'rps':>10} {'p50 ms':>9} {'p99 ms':>9}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        s = result.summary()
+        lines.append(
+            f"{s['route']:<8} {s['requests']:>9} {s['errors']:>7} {s['rps']:>10.1f} "
+            f"{s['p50_ms']:>9.2f} {s['p99_ms']:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the Digital Twins backend API")
+    parser.add_argument("--routes", default=",".join(ROUTES), help="Comma-separated routes")
+    parser.add_argument("--things", type=int, default=1000, help="Twins created by 'create'")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per other route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--target", help="Base URL of a running backend (default: in-process)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--log-level", default="WARNING", help="Backend log level in-process")
+    args = parser.parse_args()
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=args.log_level)
+    logging.getLogger().setLevel(args.log_level)
+    random.seed(args.seed)
+    results = asyncio.run(
+        run_benchmark(routes, args.things, args.requests, args.concurrency, args.target)
+    )
+    if args.json:
+        print(json.dumps([r.summary() for r in results], indent=2))
+    else:
+        print(format_table(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Read-through cache for Ditto twin documents
+
+An in-process LRU with TTL and size bounds. Entries remember Ditto's ETag
+so stale entries can be revalidated with ``If-None-Match`` instead of being
+refetched, and a write clock keeps reads that raced with a local write from
+repopulating the cache with stale data.
+"""
+
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+CacheKey = Tuple[str, str]
+
+_REVISION_RE = re.compile(r"(\d+)")
+
+
+def parse_etag_revision(etag: Optional[str]) -> Optional[int]:
+    """Extract the revision from a Ditto ETag such as ``"rev:42"``"""
+    if not etag:
+        return None
+    match = _REVISION_RE.search(etag)
+    return int(match.group(1)) if match else None
+
+
+@dataclass
+class CacheEntry:
+    """A cached response body with its validators"""
+
+    value: Dict[str, Any]
+    etag: Optional[str]
+    revision: Optional[int]
+    stored_at: float
+
+
+class ThingCache:
+    """
+    LRU cache of Ditto responses keyed by ``(thing_id, path)``.
+
+    ``path`` is ``""`` for the whole thing or e.g. ``"features/temperature"``,
+    so all entries of a thing can be dropped at once on write.
+    """
+
+    def __init__(self, ttl: float = 5.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._keys_by_thing: Dict[str, set] = {}
+        # Write clock: reads only store if the thing was not written since
+        self._clock = 0
+        self._written_at: Dict[str, int] = {}
+        self._written_floor = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "invalidations": 0,
+            "evictions": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def generation(self) -> int:
+        """Write clock value to capture before reading from Ditto"""
+        return self._clock
+
+    def _last_write(self, thing_id: str) -> int:
+        return max(self._written_at.get(thing_id, 0), self._written_floor)
+
+    def lookup(self, key: CacheKey) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Return ``(entry, fresh)``. A stale entry is still returned so its
+        ETag can be used for revalidation; stale and missing both count as
+        misses.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            if time.monotonic() - entry.stored_at < self.ttl:
+                self.stats["hits"] += 1
+                return entry, True
+        self.stats["misses"] += 1
+        return entry, False
+
+    def store(
+        self,
+        key: CacheKey,
+        value: Dict[str, Any],
+        etag: Optional[str],
+        generation: int,
+    ) -> None:
+        """Cache ``value`` unless the thing was written since ``generation``"""
+        thing_id = key[0]
+        if not self.enabled or self._last_write(thing_id) > generation:
+            return
+
+        revision = parse_etag_revision(etag)
+        current = self._entries.get(key)
+        if (
+            current is not None
+            and revision is not None
+            and current.revision is not None
+            and revision < current.revision
+        ):
+            return
+
+        self._entries[key] = CacheEntry(value, etag, revision, time.monotonic())
+        self._entries.move_to_end(key)
+        self._keys_by_thing.setdefault(thing_id, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self._forget_key(old_key)
+            self.stats["evictions"] += 1
+
+    def touch(self, key: CacheKey) -> None:
+        """Mark a stale entry fresh again after a 304 Not Modified"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.stored_at = time.monotonic()
+            self.stats["revalidations"] += 1
+
+    def invalidate(self, thing_id: str) -> None:
+        """Drop every cached entry of a thing and record the write"""
+        self._clock += 1
+        self._written_at[thing_id] = self._clock
+        if len(self._written_at) > self.max_entries:
+            # Forget per-thing clocks but stay conservative for in-flight reads
+            self._written_floor = self._clock
+            self._written_at.clear()
+        for key in self._keys_by_thing.pop(thing_id, ()):
+            if self._entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_thing.clear()
+
+    def _forget_key(self, key: CacheKey) -> None:
+        keys = self._keys_by_thing.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_thing[key[0]]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters plus current size, for tuning"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+class KnownSet:
+    """
+    Bounded LRU set of ids known to exist upstream (e.g. policies), used to
+    skip existence checks and create-if-absent round trips.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item: str) -> bool:
+        if item in self._ids:
+            self._ids.move_to_end(item)
+            self.stats["hits"] += 1
+            return True
+        self.stats["misses"] += 1
+        return False
+
+    def add(self, item: str) -> None:
+        if self.max_entries <= 0:
+            return
+        self._ids[item] = None
+        self._ids.move_to_end(item)
+        while len(self._ids) > self.max_entries:
+            self._ids.popitem(last=False)
+
+    def discard(self, item: str) -> None:
+        self._ids.pop(item, None)
+
+    def clear(self) -> None:
+        self._ids.clear()
@@ -0,0 +1,159 @@
+"""
+Negotiated response compression for the Digital Twins Platform backend
+
+``CompressionMiddleware`` compresses responses with brotli when the client
+accepts it and the optional ``brotli`` package is installed, with gzip
+otherwise. Whole responses are compressed in one go; streamed responses
+(NDJSON exports) are compressed chunk by chunk and flushed after every
+chunk, so clients still see lines as they are produced.
+"""
+
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+# Already compressed or long-lived streams that must not be buffered
+_SKIP_CONTENT_TYPES = (
+    "text/event-stream",
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/vnd.apache.parquet",
+)
+
+
+def negotiate(accept_encoding: str, brotli_available: bool = BROTLI_AVAILABLE) -> Optional[str]:
+    """Pick ``br`` or ``gzip`` from an Accept-Encoding header, or None"""
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            weights[name.strip().lower()] = quality
+
+    wildcard = weights.get("*", 0.0)
+    candidates = (["br"] if brotli_available else []) + ["gzip"]
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = weights.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware compressing HTTP responses of at least
+    ``minimum_size`` bytes in the best encoding the client accepts.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = dict(scope.get("headers") or [])
+        encoding = negotiate(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = message.get("headers") or []
+                content_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+                passthrough = _header(headers, b"content-encoding") is not None or any(
+                    content_type.startswith(t) for t in _SKIP_CONTENT_TYPES
+                )
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                headers = [
+                    (k, v)
+                    for k, v in start.get("headers") or []
+                    if k.lower() not in (b"content-length", b"vary")
+                ]
+                vary = _header(start.get("headers") or [], b"vary")
+                headers.append(
+                    (b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding")
+                )
+                headers.append((b"content-encoding", encoding.encode()))
+                if not more_body:
+                    body = compressor.compress(body, final=True)
+                    headers.append((b"content-length", str(len(body)).encode()))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start, "headers": headers})
+
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": compressor.compress(body, final=not more_body),
+                    "more_body": more_body,
+                }
+            )
+
+        await self.app(scope, receive, send_wrapper)
@@ -14,10 +14,27 @@ class Settings(BaseSettings):
     ditto_ws_url: str = "ws://localhost:8081"
     ditto_devops_user: str = "devops"
     ditto_devops_password: str = "dittoPwd"
+    ditto_http2: bool = True
+    ditto_max_connections: int = 100
+    ditto_bulk_concurrency: int = 32
+
+    # Upstream timeouts (seconds) and circuit breaker
+    ditto_timeout: float = 10.0
+    ditto_read_timeout: float = 5.0
+    ditto_breaker_failure_threshold: int = 5
+    ditto_breaker_reset_timeout: float = 10.0
+    ditto_ready_interval: float = 2.0
+    ditto_ready_recheck_interval: float = 15.0
+    ditto_default_policy_mode: str = "thing"
+    ditto_known_policies_max: int = 10000
+    ditto_cache_ttl: float = 5.0
+    ditto_cache_max_entries: int = 10000
 
     # MQTT configuration
     mqtt_broker_url: str = "mqtt://localhost:1883"
     mqtt_client_id: str = "digital-twins-backend"
+    mqtt_bridge_enabled: bool = True
+    mqtt_telemetry_topic: str = "digitaltwins/+/telemetry"
 
     # Application settings
     app_name: str = "Digital Twins Platform"
@@ -27,6 +44,56 @@ class Settings(BaseSettings):
     # API settings
     api_prefix: str = "/api/v1"
 
+    # Telemetry ingest
+    telemetry_namespace: str = "digitaltwins"
+    telemetry_flush_interval: float = 0.25
+    telemetry_max_pending: int = 5000
+    # Buffered twins beyond which readings for other twins are shed (429)
+    telemetry_max_backlog: int = 20000
+    # Largest decompressed telemetry or bulk body (413 beyond)
+    telemetry_max_body_size: int = 64 * 1024 * 1024
+    telemetry_max_concurrency: int = 16
+
+    # Property PATCHes to one feature within this many seconds share a Ditto write
+    ditto_write_coalesce_window: float = 0.02
+
+    # Change events for /ws/events (Ditto SSE stream)
+    ditto_events_enabled: bool = True
+    ditto_events_extra_fields: str = "attributes,_revision"
+    ws_event_queue_size: int = 1000
+
+    # /ws/ditto proxy: clients share this many upstream Ditto sessions
+    ditto_ws_pool_size: int = 2
+
+    # Responses at least this large are gzip/brotli compressed when accepted
+    compression_minimum_size: int = 1024
+
+    # Local search index over these comma-separated paths (empty disables);
+    # needs the change stream (DITTO_EVENTS_ENABLED)
+    search_index_paths: str = ""
+    search_index_resync_interval: float = 300.0
+
+    # Numeric feature properties from telemetry kept as time series in
+    # memory-mapped segment files under this directory
+    history_enabled: bool = True
+    history_dir: str = "data/history"
+    history_segment_points: int = 65536
+    history_flush_interval: float = 1.0
+    # Comma-separated feature properties recorded from telemetry (empty
+    # records every numeric property)
+    history_properties: str = "value"
+    # Properties kept open (memory-mapped) at once; idle ones are closed
+    history_max_open_series: int = 1000
+    # Ranges with more samples per property are served from 1m/1h/1d rollups
+    history_max_points: int = 2000
+    # Retention in days (0 keeps forever): raw samples are compressed after
+    # the first, deleted after the second; minute rollups are deleted after
+    # the third, hourly and daily rollups are kept
+    history_raw_retention_days: float = 7.0
+    history_compressed_retention_days: float = 90.0
+    history_minute_retention_days: float = 90.0
+    history_compact_interval: float = 3600.0
+
     model_config = {"env_file": ".env", "case_sensitive": False}
 
 
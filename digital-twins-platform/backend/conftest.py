@@ -0,0 +1,36 @@
+"""
+Shared fixtures: the API wired to an in-process fake Ditto
+"""
+
+import httpx
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from fake_ditto import FakeDitto
+from main import app, ditto_client
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def fake_ditto():
+    return FakeDitto()
+
+
+@pytest_asyncio.fixture
+async def client(fake_ditto):
+    """Create a test client backed by an in-process fake Ditto"""
+    ditto_client.transport = httpx.ASGITransport(app=fake_ditto.app)
+    ditto_client.cache.clear()
+    ditto_client.known_policies.clear()
+    await ditto_client.connect()
+    transport = httpx.ASGITransport(app=app)
+    async with AsyncClient(
+        transport=transport, base_url="http://test", follow_redirects=True
+    ) as ac:
+        yield ac
+    await ditto_client.disconnect()
+    ditto_client.transport = None
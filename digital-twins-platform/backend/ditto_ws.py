@@ -0,0 +1,452 @@
+"""
+Shared upstream sessions for the /ws/ditto proxy
+
+Browser clients speak the Ditto WebSocket protocol to the backend, but
+instead of one upstream socket per client, a small fixed pool of
+authenticated Ditto sessions is shared:
+
+- ``START-SEND-*`` requests are acknowledged locally and merged into one
+  upstream subscription per stream (namespaces and extra fields unioned);
+  each client's own ``namespaces`` and ``filter`` are applied locally.
+- Ditto Protocol commands get a session-unique correlation-id so their
+  responses can be routed back to the client that sent them. A command
+  that cannot be sent upstream is answered locally with a Ditto error.
+- Events are parsed once and the same frame is queued for every
+  interested client; each client has its own bounded queue and sender.
+"""
+
+import asyncio
+import base64
+import itertools
+import json
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlencode
+
+import structlog
+
+from rql import Predicate, RQLError, compile_filter
+from telemetry import merge_patch
+
+logger = structlog.get_logger()
+
+Send = Callable[[str], Awaitable[None]]
+
+# Text protocol commands and the stream each one controls
+STREAMS = {
+    "EVENTS": "events",
+    "MESSAGES": "messages",
+    "LIVE_COMMANDS": "live-commands",
+    "LIVE_EVENTS": "live-events",
+}
+# Streams Ditto applies RQL filters to
+FILTERABLE_STREAMS = {"events", "live-events"}
+
+MAX_PENDING_COMMANDS = 10000
+
+
+def parse_stream_request(text: str) -> Optional[Tuple[str, str, Dict[str, str]]]:
+    """
+    Parse ``START-SEND-EVENTS?namespaces=a,b&filter=...`` into
+    ``("START", "events", {"namespaces": "a,b", "filter": "..."})``.
+    """
+    command, _, query = text.strip().partition("?")
+    action, _, stream = command.partition("-SEND-")
+    if action not in ("START", "STOP") or stream.replace("-", "_") not in STREAMS:
+        return None
+    params = {k: v[-1] for k, v in parse_qs(query, keep_blank_values=False).items()}
+    return action, STREAMS[stream.replace("-", "_")], params
+
+
+def stream_command(action: str, stream: str) -> str:
+    """Inverse of the stream lookup: ``("START", "live-events")`` -> ``START-SEND-LIVE-EVENTS``"""
+    return f"{action}-SEND-{stream.upper()}"
+
+
+def classify_topic(topic: str) -> Optional[str]:
+    """Stream a Ditto Protocol topic belongs to, e.g. ``ns/t/things/twin/events/modified``"""
+    parts = topic.split("/")
+    if len(parts) < 5 or parts[2] != "things":
+        return None
+    channel, criterion = parts[3], parts[4]
+    if channel == "twin" and criterion == "events":
+        return "events"
+    if channel == "live":
+        return {"messages": "messages", "commands": "live-commands", "events": "live-events"}.get(
+            criterion
+        )
+    return None
+
+
+def error_response(
+    command: Dict[str, Any], status: int, error: str, message: str
+) -> Dict[str, Any]:
+    """
+    A Ditto Protocol error answering ``command``: ``.../commands/<action>``
+    becomes ``.../errors``, and the command's correlation-id is kept.
+    """
+    parts = str(command.get("topic", "")).split("/")
+    if "commands" in parts:
+        parts = parts[: parts.index("commands")]
+    topic = "/".join(parts + ["errors"])
+    correlation_id = (command.get("headers") or {}).get("correlation-id")
+    headers = {"correlation-id": correlation_id} if correlation_id is not None else {}
+    return {
+        "topic": topic,
+        "headers": headers,
+        "path": "/",
+        "value": {"status": status, "error": error, "message": message},
+        "status": status,
+    }
+
+
+def event_to_thing(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild the changed part of a thing from an event's topic, path and value"""
+    namespace, name = message["topic"].split("/", 2)[:2]
+    thing: Dict[str, Any] = {"thingId": f"{namespace}:{name}"}
+    parts = [p for p in message.get("path", "/").split("/") if p]
+    value = message.get("value")
+    if parts:
+        for part in reversed(parts):
+            value = {part: value}
+        merge_patch(thing, value)
+    elif isinstance(value, dict):
+        merge_patch(thing, value)
+    if isinstance(message.get("extra"), dict):
+        merge_patch(thing, message["extra"])
+    return thing
+
+
+class StreamSubscription:
+    """One client's interest in a stream, with its local filters"""
+
+    def __init__(self, params: Dict[str, str]):
+        namespaces = params.get("namespaces")
+        self.namespaces = set(filter(None, namespaces.split(","))) if namespaces else None
+        self.extra_fields = params.get("extraFields")
+        self.filter_str = params.get("filter")
+        self._predicate: Optional[Predicate] = (
+            compile_filter(self.filter_str) if self.filter_str else None
+        )
+
+    def matches(self, stream: str, message: Dict[str, Any]) -> bool:
+        if self.namespaces is not None:
+            if message["topic"].split("/", 1)[0] not in self.namespaces:
+                return False
+        if self._predicate is None or stream not in FILTERABLE_STREAMS:
+            return True
+        return self._predicate(event_to_thing(message))
+
+
+# ============================================
+# Clients
+# ============================================
+
+
+class ProxyClient:
+    """A browser connection attached to an upstream session"""
+
+    def __init__(self, send: Send, queue_size: int = 1000):
+        self.send = send
+        self.streams: Dict[str, StreamSubscription] = {}
+        self.session: Optional["UpstreamSession"] = None
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def deliver(self, frame: str) -> None:
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _send_loop(self) -> None:
+        while True:
+            await self.send(await self.queue.get())
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._send_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def handle(self, text: str) -> None:
+        """Process one frame received from the browser"""
+        request = parse_stream_request(text)
+        if request is not None:
+            action, stream, params = request
+            if action == "START":
+                try:
+                    self.streams[stream] = StreamSubscription(params)
+                except RQLError as e:
+                    self.deliver(f"{stream_command(action, stream)}:NACK:{e}")
+                    return
+            else:
+                self.streams.pop(stream, None)
+            self.deliver(f"{stream_command(action, stream)}:ACK")
+            await self.session.sync_subscriptions()
+            return
+
+        try:
+            message = json.loads(text)
+        except ValueError:
+            # JWT-TOKEN and other session-level frames must not reach the
+            # shared upstream session
+            logger.warning("ditto_proxy_frame_ignored", frame=text[:64])
+            return
+        if isinstance(message, dict) and "topic" in message:
+            await self.session.forward_command(self, message)
+
+
+# ============================================
+# Upstream sessions
+# ============================================
+
+
+class UpstreamSession:
+    """One authenticated Ditto WebSocket shared by many clients"""
+
+    def __init__(
+        self,
+        connect: Callable[[], Awaitable[Any]],
+        max_backoff: float = 30.0,
+        connect_timeout: float = 10.0,
+    ):
+        self.connect = connect
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.clients: Set[ProxyClient] = set()
+        self.stats = {"received": 0, "routed": 0, "fanned_out": 0, "reconnects": 0}
+        self._ws: Any = None
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed: Dict[str, str] = {}
+        self._sync_lock = asyncio.Lock()
+        self._pending: "OrderedDict[str, Tuple[ProxyClient, Optional[str]]]" = OrderedDict()
+        self._ids = itertools.count()
+        self._prefix = f"dt-{id(self):x}"
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._connected.clear()
+
+    def desired_subscriptions(self) -> Dict[str, str]:
+        """Merged upstream request for every stream some client wants"""
+        desired = {}
+        for stream in STREAMS.values():
+            subs = [c.streams[stream] for c in self.clients if stream in c.streams]
+            if not subs:
+                continue
+            params = {}
+            if all(s.namespaces for s in subs):
+                params["namespaces"] = ",".join(sorted(set().union(*(s.namespaces for s in subs))))
+            extra = sorted(
+                {f for s in subs if s.extra_fields for f in s.extra_fields.split(",") if f}
+            )
+            if extra:
+                params["extraFields"] = ",".join(extra)
+            desired[stream] = urlencode(params, safe=",/")
+        return desired
+
+    async def sync_subscriptions(self) -> None:
+        """Send START/STOP upstream so it carries exactly the merged interest"""
+        async with self._sync_lock:
+            if not self.connected:
+                return  # applied on (re)connect
+            desired = self.desired_subscriptions()
+            for stream in STREAMS.values():
+                current = self._subscribed.get(stream)
+                wanted = desired.get(stream)
+                if wanted == current:
+                    continue
+                if wanted is None:
+                    await self._ws.send(stream_command("STOP", stream))
+                    del self._subscribed[stream]
+                else:
+                    command = stream_command("START", stream)
+                    await self._ws.send(f"{command}?{wanted}" if wanted else command)
+                    self._subscribed[stream] = wanted
+                logger.info("ditto_ws_subscription_changed", stream=stream, params=wanted)
+
+    async def forward_command(self, client: ProxyClient, message: Dict[str, Any]) -> None:
+        """Send a Ditto Protocol command, remembering where its response goes"""
+        headers = dict(message.get("headers") or {})
+        correlation_id = f"{self._prefix}-{next(self._ids)}"
+        self._pending[correlation_id] = (client, headers.get("correlation-id"))
+        while len(self._pending) > MAX_PENDING_COMMANDS:
+            self._pending.popitem(last=False)
+        headers["correlation-id"] = correlation_id
+        try:
+            await asyncio.wait_for(self._connected.wait(), self.connect_timeout)
+            await self._ws.send(json.dumps({**message, "headers": headers}))
+        except Exception as e:
+            self._pending.pop(correlation_id, None)
+            logger.warning("ditto_proxy_command_failed", error=str(e), topic=message.get("topic"))
+            if isinstance(e, asyncio.TimeoutError):
+                reason = f"Ditto did not connect within {self.connect_timeout:g} s"
+            else:
+                reason = f"Sending to Ditto failed: {e}"
+            response = error_response(message, 503, "gateway:service.unavailable", reason)
+            client.deliver(json.dumps(response))
+
+    def forget(self, client: ProxyClient) -> None:
+        for correlation_id, (owner, _) in list(self._pending.items()):
+            if owner is client:
+                del self._pending[correlation_id]
+
+    def dispatch(self, frame: str) -> None:
+        """Route one upstream frame to the client(s) it is meant for"""
+        self.stats["received"] += 1
+        if frame.startswith(("START-SEND-", "STOP-SEND-")):
+            return  # clients were acknowledged locally
+        try:
+            message = json.loads(frame)
+        except ValueError:
+            return
+        if not isinstance(message, dict) or "topic" not in message:
+            return
+
+        headers = message.get("headers") or {}
+        target = self._pending.pop(headers.get("correlation-id"), None)
+        if target is not None:
+            client, original_id = target
+            headers = dict(headers)
+            if original_id is None:
+                headers.pop("correlation-id", None)
+            else:
+                headers["correlation-id"] = original_id
+            client.deliver(json.dumps({**message, "headers": headers}))
+            self.stats["routed"] += 1
+            return
+
+        stream = classify_topic(message["topic"])
+        if stream is None:
+            return
+        for client in self.clients:
+            subscription = client.streams.get(stream)
+            if subscription is not None and subscription.matches(stream, message):
+                client.deliver(frame)
+                self.stats["fanned_out"] += 1
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                self._ws = await self.connect()
+                self._subscribed = {}
+                self._connected.set()
+                backoff = 1.0
+                logger.info("ditto_ws_session_connected", clients=len(self.clients))
+                await self.sync_subscriptions()
+                async for frame in self._ws:
+                    self.dispatch(frame if isinstance(frame, str) else frame.decode())
+            except asyncio.CancelledError:
+                if self._ws is not None:
+                    await self._ws.close()
+                raise
+            except Exception as e:
+                logger.warning("ditto_ws_session_disconnected", error=str(e))
+            self._connected.clear()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+
+# ============================================
+# Pool
+# ============================================
+
+
+def websocket_connector(url: str, user: str, password: str) -> Callable[[], Awaitable[Any]]:
+    """Connection factory for Ditto's ``/ws/2`` endpoint with basic auth"""
+    token = base64.b64encode(f"{user}:{password}".encode()).decode()
+
+    async def connect():
+        from websockets.asyncio.client import connect as ws_connect
+
+        return await ws_connect(
+            f"{url.rstrip('/')}/ws/2",
+            additional_headers={"Authorization": f"Basic {token}"},
+        )
+
+    return connect
+
+
+class DittoWebSocketPool:
+    """Assigns proxy clients to a fixed number of shared upstream sessions"""
+
+    def __init__(
+        self,
+        connect: Callable[[], Awaitable[Any]],
+        size: int = 2,
+        queue_size: int = 1000,
+        connect_timeout: float = 10.0,
+    ):
+        self.queue_size = queue_size
+        self.sessions: List[UpstreamSession] = [
+            UpstreamSession(connect, connect_timeout=connect_timeout) for _ in range(size)
+        ]
+
+    async def attach(self, send: Send) -> ProxyClient:
+        client = ProxyClient(send, self.queue_size)
+        session = min(self.sessions, key=lambda s: len(s.clients))
+        client.session = session
+        session.clients.add(client)
+        session.start()
+        client.start()
+        logger.info("ditto_websocket_proxy_connected", session_clients=len(session.clients))
+        return client
+
+    async def detach(self, client: ProxyClient) -> None:
+        session = client.session
+        session.clients.discard(client)
+        session.forget(client)
+        await client.stop()
+        await session.sync_subscriptions()
+        logger.info("ditto_websocket_proxy_disconnected", session_clients=len(session.clients))
+
+    async def close(self) -> None:
+        for session in self.sessions:
+            for client in list(session.clients):
+                await client.stop()
+            session.clients.clear()
+            await session.stop()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "sessions": [
+                {
+                    "connected": s.connected,
+                    "clients": len(s.clients),
+                    "subscriptions": dict(s._subscribed),
+                    "pending_commands": len(s._pending),
+                    **s.stats,
+                }
+                for s in self.sessions
+            ],
+            "clients": sum(len(s.clients) for s in self.sessions),
+            "connected_sessions": sum(1 for s in self.sessions if s.connected),
+            "queued": sum(c.queue.qsize() for s in self.sessions for c in s.clients),
+            "dropped": sum(c.dropped for s in self.sessions for c in s.clients),
+        }
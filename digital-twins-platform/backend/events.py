@@ -0,0 +1,375 @@
+"""
+Change-event fan-out for the Digital Twins Platform
+
+``ChangeStream`` consumes Ditto's server-sent change stream and hands each
+change to its listeners (the WebSocket hub, the read cache). ``EventHub``
+keeps one bounded queue and one sender task per ``/ws/events`` client, so
+a slow client only ever delays itself. Queues conflate by thing: while a
+client is behind, successive changes to the same twin are merged into one
+pending event carrying the latest value of every property.
+"""
+
+import asyncio
+import itertools
+import json
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+import structlog
+
+from rql import Predicate, RQLError, compile_filter
+from telemetry import merge_patch
+
+logger = structlog.get_logger()
+
+Event = Dict[str, Any]
+Listener = Callable[[Event], None]
+
+
+def change_to_event(change: Dict[str, Any]) -> Optional[Event]:
+    """
+    Turn one change from Ditto's SSE stream into a client event.
+
+    The change is the modified part of the thing (plus any requested
+    ``extraFields``). A ``_revision`` of 1 marks a newly created thing.
+    """
+    thing_id = change.get("thingId")
+    if not isinstance(thing_id, str):
+        return None
+    data = dict(change)
+    revision = data.pop("_revision", None)
+    return {
+        "event": "thing.created" if revision == 1 else "thing.updated",
+        "thingId": thing_id,
+        "revision": revision,
+        "data": data,
+    }
+
+
+def deleted_event(thing_id: str) -> Event:
+    """Event published when a thing is deleted through this API"""
+    return {"event": "thing.deleted", "thingId": thing_id, "revision": None, "data": {}}
+
+
+def conflate(pending: Event, newer: Event) -> Event:
+    """Merge a newer event for the same thing into one that was not yet sent"""
+    if newer["event"] == "thing.deleted" or pending["event"] == "thing.deleted":
+        return newer
+    data = merge_patch(merge_patch({}, pending["data"]), newer["data"])
+    kind = "thing.created" if pending["event"] == "thing.created" else newer["event"]
+    return {**newer, "event": kind, "data": data}
+
+
+# ============================================
+# Per-client queue
+# ============================================
+
+
+class ConflatingQueue:
+    """
+    Bounded FIFO of pending messages keyed by thing.
+
+    Putting a message for a key that is already pending conflates the two
+    in place, keeping its position. Control messages (``key=None``) are
+    never conflated. When full, the oldest pending message is dropped and
+    the consumer is told how many were lost so it can resynchronise.
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, Event]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self._sequence = itertools.count()
+        self._unreported_drops = 0
+        self.stats = {"queued": 0, "conflated": 0, "dropped": 0}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, key: Optional[Hashable], item: Event) -> None:
+        if key is not None and key in self._items:
+            self._items[key] = conflate(self._items[key], item)
+            self.stats["conflated"] += 1
+            return
+
+        if len(self._items) >= self.maxsize:
+            self._items.popitem(last=False)
+            self.stats["dropped"] += 1
+            self._unreported_drops += 1
+        if key is None:
+            key = ("control", next(self._sequence))
+        self._items[key] = item
+        self.stats["queued"] += 1
+        self._ready.set()
+
+    async def get(self) -> Event:
+        if self._unreported_drops:
+            dropped, self._unreported_drops = self._unreported_drops, 0
+            return {"type": "dropped", "count": dropped}
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popitem(last=False)[1]
+
+
+# ============================================
+# Subscriptions
+# ============================================
+
+
+class Subscription:
+    """
+    Which events a client receives.
+
+    ``thing_ids`` and ``namespaces`` restrict by id; ``filter_str`` is an RQL
+    expression evaluated against the changed part of the thing (enriched
+    with the stream's extra fields). Deletions carry no data, so they skip
+    the filter but still respect the id restrictions. With no criteria at
+    all a subscription matches everything.
+    """
+
+    def __init__(
+        self,
+        thing_ids: Optional[List[str]] = None,
+        namespaces: Optional[List[str]] = None,
+        filter_str: Optional[str] = None,
+        active: bool = True,
+    ):
+        self.thing_ids = set(thing_ids) if thing_ids else None
+        self.namespaces = set(namespaces) if namespaces else None
+        self.filter_str = filter_str
+        self.active = active
+        self._predicate: Optional[Predicate] = compile_filter(filter_str) if filter_str else None
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> "Subscription":
+        """Build from a ``{"type": "subscribe", ...}`` client message"""
+        thing_ids = message.get("thingIds")
+        namespaces = message.get("namespaces")
+        for name, value in (("thingIds", thing_ids), ("namespaces", namespaces)):
+            if value is not None and not (
+                isinstance(value, list) and all(isinstance(v, str) for v in value)
+            ):
+                raise ValueError(f"{name} must be a list of strings")
+        filter_str = message.get("filter")
+        if filter_str is not None and not isinstance(filter_str, str):
+            raise ValueError("filter must be an RQL string")
+        return cls(thing_ids, namespaces, filter_str)
+
+    def matches(self, event: Event) -> bool:
+        if not self.active:
+            return False
+        thing_id = event["thingId"]
+        if self.thing_ids is not None and thing_id not in self.thing_ids:
+            return False
+        if self.namespaces is not None and thing_id.split(":", 1)[0] not in self.namespaces:
+            return False
+        if self._predicate is None or event["event"] == "thing.deleted":
+            return True
+        return self._predicate(event["data"])
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "thingIds": sorted(self.thing_ids) if self.thing_ids else None,
+            "namespaces": sorted(self.namespaces) if self.namespaces else None,
+            "filter": self.filter_str,
+            "active": self.active,
+        }
+
+
+# ============================================
+# Clients and hub
+# ============================================
+
+
+class EventClient:
+    """One connected consumer with its own queue and sender task"""
+
+    def __init__(self, send: Callable[[Event], Awaitable[None]], queue_size: int = 1000):
+        self.send = send
+        self.queue = ConflatingQueue(queue_size)
+        self.subscription = Subscription()
+        self._task: Optional[asyncio.Task] = None
+
+    def offer(self, event: Event) -> None:
+        if self.subscription.matches(event):
+            self.queue.put(event["thingId"], event)
+
+    def reply(self, message: Dict[str, Any]) -> None:
+        self.queue.put(None, message)
+
+    def handle_message(self, text: str) -> None:
+        """Apply a client control message (ping, subscribe, unsubscribe)"""
+        if text == "ping":
+            self.reply({"type": "pong"})
+            return
+        try:
+            message = json.loads(text)
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "ping":
+                self.reply({"type": "pong"})
+            elif kind == "subscribe":
+                self.subscription = Subscription.from_message(message)
+                self.reply({"type": "subscribed", **self.subscription.describe()})
+            elif kind == "unsubscribe":
+                self.subscription = Subscription(active=False)
+                self.reply({"type": "unsubscribed"})
+            else:
+                raise ValueError(f"Unknown message type {kind!r}")
+        except (ValueError, RQLError) as e:
+            self.reply({"type": "error", "message": str(e)})
+
+    async def _send_loop(self) -> None:
+        while True:
+            message = await self.queue.get()
+            await self.send(message)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._send_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+
+class EventHub:
+    """Fans events out to the queues of all connected clients"""
+
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self.clients: Set[EventClient] = set()
+        self.stats = {"published": 0}
+
+    def register(self, send: Callable[[Event], Awaitable[None]]) -> EventClient:
+        client = EventClient(send, self.queue_size)
+        self.clients.add(client)
+        client.start()
+        logger.info("websocket_connected", total_connections=len(self.clients))
+        return client
+
+    async def unregister(self, client: EventClient) -> None:
+        self.clients.discard(client)
+        await client.stop()
+        logger.info("websocket_disconnected", total_connections=len(self.clients))
+
+    def publish(self, event: Event) -> None:
+        """Offer an event to every client; never blocks on a slow consumer"""
+        self.stats["published"] += 1
+        for client in self.clients:
+            client.offer(event)
+
+    async def close(self) -> None:
+        for client in list(self.clients):
+            await self.unregister(client)
+
+    def snapshot(self) -> Dict[str, Any]:
+        depths = [len(c.queue) for c in self.clients]
+        totals = {"queued": 0, "conflated": 0, "dropped": 0}
+        for client in self.clients:
+            for key in totals:
+                totals[key] += client.queue.stats[key]
+        return {
+            **self.stats,
+            **totals,
+            "clients": len(self.clients),
+            "max_queue_depth": max(depths, default=0),
+            "queue_size": self.queue_size,
+        }
+
+
+# ============================================
+# Upstream change stream
+# ============================================
+
+
+class ChangeStream:
+    """
+    Keeps one consumer of Ditto's change stream running, reconnecting with
+    backoff, and passes each change to the registered listeners.
+
+    The stream counts as connected from the first change, or earlier when
+    the source calls ``opened`` once its response is open, so an idle but
+    healthy stream is reported as connected.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], AsyncIterator[Dict[str, Any]]],
+        max_backoff: float = 30.0,
+    ):
+        self.source = source
+        self.max_backoff = max_backoff
+        self.listeners: List[Listener] = []
+        self.disconnect_listeners: List[Callable[[], None]] = []
+        self.connected = False
+        self.stats = {"changes": 0, "reconnects": 0}
+        self._task: Optional[asyncio.Task] = None
+
+    def add_listener(self, listener: Listener) -> None:
+        self.listeners.append(listener)
+
+    def add_disconnect_listener(self, listener: Callable[[], None]) -> None:
+        """Call ``listener`` whenever the stream drops, as changes may have been missed"""
+        self.disconnect_listeners.append(listener)
+
+    def opened(self) -> None:
+        """Mark the stream connected; called by the source when its response opens"""
+        self.connected = True
+
+    def publish(self, event: Event) -> None:
+        """Deliver an event to every listener"""
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning("change_listener_failed", error=str(e), thing_id=event["thingId"])
+
+    async def _consume(self) -> None:
+        async for change in self.source():
+            self.connected = True
+            event = change_to_event(change)
+            if event is not None:
+                self.stats["changes"] += 1
+                self.publish(event)
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                await self._consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("change_stream_disconnected", error=str(e))
+            for listener in self.disconnect_listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    logger.warning("change_disconnect_listener_failed", error=str(e))
+            if self.connected:
+                backoff = 1.0
+            self.connected = False
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self) -> None:
+        """Start consuming in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected = False
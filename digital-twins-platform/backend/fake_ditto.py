@@ -0,0 +1,318 @@
+"""
+In-process stand-in for the Eclipse Ditto HTTP API
+
+Implements the parts of ``/api/2`` that ``DittoClient`` uses, in memory:
+things and policies with revisions and ETags, RFC 7396 merge patches,
+features, ``fields`` projections, search with the RQL subset from
+``rql.py`` and cursor paging, and the server-sent change stream. Good
+enough for tests and load benchmarks without the Docker Ditto/MongoDB
+stack:
+
+    uvicorn fake_ditto:app --port 8080
+
+or in-process with ``httpx.ASGITransport(app=FakeDitto().app)``.
+"""
+
+import asyncio
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from rql import MISSING, RQLError, compile_filter, parse_fields, project, resolve
+from telemetry import merge_patch, pointer_to_patch
+
+_OPTION_RE = re.compile(r"(\w+)\(([^)]*)\)")
+
+
+def apply_merge_patch(target: Any, patch: Any) -> Any:
+    """Apply an RFC 7396 JSON merge patch and return the result"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def parse_options(option: Optional[str]) -> Dict[str, str]:
+    """``size(10),cursor(abc)`` -> ``{"size": "10", "cursor": "abc"}``"""
+    return {name: args for name, args in _OPTION_RE.findall(option or "")}
+
+
+@lru_cache(maxsize=256)
+def _compiled(filter_str: str):
+    return compile_filter(filter_str)
+
+
+def _error(status: int, error: str, message: str) -> JSONResponse:
+    return JSONResponse({"status": status, "error": error, "message": message}, status_code=status)
+
+
+class FakeDitto:
+    """In-memory Ditto; ``app`` is the ASGI application"""
+
+    def __init__(self, enforce_policies: bool = True):
+        self.enforce_policies = enforce_policies
+        self.things: Dict[str, Dict[str, Any]] = {}
+        self.revisions: Dict[str, int] = {}
+        self.policies: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Set[asyncio.Queue] = set()
+        self.app = self._build_app()
+
+    # ========================================
+    # Change stream
+    # ========================================
+
+    def _publish(self, thing_id: str, change: Dict[str, Any]) -> None:
+        if self._subscribers:
+            event = {"thingId": thing_id, **change}
+            for queue in self._subscribers:
+                queue.put_nowait(event)
+
+    def _enrich(self, event: Dict[str, Any], extra_fields: List[str]) -> Dict[str, Any]:
+        """Add ``extraFields`` from the current thing, like Ditto does"""
+        thing_id = event["thingId"]
+        thing = self.things.get(thing_id, {})
+        enriched: Dict[str, Any] = {}
+        for field in extra_fields:
+            if field == "_revision":
+                enriched["_revision"] = self.revisions.get(thing_id)
+                continue
+            value = resolve(thing, field)
+            if value is MISSING:
+                continue
+            for part in reversed(field.strip("/").split("/")):
+                value = {part: value}
+            merge_patch(enriched, value)
+        return merge_patch(enriched, event)
+
+    # ========================================
+    # Things
+    # ========================================
+
+    def _etag(self, thing_id: str) -> Dict[str, str]:
+        return {"ETag": f'"rev:{self.revisions[thing_id]}"'}
+
+    def _write(self, thing_id: str, thing: Dict[str, Any], change: Dict[str, Any]) -> None:
+        self.things[thing_id] = thing
+        self.revisions[thing_id] = self.revisions.get(thing_id, 0) + 1
+        self._publish(thing_id, change)
+
+    def _check_policy(self, policy_id: Optional[str]) -> Optional[JSONResponse]:
+        if self.enforce_policies and policy_id and policy_id not in self.policies:
+            return _error(
+                400,
+                "things:policy.notfound",
+                f"The Policy with ID '{policy_id}' could not be found.",
+            )
+        return None
+
+    def _thing_not_found(self, thing_id: str) -> JSONResponse:
+        return _error(
+            404, "things:thing.notfound", f"The Thing with ID '{thing_id}' could not be found."
+        )
+
+    async def put_thing(self, thing_id: str, request: Request) -> Response:
+        body = await request.json()
+        exists = thing_id in self.things
+        if exists and request.headers.get("if-none-match") == "*":
+            return _error(412, "things:precondition.failed", "The Thing already exists.")
+        failed = self._check_policy(body.get("policyId"))
+        if failed is not None:
+            return failed
+        thing = {**body, "thingId": thing_id}
+        thing.setdefault("policyId", thing_id)
+        self._write(thing_id, thing, thing)
+        if exists:
+            return Response(status_code=204, headers=self._etag(thing_id))
+        return JSONResponse(thing, status_code=201, headers=self._etag(thing_id))
+
+    async def get_thing(self, thing_id: str, request: Request) -> Response:
+        thing = self.things.get(thing_id)
+        if thing is None:
+            return self._thing_not_found(thing_id)
+        headers = self._etag(thing_id)
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        fields = request.query_params.get("fields")
+        if fields:
+            try:
+                selected = parse_fields(fields)
+                thing = project(thing, fields)
+            except RQLError as e:
+                return _error(400, "json.fieldselector.invalid", str(e))
+            if "_revision" in selected:
+                thing["_revision"] = self.revisions.get(thing_id)
+        return JSONResponse(thing, headers=headers)
+
+    async def patch_thing(self, thing_id: str, request: Request) -> Response:
+        thing = self.things.get(thing_id)
+        if thing is None:
+            return self._thing_not_found(thing_id)
+        patch = await request.json()
+        patch.pop("thingId", None)
+        self._write(thing_id, {**apply_merge_patch(thing, patch), "thingId": thing_id}, patch)
+        return Response(status_code=204, headers=self._etag(thing_id))
+
+    async def delete_thing(self, thing_id: str) -> Response:
+        if self.things.pop(thing_id, None) is None:
+            return self._thing_not_found(thing_id)
+        self.revisions.pop(thing_id, None)
+        return Response(status_code=204)
+
+    async def get_feature(self, thing_id: str, feature_id: str, request: Request) -> Response:
+        thing = self.things.get(thing_id)
+        if thing is None:
+            return self._thing_not_found(thing_id)
+        feature = thing.get("features", {}).get(feature_id)
+        if feature is None:
+            return _error(
+                404,
+                "things:feature.notfound",
+                f"The Feature with ID '{feature_id}' on the Thing with ID '{thing_id}' could not be found.",
+            )
+        headers = self._etag(thing_id)
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(feature, headers=headers)
+
+    async def put_feature(self, thing_id: str, feature_id: str, request: Request) -> Response:
+        thing = self.things.get(thing_id)
+        if thing is None:
+            return self._thing_not_found(thing_id)
+        feature = await request.json()
+        features = dict(thing.get("features", {}))
+        created = feature_id not in features
+        features[feature_id] = feature
+        change = {"features": {feature_id: feature}}
+        self._write(thing_id, {**thing, "features": features}, change)
+        if created:
+            return JSONResponse(feature, status_code=201, headers=self._etag(thing_id))
+        return Response(status_code=204, headers=self._etag(thing_id))
+
+    async def patch_properties(
+        self, thing_id: str, feature_id: str, request: Request, pointer: str = ""
+    ) -> Response:
+        thing = self.things.get(thing_id)
+        if thing is None:
+            return self._thing_not_found(thing_id)
+        patch = await request.json()
+        if not pointer.strip("/") and not isinstance(patch, dict):
+            return _error(400, "things:feature.properties.invalid", "Properties must be an object.")
+        change = {"features": {feature_id: {"properties": pointer_to_patch(pointer, patch)}}}
+        self._write(thing_id, {**apply_merge_patch(thing, change), "thingId": thing_id}, change)
+        return Response(status_code=204, headers=self._etag(thing_id))
+
+    async def search(self, request: Request) -> Response:
+        params = request.query_params
+        try:
+            predicate = _compiled(params["filter"]) if params.get("filter") else None
+        except RQLError as e:
+            return _error(400, "thing-search:rql.expression.invalid", str(e))
+
+        options = parse_options(params.get("option"))
+        size = int(options.get("size", 25))
+        start = int(options.get("cursor") or 0)
+        if "limit" in options:
+            offset, _, count = options["limit"].partition(",")
+            start, size = int(offset), int(count or size)
+
+        ids = sorted(self.things)
+        if predicate is not None:
+            ids = [i for i in ids if predicate(self.things[i])]
+        page = ids[start : start + size]
+        items = [self.things[i] for i in page]
+        if params.get("fields"):
+            items = [project(thing, params["fields"]) for thing in items]
+        body: Dict[str, Any] = {"items": items}
+        if start + size < len(ids):
+            body["nextPageCursor"] = str(start + size)
+        return JSONResponse(body)
+
+    async def change_stream(self, request: Request) -> Response:
+        if "text/event-stream" not in request.headers.get("accept", ""):
+            return JSONResponse(list(self.things.values()))
+        extra_fields = [f for f in request.query_params.get("extraFields", "").split(",") if f]
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.add(queue)
+
+        async def events():
+            try:
+                while True:
+                    event = self._enrich(await queue.get(), extra_fields)
+                    yield f"data:{json.dumps(event)}\n\n"
+            finally:
+                self._subscribers.discard(queue)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    # ========================================
+    # Policies
+    # ========================================
+
+    async def put_policy(self, policy_id: str, request: Request) -> Response:
+        exists = policy_id in self.policies
+        if exists and request.headers.get("if-none-match") == "*":
+            return _error(412, "policies:precondition.failed", "The Policy already exists.")
+        policy = {**(await request.json()), "policyId": policy_id}
+        self.policies[policy_id] = policy
+        if exists:
+            return Response(status_code=204)
+        return JSONResponse(policy, status_code=201)
+
+    async def get_policy(self, policy_id: str) -> Response:
+        policy = self.policies.get(policy_id)
+        if policy is None:
+            return _error(
+                404,
+                "policies:policy.notfound",
+                f"The Policy with ID '{policy_id}' could not be found.",
+            )
+        return JSONResponse(policy)
+
+    async def delete_policy(self, policy_id: str) -> Response:
+        if self.policies.pop(policy_id, None) is None:
+            return _error(
+                404,
+                "policies:policy.notfound",
+                f"The Policy with ID '{policy_id}' could not be found.",
+            )
+        return Response(status_code=204)
+
+    # ========================================
+    # Routing
+    # ========================================
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Fake Ditto", docs_url=None, redoc_url=None, openapi_url=None)
+        things = "/api/2/things/{thing_id}"
+        feature = things + "/features/{feature_id}"
+        policies = "/api/2/policies/{policy_id}"
+
+        app.add_api_route("/health", lambda: {"status": "UP"}, methods=["GET"])
+        app.add_api_route("/api/2/things", self.change_stream, methods=["GET"])
+        app.add_api_route("/api/2/search/things", self.search, methods=["GET"])
+        app.add_api_route(things, self.put_thing, methods=["PUT"])
+        app.add_api_route(things, self.get_thing, methods=["GET"])
+        app.add_api_route(things, self.patch_thing, methods=["PATCH"])
+        app.add_api_route(things, self.delete_thing, methods=["DELETE"])
+        app.add_api_route(feature, self.get_feature, methods=["GET"])
+        app.add_api_route(feature, self.put_feature, methods=["PUT"])
+        app.add_api_route(feature + "/properties", self.patch_properties, methods=["PATCH"])
+        app.add_api_route(
+            feature + "/properties/{pointer:path}", self.patch_properties, methods=["PATCH"]
+        )
+        app.add_api_route(policies, self.put_policy, methods=["PUT"])
+        app.add_api_route(policies, self.get_policy, methods=["GET"])
+        app.add_api_route(policies, self.delete_policy, methods=["DELETE"])
+        return app
+
+
+app = FakeDitto().app
@@ -0,0 +1,988 @@
+"""
+Time-series history for feature properties
+
+Ditto only keeps the current state of a twin, so every numeric feature
+property that arrives as telemetry is also appended here. Each property
+(``thing / feature / property``) is its own series, stored as fixed-size
+segments of memory-mapped float64 columns:
+
+    <root>/<thing>/<feature>/<property>/<segment start>.t     timestamps
+    <root>/<thing>/<feature>/<property>/<segment start>.v     values
+    <root>/<thing>/<feature>/<property>/cold/<start>.blk      compressed
+    <root>/<thing>/<feature>/<property>/1m/<segment start>.*  rollups
+    <root>/<thing>/<feature>/<property>/1h/...
+    <root>/<thing>/<feature>/<property>/1d/...
+
+Segments are named after their first timestamp and filled in time order,
+so a range query finds its segments with a binary search over the names
+and its rows with ``searchsorted`` inside each segment, and reads them
+through zero-copy views of the mapped files. Unused rows hold NaN
+timestamps, which is how the fill level of a segment is recovered after
+a restart. Only the segment being appended to stays mapped; sealed ones
+are mapped while they are read.
+
+Rollups keep min/max/sum/count/last per minute, hour and day. They are
+updated as samples are appended: only the newest row of each rollup can
+still change, and it is rewritten in place. Queries read raw samples when
+the range has few enough of them and otherwise the finest rollup that
+fits the point budget, so a 30-day chart reads 720 hourly rows.
+
+Retention is tiered. Sealed raw segments older than the raw retention
+are compacted into compressed blocks: timestamps as delta-of-deltas and
+values XORed with their predecessor (as in Gorilla), byte-shuffled and
+deflated, which keeps both directions vectorized. Blocks older than the
+compressed retention are deleted, as are minute rollups past theirs, so
+only hourly and daily rollups are kept forever. Queries decode blocks
+transparently, and fall back to rollups for ranges whose raw samples are
+gone.
+
+Samples are buffered and appended in batches; samples older than the
+newest stored one of their series are dropped. Only the configured
+properties of a telemetry patch are recorded (by default ``value``), and
+only the most recently used series are kept open.
+
+Thing, feature and property names are percent-encoded into path
+components, with a leading dot encoded as well, so no name can resolve to
+``.`` or ``..`` and leave the history root.
+"""
+
+import asyncio
+import json
+import math
+import struct
+import time
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+import numpy as np
+import structlog
+
+logger = structlog.get_logger()
+
+SeriesKey = Tuple[str, str, str]
+Columns = Dict[str, np.ndarray]
+
+DTYPE = np.dtype("<f8")
+
+RAW_COLUMNS = ("t", "v")
+ROLLUP_COLUMNS = ("t", "min", "max", "sum", "count", "last")
+# Columns of an aggregated query result; ``v`` is the bucket average
+BUCKET_COLUMNS = ("t", "v", "min", "max", "last", "count")
+
+# Rollup resolutions, finest first; each width divides the next
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+# Rows per rollup segment: a week of minutes, a quarter of hours and four
+# years of days
+ROLLUP_SEGMENT_POINTS = {"1m": 7 * 1440, "1h": 92 * 24, "1d": 1461}
+
+# Upper bound on buckets per property for a requested ``step``
+MAX_BUCKETS = 100_000
+
+BLOCK_MAGIC = b"DTH1"
+# Magic, sample count, first and last timestamp, compressed timestamp bytes
+BLOCK_HEADER = struct.Struct("<4sIddI")
+COMPRESS_LEVEL = 6
+# Decoded cold blocks kept per property for repeated queries
+COLD_CACHE_BLOCKS = 4
+
+
+def parse_time(value: Any) -> Optional[float]:
+    """Epoch seconds from epoch seconds/milliseconds or an ISO-8601 string"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        value = float(value)
+        if not math.isfinite(value):
+            return None
+        return value / 1000.0 if value > 1e11 else value
+    if isinstance(value, str) and value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    return None
+
+
+def _numeric_leaves(properties: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in properties.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _numeric_leaves(value, f"{path}/")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            if math.isfinite(value):
+                yield path, float(value)
+
+
+def extract_samples(
+    patch: Dict[str, Any],
+    now: Optional[float] = None,
+    recorded: Optional[Collection[str]] = None,
+) -> Iterator[Tuple[str, str, float, float]]:
+    """
+    ``(feature, property, time, value)`` for every numeric property in a
+    merge patch, or only for those in ``recorded`` when given. The time
+    is the feature's ``timestamp`` property if it has one, else ``now``.
+    """
+    features = patch.get("features")
+    if not isinstance(features, dict):
+        return
+    for feature_id, feature in features.items():
+        properties = feature.get("properties") if isinstance(feature, dict) else None
+        if not isinstance(properties, dict):
+            continue
+        at = parse_time(properties.get("timestamp"))
+        if at is None:
+            at = now if now is not None else time.time()
+        for path, value in _numeric_leaves(properties):
+            if path != "timestamp" and (recorded is None or path in recorded):
+                yield feature_id, path, at, value
+
+
+# ============================================
+# Aggregation
+# ============================================
+
+
+def _empty(columns: Sequence[str]) -> Columns:
+    return {name: np.empty(0) for name in columns}
+
+
+def _concat(views: List[Columns], columns: Sequence[str]) -> Columns:
+    if not views:
+        return _empty(columns)
+    if len(views) == 1:
+        return views[0]
+    return {name: np.concatenate([view[name] for view in views]) for name in columns}
+
+
+def aggregate(rows: Columns, step: float) -> Columns:
+    """
+    Combine time-sorted raw (``t``/``v``) or rollup rows into rollup rows
+    of ``step``-second buckets aligned to the epoch.
+    """
+    if "v" in rows:
+        values = rows["v"]
+        rows = {
+            "t": rows["t"],
+            "min": values,
+            "max": values,
+            "sum": values,
+            "count": np.ones_like(values),
+            "last": values,
+        }
+    if not len(rows["t"]):
+        return _empty(ROLLUP_COLUMNS)
+    buckets = np.floor(rows["t"] / step) * step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return {
+        "t": buckets[starts],
+        "min": np.minimum.reduceat(rows["min"], starts),
+        "max": np.maximum.reduceat(rows["max"], starts),
+        "sum": np.add.reduceat(rows["sum"], starts),
+        "count": np.add.reduceat(rows["count"], starts),
+        "last": rows["last"][ends],
+    }
+
+
+def _merge_row(old: Dict[str, float], new: Dict[str, float]) -> Dict[str, float]:
+    return {
+        "t": old["t"],
+        "min": min(old["min"], new["min"]),
+        "max": max(old["max"], new["max"]),
+        "sum": old["sum"] + new["sum"],
+        "count": old["count"] + new["count"],
+        "last": new["last"],
+    }
+
+
+def choose_resolution(
+    start: float,
+    end: float,
+    step: Optional[float],
+    raw_points: int,
+    max_points: int,
+    available: Optional[Collection[str]] = None,
+) -> Tuple[str, Optional[float]]:
+    """
+    ``(resolution, step)`` to answer a query with: raw samples when there
+    are at most ``max_points`` of them, else the finest rollup with
+    between a quarter of and ``max_points`` rows in range, else buckets of
+    a finer rollup or of the raw samples. An explicit ``step`` is served
+    from the coarsest rollup whose width divides it.
+
+    ``available`` limits the choice to resolutions that still hold the
+    whole range (the coarsest rollup is always kept).
+    """
+    coarsest = list(RESOLUTIONS)[-1]
+    raw_ok = available is None or "raw" in available
+    tiers = [
+        (name, float(width))
+        for name, width in RESOLUTIONS.items()
+        if available is None or name in available or name == coarsest
+    ]
+    if step is not None:
+        resolution = "raw" if raw_ok else tiers[0][0]
+        for name, width in tiers:
+            if width <= step and math.isclose(step / width, round(step / width)):
+                resolution = name
+        return resolution, step
+    if raw_ok and raw_points <= max_points:
+        return "raw", None
+
+    span = max(end - start, 1e-9)
+    min_step = span / max_points
+    for name, width in tiers:
+        if width >= min_step and span / width >= max_points / 4:
+            return name, width
+    # No rollup fits the budget as is: bucket the coarsest one (or the raw
+    # samples) finer than the budget allows
+    candidates = ([("raw", 0.0)] if raw_ok else []) + tiers
+    source, source_width = candidates[0]
+    for name, width in candidates:
+        if width <= min_step:
+            source, source_width = name, width
+    if not source_width:
+        return "raw", min_step
+    return source, max(math.ceil(min_step / source_width), 1) * source_width
+
+
+# ============================================
+# Segments and series
+# ============================================
+
+
+def encode_name(name: str) -> str:
+    """
+    A thing, feature or property name as one path component. ``quote``
+    keeps dots, so a leading dot is encoded too: ``.`` and ``..`` become
+    ``%2E`` and ``%2E.``. ``unquote`` reverses it.
+    """
+    if not name:
+        raise ValueError("Empty thing, feature or property name")
+    encoded = quote(name, safe="")
+    return "%2E" + encoded[1:] if encoded.startswith(".") else encoded
+
+
+def _segment_name(start: float) -> str:
+    return f"{int(round(start * 1e6)):020d}"
+
+
+class Segment:
+    """
+    Memory-mapped columns holding up to ``capacity`` rows. An existing
+    segment is mapped on first access and unmapped again by ``release``.
+    """
+
+    def __init__(self, base: Path, columns: Sequence[str], capacity: Optional[int] = None):
+        self.base = base
+        self.start = int(base.name) / 1e6
+        self.column_names = tuple(columns)
+        self._columns: Optional[Dict[str, np.memmap]] = None
+        self._count: Optional[int] = None
+        self._last: Optional[float] = None
+        if capacity is not None:
+            self._columns = {
+                name: np.memmap(
+                    base.with_suffix(f".{name}"), dtype=DTYPE, mode="w+", shape=(capacity,)
+                )
+                for name in columns
+            }
+            self._columns["t"][:] = np.nan
+            self._count = 0
+
+    @property
+    def columns(self) -> Dict[str, np.memmap]:
+        if self._columns is None:
+            self._columns = {
+                name: np.memmap(self.base.with_suffix(f".{name}"), dtype=DTYPE, mode="r+")
+                for name in self.column_names
+            }
+            # NaN sorts last, so this is the number of filled rows
+            self._count = int(np.searchsorted(self._columns["t"], np.inf, side="right"))
+        return self._columns
+
+    @property
+    def ts(self) -> np.memmap:
+        return self.columns["t"]
+
+    @property
+    def count(self) -> int:
+        if self._count is None:
+            self.columns  # maps the files and counts the filled rows
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return len(self.ts)
+
+    @property
+    def last(self) -> float:
+        if self._columns is None and self._last is not None:
+            return self._last
+        return float(self.ts[self.count - 1]) if self.count else -math.inf
+
+    def release(self) -> None:
+        """Unmap the columns (views already handed out stay valid)"""
+        if self._columns is not None:
+            self._last = self.last
+            self.flush()
+            self._columns = None
+
+    def append(self, rows: Columns) -> None:
+        end = self.count + len(rows["t"])
+        # Timestamps last: a row only counts once its timestamp is written
+        for name, column in self.columns.items():
+            if name != "t":
+                column[self.count : end] = rows[name]
+        self.ts[self.count : end] = rows["t"]
+        self._count = end
+
+    def view(self, start: float, end: float) -> Optional[Columns]:
+        ts = self.ts[: self.count]
+        lo = int(np.searchsorted(ts, start, side="left"))
+        hi = int(np.searchsorted(ts, end, side="right"))
+        if hi <= lo:
+            return None
+        return {name: np.asarray(column[lo:hi]) for name, column in self.columns.items()}
+
+    def flush(self) -> None:
+        for column in (self._columns or {}).values():
+            column.flush()
+
+
+class Series:
+    """Time-ordered segments of ``columns`` in ``directory``"""
+
+    def __init__(self, directory: Path, segment_points: int, columns: Sequence[str] = RAW_COLUMNS):
+        self.directory = directory
+        self.segment_points = segment_points
+        self.column_names = tuple(columns)
+        # The directory is only created by the first append, so reading a
+        # series that does not exist leaves no trace
+        self.segments = [
+            Segment(path.with_suffix(""), columns) for path in sorted(directory.glob("*.t"))
+        ]
+        self.starts = [segment.start for segment in self.segments]
+
+    @property
+    def last(self) -> float:
+        return self.segments[-1].last if self.segments else -math.inf
+
+    def append(self, rows: Columns) -> None:
+        """Append rows sorted by time and not older than ``last``"""
+        pos, total = 0, len(rows["t"])
+        while pos < total:
+            segment = self.segments[-1] if self.segments else None
+            if segment is None or segment.count == segment.capacity:
+                if segment is not None:
+                    segment.release()
+                self.directory.mkdir(parents=True, exist_ok=True)
+                base = self.directory / _segment_name(float(rows["t"][pos]))
+                segment = Segment(base, self.column_names, capacity=self.segment_points)
+                self.segments.append(segment)
+                self.starts.append(segment.start)
+            n = min(segment.capacity - segment.count, total - pos)
+            segment.append({name: column[pos : pos + n] for name, column in rows.items()})
+            pos += n
+
+    def last_row(self) -> Optional[Dict[str, float]]:
+        if not self.segments or not self.segments[-1].count:
+            return None
+        segment = self.segments[-1]
+        return {name: float(column[segment.count - 1]) for name, column in segment.columns.items()}
+
+    def replace_last_row(self, row: Dict[str, float]) -> None:
+        segment = self.segments[-1]
+        for name, column in segment.columns.items():
+            column[segment.count - 1] = row[name]
+
+    def views(self, start: float, end: float) -> List[Columns]:
+        """Zero-copy views of the rows with ``start <= t <= end``"""
+        first = max(bisect_right(self.starts, start) - 1, 0)
+        views = []
+        for segment in self.segments[first:]:
+            if segment.start > end:
+                break
+            view = segment.view(start, end)
+            if view is not None:
+                views.append(view)
+            if segment is not self.segments[-1]:
+                segment.release()
+        return views
+
+    @property
+    def earliest(self) -> float:
+        return self.starts[0] if self.segments else math.inf
+
+    def drop(self, segment: Segment) -> None:
+        """Forget ``segment`` and delete its files"""
+        index = self.segments.index(segment)
+        del self.segments[index], self.starts[index]
+        base = self.directory / _segment_name(segment.start)
+        for name in self.column_names:
+            base.with_suffix(f".{name}").unlink(missing_ok=True)
+
+    def sealed(self, before: float) -> List[Segment]:
+        """Segments no longer appended to whose rows are all older than ``before``"""
+        sealed = []
+        for segment in self.segments[:-1]:
+            if segment.last < before:
+                sealed.append(segment)
+            segment.release()
+        return sealed
+
+    def flush(self) -> None:
+        if self.segments:
+            self.segments[-1].flush()
+
+
+# ============================================
+# Compressed blocks
+# ============================================
+
+
+def _shuffle(words: np.ndarray) -> bytes:
+    # Byte planes: the high bytes of small deltas and XORs are mostly zero
+    return zlib.compress(words.view(np.uint8).reshape(-1, 8).T.tobytes(), COMPRESS_LEVEL)
+
+
+def _unshuffle(data: bytes, count: int, dtype: str) -> np.ndarray:
+    planes = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(8, count)
+    return np.ascontiguousarray(planes.T).view(dtype).ravel()
+
+
+def encode_block(ts: np.ndarray, vs: np.ndarray) -> bytes:
+    """
+    Compress time-sorted samples. Timestamps of one binade (all epoch
+    times from 2004 to 2038) have int64 bit patterns linear in their
+    value, so their delta-of-deltas are exact and near zero for regular
+    sampling; values are XORed with their predecessor.
+    """
+    ts = np.ascontiguousarray(ts, dtype=DTYPE)
+    bits = ts.view("<i8")
+    dod = np.diff(np.diff(bits, prepend=0), prepend=0)
+    values = np.ascontiguousarray(vs, dtype=DTYPE).view("<u8")
+    xor = values.copy()
+    xor[1:] ^= values[:-1]
+    t_data, v_data = _shuffle(dod), _shuffle(xor)
+    header = BLOCK_HEADER.pack(BLOCK_MAGIC, len(ts), ts[0], ts[-1], len(t_data))
+    return header + t_data + v_data
+
+
+def decode_block(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    magic, count, _, _, t_size = BLOCK_HEADER.unpack_from(data)
+    if magic != BLOCK_MAGIC:
+        raise ValueError("not a history block")
+    body = memoryview(data)[BLOCK_HEADER.size :]
+    dod = _unshuffle(body[:t_size], count, "<i8")
+    ts = np.cumsum(np.cumsum(dod)).view(DTYPE)
+    vs = np.bitwise_xor.accumulate(_unshuffle(body[t_size:], count, "<u8")).view(DTYPE)
+    return ts, vs
+
+
+class Block:
+    """A compressed block file and the time range it covers"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            _, self.count, self.start, self.last, _ = BLOCK_HEADER.unpack(
+                f.read(BLOCK_HEADER.size)
+            )
+
+
+class ColdStore:
+    """Compressed raw samples in ``directory``, one block per compacted segment"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.blocks = (
+            [Block(path) for path in sorted(directory.glob("*.blk"))]
+            if directory.is_dir()
+            else []
+        )
+        self.starts = [block.start for block in self.blocks]
+        self._cache: "OrderedDict[Path, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+
+    @property
+    def last(self) -> float:
+        return self.blocks[-1].last if self.blocks else -math.inf
+
+    @property
+    def earliest(self) -> float:
+        return self.starts[0] if self.blocks else math.inf
+
+    def write(self, ts: np.ndarray, vs: np.ndarray) -> Block:
+        """Compress samples into a new block file (safe to run in a thread)"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{_segment_name(float(ts[0]))}.blk"
+        partial = path.with_suffix(".tmp")
+        partial.write_bytes(encode_block(ts, vs))
+        partial.replace(path)
+        return Block(path)
+
+    def add(self, block: Block) -> None:
+        index = bisect_right(self.starts, block.start)
+        self.blocks.insert(index, block)
+        self.starts.insert(index, block.start)
+
+    def _decode(self, block: Block) -> Tuple[np.ndarray, np.ndarray]:
+        decoded = self._cache.pop(block.path, None)
+        if decoded is None:
+            decoded = decode_block(block.path.read_bytes())
+        self._cache[block.path] = decoded
+        while len(self._cache) > COLD_CACHE_BLOCKS:
+            self._cache.popitem(last=False)
+        return decoded
+
+    def views(self, start: float, end: float) -> List[Columns]:
+        first = max(bisect_right(self.starts, start) - 1, 0)
+        views = []
+        for block in self.blocks[first:]:
+            if block.start > end:
+                break
+            if block.last < start:
+                continue
+            ts, vs = self._decode(block)
+            lo = int(np.searchsorted(ts, start, side="left"))
+            hi = int(np.searchsorted(ts, end, side="right"))
+            if hi > lo:
+                views.append({"t": ts[lo:hi], "v": vs[lo:hi]})
+        return views
+
+    def count(self, start: float, end: float) -> int:
+        """
+        Number of samples with ``start <= t <= end``. Blocks wholly in
+        range are counted from their headers, so at most the two blocks
+        at the ends of the range are decoded.
+        """
+        total = 0
+        first = max(bisect_right(self.starts, start) - 1, 0)
+        for block in self.blocks[first:]:
+            if block.start > end:
+                break
+            if block.last < start:
+                continue
+            if start <= block.start and block.last <= end:
+                total += block.count
+            else:
+                ts, _ = self._decode(block)
+                total += int(
+                    np.searchsorted(ts, end, side="right") - np.searchsorted(ts, start, side="left")
+                )
+        return total
+
+    def drop_before(self, before: float) -> int:
+        """Delete blocks whose samples are all older than ``before``"""
+        expired = 0
+        while self.blocks and self.blocks[0].last < before:
+            block = self.blocks.pop(0)
+            self.starts.pop(0)
+            self._cache.pop(block.path, None)
+            block.path.unlink(missing_ok=True)
+            expired += 1
+        return expired
+
+
+class PropertyHistory:
+    """Raw samples of one property, hot and compressed, and their rollups"""
+
+    def __init__(
+        self,
+        directory: Path,
+        segment_points: int,
+        rollup_points: Optional[Dict[str, int]] = None,
+    ):
+        self.directory = directory
+        self.raw = Series(directory, segment_points)
+        self.cold = ColdStore(directory / "cold")
+        rollup_points = rollup_points or ROLLUP_SEGMENT_POINTS
+        self.rollups = {
+            name: Series(directory / name, rollup_points[name], ROLLUP_COLUMNS)
+            for name in RESOLUTIONS
+        }
+        # Resolution -> time before which its rows were deleted by retention
+        self.horizons: Dict[str, float] = {}
+        horizons = directory / "horizons.json"
+        if horizons.exists():
+            self.horizons = json.loads(horizons.read_text())
+
+        for segment in list(self.raw.segments):
+            if segment.start in self.cold.starts:
+                # Compacted, but the process stopped before the segment was deleted
+                self.raw.drop(segment)
+        if self.raw.segments and not any(r.segments for r in self.rollups.values()):
+            # Raw history written before rollups existed
+            for view in self.raw.views(-math.inf, math.inf):
+                self._roll_up(view)
+
+    @property
+    def last(self) -> float:
+        return max(self.raw.last, self.cold.last)
+
+    def append(self, ts: np.ndarray, vs: np.ndarray) -> None:
+        """Append samples sorted by time and not older than ``last``"""
+        rows = {"t": ts, "v": vs}
+        self.raw.append(rows)
+        self._roll_up(rows)
+
+    def _roll_up(self, rows: Columns) -> None:
+        # Each resolution is built from the previous one's rows
+        for name, width in RESOLUTIONS.items():
+            rows = aggregate(rows, width)
+            if not len(rows["t"]):
+                return
+            series = self.rollups[name]
+            last = series.last_row()
+            if last is not None and last["t"] == rows["t"][0]:
+                head = {column: float(values[0]) for column, values in rows.items()}
+                series.replace_last_row(_merge_row(last, head))
+                series.append({column: values[1:] for column, values in rows.items()})
+            else:
+                series.append(rows)
+
+    def _raw_views(self, start: float, end: float) -> List[Columns]:
+        return self.cold.views(start, end) + self.raw.views(start, end)
+
+    def available(self, start: float) -> List[str]:
+        """Resolutions still holding everything from ``start`` on"""
+        return [
+            name
+            for name in ("raw", *RESOLUTIONS)
+            if self.horizons.get(name, -math.inf) <= start
+        ]
+
+    def count(self, start: float, end: float) -> int:
+        """Raw samples in range, without decoding the blocks it covers whole"""
+        hot = sum(len(view["t"]) for view in self.raw.views(start, end))
+        return self.cold.count(start, end) + hot
+
+    def read(self, resolution: str, start: float, end: float, step: Optional[float]) -> Columns:
+        """Rows in range at ``resolution``, aggregated to ``step`` when given"""
+        if resolution == "raw":
+            rows = _concat(self._raw_views(start, end), RAW_COLUMNS)
+            if step is None:
+                return rows
+        else:
+            width = RESOLUTIONS[resolution]
+            views = self.rollups[resolution].views(math.floor(start / width) * width, end)
+            rows = _concat(views, ROLLUP_COLUMNS)
+        buckets = aggregate(rows, step)
+        return {
+            "t": buckets["t"],
+            "v": buckets["sum"] / buckets["count"],
+            "min": buckets["min"],
+            "max": buckets["max"],
+            "last": buckets["last"],
+            "count": buckets["count"],
+        }
+
+    def compacted(self, segment: Segment, block: Block) -> None:
+        """Swap a sealed raw segment for the block holding its samples"""
+        self.cold.add(block)
+        self.raw.drop(segment)
+
+    def expire(self, raw_before: Optional[float], minute_before: Optional[float]) -> int:
+        """Delete raw samples and minute rollups past their retention"""
+        expired = 0
+        if raw_before is not None:
+            dropped = self.cold.drop_before(raw_before)
+            for segment in self.raw.sealed(raw_before):
+                self.raw.drop(segment)
+                dropped += 1
+            if dropped:
+                self._expired("raw", raw_before)
+            expired += dropped
+        if minute_before is not None:
+            minutes = self.rollups["1m"]
+            sealed = minutes.sealed(minute_before)
+            for segment in sealed:
+                minutes.drop(segment)
+            if sealed:
+                self._expired("1m", minute_before)
+            expired += len(sealed)
+        return expired
+
+    def _expired(self, resolution: str, before: float) -> None:
+        self.horizons[resolution] = max(self.horizons.get(resolution, -math.inf), before)
+        (self.directory / "horizons.json").write_text(json.dumps(self.horizons))
+
+    def flush(self) -> None:
+        self.raw.flush()
+        for series in self.rollups.values():
+            series.flush()
+
+
+# ============================================
+# Store
+# ============================================
+
+
+class HistoryStore:
+    """
+    Per-property history under ``root``, fed with telemetry merge patches
+    through ``record_patch`` and flushed every ``flush_interval`` seconds.
+
+    Every ``compact_interval`` seconds, raw samples older than
+    ``raw_retention`` seconds are compressed, and compressed samples and
+    minute rollups past ``compressed_retention`` and ``minute_retention``
+    are deleted. A retention of 0 keeps that tier forever.
+
+    ``record_patch`` only records the ``recorded_properties`` of each
+    feature (None records every numeric property). At most
+    ``max_open_series`` properties stay open, each holding a few memory
+    mappings; the least recently used one is flushed and closed beyond that.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        segment_points: int = 65536,
+        flush_interval: float = 1.0,
+        max_points: int = 2000,
+        raw_retention: float = 0.0,
+        compressed_retention: float = 0.0,
+        minute_retention: float = 0.0,
+        compact_interval: float = 3600.0,
+        recorded_properties: Optional[Collection[str]] = ("value",),
+        max_open_series: int = 1000,
+    ):
+        self.root = Path(root)
+        self.segment_points = segment_points
+        self.flush_interval = flush_interval
+        self.max_points = max_points
+        self.raw_retention = raw_retention
+        self.compressed_retention = compressed_retention
+        self.minute_retention = minute_retention
+        self.compact_interval = compact_interval
+        self.recorded_properties = (
+            frozenset(recorded_properties) if recorded_properties is not None else None
+        )
+        self.max_open_series = max(max_open_series, 1)
+        self._series: "OrderedDict[SeriesKey, PropertyHistory]" = OrderedDict()
+        self._pending: Dict[SeriesKey, Tuple[List[float], List[float]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._compactor: Optional[asyncio.Task] = None
+        self.stats = {
+            "samples": 0,
+            "stored": 0,
+            "late": 0,
+            "compacted": 0,
+            "expired": 0,
+            "compaction_failures": 0,
+            "rejected": 0,
+            "closed": 0,
+        }
+
+    @property
+    def pending(self) -> int:
+        return sum(len(ts) for ts, _ in self._pending.values())
+
+    def _directory(self, key: SeriesKey) -> Path:
+        return self.root.joinpath(*(encode_name(part) for part in key))
+
+    def series(self, key: SeriesKey, create: bool = False) -> Optional[PropertyHistory]:
+        series = self._series.get(key)
+        if series is not None:
+            self._series.move_to_end(key)
+            return series
+        directory = self._directory(key)
+        if not create and not directory.is_dir():
+            return None
+        series = self._series[key] = PropertyHistory(directory, self.segment_points)
+        while len(self._series) > self.max_open_series:
+            _, idle = self._series.popitem(last=False)
+            idle.flush()
+            self.stats["closed"] += 1
+        return series
+
+    def record(self, thing_id: str, feature_id: str, prop: str, at: float, value: float) -> None:
+        """Buffer one sample"""
+        if not (thing_id and feature_id and prop):
+            self.stats["rejected"] += 1
+            return
+        self.stats["samples"] += 1
+        ts, vs = self._pending.setdefault((thing_id, feature_id, prop), ([], []))
+        ts.append(at)
+        vs.append(value)
+
+    def record_patch(self, thing_id: str, patch: Dict[str, Any]) -> None:
+        """Buffer the recorded numeric feature properties of a telemetry merge patch"""
+        now = time.time()
+        for feature_id, prop, at, value in extract_samples(patch, now, self.recorded_properties):
+            self.record(thing_id, feature_id, prop, at, value)
+
+    def _flush_key(self, key: SeriesKey) -> None:
+        pending = self._pending.pop(key, None)
+        if not pending:
+            return
+        ts = np.asarray(pending[0], dtype=DTYPE)
+        vs = np.asarray(pending[1], dtype=DTYPE)
+        order = np.argsort(ts, kind="stable")
+        ts, vs = ts[order], vs[order]
+
+        series = self.series(key, create=True)
+        keep = ts >= series.last
+        self.stats["late"] += int(len(ts) - keep.sum())
+        if not keep.all():
+            ts, vs = ts[keep], vs[keep]
+        series.append(ts, vs)
+        self.stats["stored"] += len(ts)
+
+    def flush(self) -> None:
+        """Append all buffered samples to their series"""
+        for key in list(self._pending):
+            try:
+                self._flush_key(key)
+            except (OSError, ValueError) as e:
+                logger.warning("history_flush_failed", series="/".join(key), error=str(e))
+
+    def properties(self, thing_id: str, feature_id: str) -> List[str]:
+        """Properties of a feature that have history"""
+        directory = self.root / encode_name(thing_id) / encode_name(feature_id)
+        stored = {unquote(p.name) for p in directory.iterdir()} if directory.is_dir() else set()
+        buffered = {k[2] for k in self._pending if k[0] == thing_id and k[1] == feature_id}
+        return sorted(stored | buffered)
+
+    def query(
+        self,
+        thing_id: str,
+        feature_id: str,
+        start: float,
+        end: float,
+        step: Optional[float] = None,
+        properties: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Samples of a feature's properties between ``start`` and ``end``
+        (epoch seconds, inclusive), as ``{"t": [...], "v": [...]}`` per
+        property. With ``step``, or when a property has more than
+        ``max_points`` samples in range, rows are buckets with the average
+        ``v`` plus ``min``, ``max``, ``last`` and ``count``, read from the
+        rollup named by ``resolution``.
+        """
+        if step is not None and (end - start) / step > MAX_BUCKETS:
+            raise ValueError(f"step too small: more than {MAX_BUCKETS} buckets")
+        histories: Dict[str, Optional[PropertyHistory]] = {}
+        for name in properties or self.properties(thing_id, feature_id):
+            key = (thing_id, feature_id, name)
+            self._flush_key(key)
+            histories[name] = self.series(key)
+
+        stored = [h for h in histories.values() if h is not None]
+        available = {"raw", *RESOLUTIONS}
+        for history in stored:
+            available.intersection_update(history.available(start))
+        # Only needed to decide whether raw samples fit in max_points
+        raw_points = (
+            max((h.count(start, end) for h in stored), default=0)
+            if step is None and "raw" in available
+            else 0
+        )
+        resolution, step = choose_resolution(
+            start, end, step, raw_points, self.max_points, available
+        )
+        columns = RAW_COLUMNS if resolution == "raw" and step is None else BUCKET_COLUMNS
+        return {
+            "thingId": thing_id,
+            "featureId": feature_id,
+            "from": start,
+            "to": end,
+            "resolution": resolution,
+            "step": step,
+            "properties": {
+                name: history.read(resolution, start, end, step) if history else _empty(columns)
+                for name, history in histories.items()
+            },
+        }
+
+    def _stored_keys(self) -> Iterator[SeriesKey]:
+        if not self.root.is_dir():
+            return
+        for thing in self.root.iterdir():
+            for feature in thing.iterdir() if thing.is_dir() else ():
+                for prop in feature.iterdir() if feature.is_dir() else ():
+                    yield (unquote(thing.name), unquote(feature.name), unquote(prop.name))
+
+    async def compact(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Apply the retention policy to every stored property. Blocks are
+        compressed and written in a worker thread; ingest and queries keep
+        running on the event loop meanwhile.
+        """
+        now = time.time() if now is None else now
+        compact_before = now - self.raw_retention if self.raw_retention else None
+        raw_before = now - self.compressed_retention if self.compressed_retention else None
+        minute_before = now - self.minute_retention if self.minute_retention else None
+        result = {"compacted": 0, "expired": 0}
+
+        for key in list(self._stored_keys()):
+            try:
+                history = self.series(key)
+                if history is None:
+                    continue
+                result["expired"] += history.expire(raw_before, minute_before)
+                if compact_before is not None:
+                    # Sealed segments are never written again, so the worker
+                    # thread can read them while ingest appends elsewhere
+                    for segment in history.raw.sealed(compact_before):
+                        view = segment.view(-math.inf, math.inf)
+                        block = await asyncio.to_thread(history.cold.write, view["t"], view["v"])
+                        history.compacted(segment, block)
+                        result["compacted"] += 1
+            except (OSError, ValueError) as e:
+                self.stats["compaction_failures"] += 1
+                logger.warning("history_compaction_failed", series="/".join(key), error=str(e))
+
+        self.stats["compacted"] += result["compacted"]
+        self.stats["expired"] += result["expired"]
+        if result["compacted"] or result["expired"]:
+            logger.info("history_compacted", **result)
+        return result
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    async def _run_compactor(self) -> None:
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            await self.compact()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        retention = self.raw_retention or self.compressed_retention or self.minute_retention
+        if self._compactor is None and retention:
+            self._compactor = asyncio.create_task(self._run_compactor())
+
+    async def stop(self) -> None:
+        """Stop the background tasks and write out buffered samples"""
+        for task in (self._task, self._compactor):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._compactor = None
+        self.flush()
+        for series in self._series.values():
+            series.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": self.pending, "series": len(self._series)}
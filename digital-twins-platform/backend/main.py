@@ -6,11 +6,15 @@ Provides a REST API layer on top of Eclipse Ditto
 import asyncio
 import json
 import logging
+import time
+import zlib
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
 
 import httpx
+import orjson
 import structlog
 from fastapi import (
     APIRouter,
@@ -19,14 +23,49 @@ from fastapi import (
     FastAPI,
     HTTPException,
     Query,
+    Request,
     WebSocket,
     WebSocketDisconnect,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, field_validator
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from pydantic_settings import BaseSettings
 
+from cache import KnownSet, ThingCache
+from compression import CompressionMiddleware
+from ditto_ws import DittoWebSocketPool, websocket_connector
+from events import ChangeStream, EventHub, deleted_event
+from history import HistoryStore, parse_time
+from metrics import MetricsMiddleware, httpx_pool_state, observe_upstream, register_stats, render
+from mqtt_bridge import MQTTBridge
+from resilience import CircuitBreaker, ReadinessProbe
+from rql import RQLError, parse_fields, project
+from search_index import BOOTSTRAP_FIELDS, LOCAL_CURSOR_PREFIX, SearchIndex, cursor_filter
+from snapshot import (
+    MEDIA_TYPES,
+    PARQUET_AVAILABLE,
+    SNAPSHOT_FIELDS,
+    export_batches,
+    import_documents,
+    ndjson_chunks,
+    ndjson_lines,
+    parquet_chunks,
+    parquet_lines,
+)
+from telemetry import (
+    BacklogFull,
+    PayloadTooLarge,
+    TelemetryBatcher,
+    WriteCoalescer,
+    decode_body,
+    parse_payloads,
+    pointer_to_patch,
+    telemetry_to_patch,
+    to_thing_id,
+)
+
 # ============================================
 # Configuration
 # ============================================
@@ -40,7 +79,83 @@ class Settings(BaseSettings):
     ditto_devops_user: str = "devops"
     ditto_devops_password: str = "dittoPwd"
     mqtt_broker_url: str = "mqtt://localhost:1883"
+    mqtt_client_id: str = "digital-twins-backend"
+    mqtt_bridge_enabled: bool = True
+    mqtt_telemetry_topic: str = "digitaltwins/+/telemetry"
     log_level: str = "INFO"
+    api_prefix: str = "/api/v1"
+
+    # Upstream connection pool (HTTP/2 is negotiated on https URLs)
+    ditto_http2: bool = True
+    ditto_max_connections: int = 100
+    ditto_bulk_concurrency: int = 32
+
+    # Upstream timeouts (seconds) and circuit breaker
+    ditto_timeout: float = 10.0
+    ditto_read_timeout: float = 5.0
+    ditto_breaker_failure_threshold: int = 5
+    ditto_breaker_reset_timeout: float = 10.0
+    ditto_ready_interval: float = 2.0
+    ditto_ready_recheck_interval: float = 15.0
+
+    # Default policies: "thing" creates <thingId>:policy per thing,
+    # "namespace" shares one <namespace>:default-policy per namespace
+    ditto_default_policy_mode: str = "thing"
+    ditto_known_policies_max: int = 10000
+
+    # Read-through cache for things and features (ttl 0 disables it)
+    ditto_cache_ttl: float = 5.0
+    ditto_cache_max_entries: int = 10000
+
+    # Telemetry ingest
+    telemetry_namespace: str = "digitaltwins"
+    telemetry_flush_interval: float = 0.25
+    telemetry_max_pending: int = 5000
+    # Buffered twins beyond which readings for other twins are shed (429)
+    telemetry_max_backlog: int = 20000
+    # Largest decompressed telemetry or bulk body (413 beyond)
+    telemetry_max_body_size: int = 64 * 1024 * 1024
+    telemetry_max_concurrency: int = 16
+
+    # Property PATCHes to one feature within this many seconds share a Ditto write
+    ditto_write_coalesce_window: float = 0.02
+
+    # Change events for /ws/events (Ditto SSE stream)
+    ditto_events_enabled: bool = True
+    ditto_events_extra_fields: str = "attributes,_revision"
+    ws_event_queue_size: int = 1000
+
+    # /ws/ditto proxy: clients share this many upstream Ditto sessions
+    ditto_ws_pool_size: int = 2
+
+    # Responses at least this large are gzip/brotli compressed when accepted
+    compression_minimum_size: int = 1024
+
+    # Local search index over these comma-separated paths (empty disables);
+    # needs the change stream (DITTO_EVENTS_ENABLED)
+    search_index_paths: str = ""
+    search_index_resync_interval: float = 300.0
+
+    # Numeric feature properties from telemetry kept as time series in
+    # memory-mapped segment files under this directory
+    history_enabled: bool = True
+    history_dir: str = "data/history"
+    history_segment_points: int = 65536
+    history_flush_interval: float = 1.0
+    # Comma-separated feature properties recorded from telemetry (empty
+    # records every numeric property)
+    history_properties: str = "value"
+    # Properties kept open (memory-mapped) at once; idle ones are closed
+    history_max_open_series: int = 1000
+    # Ranges with more samples per property are served from 1m/1h/1d rollups
+    history_max_points: int = 2000
+    # Retention in days (0 keeps forever): raw samples are compressed after
+    # the first, deleted after the second; minute rollups are deleted after
+    # the third, hourly and daily rollups are kept
+    history_raw_retention_days: float = 7.0
+    history_compressed_retention_days: float = 90.0
+    history_minute_retention_days: float = 90.0
+    history_compact_interval: float = 3600.0
 
     model_config = {"env_file": ".env", "case_sensitive": False}
 
@@ -65,6 +180,19 @@ structlog.configure(
 logger = structlog.get_logger()
 logging.basicConfig(level=getattr(logging, settings.log_level))
 
+# Upstream statuses that count against the circuit breaker
+UPSTREAM_FAILURE_STATUSES = {502, 503, 504}
+
+# Ditto's answer to a thing PUT naming a policy that does not exist
+POLICY_NOT_FOUND = "things:policy.notfound"
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 
 # ============================================
 # Ditto API Client
@@ -74,7 +202,22 @@ logging.basicConfig(level=getattr(logging, settings.log_level))
 class DittoClient:
     """Client for interacting with Eclipse Ditto HTTP API"""
 
-    def __init__(self, base_url: str, devops_user: str, devops_password: str):
+    def __init__(
+        self,
+        base_url: str,
+        devops_user: str,
+        devops_password: str,
+        cache_ttl: float = 5.0,
+        cache_max_entries: int = 10000,
+        http2: bool = True,
+        max_connections: int = 100,
+        default_policy_mode: str = "thing",
+        known_policies_max: int = 10000,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        timeout: float = 10.0,
+        read_timeout: float = 5.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
         self.base_url = base_url.rstrip("/")
         self.auth = (devops_user, devops_password)
         self.headers = {
@@ -82,6 +225,22 @@ class DittoClient:
             "Accept": "application/json",
         }
         self._client: Optional[httpx.AsyncClient] = None
+        self.cache = ThingCache(ttl=cache_ttl, max_entries=cache_max_entries)
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.max_connections = max_connections
+        # Custom transport, e.g. httpx.ASGITransport(app=FakeDitto().app)
+        self.transport = transport
+        # Per-operation timeouts: reads fail faster than writes
+        self.timeout = timeout
+        self.read_timeout = read_timeout
+        self.breaker = breaker or CircuitBreaker()
+        if default_policy_mode not in ("thing", "namespace"):
+            raise ValueError("default_policy_mode must be 'thing' or 'namespace'")
+        self.default_policy_mode = default_policy_mode
+        self.known_policies = KnownSet(known_policies_max)
+        self._policy_creates: Dict[str, asyncio.Task] = {}
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("ditto_http2_unavailable", hint="pip install httpx[http2]")
 
     async def connect(self):
         """Initialize the HTTP client"""
@@ -89,10 +248,16 @@ class DittoClient:
             self._client = httpx.AsyncClient(
                 auth=self.auth,
                 headers=self.headers,
-                timeout=30.0,
+                timeout=self.timeout,
                 follow_redirects=True,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                transport=self.transport,
             )
-        logger.info("ditto_client_connected", base_url=self.base_url)
+        logger.info("ditto_client_connected", base_url=self.base_url, http2=self.http2)
 
     async def disconnect(self):
         """Close the HTTP client"""
@@ -114,23 +279,29 @@ class DittoClient:
     async def create_policy(self, policy_id: str, policy: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new policy for access control"""
         url = f"{self.base_url}/api/2/policies/{policy_id}"
-        response = await self.client.put(url, json=policy)
+        response = await self._request("create_policy", "PUT", url, json=policy)
         response.raise_for_status()
+        self.known_policies.add(policy_id)
+        if response.status_code == 204 or not response.content:
+            return policy
         return response.json()
 
     async def get_policy(self, policy_id: str) -> Dict[str, Any]:
         """Retrieve a policy by ID"""
         url = f"{self.base_url}/api/2/policies/{policy_id}"
-        response = await self.client.get(url)
+        response = await self._request("get_policy", "GET", url)
         if response.status_code == 404:
+            self.known_policies.discard(policy_id)
             raise HTTPException(status_code=404, detail=f"Policy {policy_id} not found")
         response.raise_for_status()
+        self.known_policies.add(policy_id)
         return response.json()
 
     async def delete_policy(self, policy_id: str) -> None:
         """Delete a policy"""
         url = f"{self.base_url}/api/2/policies/{policy_id}"
-        response = await self.client.delete(url)
+        self.known_policies.discard(policy_id)
+        response = await self._request("delete_policy", "DELETE", url)
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail=f"Policy {policy_id} not found")
         response.raise_for_status()
@@ -147,13 +318,83 @@ class DittoClient:
         policy_id: Optional[str] = None,
     ) -> Dict[str, Any]:
         """Create a new digital twin (Thing)"""
-        url = f"{self.base_url}/api/2/things/{thing_id}"
-
         # Create policy if not provided
-        if not policy_id:
-            policy_id = f"{thing_id}:policy"
-            await self._create_default_policy(policy_id)
+        default_policy = not policy_id
+        if default_policy:
+            policy_id = self.default_policy_id(thing_id)
+            await self._ensure_default_policy(policy_id)
 
+        _, body = await self._put_thing(thing_id, policy_id, attributes, features, default_policy)
+        return body
+
+    async def create_things_bulk(
+        self,
+        things: List[Dict[str, Any]],
+        concurrency: int = 32,
+    ) -> List[Dict[str, Any]]:
+        """
+        Create many digital twins with bounded parallelism.
+
+        Each item is a dict with ``thing_id`` and optional ``policy_id``,
+        ``attributes`` and ``features``. Missing default policies are created
+        first (once per distinct policy), then all things are written
+        concurrently. Returns one result per item, in input order; a failing
+        item never fails the batch.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        default_policies = sorted(
+            {self.default_policy_id(t["thing_id"]) for t in things if not t.get("policy_id")}
+        )
+        policy_errors: Dict[str, Exception] = {}
+
+        async def create_policy(policy_id: str) -> None:
+            try:
+                await bounded(self._ensure_default_policy(policy_id))
+            except Exception as e:
+                policy_errors[policy_id] = e
+
+        await asyncio.gather(*(create_policy(p) for p in default_policies))
+
+        async def create(thing: Dict[str, Any]) -> Dict[str, Any]:
+            thing_id = thing["thing_id"]
+            policy_id = thing.get("policy_id") or self.default_policy_id(thing_id)
+            try:
+                if policy_id in policy_errors:
+                    raise policy_errors[policy_id]
+                status_code, _ = await bounded(
+                    self._put_thing(
+                        thing_id,
+                        policy_id,
+                        thing.get("attributes"),
+                        thing.get("features"),
+                        default_policy=not thing.get("policy_id"),
+                    )
+                )
+                return {"thingId": thing_id, "status": status_code}
+            except Exception as e:
+                return {"thingId": thing_id, **_error_result(e)}
+
+        return await asyncio.gather(*(create(t) for t in things))
+
+    async def _put_thing(
+        self,
+        thing_id: str,
+        policy_id: str,
+        attributes: Optional[Dict[str, Any]] = None,
+        features: Optional[Dict[str, Any]] = None,
+        default_policy: bool = False,
+    ) -> Tuple[int, Dict[str, Any]]:
+        """
+        PUT a complete thing document, returning the status code and body.
+        If ``policy_id`` is a default policy that Ditto no longer has
+        (deleted outside this API), it is created again and the PUT retried
+        once.
+        """
         thing = {
             "thingId": thing_id,
             "policyId": policy_id,
@@ -164,18 +405,57 @@ class DittoClient:
         if features:
             thing["features"] = features
 
-        response = await self.client.put(url, json=thing)
-        response.raise_for_status()
-        return response.json()
+        try:
+            return await self.put_thing(thing)
+        except httpx.HTTPStatusError as e:
+            if not default_policy or _ditto_error(e.response) != POLICY_NOT_FOUND:
+                raise
+        logger.warning("default_policy_missing", policy_id=policy_id, thing_id=thing_id)
+        await self._ensure_default_policy(policy_id)
+        return await self.put_thing(thing)
+
+    async def put_thing(self, thing: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Create or replace a thing from its full document (e.g. from a
+        snapshot), returning the status code and body
+        """
+        thing_id = thing["thingId"]
+        url = f"{self.base_url}/api/2/things/{thing_id}"
+        thing = {key: value for key, value in thing.items() if not key.startswith("_")}
 
-    async def get_thing(self, thing_id: str) -> Dict[str, Any]:
-        """Retrieve a digital twin by ID"""
+        self.cache.invalidate(thing_id)
+        response = await self._request("put_thing", "PUT", url, json=thing)
+        self.cache.invalidate(thing_id)
+        if _ditto_error(response) == POLICY_NOT_FOUND:
+            self.known_policies.discard(thing.get("policyId"))
+        response.raise_for_status()
+        if response.status_code == 204 or not response.content:
+            return response.status_code, thing
+        return response.status_code, response.json()
+
+    async def get_thing(self, thing_id: str, fields: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Retrieve a digital twin by ID, optionally only the selected
+        ``fields`` (Ditto field selector, e.g. ``thingId,attributes/location``)
+        """
         url = f"{self.base_url}/api/2/things/{thing_id}"
-        response = await self.client.get(url)
-        if response.status_code == 404:
+        if fields:
+            # A fresh full copy answers any projection without a round trip,
+            # except for special fields (``_revision``, ``_metadata``...)
+            # that only Ditto knows
+            entry, fresh = self.cache.lookup((thing_id, ""))
+            if fresh and not any(path.startswith("_") for path in parse_fields(fields)):
+                return project(entry.value, fields)
+            response = await self._cached_get(
+                "get_thing", (thing_id, f"?fields={fields}"), url, params={"fields": fields}
+            )
+        else:
+            response = await self._cached_get("get_thing", (thing_id, ""), url)
+        if response is None:
             raise HTTPException(status_code=404, detail=f"Thing {thing_id} not found")
-        response.raise_for_status()
-        return response.json()
+        if response.get("policyId"):
+            self.known_policies.add(response["policyId"])
+        return response
 
     async def update_thing(
         self,
@@ -193,19 +473,31 @@ class DittoClient:
         if not thing:
             raise HTTPException(status_code=400, detail="No update data provided")
 
+        return await self.merge_thing(thing_id, thing)
+
+    async def merge_thing(self, thing_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a JSON merge patch to a digital twin"""
         url = f"{self.base_url}/api/2/things/{thing_id}"
-        response = await self.client.patch(
+        self.cache.invalidate(thing_id)
+        response = await self._request(
+            "merge_thing",
+            "PATCH",
             url,
-            json=thing,
+            json=patch,
             headers={"Content-Type": "application/merge-patch+json"},
         )
+        self.cache.invalidate(thing_id)
         response.raise_for_status()
+        if response.status_code == 204 or not response.content:
+            return {}
         return response.json()
 
     async def delete_thing(self, thing_id: str) -> None:
         """Delete a digital twin"""
         url = f"{self.base_url}/api/2/things/{thing_id}"
-        response = await self.client.delete(url)
+        self.cache.invalidate(thing_id)
+        response = await self._request("delete_thing", "DELETE", url)
+        self.cache.invalidate(thing_id)
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail=f"Thing {thing_id} not found")
         response.raise_for_status()
@@ -215,19 +507,100 @@ class DittoClient:
         filter_str: Optional[str] = None,
         option: Optional[str] = None,
         limit: int = 25,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """List things with optional filtering"""
-        url = f"{self.base_url}/api/2/things"
-        params = {"limit": limit}
+        """
+        List things with optional filtering, via Ditto's search API.
+        Pass the returned ``nextPageCursor`` as ``cursor`` to get the next page;
+        ``fields`` limits each thing to the selected fields.
+        """
+        options = [f"size({limit})"]
+        if cursor:
+            options.append(f"cursor({cursor})")
+        if option:
+            options.append(option)
 
+        url = f"{self.base_url}/api/2/search/things"
+        params = {"option": ",".join(options)}
         if filter_str:
             params["filter"] = filter_str
-        if option:
-            params["option"] = option
+        if fields:
+            params["fields"] = fields
 
-        response = await self.client.get(url, params=params)
+        response = await self._request("search_things", "GET", url, params=params)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
+
+    async def iter_things(
+        self,
+        filter_str: Optional[str] = None,
+        page_size: int = 200,
+        fields: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield every thing matching ``filter_str``, following search cursors.
+
+        The next page is requested while the current one is being consumed,
+        so at most two pages are held in memory regardless of fleet size.
+        """
+        page = await self.list_things(filter_str=filter_str, limit=page_size, fields=fields)
+        while True:
+            cursor = page.get("nextPageCursor")
+            next_page = (
+                asyncio.ensure_future(
+                    self.list_things(
+                        filter_str=filter_str, limit=page_size, cursor=cursor, fields=fields
+                    )
+                )
+                if cursor
+                else None
+            )
+            try:
+                for item in page.get("items", []):
+                    yield item
+            except BaseException:
+                if next_page is not None:
+                    next_page.cancel()
+                raise
+            if next_page is None:
+                return
+            page = await next_page
+
+    async def stream_changes(
+        self,
+        extra_fields: Optional[str] = None,
+        on_open: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield thing changes from Ditto's server-sent event stream.
+
+        Each change is the modified part of a thing; ``extra_fields`` (e.g.
+        ``"attributes,_revision"``) enriches it with unchanged fields.
+        ``on_open`` is called once the stream is open, before any change.
+        """
+        url = f"{self.base_url}/api/2/things"
+        params = {"extraFields": extra_fields} if extra_fields else None
+        async with self.client.stream(
+            "GET",
+            url,
+            params=params,
+            headers={"Accept": "text/event-stream"},
+            timeout=httpx.Timeout(None, connect=10.0),
+        ) as response:
+            response.raise_for_status()
+            logger.info("change_stream_connected", url=url)
+            if on_open is not None:
+                on_open()
+            data_lines: List[str] = []
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].lstrip())
+                elif not line and data_lines:
+                    data = "\n".join(data_lines).strip()
+                    data_lines = []
+                    if data:
+                        yield json.loads(data)
 
     # ========================================
     # Feature Operations
@@ -236,13 +609,14 @@ class DittoClient:
     async def get_feature(self, thing_id: str, feature_id: str) -> Dict[str, Any]:
         """Get a specific feature of a thing"""
         url = f"{self.base_url}/api/2/things/{thing_id}/features/{feature_id}"
-        response = await self.client.get(url)
-        if response.status_code == 404:
+        response = await self._cached_get(
+            "get_feature", (thing_id, f"features/{feature_id}"), url
+        )
+        if response is None:
             raise HTTPException(
                 status_code=404, detail=f"Feature {feature_id} not found on thing {thing_id}"
             )
-        response.raise_for_status()
-        return response.json()
+        return response
 
     async def update_feature(
         self, thing_id: str, feature_id: str, properties: Dict[str, Any]
@@ -251,14 +625,135 @@ class DittoClient:
         url = f"{self.base_url}/api/2/things/{thing_id}/features/{feature_id}"
         feature = {"properties": properties}
 
-        response = await self.client.put(url, json=feature)
+        self.cache.invalidate(thing_id)
+        response = await self._request("update_feature", "PUT", url, json=feature)
+        self.cache.invalidate(thing_id)
         response.raise_for_status()
+        if response.status_code == 204 or not response.content:
+            return feature
         return response.json()
 
+    async def merge_feature_properties(
+        self, thing_id: str, feature_id: str, patch: Any, pointer: str = ""
+    ) -> None:
+        """
+        Apply a JSON merge patch to a feature's properties, or to the
+        property at JSON pointer ``pointer`` (e.g. ``/status/temperature``)
+        """
+        path = "/".join(quote(t, safe="~") for t in pointer.split("/") if t)
+        url = f"{self.base_url}/api/2/things/{thing_id}/features/{feature_id}/properties"
+        if path:
+            url = f"{url}/{path}"
+
+        self.cache.invalidate(thing_id)
+        response = await self._request(
+            "merge_feature_properties",
+            "PATCH",
+            url,
+            json=patch,
+            headers={"Content-Type": "application/merge-patch+json"},
+        )
+        self.cache.invalidate(thing_id)
+        if response.status_code == 404:
+            if _ditto_error(response) == "things:feature.notfound":
+                detail = f"Feature {feature_id} not found on thing {thing_id}"
+            else:
+                detail = f"Thing {thing_id} not found"
+            raise HTTPException(status_code=404, detail=detail)
+        response.raise_for_status()
+
     # ========================================
     # Helper Methods
     # ========================================
 
+    def timeout_for(self, operation: str) -> float:
+        """Timeout for a DittoClient operation"""
+        if operation.startswith("get_") or operation in ("search_things", "health"):
+            return self.read_timeout
+        return self.timeout
+
+    async def _request(self, operation: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send one request to Ditto through the circuit breaker, recording
+        latency and status per operation. Raises CircuitOpenError (503)
+        without calling Ditto while the circuit is open.
+        """
+        self.breaker.before_call()
+        started = time.perf_counter()
+        status_code = None
+        success = None
+        try:
+            response = await self.client.request(
+                method, url, timeout=self.timeout_for(operation), **kwargs
+            )
+            status_code = response.status_code
+            success = status_code not in UPSTREAM_FAILURE_STATUSES
+            return response
+        except httpx.TransportError:
+            success = False
+            raise
+        finally:
+            observe_upstream(operation, status_code, time.perf_counter() - started)
+            self.breaker.record(success)
+
+    async def check_health(self) -> bool:
+        """Whether Ditto's gateway reports itself healthy"""
+        response = await self._request("health", "GET", f"{self.base_url}/health")
+        return response.status_code == 200
+
+    async def _cached_get(
+        self,
+        operation: str,
+        key: Tuple[str, str],
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        GET through the read-through cache, revalidating stale entries with
+        If-None-Match. Returns None on 404. Cached documents are shared, so
+        callers must treat them as read-only.
+        """
+        entry, fresh = self.cache.lookup(key)
+        if fresh:
+            return entry.value
+
+        generation = self.cache.generation()
+        headers = {"If-None-Match": entry.etag} if entry and entry.etag else None
+        response = await self._request(operation, "GET", url, headers=headers, params=params)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(key)
+            return entry.value
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+
+        value = orjson.loads(response.content)
+        self.cache.store(key, value, response.headers.get("etag"), generation)
+        return value
+
+    def default_policy_id(self, thing_id: str) -> str:
+        """Policy used for a thing created without an explicit policy_id"""
+        if self.default_policy_mode == "namespace":
+            namespace = thing_id.split(":", 1)[0]
+            return f"{namespace}:default-policy"
+        return f"{thing_id}:policy"
+
+    async def _ensure_default_policy(self, policy_id: str) -> None:
+        """
+        Make sure a default policy exists, skipping the round trip for
+        policies already known to exist. Concurrent callers for the same
+        policy share a single upstream request.
+        """
+        if policy_id in self.known_policies:
+            return
+
+        task = self._policy_creates.get(policy_id)
+        if task is None:
+            task = asyncio.ensure_future(self._create_default_policy(policy_id))
+            self._policy_creates[policy_id] = task
+            task.add_done_callback(lambda _: self._policy_creates.pop(policy_id, None))
+        await asyncio.shield(task)
+
     async def _create_default_policy(self, policy_id: str) -> None:
         """Create a default policy with full access for the owner"""
         policy = {
@@ -285,12 +780,39 @@ class DittoClient:
                 },
             },
         }
-        try:
-            await self.create_policy(policy_id, policy)
+        # If-None-Match: * makes the PUT create-only: an existing policy is
+        # left untouched and answered with 412 instead of being overwritten
+        url = f"{self.base_url}/api/2/policies/{policy_id}"
+        response = await self._request(
+            "create_default_policy", "PUT", url, json=policy, headers={"If-None-Match": "*"}
+        )
+        if response.status_code not in (409, 412):  # Ignore if already exists
+            response.raise_for_status()
             logger.info("default_policy_created", policy_id=policy_id)
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code != 409:  # Ignore if already exists
-                raise
+        self.known_policies.add(policy_id)
+
+
+def _ditto_error(response: httpx.Response) -> Optional[str]:
+    """Ditto's error code (e.g. ``things:thing.notfound``) of a failed response"""
+    if response.is_success:
+        return None
+    try:
+        return response.json().get("error")
+    except (ValueError, AttributeError):
+        return None
+
+
+def _error_result(error: Exception) -> Dict[str, Any]:
+    """Status and message for a per-item failure in a bulk operation"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return {"status": error.response.status_code, "error": error.response.text}
+    if isinstance(error, HTTPException):
+        return {"status": error.status_code, "error": str(error.detail)}
+    if isinstance(error, httpx.TimeoutException):
+        return {"status": 504, "error": str(error) or type(error).__name__}
+    if isinstance(error, httpx.HTTPError):
+        return {"status": 502, "error": str(error) or type(error).__name__}
+    return {"status": 500, "error": str(error)}
 
 
 # Global Ditto client instance
@@ -298,6 +820,117 @@ ditto_client = DittoClient(
     settings.ditto_api_url,
     settings.ditto_devops_user,
     settings.ditto_devops_password,
+    cache_ttl=settings.ditto_cache_ttl,
+    cache_max_entries=settings.ditto_cache_max_entries,
+    http2=settings.ditto_http2,
+    max_connections=settings.ditto_max_connections,
+    default_policy_mode=settings.ditto_default_policy_mode,
+    known_policies_max=settings.ditto_known_policies_max,
+    timeout=settings.ditto_timeout,
+    read_timeout=settings.ditto_read_timeout,
+    breaker=CircuitBreaker(
+        failure_threshold=settings.ditto_breaker_failure_threshold,
+        reset_timeout=settings.ditto_breaker_reset_timeout,
+    ),
+)
+
+# Background Ditto readiness, reported by /ready
+readiness = ReadinessProbe(
+    ditto_client.check_health,
+    interval=settings.ditto_ready_interval,
+    recheck_interval=settings.ditto_ready_recheck_interval,
+)
+
+# Telemetry micro-batcher: one merge patch per thing per flush window
+telemetry_batcher = TelemetryBatcher(
+    ditto_client.merge_thing,
+    flush_interval=settings.telemetry_flush_interval,
+    max_pending=settings.telemetry_max_pending,
+    max_concurrency=settings.telemetry_max_concurrency,
+    max_backlog=settings.telemetry_max_backlog,
+)
+
+# Numeric telemetry properties kept as time series for /history
+history_properties = [p.strip() for p in settings.history_properties.split(",") if p.strip()]
+history_store = HistoryStore(
+    settings.history_dir,
+    segment_points=settings.history_segment_points,
+    flush_interval=settings.history_flush_interval,
+    max_points=settings.history_max_points,
+    raw_retention=settings.history_raw_retention_days * 86400,
+    compressed_retention=settings.history_compressed_retention_days * 86400,
+    minute_retention=settings.history_minute_retention_days * 86400,
+    compact_interval=settings.history_compact_interval,
+    recorded_properties=history_properties or None,
+    max_open_series=settings.history_max_open_series,
+)
+if settings.history_enabled:
+    telemetry_batcher.add_listener(history_store.record_patch)
+
+# Property writes coalesced per (thing, feature) into one merge patch
+property_writes = WriteCoalescer(
+    lambda key, patch: ditto_client.merge_feature_properties(*key, patch),
+    window=settings.ditto_write_coalesce_window,
+)
+
+# MQTT bridge feeding device telemetry into the same batcher
+mqtt_bridge = MQTTBridge(
+    telemetry_batcher,
+    broker_url=settings.mqtt_broker_url,
+    client_id=settings.mqtt_client_id,
+    topic=settings.mqtt_telemetry_topic,
+    namespace=settings.telemetry_namespace,
+)
+
+# Ditto change stream fanned out to /ws/events clients
+change_stream = ChangeStream(
+    lambda: ditto_client.stream_changes(
+        extra_fields=settings.ditto_events_extra_fields, on_open=change_stream.opened
+    )
+)
+event_hub = EventHub(queue_size=settings.ws_event_queue_size)
+change_stream.add_listener(event_hub.publish)
+# Changes made outside this API (other clients, devices) evict cached copies
+change_stream.add_listener(lambda event: ditto_client.cache.invalidate(event["thingId"]))
+
+# Searches over indexed paths answered locally, current from the change stream
+search_index = SearchIndex(
+    lambda: ditto_client.iter_things(fields=BOOTSTRAP_FIELDS),
+    paths=[p.strip() for p in settings.search_index_paths.split(",") if p.strip()],
+    resync_interval=settings.search_index_resync_interval,
+)
+change_stream.add_listener(search_index.apply)
+change_stream.add_disconnect_listener(search_index.invalidate)
+
+# Shared upstream Ditto WebSocket sessions behind /ws/ditto
+ditto_ws_pool = DittoWebSocketPool(
+    websocket_connector(
+        settings.ditto_ws_url, settings.ditto_devops_user, settings.ditto_devops_password
+    ),
+    size=settings.ditto_ws_pool_size,
+    queue_size=settings.ws_event_queue_size,
+)
+
+# Component counters exported as gauges when /metrics is scraped
+register_stats(
+    {
+        "ditto_cache": ditto_client.cache.snapshot,
+        "ditto_known_policies": lambda: {
+            **ditto_client.known_policies.stats,
+            "entries": len(ditto_client.known_policies),
+        },
+        "ditto_pool": lambda: httpx_pool_state(ditto_client._client),
+        "ditto_circuit": ditto_client.breaker.snapshot,
+        "ditto_ready": lambda: {"up": readiness.ready, **readiness.stats},
+        "telemetry": lambda: {**telemetry_batcher.stats, "pending": telemetry_batcher.pending},
+        "property_writes": property_writes.snapshot,
+        "history": history_store.snapshot,
+        "mqtt_bridge": lambda: {**mqtt_bridge.stats, "connected": mqtt_bridge.connected},
+        "change_stream": lambda: {**change_stream.stats, "connected": change_stream.connected},
+        "ws_events": event_hub.snapshot,
+        "search_index": search_index.snapshot,
+        "ws_ditto": ditto_ws_pool.snapshot,
+    }
 )
 
 
@@ -313,26 +946,32 @@ async def lifespan(app: FastAPI):
     logger.info("application_starting")
     await ditto_client.connect()
 
-    # Wait for Ditto to be ready
-    max_retries = 30
-    for i in range(max_retries):
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{settings.ditto_api_url}/health", timeout=5.0)
-                if response.status_code == 200:
-                    logger.info("ditto_health_check_passed")
-                    break
-        except Exception as e:
-            logger.warning("ditto_health_check_failed", attempt=i + 1, error=str(e))
-            if i < max_retries - 1:
-                await asyncio.sleep(2)
-    else:
-        logger.error("ditto_unavailable_after_retries")
+    # Probe Ditto in the background; /ready reports the result
+    readiness.start()
+    telemetry_batcher.start()
+    if settings.history_enabled:
+        history_store.start()
+    if settings.mqtt_bridge_enabled:
+        mqtt_bridge.start()
+    if settings.ditto_events_enabled:
+        change_stream.start()
+        search_index.start()
+    elif search_index.enabled:
+        logger.warning("search_index_disabled", reason="DITTO_EVENTS_ENABLED is false")
 
     yield
 
     # Shutdown
     logger.info("application_shutting_down")
+    await change_stream.stop()
+    await search_index.stop()
+    await event_hub.close()
+    await ditto_ws_pool.close()
+    await mqtt_bridge.stop()
+    await telemetry_batcher.stop()
+    await history_store.stop()
+    await property_writes.stop()
+    await readiness.stop()
     await ditto_client.disconnect()
 
 
@@ -356,6 +995,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli for responses above COMPRESSION_MINIMUM_SIZE bytes
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+
+# Outermost, so latency includes the other middleware
+app.add_middleware(MetricsMiddleware)
+
 
 # ============================================
 # Pydantic Models
@@ -420,6 +1065,57 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
 
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """Readiness: Ditto answered the last health probe and the circuit is not open"""
+    circuit = ditto_client.breaker.snapshot()
+    ready = readiness.ready and circuit["state"] != "open"
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "ditto": readiness.snapshot(),
+        "circuit": circuit,
+    }
+    return JSONResponse(body, status_code=200 if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@app.exception_handler(httpx.TimeoutException)
+async def upstream_timeout_handler(request: Request, exc: httpx.TimeoutException):
+    """Report Ditto timeouts as 504 instead of an unhandled 500"""
+    return JSONResponse(
+        {"detail": "Ditto did not respond in time"},
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+    )
+
+
+@app.get("/health/events", tags=["Health"])
+async def event_stats():
+    """Change stream and WebSocket fan-out statistics"""
+    return {
+        "stream": {**change_stream.stats, "connected": change_stream.connected},
+        "clients": event_hub.snapshot(),
+        "ditto_proxy": ditto_ws_pool.snapshot(),
+    }
+
+
+@app.get("/metrics", tags=["Health"], response_class=Response)
+async def metrics():
+    """Prometheus metrics for requests, Ditto upstream calls and components"""
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/health/cache", tags=["Health"])
+async def cache_stats():
+    """Hit/miss counters of the Ditto read-through and known-policy caches"""
+    return {
+        **ditto_client.cache.snapshot(),
+        "known_policies": {
+            **ditto_client.known_policies.stats,
+            "entries": len(ditto_client.known_policies),
+        },
+    }
+
+
 # ============================================
 # API Routes
 # ============================================
@@ -460,6 +1156,66 @@ async def create_thing(thing: ThingCreate):
         )
 
 
+@things_router.post(
+    "/bulk",
+    summary="Create many digital twins",
+)
+async def create_things_bulk(
+    request: Request,
+    concurrency: int = Query(
+        settings.ditto_bulk_concurrency, ge=1, le=256, description="Parallel upstream writes"
+    ),
+):
+    """
+    Create digital twins in bulk from a JSON array or NDJSON body of
+    ThingCreate objects (``Content-Encoding: gzip`` is supported).
+
+    Policies and things are written with bounded parallelism over the shared
+    connection pool. The response lists one result per item in input order;
+    invalid or failing items are reported without failing the batch.
+    """
+    try:
+        body = decode_body(
+            await request.body(),
+            request.headers.get("content-encoding"),
+            settings.telemetry_max_body_size,
+        )
+        items = parse_payloads(body)
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bulk payload: {e}")
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid: List[Dict[str, Any]] = []
+    positions: List[int] = []
+    for index, item in enumerate(items):
+        try:
+            thing = ThingCreate(**item)
+        except ValidationError as e:
+            results[index] = {
+                "thingId": item.get("thing_id"),
+                "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                "error": str(e.errors(include_url=False)),
+            }
+            continue
+        valid.append(thing.model_dump())
+        positions.append(index)
+
+    created = await ditto_client.create_things_bulk(valid, concurrency=concurrency)
+    for index, result in zip(positions, created):
+        results[index] = result
+
+    succeeded = sum(1 for r in results if r["status"] < 300)
+    logger.info("things_bulk_created", total=len(results), succeeded=succeeded)
+    return {
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+    }
+
+
 @things_router.get(
     "/",
     summary="List all digital twins",
@@ -467,6 +1223,10 @@ async def create_thing(thing: ThingCreate):
 async def list_things(
     filter: Optional[str] = Query(None, description="RQL filter expression"),
     limit: int = Query(25, ge=1, le=200, description="Maximum number of results"),
+    cursor: Optional[str] = Query(None, description="nextPageCursor of the previous page"),
+    fields: Optional[str] = Query(
+        None, description="Fields to return, e.g. thingId,features/temperature(properties/value)"
+    ),
 ):
     """
     List digital twins with optional filtering.
@@ -475,18 +1235,210 @@ async def list_things(
     Example filters:
     - eq(attributes/type,"sensor")
     - gt(features/temperature/properties/value,25)
+
+    Use ``fields`` to return only what you need, e.g.
+    ``fields=thingId,features/temperature(properties/value)``.
+    """
+    return ORJSONResponse(await _search(filter, limit, cursor, fields))
+
+
+async def _search(
+    filter_str: Optional[str], limit: int, cursor: Optional[str], fields: Optional[str]
+) -> Dict[str, Any]:
+    """One page of search results, from the local index when it covers the query"""
+    result = search_index.search(filter_str, limit, cursor, fields)
+    if result is not None:
+        return result
+    if cursor and cursor.startswith(LOCAL_CURSOR_PREFIX):
+        # Continue a locally answered search in Ditto
+        filter_str, cursor = cursor_filter(filter_str, cursor), None
+    return await ditto_client.list_things(
+        filter_str=filter_str, limit=limit, cursor=cursor, fields=fields
+    )
+
+
+async def _stream_things(
+    filter_str: Optional[str], page_size: int, fields: Optional[str] = None
+) -> StreamingResponse:
+    """
+    Stream all matching things as NDJSON. The first page is fetched before
+    the response starts, so upstream errors still map to an HTTP status.
+    """
+    things = ditto_client.iter_things(filter_str=filter_str, page_size=page_size, fields=fields)
+    try:
+        first = [await things.__anext__()]
+    except StopAsyncIteration:
+        first = []
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(
+            status_code=e.response.status_code,
+            detail=f"Failed to search things: {e.response.text}",
+        )
+
+    async def lines():
+        chunk = [orjson.dumps(thing) for thing in first]
+        async for thing in things:
+            chunk.append(orjson.dumps(thing))
+            if len(chunk) >= 100:
+                yield b"\n".join(chunk) + b"\n"
+                chunk = []
+        if chunk:
+            yield b"\n".join(chunk) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@things_router.get(
+    "/export",
+    summary="Stream all digital twins as NDJSON",
+    response_class=StreamingResponse,
+)
+async def export_things(
+    filter: Optional[str] = Query(None, description="RQL filter expression"),
+    page_size: int = Query(200, ge=1, le=200, description="Upstream page size"),
+    fields: Optional[str] = Query(
+        None, description="Fields to return, e.g. thingId,features/temperature(properties/value)"
+    ),
+):
+    """
+    Stream every matching digital twin, one JSON document per line.
+    Search cursors are followed server-side with constant memory.
+    """
+    return await _stream_things(filter, page_size, fields)
+
+
+# Feature routes come before the catch-all "/{thing_id:path}" routes,
+# which would otherwise match ".../features/..." as part of the thing id
+@things_router.get(
+    "/{thing_id:path}/features/{feature_id}",
+    summary="Get a specific feature",
+)
+async def get_feature(thing_id: str, feature_id: str):
+    """Get a specific feature from a digital twin."""
+    return await ditto_client.get_feature(thing_id, feature_id)
+
+
+@things_router.get(
+    "/{thing_id:path}/features/{feature_id}/history",
+    summary="Get the history of a feature's properties",
+)
+async def get_feature_history(
+    thing_id: str,
+    feature_id: str,
+    start: Optional[str] = Query(
+        None, alias="from", description="Start (ISO-8601 or epoch seconds), default to - 1h"
+    ),
+    end: Optional[str] = Query(
+        None, alias="to", description="End (ISO-8601 or epoch seconds), default now"
+    ),
+    step: Optional[float] = Query(None, gt=0, description="Average per step seconds"),
+    properties: Optional[str] = Query(
+        None, description="Comma-separated properties, default all with history"
+    ),
+) -> Response:
+    """
+    Time series of a feature's numeric properties recorded from telemetry,
+    as ``{"t": [epoch seconds...], "v": [values...]}`` per property.
+    With ``step``, or for ranges with more than ``HISTORY_MAX_POINTS``
+    samples, rows are buckets (``v`` average, ``min``, ``max``, ``last``,
+    ``count``) read from the 1m/1h/1d rollups where possible.
     """
-    result = await ditto_client.list_things(filter_str=filter, limit=limit)
+    if not settings.history_enabled:
+        raise HTTPException(status_code=404, detail="History is disabled")
+    end_time = parse_time(end) if end else time.time()
+    start_time = parse_time(start) if start else (end_time or 0) - 3600
+    if start_time is None or end_time is None:
+        raise HTTPException(status_code=400, detail="from/to must be ISO-8601 or epoch seconds")
+    if start_time > end_time:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    names = [p.strip() for p in properties.split(",") if p.strip()] if properties else None
+    try:
+        result = history_store.query(thing_id, feature_id, start_time, end_time, step, names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse(result)
+
+
+@things_router.put(
+    "/{thing_id:path}/features/{feature_id}",
+    summary="Update a feature",
+)
+async def update_feature(thing_id: str, feature_id: str, feature: FeatureUpdate):
+    """Update a feature's properties."""
+    result = await ditto_client.update_feature(
+        thing_id=thing_id, feature_id=feature_id, properties=feature.properties
+    )
+    logger.info("feature_updated", thing_id=thing_id, feature_id=feature_id)
     return result
 
 
+async def _patch_properties(thing_id: str, feature_id: str, patch: Dict[str, Any]) -> Response:
+    await property_writes.write((thing_id, feature_id), patch)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def _read_json(request: Request) -> Any:
+    try:
+        return json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+
+
+@things_router.patch(
+    "/{thing_id:path}/features/{feature_id}/properties",
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+    summary="Merge-patch a feature's properties",
+)
+async def patch_feature_properties(thing_id: str, feature_id: str, request: Request):
+    """
+    Apply a JSON merge patch to a feature's properties: only the members
+    in the body are written, ``null`` removes a property.
+
+    Patches to the same feature arriving within
+    ``DITTO_WRITE_COALESCE_WINDOW`` are sent to Ditto as one merge patch.
+    """
+    patch = await _read_json(request)
+    if not isinstance(patch, dict):
+        raise HTTPException(status_code=400, detail="Properties patch must be a JSON object")
+    return await _patch_properties(thing_id, feature_id, patch)
+
+
+@things_router.patch(
+    "/{thing_id:path}/features/{feature_id}/properties/{pointer:path}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+    summary="Merge-patch a single feature property",
+)
+async def patch_feature_property(thing_id: str, feature_id: str, pointer: str, request: Request):
+    """
+    Merge the JSON body into the property at JSON pointer ``pointer``,
+    e.g. ``PATCH /things/ns:pump/features/motor/properties/status/rpm``
+    with body ``1450``. A ``null`` body removes the property.
+    """
+    if not pointer.strip("/"):
+        return await patch_feature_properties(thing_id, feature_id, request)
+    value = await _read_json(request)
+    return await _patch_properties(thing_id, feature_id, pointer_to_patch(pointer, value))
+
+
 @things_router.get(
     "/{thing_id:path}",
     summary="Get a digital twin by ID",
 )
-async def get_thing(thing_id: str):
+async def get_thing(
+    thing_id: str,
+    fields: Optional[str] = Query(
+        None, description="Fields to return, e.g. thingId,features/temperature(properties/value)"
+    ),
+) -> Response:
     """Retrieve a digital twin by its unique identifier."""
-    return await ditto_client.get_thing(thing_id)
+    if fields:
+        try:
+            parse_fields(fields)
+        except RQLError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid fields: {e}")
+    return ORJSONResponse(await ditto_client.get_thing(thing_id, fields=fields))
 
 
 @things_router.patch(
@@ -515,31 +1467,11 @@ async def update_thing(thing_id: str, update: ThingUpdate):
 async def delete_thing(thing_id: str):
     """Delete a digital twin by ID."""
     await ditto_client.delete_thing(thing_id)
+    # Ditto's change stream does not report deletions
+    change_stream.publish(deleted_event(thing_id))
     logger.info("thing_deleted", thing_id=thing_id)
 
 
-@things_router.get(
-    "/{thing_id:path}/features/{feature_id}",
-    summary="Get a specific feature",
-)
-async def get_feature(thing_id: str, feature_id: str):
-    """Get a specific feature from a digital twin."""
-    return await ditto_client.get_feature(thing_id, feature_id)
-
-
-@things_router.put(
-    "/{thing_id:path}/features/{feature_id}",
-    summary="Update a feature",
-)
-async def update_feature(thing_id: str, feature_id: str, feature: FeatureUpdate):
-    """Update a feature's properties."""
-    result = await ditto_client.update_feature(
-        thing_id=thing_id, feature_id=feature_id, properties=feature.properties
-    )
-    logger.info("feature_updated", thing_id=thing_id, feature_id=feature_id)
-    return result
-
-
 # ============================================
 # Policies Endpoints
 # ============================================
@@ -583,41 +1515,104 @@ async def delete_policy(policy_id: str):
     logger.info("policy_deleted", policy_id=policy_id)
 
 
-# Include routers
-app.include_router(things_router)
-app.include_router(policies_router)
-
-
 # ============================================
-# WebSocket Connection Manager
+# Telemetry Endpoints
 # ============================================
 
+telemetry_router = APIRouter(prefix=settings.api_prefix, tags=["Telemetry"])
+
+
+async def _read_telemetry(request: Request) -> List[Dict[str, Any]]:
+    """Decode a (possibly gzip-compressed) JSON or NDJSON telemetry body"""
+    try:
+        body = decode_body(
+            await request.body(),
+            request.headers.get("content-encoding"),
+            settings.telemetry_max_body_size,
+        )
+        return parse_payloads(body)
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid telemetry payload: {e}")
+
 
-class ConnectionManager:
-    """Manage WebSocket connections for real-time updates"""
+def _ingest_telemetry(payloads: List[Dict[str, Any]], twin_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    Queue each reading for ``twin_id``, or for the twin it names itself.
+    Readings without a usable twin id or with malformed sensors are
+    counted as rejected. Answers 429 when the batcher is shedding load,
+    with the ``index`` of the reading that was shed: readings before it
+    stay queued, so the client resends from there.
+    """
+    accepted = rejected = 0
+    for index, payload in enumerate(payloads):
+        try:
+            thing_id = to_thing_id(
+                twin_id or payload.get("twin_id") or payload.get("thingId"),
+                settings.telemetry_namespace,
+            )
+            patch = telemetry_to_patch(payload)
+        except ValueError:
+            rejected += 1
+            continue
+        try:
+            telemetry_batcher.submit(thing_id, patch)
+        except BacklogFull as e:
+            raise HTTPException(
+                status_code=429,
+                detail={
+                    "message": f"Telemetry backlog full: {e}",
+                    "index": index,
+                    "accepted": accepted,
+                    "rejected": rejected,
+                },
+                headers={"Retry-After": "1"},
+            )
+        accepted += 1
+    return {"accepted": accepted, "rejected": rejected}
 
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info("websocket_connected", total_connections=len(self.active_connections))
+@telemetry_router.post(
+    "/twins/{twin_id}/telemetry",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Ingest telemetry for a digital twin",
+)
+async def ingest_twin_telemetry(twin_id: str, request: Request):
+    """
+    Accept one reading (JSON object) or several (JSON array or NDJSON)
+    for a single twin.
+    Send ``Content-Encoding: gzip`` for compressed bodies.
+
+    Readings are buffered and written to Ditto as one merge patch per twin
+    per flush window. Answers 413 for a body that inflates beyond
+    ``TELEMETRY_MAX_BODY_SIZE`` and 429 while the backlog is full.
+    """
+    return _ingest_telemetry(await _read_telemetry(request), twin_id)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        logger.info("websocket_disconnected", total_connections=len(self.active_connections))
 
-    async def broadcast(self, message: dict):
-        """Broadcast a message to all connected clients"""
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.warning("broadcast_failed", error=str(e))
+@telemetry_router.post(
+    "/telemetry",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Ingest telemetry for many digital twins",
+)
+async def ingest_telemetry_batch(request: Request):
+    """
+    Accept a batch of readings for any number of twins as NDJSON or a JSON
+    array. Every reading must carry a ``twin_id`` (or ``thingId``).
+    """
+    return _ingest_telemetry(await _read_telemetry(request))
 
 
-manager = ConnectionManager()
+# Include routers
+app.include_router(things_router)
+app.include_router(policies_router)
+app.include_router(telemetry_router)
+
+
+# ============================================
+# WebSocket Endpoints
+# ============================================
 
 
 @app.websocket("/ws/events")
@@ -625,30 +1620,35 @@ async def websocket_events(websocket: WebSocket):
     """
     WebSocket endpoint for real-time digital twin events.
 
-    Connect to receive live updates when things change.
+    Connect to receive live updates when things change. Each client has
+    its own bounded queue; while a client is behind, pending changes to
+    the same thing are merged so it always receives the latest values.
 
     Message format:
     {
         "event": "thing.created" | "thing.updated" | "thing.deleted",
         "thingId": "namespace:name",
-        "data": { ... }
+        "revision": 42,
+        "data": { ... changed part of the thing ... }
     }
+
+    Client messages:
+    - "ping" -> {"type": "pong"}
+    - {"type": "subscribe", "thingIds": [...], "namespaces": [...],
+       "filter": "eq(attributes/type,\"pump\")"} (all fields optional)
+    - {"type": "unsubscribe"}
     """
-    await manager.connect(websocket)
+    await websocket.accept()
+    client = event_hub.register(websocket.send_json)
     try:
         while True:
-            # Wait for any message from client (ping/pong or subscribe)
-            data = await websocket.receive_text()
-
-            # Echo back for now - in production, implement subscription logic
-            if data == "ping":
-                await websocket.send_json({"type": "pong"})
-
+            client.handle_message(await websocket.receive_text())
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
     except Exception as e:
         logger.error("websocket_error", error=str(e))
-        manager.disconnect(websocket)
+    finally:
+        await event_hub.unregister(client)
 
 
 @app.websocket("/ws/ditto")
@@ -657,43 +1657,21 @@ async def websocket_ditto_proxy(websocket: WebSocket):
     WebSocket proxy to Eclipse Ditto's WebSocket API.
 
     This provides direct access to Ditto's WebSocket for advanced use cases.
+    Clients share a small pool of upstream sessions: START-SEND-* requests
+    are merged upstream and filtered per client, and command responses are
+    routed back by correlation-id.
     """
-    import websockets
-
     await websocket.accept()
-    logger.info("ditto_websocket_proxy_connected")
-
+    client = await ditto_ws_pool.attach(websocket.send_text)
     try:
-        async with websockets.connect(
-            f"{settings.ditto_ws_url}/ws/2",
-            extra_headers={
-                "Authorization": f"Basic {settings.ditto_devops_user}:{settings.ditto_devops_password}"
-            },
-        ) as ditto_ws:
-            # Create tasks for bidirectional message forwarding
-            async def forward_to_ditto():
-                try:
-                    while True:
-                        data = await websocket.receive_text()
-                        await ditto_ws.send(data)
-                except WebSocketDisconnect:
-                    pass
-
-            async def forward_from_ditto():
-                try:
-                    async for message in ditto_ws:
-                        await websocket.send_text(message)
-                except Exception:
-                    pass
-
-            # Run both directions concurrently
-            await asyncio.gather(forward_to_ditto(), forward_from_ditto())
-
+        while True:
+            await client.handle(await websocket.receive_text())
     except WebSocketDisconnect:
-        logger.info("ditto_websocket_proxy_disconnected")
+        pass
     except Exception as e:
         logger.error("ditto_websocket_proxy_error", error=str(e))
-        await websocket.close()
+    finally:
+        await ditto_ws_pool.detach(client)
 
 
 # ============================================
@@ -707,6 +1685,10 @@ search_router = APIRouter(prefix="/search", tags=["Search"])
 async def search_things(
     q: str = Query(..., description="Search query (RQL expression)"),
     limit: int = Query(25, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="nextPageCursor of the previous page"),
+    fields: Optional[str] = Query(
+        None, description="Fields to return, e.g. thingId,features/temperature(properties/value)"
+    ),
 ):
     """
     Search for digital twins using RQL query syntax.
@@ -715,14 +1697,145 @@ async def search_things(
     - ?q=eq(attributes/type,"temperature-sensor")
     - ?q=and(gt(features/temperature/properties/value,20),lt(features/humidity/properties/value,80))
     - ?q=like(attributes/name,"Room*")
+
+    Queries on ``SEARCH_INDEX_PATHS`` using only ``eq``, ``gt``, ``ge``,
+    ``lt``, ``le``, ``like`` and ``and`` are answered from the local index.
     """
-    result = await ditto_client.list_things(filter_str=q, limit=limit)
-    return result
+    return ORJSONResponse(await _search(q, limit, cursor, fields))
+
+
+@search_router.get("/things/export", response_class=StreamingResponse)
+async def export_search_things(
+    q: str = Query(..., description="Search query (RQL expression)"),
+    page_size: int = Query(200, ge=1, le=200, description="Upstream page size"),
+    fields: Optional[str] = Query(
+        None, description="Fields to return, e.g. thingId,features/temperature(properties/value)"
+    ),
+):
+    """Stream every thing matching an RQL query as NDJSON."""
+    return await _stream_things(q, page_size, fields)
 
 
 app.include_router(search_router)
 
 
+# ============================================
+# Snapshot Endpoints
+# ============================================
+
+snapshot_router = APIRouter(prefix="/snapshot", tags=["Snapshot"])
+
+SNAPSHOT_FORMAT = "^(ndjson|parquet)$"
+
+
+def _require_format(format: str) -> None:
+    if format == "parquet" and not PARQUET_AVAILABLE:
+        raise HTTPException(status_code=501, detail="Parquet snapshots require pyarrow")
+
+
+async def _snapshot_policy(policy_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        return await ditto_client.get_policy(policy_id)
+    except HTTPException as e:
+        if e.status_code == 404:
+            return None
+        raise
+
+
+@snapshot_router.get("/export", summary="Stream a snapshot of the fleet")
+async def export_snapshot(
+    format: str = Query("ndjson", pattern=SNAPSHOT_FORMAT),
+    filter: Optional[str] = Query(None, description="RQL filter expression"),
+    page_size: int = Query(200, ge=1, le=200, description="Upstream page size"),
+):
+    """
+    Stream every matching thing and the policies it uses as NDJSON or
+    Parquet. Each policy precedes the first thing that refers to it. The
+    first page is fetched before the response starts, so upstream errors
+    still map to an HTTP status.
+    """
+    _require_format(format)
+    batches = export_batches(
+        ditto_client.iter_things(filter_str=filter, page_size=page_size, fields=SNAPSHOT_FIELDS),
+        _snapshot_policy,
+        batch_size=page_size,
+        concurrency=settings.ditto_bulk_concurrency,
+    )
+    try:
+        first = [await batches.__anext__()]
+    except StopAsyncIteration:
+        first = []
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(
+            status_code=e.response.status_code,
+            detail=f"Failed to export snapshot: {e.response.text}",
+        )
+
+    async def all_batches():
+        for batch in first:
+            yield batch
+        async for batch in batches:
+            yield batch
+
+    encode = parquet_chunks if format == "parquet" else ndjson_chunks
+    return StreamingResponse(
+        encode(all_batches()),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="snapshot.{format}"'},
+    )
+
+
+@snapshot_router.post("/import", summary="Restore a snapshot of the fleet")
+async def import_snapshot(
+    request: Request,
+    format: Optional[str] = Query(
+        None, pattern=SNAPSHOT_FORMAT, description="Defaults from Content-Type"
+    ),
+    concurrency: int = Query(
+        settings.ditto_bulk_concurrency, ge=1, le=256, description="Parallel upstream writes"
+    ),
+):
+    """
+    Create or replace every policy and thing of a snapshot produced by
+    ``/snapshot/export`` (NDJSON may be sent with ``Content-Encoding: gzip``).
+
+    The body is written as it is read, with bounded parallelism over the
+    shared connection pool. Failing documents are counted, and the first
+    of them listed, without failing the import.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "parquet" if "parquet" in content_type else "ndjson"
+    _require_format(format)
+    if format == "parquet":
+        lines = parquet_lines(request.stream())
+    else:
+        lines = ndjson_lines(request.stream(), request.headers.get("content-encoding"))
+
+    started = time.perf_counter()
+    try:
+        result = await import_documents(
+            lines,
+            ditto_client.create_policy,
+            ditto_client.put_thing,
+            concurrency=concurrency,
+            describe_error=_error_result,
+        )
+    except (OSError, ValueError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot: {e}")
+    logger.info(
+        "snapshot_imported",
+        policies=result["policies"],
+        things=result["things"],
+        failed=result["failed"],
+        elapsed=round(time.perf_counter() - started, 3),
+    )
+    return result
+
+
+app.include_router(snapshot_router)
+
+
 # ============================================
 # Main entry point
 # ============================================
@@ -0,0 +1,178 @@
+"""
+Prometheus metrics for the Digital Twins Platform backend
+
+Hot-path instrumentation is limited to one histogram observation and two
+gauge updates per request, using label children cached after first use.
+The route template is read from the scope after routing, so requests are
+matched against the routes only once.
+Everything that is already counted elsewhere (caches, queues, the httpx
+pool, WebSocket clients) is read only when ``/metrics`` is scraped.
+"""
+
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram
+from prometheus_client import generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Backend request latency by route",
+    ["method", "route"],
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Backend responses by route and status",
+    ["method", "route", "status"],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Backend requests currently being served by method",
+    ["method"],
+)
+DITTO_REQUEST_DURATION = Histogram(
+    "ditto_request_duration_seconds",
+    "Ditto upstream latency by DittoClient operation",
+    ["operation"],
+)
+DITTO_RESPONSES = Counter(
+    "ditto_responses_total",
+    "Ditto upstream responses by operation and status ('error' if none)",
+    ["operation", "status"],
+)
+
+UNMATCHED_ROUTE = "unmatched"
+
+_http_histograms: Dict[Tuple[str, str], Any] = {}
+_in_flight_gauges: Dict[str, Any] = {}
+_ditto_histograms: Dict[str, Any] = {}
+_status_children: Dict[Tuple[Any, ...], Any] = {}
+
+
+def _counter(counter: Counter, *labels: str) -> Any:
+    key = (id(counter), *labels)
+    child = _status_children.get(key)
+    if child is None:
+        child = _status_children[key] = counter.labels(*labels)
+    return child
+
+
+def observe_upstream(operation: str, status: Optional[int], seconds: float) -> None:
+    """Record one Ditto request made by ``DittoClient``"""
+    histogram = _ditto_histograms.get(operation)
+    if histogram is None:
+        histogram = _ditto_histograms[operation] = DITTO_REQUEST_DURATION.labels(operation)
+    histogram.observe(seconds)
+    _counter(DITTO_RESPONSES, operation, str(status) if status is not None else "error").inc()
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition body and content type for ``/metrics``"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# ============================================
+# Request middleware
+# ============================================
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing HTTP requests per route template (e.g.
+    ``/things/{thing_id:path}``), so thing ids never become labels.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        in_flight = _in_flight_gauges.get(method)
+        if in_flight is None:
+            in_flight = _in_flight_gauges[method] = HTTP_IN_FLIGHT.labels(method)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            # The router records the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            histogram = _http_histograms.get((method, route))
+            if histogram is None:
+                histogram = _http_histograms[(method, route)] = HTTP_REQUEST_DURATION.labels(
+                    method, route
+                )
+            histogram.observe(elapsed)
+            _counter(HTTP_REQUESTS, method, route, str(status)).inc()
+
+
+# ============================================
+# Scrape-time collectors
+# ============================================
+
+
+def httpx_pool_state(client: Any) -> Optional[Dict[str, int]]:
+    """Connection counts of an httpx client's pool (None if not inspectable)"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if pool is None:
+        return None
+    connections = list(getattr(pool, "connections", ()))
+    idle = sum(1 for c in connections if c.is_idle())
+    waiting = sum(1 for r in getattr(pool, "_requests", ()) if getattr(r, "connection", 1) is None)
+    return {
+        "active": len(connections) - idle,
+        "idle": idle,
+        "waiting": waiting,
+        "max": getattr(pool, "_max_connections", 0) or 0,
+    }
+
+
+class StatsCollector:
+    """
+    Exposes component counters as gauges at scrape time.
+
+    ``sources`` maps a metric prefix to a callable returning a flat dict of
+    numbers, e.g. ``{"ditto_cache": lambda: cache.snapshot()}``.
+    """
+
+    def __init__(self, sources: Dict[str, Callable[[], Optional[Dict[str, Any]]]]):
+        self.sources = sources
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        for prefix, source in self.sources.items():
+            try:
+                stats = source()
+            except Exception:
+                continue
+            if not stats:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                elif not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f"{prefix}_{key}", f"{prefix} {key}", value=value)
+
+    def describe(self) -> Iterable[GaugeMetricFamily]:
+        return []
+
+
+def register_stats(sources: Dict[str, Callable[[], Optional[Dict[str, Any]]]]) -> StatsCollector:
+    collector = StatsCollector(sources)
+    REGISTRY.register(collector)
+    return collector
@@ -0,0 +1,172 @@
+"""
+MQTT telemetry bridge for the Digital Twins Platform
+
+Subscribes to device telemetry topics (``digitaltwins/{twin_id}/telemetry``
+by default, as published by the demo ``MQTTPublisher``) and feeds the
+decoded readings into the shared ``TelemetryBatcher``, which coalesces them
+per twin and writes to Ditto with bounded concurrency.
+"""
+
+import asyncio
+import ssl
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import structlog
+
+from telemetry import (
+    BacklogFull,
+    TelemetryBatcher,
+    decode_body,
+    parse_payloads,
+    telemetry_to_patch,
+    to_thing_id,
+)
+
+logger = structlog.get_logger()
+
+
+def parse_broker_url(url: str) -> Dict[str, Any]:
+    """Split an ``mqtt://`` / ``mqtts://`` URL into client connection options"""
+    parsed = urlparse(url if "://" in url else f"mqtt://{url}")
+    secure = parsed.scheme in ("mqtts", "ssl", "tls")
+    return {
+        "hostname": parsed.hostname or "localhost",
+        "port": parsed.port or (8883 if secure else 1883),
+        "username": parsed.username,
+        "password": parsed.password,
+        "tls_context": ssl.create_default_context() if secure else None,
+    }
+
+
+def _default_client_factory(**options: Any):
+    """Create an ``aiomqtt.Client``; imported lazily so MQTT stays optional"""
+    import aiomqtt
+
+    return aiomqtt.Client(**options)
+
+
+class MQTTBridge:
+    """
+    Asyncio MQTT subscriber that forwards telemetry into a TelemetryBatcher.
+
+    The bridge reconnects with capped exponential backoff, so a broker
+    outage never blocks the API; readings that arrive while Ditto is slow
+    simply coalesce in the batcher.
+    """
+
+    def __init__(
+        self,
+        batcher: TelemetryBatcher,
+        broker_url: str,
+        client_id: str,
+        topic: str = "digitaltwins/+/telemetry",
+        namespace: str = "digitaltwins",
+        qos: int = 1,
+        max_backoff: float = 30.0,
+        client_factory: Optional[Callable[..., Any]] = None,
+    ):
+        self.batcher = batcher
+        self.broker_url = broker_url
+        self.client_id = client_id
+        self.topic = topic
+        self.namespace = namespace
+        self.qos = qos
+        self.max_backoff = max_backoff
+        self.client_factory = client_factory or _default_client_factory
+        self._twin_level = self._wildcard_level(topic)
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        self.stats = {"messages": 0, "readings": 0, "rejected": 0}
+
+    @staticmethod
+    def _wildcard_level(topic: str) -> Optional[int]:
+        """Index of the ``+`` topic level that carries the twin id"""
+        levels = topic.split("/")
+        return levels.index("+") if "+" in levels else None
+
+    def _twin_from_topic(self, topic: str) -> Optional[str]:
+        if self._twin_level is None:
+            return None
+        levels = topic.split("/")
+        return levels[self._twin_level] if len(levels) > self._twin_level else None
+
+    def handle_message(self, topic: str, payload: bytes) -> int:
+        """Decode one MQTT message and queue its readings; returns readings queued"""
+        self.stats["messages"] += 1
+        try:
+            body = decode_body(payload, "gzip" if payload[:2] == b"\x1f\x8b" else None)
+            readings = parse_payloads(body)
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            self.stats["rejected"] += 1
+            logger.warning("mqtt_payload_invalid", topic=topic, error=str(e))
+            return 0
+
+        topic_twin = self._twin_from_topic(topic)
+        queued = 0
+        for reading in readings:
+            try:
+                thing_id = to_thing_id(
+                    reading.get("twin_id") or reading.get("thingId") or topic_twin,
+                    self.namespace,
+                )
+                self.batcher.submit(thing_id, telemetry_to_patch(reading))
+            except BacklogFull:
+                # MQTT has no way to push back; the batcher counts it as shed
+                continue
+            except Exception as e:
+                # One bad reading must not end the subscription
+                self.stats["rejected"] += 1
+                logger.warning("mqtt_reading_invalid", topic=topic, error=str(e))
+                continue
+            queued += 1
+
+        self.stats["readings"] += queued
+        return queued
+
+    async def _consume(self) -> None:
+        options = parse_broker_url(self.broker_url)
+        options["identifier"] = self.client_id
+        async with self.client_factory(**options) as client:
+            await client.subscribe(self.topic, qos=self.qos)
+            self.connected = True
+            logger.info("mqtt_bridge_subscribed", topic=self.topic)
+            async for message in client.messages:
+                payload = message.payload
+                if not isinstance(payload, (bytes, bytearray)):
+                    payload = str(payload).encode()
+                self.handle_message(str(message.topic), bytes(payload))
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                await self._consume()
+            except asyncio.CancelledError:
+                raise
+            except ImportError as e:
+                logger.error("mqtt_bridge_unavailable", error=str(e))
+                return
+            except Exception as e:
+                logger.warning("mqtt_bridge_disconnected", error=str(e))
+            if self.connected:
+                backoff = 1.0
+            self.connected = False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self) -> None:
+        """Start consuming in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop consuming and disconnect from the broker"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected = False
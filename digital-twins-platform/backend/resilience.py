@@ -0,0 +1,182 @@
+"""
+Failure handling for the Ditto upstream
+
+``CircuitBreaker`` fails calls fast while Ditto is down instead of letting
+every request wait for a timeout, and lets a single probe call through
+after ``reset_timeout`` to find out whether it recovered.
+``ReadinessProbe`` polls Ditto's health in the background so application
+startup never waits for it.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import structlog
+from fastapi import HTTPException
+
+logger = structlog.get_logger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(HTTPException):
+    """Raised instead of calling Ditto while the circuit is open"""
+
+    def __init__(self, retry_after: float):
+        seconds = max(1, int(retry_after + 0.999))
+        super().__init__(
+            status_code=503,
+            detail="Ditto is unavailable, failing fast",
+            headers={"Retry-After": str(seconds)},
+        )
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after ``failure_threshold`` consecutive failures; open ->
+    half-open after ``reset_timeout`` seconds, admitting up to
+    ``half_open_max_calls`` probes; a successful probe closes the circuit,
+    a failed one opens it again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10.0,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self.stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def before_call(self) -> None:
+        """Raise ``CircuitOpenError`` unless a call may go upstream now"""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return
+        self.stats["rejected"] += 1
+        retry_after = self._opened_at + self.reset_timeout - self.clock()
+        raise CircuitOpenError(retry_after)
+
+    def record(self, success: Optional[bool]) -> None:
+        """
+        Report the outcome of an admitted call. ``None`` (e.g. the caller
+        was cancelled) only frees a half-open probe slot.
+        """
+        if success is None:
+            if self._state == HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+            return
+        if success:
+            if self._state != CLOSED:
+                logger.info("ditto_circuit_closed")
+            self._state = CLOSED
+            self._failures = 0
+            return
+
+        self._failures += 1
+        if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != OPEN:
+                logger.warning("ditto_circuit_opened", failures=self._failures)
+                self.stats["opened"] += 1
+            self._state = OPEN
+            self._opened_at = self.clock()
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = self.state
+        return {
+            **self.stats,
+            "state": state,
+            "state_code": _STATE_CODES[state],
+            "consecutive_failures": self._failures,
+        }
+
+
+class ReadinessProbe:
+    """
+    Polls ``check`` in the background: every ``interval`` seconds until it
+    succeeds, then every ``recheck_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        check: Callable[[], Awaitable[bool]],
+        interval: float = 2.0,
+        recheck_interval: float = 15.0,
+    ):
+        self.check = check
+        self.interval = interval
+        self.recheck_interval = recheck_interval
+        self.ready = False
+        self.last_error: Optional[str] = None
+        self.last_checked: Optional[float] = None
+        self.stats = {"checks": 0, "failures": 0}
+        self._task: Optional[asyncio.Task] = None
+
+    async def probe(self) -> bool:
+        """Run one check and update ``ready``"""
+        self.stats["checks"] += 1
+        try:
+            ok = await self.check()
+            error = None if ok else "unhealthy"
+        except Exception as e:
+            ok, error = False, str(e) or type(e).__name__
+        self.last_checked = time.time()
+        if not ok:
+            self.stats["failures"] += 1
+        if ok != self.ready:
+            if ok:
+                logger.info("ditto_health_check_passed")
+            else:
+                logger.warning("ditto_health_check_failed", error=error)
+        self.ready, self.last_error = ok, error
+        return ok
+
+    async def _run(self) -> None:
+        while True:
+            ok = await self.probe()
+            await asyncio.sleep(self.recheck_interval if ok else self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "last_error": self.last_error,
+            "last_checked": self.last_checked,
+            **self.stats,
+        }
@@ -0,0 +1,296 @@
+"""
+RQL filter parsing and evaluation
+
+Implements the subset of Ditto's Resource Query Language used by the
+platform: ``eq ne gt ge lt le in like ilike exists and or not`` over
+``thingId``, ``policyId``, ``_namespace`` and slash-separated JSON paths
+such as ``attributes/location`` or ``features/temperature/properties/value``.
+
+Filters compile to plain Python closures, so evaluating one against a
+thing document costs a few dictionary lookups. Ditto field selectors
+(``thingId,features/temperature(properties/value)``) are parsed here too,
+so a cached thing can be projected locally.
+"""
+
+import copy
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+LOGICAL_OPS = {"and", "or", "not"}
+COMPARISON_OPS = {"eq", "ne", "gt", "ge", "lt", "le", "like", "ilike"}
+ALL_OPS = LOGICAL_OPS | COMPARISON_OPS | {"in", "exists"}
+
+MISSING = object()
+
+
+class RQLError(ValueError):
+    """Raised for malformed or unsupported RQL expressions"""
+
+
+@dataclass
+class Node:
+    """A parsed RQL expression"""
+
+    op: str
+    path: Optional[str] = None
+    values: Tuple[Any, ...] = ()
+    children: List["Node"] = field(default_factory=list)
+
+    @property
+    def value(self) -> Any:
+        return self.values[0] if self.values else None
+
+
+# ============================================
+# Parsing
+# ============================================
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def error(self, message: str) -> RQLError:
+        return RQLError(f"{message} at position {self.pos} in {self.text!r}")
+
+    def skip_ws(self) -> None:
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def peek(self) -> str:
+        self.skip_ws()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self.error(f"Expected {char!r}")
+        self.pos += 1
+
+    def word(self) -> str:
+        self.skip_ws()
+        start = self.pos
+        while self.pos < len(self.text) and self.text[self.pos] not in ",()":
+            self.pos += 1
+        return self.text[start : self.pos].strip()
+
+    def string(self) -> str:
+        quote = self.text[self.pos]
+        self.pos += 1
+        out = []
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            if char == "\\" and self.pos + 1 < len(self.text):
+                out.append(self.text[self.pos + 1])
+                self.pos += 2
+                continue
+            if char == quote:
+                self.pos += 1
+                return "".join(out)
+            out.append(char)
+            self.pos += 1
+        raise self.error("Unterminated string")
+
+    def literal(self) -> Any:
+        if self.peek() in ("'", '"'):
+            return self.string()
+        token = self.word()
+        if token == "true":
+            return True
+        if token == "false":
+            return False
+        if token == "null":
+            return None
+        try:
+            return int(token)
+        except ValueError:
+            pass
+        try:
+            return float(token)
+        except ValueError:
+            raise self.error(f"Invalid value {token!r}")
+
+    def expression(self) -> Node:
+        op = self.word()
+        if op not in ALL_OPS:
+            raise self.error(f"Unsupported operator {op!r}")
+        self.expect("(")
+
+        if op in LOGICAL_OPS:
+            children = [self.expression()]
+            while self.peek() == ",":
+                self.pos += 1
+                children.append(self.expression())
+            if op == "not" and len(children) != 1:
+                raise self.error("not() takes exactly one expression")
+            node = Node(op, children=children)
+        else:
+            path = self.word()
+            if not path:
+                raise self.error("Missing property path")
+            values = []
+            while self.peek() == ",":
+                self.pos += 1
+                values.append(self.literal())
+            if op == "exists" and values:
+                raise self.error("exists() takes only a property path")
+            if op in COMPARISON_OPS and len(values) != 1:
+                raise self.error(f"{op}() takes a property path and one value")
+            if op == "in" and not values:
+                raise self.error("in() needs at least one value")
+            node = Node(op, path=path, values=tuple(values))
+
+        self.expect(")")
+        return node
+
+
+def parse(expression: str) -> Node:
+    """Parse an RQL filter expression into a Node tree"""
+    parser = _Parser(expression)
+    node = parser.expression()
+    if parser.peek():
+        raise parser.error("Unexpected trailing input")
+    return node
+
+
+# ============================================
+# Evaluation
+# ============================================
+
+
+def resolve(thing: Dict[str, Any], path: str) -> Any:
+    """Look up a slash-separated path in a thing; returns MISSING if absent"""
+    if path == "_namespace":
+        thing_id = thing.get("thingId")
+        return thing_id.split(":", 1)[0] if isinstance(thing_id, str) else MISSING
+
+    current: Any = thing
+    for part in path.strip("/").split("/"):
+        if not isinstance(current, dict) or part not in current:
+            return MISSING
+        current = current[part]
+    return current
+
+
+def parse_fields(fields: str) -> List[str]:
+    """
+    Expand a Ditto field selector into slash paths:
+    ``thingId,features/t(properties/value,properties/unit)`` ->
+    ``["thingId", "features/t/properties/value", "features/t/properties/unit"]``
+    """
+    paths: List[str] = []
+    depth, start = 0, 0
+    for i, char in enumerate(fields + ","):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                raise RQLError(f"Unbalanced ')' in fields: {fields}")
+        elif char == "," and depth == 0:
+            token = fields[start:i].strip()
+            start = i + 1
+            if not token:
+                continue
+            if "(" in token:
+                if not token.endswith(")"):
+                    raise RQLError(f"Invalid field selector: {token}")
+                prefix, inner = token[:-1].split("(", 1)
+                paths.extend(f"{prefix.strip('/')}/{p}" for p in parse_fields(inner))
+            else:
+                paths.append(token.strip("/"))
+    if depth != 0:
+        raise RQLError(f"Unbalanced '(' in fields: {fields}")
+    return paths
+
+
+def project(thing: Dict[str, Any], fields: str) -> Dict[str, Any]:
+    """
+    Keep only the selected ``fields`` of a thing, as Ditto's ``fields``
+    option does. Values are copied, so the result never shares objects
+    with ``thing``; a field inside another selected field adds nothing.
+    """
+    result: Dict[str, Any] = {}
+    for path in parse_fields(fields):
+        value = resolve(thing, path)
+        if value is MISSING:
+            continue
+        *parents, leaf = path.split("/")
+        target = result
+        for part in parents:
+            target = target.setdefault(part, {})
+            if not isinstance(target, dict):
+                break
+        else:
+            target[leaf] = copy.deepcopy(value)
+    return result
+
+
+def like_pattern(pattern: str, ignore_case: bool = False) -> "re.Pattern":
+    """Translate an RQL like pattern (``*`` and ``?`` wildcards) to a regex"""
+    regex = "".join(
+        ".*" if char == "*" else "." if char == "?" else re.escape(char) for char in pattern
+    )
+    return re.compile(f"^{regex}$", re.IGNORECASE | re.DOTALL if ignore_case else re.DOTALL)
+
+
+def _comparable(a: Any, b: Any) -> bool:
+    numeric = (int, float)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool)
+    return (isinstance(a, numeric) and isinstance(b, numeric)) or type(a) is type(b)
+
+
+def compile_node(node: Node) -> Predicate:
+    """Compile a parsed expression into a predicate over thing documents"""
+    if node.op == "and":
+        parts = [compile_node(c) for c in node.children]
+        return lambda thing: all(p(thing) for p in parts)
+    if node.op == "or":
+        parts = [compile_node(c) for c in node.children]
+        return lambda thing: any(p(thing) for p in parts)
+    if node.op == "not":
+        inner = compile_node(node.children[0])
+        return lambda thing: not inner(thing)
+
+    path = node.path
+    if node.op == "exists":
+        return lambda thing: resolve(thing, path) is not MISSING
+    if node.op == "in":
+        options = node.values
+        return lambda thing: resolve(thing, path) in options
+    if node.op in ("like", "ilike"):
+        regex = like_pattern(str(node.value), ignore_case=node.op == "ilike")
+
+        def match_like(thing: Dict[str, Any]) -> bool:
+            actual = resolve(thing, path)
+            return isinstance(actual, str) and regex.match(actual) is not None
+
+        return match_like
+
+    expected = node.value
+    if node.op == "eq":
+        return lambda thing: resolve(thing, path) == expected
+    if node.op == "ne":
+        return lambda thing: resolve(thing, path) != expected
+
+    compare = {
+        "gt": lambda a: a > expected,
+        "ge": lambda a: a >= expected,
+        "lt": lambda a: a < expected,
+        "le": lambda a: a <= expected,
+    }[node.op]
+
+    def match_order(thing: Dict[str, Any]) -> bool:
+        actual = resolve(thing, path)
+        return actual is not MISSING and _comparable(actual, expected) and compare(actual)
+
+    return match_order
+
+
+def compile_filter(expression: str) -> Predicate:
+    """Parse and compile an RQL filter expression"""
+    return compile_node(parse(expression))
@@ -0,0 +1,520 @@
+"""
+Local secondary index for twin searches
+
+Keeps a copy of every thing, plus hash and sorted indexes over a
+configured set of paths (e.g. ``attributes/type``), current from the Ditto
+change stream. Searches that are a single comparison, or an ``and`` of
+``eq``, ``gt``, ``ge``, ``lt``, ``le`` and ``like`` on indexed paths, are
+answered from memory; anything else returns None and goes to Ditto.
+
+The copy is rebuilt from Ditto's search API at startup, after the change
+stream drops and every ``resync_interval`` seconds. Recent changes and
+those arriving while a rebuild runs are replayed onto the new copy
+before it is swapped in, since Ditto's search lags behind its events.
+Local results are sorted by thing id like Ditto's, and their cursors
+(``idx:<last thing id>``) translate into a plain ``gt(thingId,...)``
+filter if a later page has to come from Ditto.
+
+An update to a thing the copy does not hold carries only the changed
+members, so the thing is marked stale and every search goes to Ditto
+until a rebuild loads it in full. So does an update carrying the
+``policyId``: it may replace the whole thing (a PUT, or a recreate after
+a deletion this API did not see), which merging into the copy would not
+undo for removed members. Ditto's change stream does not report
+deletions: things deleted through this API are removed at once, those
+deleted elsewhere (another client, Ditto's own API) stay in the copy
+until the next resync.
+"""
+
+import asyncio
+import json
+import math
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import structlog
+
+from rql import MISSING, Node, RQLError, like_pattern, parse, project, resolve
+
+logger = structlog.get_logger()
+
+Event = Dict[str, Any]
+
+LOCAL_CURSOR_PREFIX = "idx:"
+
+# Paths every index covers, besides the configured ones
+BUILTIN_PATHS = ("thingId", "_namespace")
+
+# Fields requested when (re)building the copy from Ditto's search API
+BOOTSTRAP_FIELDS = "thingId,policyId,attributes,features,_revision"
+
+ORDER_OPS = ("gt", "ge", "lt", "le")
+
+
+def _kind(value: Any) -> Optional[str]:
+    """Type class used for equality and ordering (bools are not numbers)"""
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if value is None:
+        return "null"
+    return None
+
+
+def _without_nulls(value: Any) -> Any:
+    if not isinstance(value, dict):
+        return value
+    return {k: _without_nulls(v) for k, v in value.items() if v is not None}
+
+
+def apply_change(thing: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply a change (a merge patch) to a copy of ``thing``"""
+    result = dict(thing)
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = apply_change(result[key], value)
+        else:
+            result[key] = _without_nulls(value)
+    return result
+
+
+def local_cursor(thing_id: str) -> str:
+    return f"{LOCAL_CURSOR_PREFIX}{thing_id}"
+
+
+def cursor_filter(filter_str: Optional[str], cursor: str) -> str:
+    """Ditto filter equivalent to continuing after a local cursor"""
+    after = f"gt(thingId,{json.dumps(cursor[len(LOCAL_CURSOR_PREFIX):])})"
+    return f"and({filter_str},{after})" if filter_str else after
+
+
+# ============================================
+# Indexes
+# ============================================
+
+
+class Condition:
+    """One comparison of a covered query, tested against indexed values"""
+
+    __slots__ = ("path", "op", "value", "kind", "regex", "prefix")
+
+    def __init__(self, node: Node):
+        self.path = node.path
+        self.op = node.op
+        self.value = node.value
+        self.kind = _kind(node.value)
+        self.regex = self.prefix = None
+        if self.op == "like":
+            pattern = str(node.value)
+            self.regex = like_pattern(pattern)
+            head = pattern[:-1]
+            if pattern.endswith("*") and "*" not in head and "?" not in head:
+                self.prefix = head
+
+    def test(self, entry: Optional[Tuple[str, Any]]) -> bool:
+        if entry is None:
+            return False
+        kind, value = entry
+        if self.op == "like":
+            return kind == "string" and self.regex.match(value) is not None
+        if kind != self.kind:
+            return False
+        if self.op == "eq":
+            return value == self.value
+        if self.op == "gt":
+            return value > self.value
+        if self.op == "ge":
+            return value >= self.value
+        if self.op == "lt":
+            return value < self.value
+        return value <= self.value
+
+
+def _first(pairs: List[Tuple[Any, str]], value: Any, after: bool = False) -> int:
+    """Position of the first pair whose value is >= ``value`` (> if ``after``)"""
+    return (bisect_right if after else bisect_left)(pairs, value, key=lambda p: p[0])
+
+
+class PathIndex:
+    """Hash index plus sorted number/string indexes over one path"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.values: Dict[str, Tuple[str, Any]] = {}
+        self.by_value: Dict[Tuple[str, Any], Set[str]] = {}
+        self.sorted: Dict[str, List[Tuple[Any, str]]] = {"number": [], "string": []}
+
+    def add(self, thing_id: str, value: Any, keep_sorted: bool = True) -> None:
+        kind = _kind(value)
+        if kind is None or (kind == "number" and math.isnan(value)):
+            return
+        self.values[thing_id] = (kind, value)
+        self.by_value.setdefault((kind, value), set()).add(thing_id)
+        if kind in self.sorted:
+            if keep_sorted:
+                insort(self.sorted[kind], (value, thing_id))
+            else:
+                self.sorted[kind].append((value, thing_id))
+
+    def sort(self) -> None:
+        """Restore order after adds with ``keep_sorted=False``"""
+        for pairs in self.sorted.values():
+            pairs.sort()
+
+    def remove(self, thing_id: str) -> None:
+        entry = self.values.pop(thing_id, None)
+        if entry is None:
+            return
+        kind, value = entry
+        ids = self.by_value[entry]
+        ids.discard(thing_id)
+        if not ids:
+            del self.by_value[entry]
+        if kind in self.sorted:
+            pairs = self.sorted[kind]
+            del pairs[bisect_left(pairs, (value, thing_id))]
+
+    def _range(self, condition: Condition) -> Optional[Tuple[List[Tuple[Any, str]], int, int]]:
+        if condition.op in ORDER_OPS:
+            pairs = self.sorted[condition.kind]
+            value = condition.value
+            if condition.op in ("gt", "ge"):
+                return pairs, _first(pairs, value, after=condition.op == "gt"), len(pairs)
+            return pairs, 0, _first(pairs, value, after=condition.op == "le")
+        if condition.prefix is not None:
+            pairs = self.sorted["string"]
+            prefix = condition.prefix
+            if not prefix:
+                return pairs, 0, len(pairs)
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            return pairs, _first(pairs, prefix), _first(pairs, upper)
+        return None
+
+    def estimate(self, condition: Condition) -> int:
+        """Number of things matching ``condition``"""
+        if condition.op == "eq":
+            return len(self.by_value.get((condition.kind, condition.value), ()))
+        bounds = self._range(condition)
+        if bounds is not None:
+            return bounds[2] - bounds[1]
+        return sum(
+            len(ids)
+            for (kind, value), ids in self.by_value.items()
+            if kind == "string" and condition.regex.match(value)
+        )
+
+    def select(self, condition: Condition) -> Iterable[str]:
+        """Ids of the things matching ``condition``"""
+        if condition.op == "eq":
+            return self.by_value.get((condition.kind, condition.value), ())
+        bounds = self._range(condition)
+        if bounds is not None:
+            pairs, lo, hi = bounds
+            return (pairs[i][1] for i in range(lo, hi))
+        return (
+            thing_id
+            for (kind, value), ids in self.by_value.items()
+            if kind == "string" and condition.regex.match(value)
+            for thing_id in ids
+        )
+
+
+class ThingIndex:
+    """Thing documents with a ``PathIndex`` per indexed path"""
+
+    def __init__(self, paths: List[str]):
+        self.paths = {path: PathIndex(path) for path in (*BUILTIN_PATHS, *paths)}
+        self.things: Dict[str, Dict[str, Any]] = {}
+        self.revisions: Dict[str, Optional[int]] = {}
+        self.ids: List[str] = []
+        # Things known only from partial updates; searches go to Ditto
+        self.stale: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.things)
+
+    def load(self, things: Iterable[Tuple[Dict[str, Any], Optional[int]]]) -> None:
+        """Fill an empty index with ``(thing, revision)`` pairs, sorting once at the end"""
+        for thing, revision in things:
+            thing_id = thing["thingId"]
+            self.things[thing_id] = thing
+            self.revisions[thing_id] = revision
+            for path, index in self.paths.items():
+                value = resolve(thing, path)
+                if value is not MISSING:
+                    index.add(thing_id, value, keep_sorted=False)
+        self.ids = sorted(self.things)
+        for index in self.paths.values():
+            index.sort()
+
+    def put(self, thing: Dict[str, Any], revision: Optional[int] = None) -> None:
+        thing_id = thing["thingId"]
+        current = self.revisions.get(thing_id)
+        if revision is not None and current is not None and revision <= current:
+            return
+        self.remove(thing_id)
+        self.stale.discard(thing_id)
+        self.things[thing_id] = thing
+        self.revisions[thing_id] = revision if revision is not None else current
+        insort(self.ids, thing_id)
+        for path, index in self.paths.items():
+            value = resolve(thing, path)
+            if value is not MISSING:
+                index.add(thing_id, value)
+
+    def remove(self, thing_id: str) -> None:
+        self.stale.discard(thing_id)
+        if self.things.pop(thing_id, None) is None:
+            return
+        self.revisions.pop(thing_id, None)
+        del self.ids[bisect_left(self.ids, thing_id)]
+        for index in self.paths.values():
+            index.remove(thing_id)
+
+    def apply(self, event: Event) -> bool:
+        """
+        Apply a change-stream event (see ``events.change_to_event``).
+        Returns False if it updated a thing the index does not hold, or
+        may have replaced one (see the module docstring); the thing is
+        then stale until the index is rebuilt.
+        """
+        thing_id = event["thingId"]
+        if event["event"] == "thing.deleted":
+            self.remove(thing_id)
+            return True
+        data = {k: v for k, v in event["data"].items() if not k.startswith("_")}
+        current = self.things.get(thing_id)
+        if event["event"] == "thing.created":
+            thing = _without_nulls(data)
+        elif current is None or "policyId" in data:
+            revision, held = event.get("revision"), self.revisions.get(thing_id)
+            if current is not None and None not in (revision, held) and revision <= held:
+                return True
+            self.stale.add(thing_id)
+            return False
+        else:
+            thing = apply_change(current, data)
+        self.put({**thing, "thingId": thing_id}, event.get("revision"))
+        return True
+
+    def _conditions(self, node: Node) -> Optional[List[Condition]]:
+        nodes = node.children if node.op == "and" else [node]
+        for condition in nodes:
+            if condition.path not in self.paths:
+                return None
+            if condition.op == "eq":
+                if _kind(condition.value) is None:
+                    return None
+            elif condition.op in ORDER_OPS:
+                if _kind(condition.value) not in ("number", "string"):
+                    return None
+            elif condition.op != "like":
+                return None
+        return [Condition(n) for n in nodes]
+
+    def search(
+        self,
+        filter_str: Optional[str] = None,
+        limit: int = 25,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Answer a search like Ditto's search API would, or return None if
+        the filter uses operators or paths the index does not cover, or
+        any thing is stale
+        """
+        if self.stale:
+            return None
+        if cursor is not None and not cursor.startswith(LOCAL_CURSOR_PREFIX):
+            return None
+        after = cursor[len(LOCAL_CURSOR_PREFIX) :] if cursor is not None else None
+        conditions: List[Condition] = []
+        if filter_str:
+            try:
+                covered = self._conditions(parse(filter_str))
+            except RQLError:
+                return None
+            if covered is None:
+                return None
+            conditions = covered
+
+        page, more = self._page(conditions, limit, after)
+        items = [self.things[i] for i in page]
+        if fields:
+            items = [project(thing, fields) for thing in items]
+        result: Dict[str, Any] = {"items": items}
+        if more:
+            result["nextPageCursor"] = local_cursor(page[-1])
+        return result
+
+    def _page(
+        self, conditions: List[Condition], limit: int, after: Optional[str]
+    ) -> Tuple[List[str], bool]:
+        """
+        The ``limit`` matching ids following ``after`` in id order, and
+        whether more follow. Starts from the most selective condition;
+        when that still matches a large share of the fleet, walking all
+        ids in order and stopping after one page is cheaper than sorting
+        every match.
+        """
+        plans = sorted(
+            ((self.paths[c.path].estimate(c), c) for c in conditions), key=lambda p: p[0]
+        )
+        checks = [(self.paths[c.path].values, c) for _, c in plans]
+        start = bisect_right(self.ids, after) if after is not None else 0
+
+        if not plans or plans[0][0] ** 2 > (limit + 1) * len(self.ids):
+            page: List[str] = []
+            for i in range(start, len(self.ids)):
+                thing_id = self.ids[i]
+                if all(c.test(values.get(thing_id)) for values, c in checks):
+                    if len(page) == limit:
+                        return page, True
+                    page.append(thing_id)
+            return page, False
+
+        first = plans[0][1]
+        rest = checks[1:]
+        candidates = self.paths[first.path].select(first)
+        if after is not None:
+            candidates = (i for i in candidates if i > after)
+        if rest:
+            candidates = (
+                i for i in candidates if all(c.test(values.get(i)) for values, c in rest)
+            )
+        ids = sorted(candidates)
+        return ids[:limit], len(ids) > limit
+
+
+# ============================================
+# Lifecycle
+# ============================================
+
+
+class SearchIndex:
+    """
+    A ``ThingIndex`` kept current from change-stream events and rebuilt
+    from ``source`` (an iterator over every thing, with ``_revision``).
+    Disabled when ``paths`` is empty.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], AsyncIterator[Dict[str, Any]]],
+        paths: List[str],
+        resync_interval: float = 300.0,
+        replay_size: int = 10000,
+    ):
+        self.source = source
+        self.paths = paths
+        self.resync_interval = resync_interval
+        self.index = ThingIndex(paths)
+        self.ready = False
+        self.stats = {"hits": 0, "fallbacks": 0, "rebuilds": 0, "rebuild_failures": 0}
+        self._recent: deque = deque(maxlen=replay_size)
+        self._replay: Optional[List[Event]] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.paths)
+
+    def apply(self, event: Event) -> None:
+        """Change-stream listener; rebuilds early when a thing goes stale"""
+        if not self.index.apply(event) and self.ready:
+            self._wakeup.set()
+        self._recent.append(event)
+        if self._replay is not None:
+            self._replay.append(event)
+
+    def invalidate(self) -> None:
+        """Stop answering locally and rebuild, e.g. after missed changes"""
+        if self.ready:
+            logger.info("search_index_invalidated")
+        self.ready = False
+        self._wakeup.set()
+
+    def search(
+        self,
+        filter_str: Optional[str] = None,
+        limit: int = 25,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Local result, or None if the search must go to Ditto"""
+        result = self.index.search(filter_str, limit, cursor, fields) if self.ready else None
+        self.stats["hits" if result is not None else "fallbacks"] += 1
+        return result
+
+    async def rebuild(self) -> None:
+        """Load every thing from ``source`` into a new index and swap it in"""
+        fresh = ThingIndex(self.paths)
+        recent = list(self._recent)
+        self._replay = []
+        try:
+            loaded: Dict[str, Tuple[Dict[str, Any], Optional[int]]] = {}
+            async for thing in self.source():
+                if isinstance(thing.get("thingId"), str):
+                    thing = dict(thing)
+                    revision = thing.pop("_revision", None)
+                    loaded[thing["thingId"]] = (thing, revision)
+            fresh.load(loaded.values())
+            for event in recent:
+                fresh.apply(event)
+            # Things updated before the rebuild yet missing from the search
+            # were deleted outside this API (or are not searchable yet);
+            # only those updated since the rebuild began stay stale
+            fresh.stale.clear()
+            for event in self._replay:
+                fresh.apply(event)
+        finally:
+            self._replay = None
+        self.index = fresh
+        self.ready = True
+        self.stats["rebuilds"] += 1
+        logger.info("search_index_rebuilt", things=len(fresh))
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.rebuild()
+                timeout = self.resync_interval
+            except Exception as e:
+                self.stats["rebuild_failures"] += 1
+                logger.warning("search_index_rebuild_failed", error=str(e))
+                timeout = min(self.resync_interval, 5.0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.ready = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "ready": self.ready,
+            "things": len(self.index),
+            "stale": len(self.index.stale),
+        }
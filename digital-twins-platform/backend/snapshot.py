@@ -0,0 +1,320 @@
+"""
+Fleet snapshots: every thing and the policies it uses, as NDJSON or Parquet
+
+``export_batches`` walks the fleet page by page through Ditto's search
+cursors and fetches each policy the first time a thing refers to it,
+emitting the policy ahead of that thing, so a snapshot can be restored in
+a single pass. ``import_documents`` writes a snapshot back with bounded
+parallelism; a thing only waits for its own policy to be written.
+
+NDJSON snapshots hold the Ditto documents themselves, one per line.
+Parquet snapshots (optional ``pyarrow``) hold ``kind``, ``id`` and the
+JSON ``document`` of each, one row group per page. Both are produced and
+consumed incrementally, so memory use does not grow with the fleet.
+"""
+
+import asyncio
+import io
+import tempfile
+import zlib
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Union,
+)
+
+import orjson
+import structlog
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    PARQUET_AVAILABLE = True
+except ImportError:
+    pa = pq = None
+    PARQUET_AVAILABLE = False
+
+logger = structlog.get_logger()
+
+Document = Dict[str, Any]
+
+# Fields exported per thing (leaves out _metadata and other system fields)
+SNAPSHOT_FIELDS = "thingId,policyId,definition,attributes,features"
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+# Failures listed in an import result; further ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Parquet uploads are spooled to disk beyond this size
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# Longest NDJSON line (one document) accepted on import
+MAX_LINE_SIZE = 16 * 1024 * 1024
+
+# Gzipped uploads are inflated at most this much at a time
+INFLATE_CHUNK = 1024 * 1024
+
+
+def document_kind(document: Document) -> str:
+    """``thing`` or ``policy``"""
+    if "thingId" in document:
+        return "thing"
+    if "policyId" in document and "entries" in document:
+        return "policy"
+    raise ValueError("Not a thing (thingId) or policy (policyId, entries)")
+
+
+# ============================================
+# Export
+# ============================================
+
+
+async def export_batches(
+    things: AsyncIterator[Document],
+    get_policy: Callable[[str], Awaitable[Optional[Document]]],
+    batch_size: int = 200,
+    concurrency: int = 32,
+) -> AsyncIterator[List[Document]]:
+    """
+    Batches of up to ``batch_size`` things, each preceded by the policies
+    its things use that earlier batches did not. ``get_policy`` returns
+    None for a missing policy, which is then left out.
+    """
+    seen: Set[str] = set()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(policy_id: str) -> Optional[Document]:
+        async with semaphore:
+            policy = await get_policy(policy_id)
+        if policy is None:
+            logger.warning("snapshot_policy_missing", policy_id=policy_id)
+        return policy
+
+    async def with_policies(batch: List[Document]) -> List[Document]:
+        new = []
+        for thing in batch:
+            policy_id = thing.get("policyId")
+            if policy_id and policy_id not in seen:
+                seen.add(policy_id)
+                new.append(policy_id)
+        policies = await asyncio.gather(*(fetch(p) for p in new))
+        return [p for p in policies if p is not None] + batch
+
+    batch: List[Document] = []
+    async for thing in things:
+        batch.append(thing)
+        if len(batch) >= batch_size:
+            yield await with_policies(batch)
+            batch = []
+    if batch:
+        yield await with_policies(batch)
+
+
+async def ndjson_chunks(batches: AsyncIterator[List[Document]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield b"".join(orjson.dumps(document) + b"\n" for document in batch)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what the Parquet writer produced since the last drain"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([("kind", pa.string()), ("id", pa.string()), ("document", pa.string())])
+
+
+async def parquet_chunks(batches: AsyncIterator[List[Document]]) -> AsyncIterator[bytes]:
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    async for batch in batches:
+        kinds = [document_kind(document) for document in batch]
+        table = pa.table(
+            {
+                "kind": kinds,
+                "id": [d["thingId" if k == "thing" else "policyId"] for d, k in zip(batch, kinds)],
+                "document": [orjson.dumps(document).decode() for document in batch],
+            },
+            schema=schema,
+        )
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+# ============================================
+# Import
+# ============================================
+
+
+def _inflate(decompressor: Any, data: bytes) -> Iterator[bytes]:
+    """Output of ``decompressor`` for ``data``, at most ``INFLATE_CHUNK`` bytes per piece"""
+    while data:
+        yield decompressor.decompress(data, INFLATE_CHUNK)
+        data = decompressor.unconsumed_tail
+
+
+async def ndjson_lines(
+    chunks: AsyncIterator[bytes],
+    content_encoding: Optional[str] = None,
+    max_line_size: int = MAX_LINE_SIZE,
+) -> AsyncIterator[bytes]:
+    """
+    Lines of an NDJSON body as it arrives, gunzipping it if needed. Only
+    the current line is held in memory; raises ``ValueError`` once it
+    exceeds ``max_line_size`` bytes.
+    """
+    gzipped = bool(content_encoding and "gzip" in content_encoding.lower())
+    decompressor = zlib.decompressobj(wbits=31) if gzipped else None
+    too_long = ValueError(f"NDJSON line exceeds {max_line_size} bytes")
+    pending: List[bytes] = []
+    pending_size = 0
+    async for chunk in chunks:
+        pieces = _inflate(decompressor, chunk) if decompressor is not None else (chunk,)
+        for piece in pieces:
+            if b"\n" not in piece:
+                pending.append(piece)
+                pending_size += len(piece)
+                if pending_size > max_line_size:
+                    raise too_long
+                continue
+            *lines, rest = b"".join((*pending, piece)).split(b"\n")
+            pending, pending_size = [rest], len(rest)
+            for line in lines:
+                if len(line) > max_line_size:
+                    raise too_long
+                if line.strip():
+                    yield line
+    if decompressor is not None:
+        pending.append(decompressor.flush())
+    for line in b"".join(pending).split(b"\n"):
+        if len(line) > max_line_size:
+            raise too_long
+        if line.strip():
+            yield line
+
+
+async def parquet_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    The ``document`` column of a Parquet snapshot. Its footer comes last,
+    so the upload is spooled first, then read one batch at a time.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+        async for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+        for batch in pq.ParquetFile(spool).iter_batches(batch_size=1000, columns=["document"]):
+            for document in batch.column(0).to_pylist():
+                yield document
+
+
+def _error(error: Exception) -> Dict[str, Any]:
+    return {"error": str(error)}
+
+
+async def import_documents(
+    lines: AsyncIterator[Union[bytes, str]],
+    put_policy: Callable[[str, Document], Awaitable[Any]],
+    put_thing: Callable[[Document], Awaitable[Any]],
+    concurrency: int = 32,
+    describe_error: Callable[[Exception], Dict[str, Any]] = _error,
+) -> Dict[str, Any]:
+    """
+    Write every policy and thing of a snapshot, at most ``concurrency`` at
+    a time. Input is read only as fast as writes complete. Things wait for
+    a pending write of their policy and fail with it; a failing document
+    never fails the import.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    policy_writes: Dict[str, asyncio.Task] = {}
+    failed_policies: Dict[str, Exception] = {}
+    tasks: Set[asyncio.Task] = set()
+    result: Dict[str, Any] = {"policies": 0, "things": 0, "failed": 0, "errors": []}
+
+    def fail(item: Dict[str, Any], error: Exception) -> None:
+        result["failed"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({**item, **describe_error(error)})
+
+    async def write_policy(policy: Document) -> None:
+        policy_id = policy["policyId"]
+        try:
+            await put_policy(policy_id, policy)
+            failed_policies.pop(policy_id, None)
+            result["policies"] += 1
+        except Exception as e:
+            failed_policies[policy_id] = e
+            fail({"policyId": policy_id}, e)
+        finally:
+            if policy_writes.get(policy_id) is asyncio.current_task():
+                del policy_writes[policy_id]
+
+    async def write_thing(thing: Document) -> None:
+        policy_id = thing.get("policyId")
+        pending = policy_writes.get(policy_id)
+        if pending is not None:
+            await asyncio.shield(pending)
+        try:
+            if policy_id in failed_policies:
+                raise failed_policies[policy_id]
+            await put_thing(thing)
+            result["things"] += 1
+        except Exception as e:
+            fail({"thingId": thing["thingId"]}, e)
+
+    try:
+        number = 0
+        async for line in lines:
+            number += 1
+            try:
+                document = orjson.loads(line)
+                kind = document_kind(document) if isinstance(document, dict) else None
+                if kind is None:
+                    raise ValueError("Each line must be a JSON object")
+            except ValueError as e:
+                fail({"line": number}, e)
+                continue
+
+            await semaphore.acquire()
+            if kind == "policy":
+                task = asyncio.create_task(write_policy(document))
+                policy_writes[document["policyId"]] = task
+            else:
+                task = asyncio.create_task(write_thing(document))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+    finally:
+        # Writes already started finish even if reading the input failed
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return result
@@ -0,0 +1,409 @@
+"""
+Telemetry ingest for the Digital Twins Platform
+
+Turns device/simulator telemetry payloads into Ditto merge patches and
+micro-batches them per thing, so a fleet publishing at a steady rate costs
+one upstream write per thing per flush window instead of one per reading.
+``WriteCoalescer`` does the same for synchronous property writes, where
+every caller still waits for (and sees the outcome of) the upstream write.
+"""
+
+import asyncio
+import json
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+ApplyPatch = Callable[[str, Dict[str, Any]], Awaitable[Any]]
+
+# Reading keys copied verbatim into the feature properties
+READING_PROPERTIES = (
+    "value",
+    "unit",
+    "timestamp",
+    "min",
+    "max",
+    "warning_threshold",
+    "critical_threshold",
+)
+
+# Largest decompressed request body; protects against gzip bombs
+MAX_DECODED_SIZE = 64 * 1024 * 1024
+
+
+class PayloadTooLarge(ValueError):
+    """A compressed body inflates beyond the allowed size"""
+
+
+class BacklogFull(Exception):
+    """The batcher holds too many things waiting for upstream; retry later"""
+
+
+# ============================================
+# Payload Decoding
+# ============================================
+
+
+def decode_body(
+    body: bytes, content_encoding: Optional[str] = None, max_size: int = MAX_DECODED_SIZE
+) -> bytes:
+    """
+    Undo a gzip Content-Encoding, if any. Raises ``PayloadTooLarge`` as
+    soon as the output exceeds ``max_size`` bytes, without inflating the
+    rest, and ``ValueError`` for corrupt or truncated data.
+    """
+    if not (content_encoding and "gzip" in content_encoding.lower()):
+        return body
+    chunks: List[bytes] = []
+    size = 0
+    data = body
+    # A gzip body may hold several members back to back
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            chunk = decompressor.decompress(data, max_size - size + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip data: {e}") from e
+        size += len(chunk)
+        if size > max_size:
+            raise PayloadTooLarge(f"Decompressed body exceeds {max_size} bytes")
+        if not decompressor.eof:
+            raise ValueError("Truncated gzip data")
+        chunks.append(chunk)
+        data = decompressor.unused_data
+    return b"".join(chunks)
+
+
+def parse_payloads(body: bytes) -> List[Dict[str, Any]]:
+    """
+    Parse a request body holding a JSON object, a JSON array of objects,
+    or newline-delimited JSON (one object per line).
+    """
+    text = body.decode("utf-8").strip()
+    if not text:
+        return []
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    payloads = data if isinstance(data, list) else [data]
+    for payload in payloads:
+        if not isinstance(payload, dict):
+            raise ValueError("Each item must be a JSON object")
+    return payloads
+
+
+def to_thing_id(twin_id: Any, namespace: str) -> str:
+    """
+    Map a twin id to a Ditto thing id, adding a namespace when missing.
+    Raises ``ValueError`` unless the id is a non-empty string.
+    """
+    if not twin_id or not isinstance(twin_id, str):
+        raise ValueError(f"twin_id must be a non-empty string, got {twin_id!r}")
+    return twin_id if ":" in twin_id else f"{namespace}:{twin_id}"
+
+
+def telemetry_to_patch(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a telemetry payload into a Ditto merge patch.
+
+    Understands the simulator format (``status`` plus a ``sensors`` list,
+    one feature per sensor) and passes through explicit ``attributes`` /
+    ``features`` objects unchanged. Raises ``ValueError`` when ``sensors``
+    is not a list of objects with string ids.
+    """
+    patch: Dict[str, Any] = {}
+
+    if isinstance(payload.get("attributes"), dict):
+        patch["attributes"] = dict(payload["attributes"])
+    if isinstance(payload.get("features"), dict):
+        patch["features"] = dict(payload["features"])
+
+    if "status" in payload:
+        patch.setdefault("attributes", {})["status"] = payload["status"]
+
+    sensors = payload.get("sensors") or []
+    if not isinstance(sensors, list):
+        raise ValueError("sensors must be a list")
+    for sensor in sensors:
+        if not isinstance(sensor, dict):
+            raise ValueError("Each sensor must be a JSON object")
+        sensor_id = sensor.get("sensor_id") or sensor.get("id")
+        if not sensor_id:
+            continue
+        if not isinstance(sensor_id, str):
+            raise ValueError(f"sensor_id must be a string, got {sensor_id!r}")
+        properties = {key: sensor[key] for key in READING_PROPERTIES if key in sensor}
+        if "timestamp" not in properties and "timestamp" in payload:
+            properties["timestamp"] = payload["timestamp"]
+        patch.setdefault("features", {})[sensor_id] = {"properties": properties}
+
+    return patch
+
+
+def merge_patch(target: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fold merge patch ``patch`` into ``target`` in place and return it.
+
+    Later values win; ``None`` is kept so the deletion still reaches Ditto.
+    """
+    for key, value in patch.items():
+        if isinstance(value, dict):
+            current = target.get(key)
+            if not isinstance(current, dict):
+                current = target[key] = {}
+            merge_patch(current, value)
+        else:
+            target[key] = value
+    return target
+
+
+def can_merge(target: Dict[str, Any], patch: Dict[str, Any]) -> bool:
+    """
+    Whether folding ``patch`` into the pending patch ``target`` has the same
+    effect as applying both in order. An object merged over a pending
+    deletion or scalar would keep stale upstream members, so it is not.
+    """
+    for key, value in patch.items():
+        if isinstance(value, dict) and key in target:
+            current = target[key]
+            if not isinstance(current, dict) or not can_merge(current, value):
+                return False
+    return True
+
+
+def pointer_to_patch(pointer: str, value: Any) -> Any:
+    """
+    Turn a JSON pointer (``/a/b`` or ``a/b``) and a value into the merge
+    patch that sets that location, e.g. ``{"a": {"b": value}}``.
+    """
+    patch = value
+    for token in reversed([t for t in pointer.split("/") if t]):
+        patch = {token.replace("~1", "/").replace("~0", "~"): patch}
+    return patch
+
+
+# ============================================
+# Micro-batching
+# ============================================
+
+
+class TelemetryBatcher:
+    """
+    Buffer merge patches per thing and flush them periodically.
+
+    Patches submitted for the same thing within one flush window are
+    merged, so only the latest value of each property goes upstream.
+    A patch that cannot be merged (see ``can_merge``), such as an object
+    following a pending deletion, is queued behind it instead, and a
+    thing's patches are sent in order. Flushes run with bounded
+    concurrency through ``apply``.
+
+    ``max_pending`` buffered things trigger an early flush. While upstream
+    is too slow to keep up, patches keep merging into things already
+    buffered, but once ``max_backlog`` things are buffered a patch for
+    another thing is shed: ``submit`` raises ``BacklogFull`` and the
+    caller should retry later.
+    """
+
+    def __init__(
+        self,
+        apply: ApplyPatch,
+        flush_interval: float = 0.25,
+        max_pending: int = 5000,
+        max_concurrency: int = 16,
+        max_backlog: int = 20000,
+    ):
+        self.apply = apply
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_backlog = max(max_backlog, max_pending)
+        self.max_concurrency = max_concurrency
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.stats = {"received": 0, "flushed": 0, "failed": 0, "shed": 0}
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any]], None]) -> None:
+        """Call ``listener(thing_id, patch)`` for every submitted patch, before merging"""
+        self.listeners.append(listener)
+
+    def submit(self, thing_id: str, patch: Dict[str, Any]) -> None:
+        """Queue a merge patch for ``thing_id``; raises ``BacklogFull`` when shed"""
+        self.stats["received"] += 1
+        if not patch:
+            return
+        if len(self._pending) >= self.max_backlog and thing_id not in self._pending:
+            self.stats["shed"] += 1
+            self._wakeup.set()
+            raise BacklogFull(f"{len(self._pending)} things waiting for upstream")
+        for listener in self.listeners:
+            try:
+                listener(thing_id, patch)
+            except Exception as e:
+                logger.warning("telemetry_listener_failed", thing_id=thing_id, error=str(e))
+        queued = self._pending.setdefault(thing_id, [])
+        if queued and can_merge(queued[-1], patch):
+            merge_patch(queued[-1], patch)
+        else:
+            queued.append(merge_patch({}, patch))
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Send all pending patches upstream, returning the number sent"""
+        if not self._pending:
+            return 0
+
+        batch, self._pending = self._pending, {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send(thing_id: str, patches: List[Dict[str, Any]]) -> int:
+            sent = 0
+            async with semaphore:
+                for patch in patches:
+                    try:
+                        await self.apply(thing_id, patch)
+                        sent += 1
+                    except Exception as e:
+                        logger.warning("telemetry_flush_failed", thing_id=thing_id, error=str(e))
+                        self.stats["failed"] += 1
+            return sent
+
+        sent = sum(await asyncio.gather(*(send(t, p) for t, p in batch.items())))
+        self.stats["flushed"] += sent
+        return sent
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Start the background flush loop"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush loop and send whatever is still pending"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+
+# ============================================
+# Write coalescing
+# ============================================
+
+
+class _Batch:
+    __slots__ = ("patch", "writes", "future", "sealed", "task")
+
+    def __init__(self, patch: Dict[str, Any]):
+        self.patch = patch
+        self.writes = 1
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Nobody may be left waiting for a failed write; avoid "never retrieved"
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.sealed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class WriteCoalescer:
+    """
+    Merge patches written to the same key within ``window`` seconds into a
+    single upstream write.
+
+    ``write`` returns once the combined patch has been applied, with its
+    result or exception, so callers keep request/response semantics.
+    Writes for one key are applied in submission order: a batch is sent
+    only after the previous batch for the key has finished, and writes
+    arriving meanwhile join the waiting batch.
+    """
+
+    def __init__(
+        self,
+        apply: Callable[[Hashable, Dict[str, Any]], Awaitable[Any]],
+        window: float = 0.02,
+        max_writes: int = 1000,
+    ):
+        self.apply = apply
+        self.window = window
+        self.max_writes = max_writes
+        self._pending: Dict[Hashable, _Batch] = {}
+        self._last: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"received": 0, "flushed": 0, "failed": 0}
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def write(self, key: Hashable, patch: Dict[str, Any]) -> Any:
+        """Merge ``patch`` into the pending write for ``key`` and wait for it"""
+        self.stats["received"] += 1
+        batch = self._pending.get(key)
+        if batch is not None and batch.writes < self.max_writes and can_merge(batch.patch, patch):
+            merge_patch(batch.patch, patch)
+            batch.writes += 1
+        else:
+            if batch is not None:
+                batch.sealed.set()
+            batch = self._pending[key] = _Batch(merge_patch({}, patch))
+            batch.task = asyncio.create_task(self._flush(key, batch, self._last.get(key)))
+            self._last[key] = batch.task
+        return await asyncio.shield(batch.future)
+
+    async def _flush(self, key: Hashable, batch: _Batch, previous: Optional[asyncio.Task]) -> None:
+        try:
+            await asyncio.wait_for(batch.sealed.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        if previous is not None:
+            await previous
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+
+        try:
+            result = await self.apply(key, batch.patch)
+        except Exception as e:
+            self.stats["failed"] += 1
+            batch.future.set_exception(e)
+        else:
+            self.stats["flushed"] += 1
+            batch.future.set_result(result)
+        finally:
+            if not batch.future.done():
+                batch.future.cancel()
+            if self._last.get(key) is batch.task:
+                del self._last[key]
+
+    async def stop(self) -> None:
+        """Send everything still pending and wait for it"""
+        for batch in list(self._pending.values()):
+            batch.sealed.set()
+        tasks = list(self._last.values())
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": self.pending}
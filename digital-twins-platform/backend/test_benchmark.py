@@ -0,0 +1,21 @@
+"""
+Tests for the in-process load benchmark
+"""
+
+import pytest
+from benchmark import ROUTES, RouteResult, format_table, run_benchmark
+
+
+def test_percentiles_use_nearest_rank():
+    result = RouteResult("get", latencies=[i / 1000 for i in range(1, 101)], elapsed=2.0)
+    assert result.percentile(50) == pytest.approx(50.0)
+    assert result.percentile(99) == pytest.approx(99.0)
+    assert result.summary()["rps"] == 50.0
+
+
+@pytest.mark.asyncio
+async def test_in_process_run_reports_every_route():
+    results = await run_benchmark(list(ROUTES), things=20, requests=20, concurrency=4)
+    assert [r.route for r in results] == list(ROUTES)
+    assert all(r.errors == 0 and r.requests == 20 for r in results)
+    assert "p99 ms" in format_table(results)
@@ -0,0 +1,183 @@
+"""
+Tests for bulk twin provisioning
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+import main
+from main import DittoClient
+
+
+class FakeDitto:
+    """Records concurrency and fails selected things"""
+
+    def __init__(self, fail_things=(), fail_policies=()):
+        self.fail_things = set(fail_things)
+        self.fail_policies = set(fail_policies)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            path = request.url.path
+            self.requests.append((request.method, path))
+            entity_id = path.rsplit("/", 1)[-1]
+            if "/policies/" in path and entity_id in self.fail_policies:
+                return httpx.Response(403, text="policy forbidden")
+            if "/things/" in path and entity_id in self.fail_things:
+                return httpx.Response(400, text="bad thing")
+            return httpx.Response(201, json=json.loads(request.content))
+        finally:
+            self.in_flight -= 1
+
+
+def _connect(client: DittoClient, fake: FakeDitto) -> DittoClient:
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler))
+    return client
+
+
+@pytest.mark.asyncio
+async def test_bulk_creates_policies_once_and_bounds_concurrency():
+    fake = FakeDitto()
+    ditto = _connect(DittoClient("http://ditto", "u", "p", cache_ttl=0), fake)
+    things = [{"thing_id": f"ns:t{i}"} for i in range(40)]
+    things.append({"thing_id": "ns:shared", "policy_id": "ns:existing"})
+
+    results = await ditto.create_things_bulk(things, concurrency=4)
+
+    assert [r["thingId"] for r in results] == [t["thing_id"] for t in things]
+    assert all(r["status"] == 201 for r in results)
+    policy_puts = [p for m, p in fake.requests if "/policies/" in p]
+    assert len(policy_puts) == 40
+    assert fake.max_in_flight <= 4
+
+
+@pytest.mark.asyncio
+async def test_bulk_reports_per_item_failures():
+    fake = FakeDitto(fail_things={"ns:bad"}, fail_policies={"ns:nopolicy:policy"})
+    ditto = _connect(DittoClient("http://ditto", "u", "p", cache_ttl=0), fake)
+    things = [{"thing_id": "ns:ok"}, {"thing_id": "ns:bad"}, {"thing_id": "ns:nopolicy"}]
+
+    results = await ditto.create_things_bulk(things, concurrency=2)
+
+    assert [r["status"] for r in results] == [201, 400, 403]
+    assert results[1]["error"] == "bad thing"
+    # The thing whose policy failed is never written
+    assert ("PUT", "/api/2/things/ns:nopolicy") not in fake.requests
+
+
+@pytest.mark.asyncio
+async def test_bulk_endpoint_accepts_ndjson():
+    fake = FakeDitto()
+    _connect(main.ditto_client, fake)
+    body = "\n".join(
+        json.dumps(item)
+        for item in (
+            {"thing_id": "ns:a", "attributes": {"type": "pump"}},
+            {"thing_id": "no-namespace"},
+            {"thing_id": "ns:b", "policy_id": "ns:p"},
+        )
+    )
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post(
+            "/things/bulk?concurrency=2",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+    main.ditto_client._client = None
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 3
+    assert data["succeeded"] == 2
+    assert [r["status"] for r in data["results"]] == [201, 422, 201]
+
+
+class TestKnownPolicies:
+    """Tests for skipping redundant default-policy creation"""
+
+    @pytest.mark.asyncio
+    async def test_recreate_skips_known_policy(self):
+        fake = FakeDitto()
+        ditto = _connect(DittoClient("http://ditto", "u", "p", cache_ttl=0), fake)
+        await ditto.create_thing("ns:a")
+        await ditto.create_thing("ns:a", attributes={"v": 2})
+        policy_puts = [p for m, p in fake.requests if "/policies/" in p]
+        assert policy_puts == ["/api/2/policies/ns:a:policy"]
+
+    @pytest.mark.asyncio
+    async def test_namespace_policy_shared_by_concurrent_creates(self):
+        fake = FakeDitto()
+        ditto = _connect(
+            DittoClient("http://ditto", "u", "p", cache_ttl=0, default_policy_mode="namespace"),
+            fake,
+        )
+        await asyncio.gather(*(ditto.create_thing(f"plant:t{i}") for i in range(10)))
+        results = await ditto.create_things_bulk([{"thing_id": "plant:t10"}])
+
+        policy_puts = [p for m, p in fake.requests if "/policies/" in p]
+        assert policy_puts == ["/api/2/policies/plant:default-policy"]
+        assert results[0]["status"] == 201
+
+    @pytest.mark.asyncio
+    async def test_existing_policy_is_not_overwritten(self):
+        seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            seen.append((request.method, request.headers.get("if-none-match")))
+            if "/policies/" in request.url.path:
+                return httpx.Response(412, json={"error": "policies:precondition.failed"})
+            return httpx.Response(201, json={})
+
+        ditto = DittoClient("http://ditto", "u", "p", cache_ttl=0)
+        ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        await ditto.create_thing("ns:a")
+        assert seen[0] == ("PUT", "*")
+        assert "ns:a:policy" in ditto.known_policies
+
+    @pytest.mark.asyncio
+    async def test_get_policy_warms_cache(self):
+        fake = FakeDitto()
+        ditto = _connect(DittoClient("http://ditto", "u", "p", cache_ttl=0), fake)
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            fake.requests.append((request.method, request.url.path))
+            return httpx.Response(200, json={"policyId": "ns:a:policy"})
+
+        ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        await ditto.get_policy("ns:a:policy")
+        ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler))
+        await ditto.create_thing("ns:a")
+        assert ("PUT", "/api/2/policies/ns:a:policy") not in fake.requests
+
+    @pytest.mark.asyncio
+    async def test_policy_deleted_outside_the_api_is_recreated(
+        self, client, fake_ditto, monkeypatch
+    ):
+        ditto = main.ditto_client
+        monkeypatch.setattr(ditto, "default_policy_mode", "namespace")
+        assert (await client.post("/things/", json={"thing_id": "plant:a"})).status_code == 201
+        assert "plant:default-policy" in ditto.known_policies
+        del fake_ditto.policies["plant:default-policy"]
+
+        response = await client.post("/things/", json={"thing_id": "plant:b"})
+        assert response.status_code == 201
+        assert "plant:default-policy" in fake_ditto.policies
+        del fake_ditto.policies["plant:default-policy"]
+        results = await ditto.create_things_bulk([{"thing_id": "plant:c"}])
+        assert results[0]["status"] == 201
+
+        # An explicit policy is never created on the caller's behalf
+        response = await client.post(
+            "/things/", json={"thing_id": "plant:d", "policy_id": "plant:missing"}
+        )
+        assert response.status_code == 400
+        assert "plant:missing" not in fake_ditto.policies
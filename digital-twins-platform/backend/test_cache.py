@@ -0,0 +1,125 @@
+"""
+Tests for the Ditto read-through cache
+"""
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from cache import ThingCache, parse_etag_revision
+from main import DittoClient
+
+
+class FakeDitto:
+    """Minimal Ditto responder that honours If-None-Match"""
+
+    def __init__(self):
+        self.revision = 1
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append((request.method, request.url.path, request.headers.get("if-none-match")))
+        etag = f'"rev:{self.revision}"'
+        if request.method == "PATCH":
+            self.revision += 1
+            return httpx.Response(204)
+        if request.url.path.endswith(":missing"):
+            return httpx.Response(404, json={"error": "things:thing.notfound"})
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        body = {"thingId": "ns:a", "attributes": {"rev": self.revision}}
+        return httpx.Response(200, json=body, headers={"ETag": etag})
+
+
+@pytest.fixture
+def fake_ditto():
+    return FakeDitto()
+
+
+@pytest.fixture
+def ditto(fake_ditto):
+    client = DittoClient("http://ditto", "devops", "secret", cache_ttl=60)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(fake_ditto.handler))
+    return client
+
+
+def test_parse_etag_revision():
+    assert parse_etag_revision('"rev:42"') == 42
+    assert parse_etag_revision(None) is None
+    assert parse_etag_revision('"abc"') is None
+
+
+class TestThingCache:
+    """Tests for LRU, TTL and invalidation bookkeeping"""
+
+    def test_lru_eviction(self):
+        cache = ThingCache(ttl=60, max_entries=2)
+        for name in ("a", "b", "c"):
+            cache.store((f"ns:{name}", ""), {"n": name}, None, cache.generation())
+        assert cache.lookup(("ns:a", "")) == (None, False)
+        assert cache.lookup(("ns:c", ""))[1] is True
+        assert cache.stats["evictions"] == 1
+
+    def test_write_during_read_is_not_cached(self):
+        cache = ThingCache(ttl=60)
+        generation = cache.generation()
+        cache.invalidate("ns:a")
+        cache.store(("ns:a", ""), {"stale": True}, None, generation)
+        assert len(cache) == 0
+
+    def test_older_revision_does_not_replace_newer(self):
+        cache = ThingCache(ttl=60)
+        cache.store(("ns:a", ""), {"rev": 5}, '"rev:5"', cache.generation())
+        cache.store(("ns:a", ""), {"rev": 4}, '"rev:4"', cache.generation())
+        entry, _ = cache.lookup(("ns:a", ""))
+        assert entry.value == {"rev": 5}
+
+    def test_invalidate_drops_thing_and_features(self):
+        cache = ThingCache(ttl=60)
+        cache.store(("ns:a", ""), {}, None, cache.generation())
+        cache.store(("ns:a", "features/t"), {}, None, cache.generation())
+        cache.store(("ns:b", ""), {}, None, cache.generation())
+        cache.invalidate("ns:a")
+        assert len(cache) == 1
+        assert cache.stats["invalidations"] == 2
+
+    def test_disabled_with_zero_ttl(self):
+        cache = ThingCache(ttl=0)
+        cache.store(("ns:a", ""), {}, None, cache.generation())
+        assert len(cache) == 0
+
+
+class TestDittoClientCache:
+    """Tests for DittoClient read-through behaviour"""
+
+    @pytest.mark.asyncio
+    async def test_hit_after_first_read(self, ditto, fake_ditto):
+        first = await ditto.get_thing("ns:a")
+        second = await ditto.get_thing("ns:a")
+        assert first == second
+        assert len(fake_ditto.requests) == 1
+        assert ditto.cache.stats["hits"] == 1
+        assert ditto.cache.stats["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_entry_revalidates_with_etag(self, ditto, fake_ditto):
+        await ditto.get_thing("ns:a")
+        ditto.cache.ttl = 1e-9
+        await ditto.get_thing("ns:a")
+        assert fake_ditto.requests[-1] == ("GET", "/api/2/things/ns:a", '"rev:1"')
+        assert ditto.cache.stats["revalidations"] == 1
+
+    @pytest.mark.asyncio
+    async def test_own_writes_invalidate(self, ditto, fake_ditto):
+        await ditto.get_thing("ns:a")
+        await ditto.update_thing("ns:a", attributes={"x": 1})
+        thing = await ditto.get_thing("ns:a")
+        assert thing["attributes"]["rev"] == 2
+        assert ditto.cache.stats["hits"] == 0
+
+    @pytest.mark.asyncio
+    async def test_not_found_is_not_cached(self, ditto, fake_ditto):
+        with pytest.raises(HTTPException):
+            await ditto.get_thing("ns:missing")
+        with pytest.raises(HTTPException):
+            await ditto.get_thing("ns:missing")
+        assert len(fake_ditto.requests) == 2
@@ -0,0 +1,87 @@
+"""
+Tests for negotiated response compression
+"""
+
+import zlib
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from compression import CompressionMiddleware, _Compressor, negotiate
+
+BODY = "x" * 5000
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/big")
+    async def big():
+        return PlainTextResponse(BODY)
+
+    @app.get("/small")
+    async def small():
+        return PlainTextResponse("ok")
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for i in range(3):
+                yield f'{{"n":{i}}}\n'
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return app
+
+
+@pytest.mark.parametrize(
+    "header,brotli_available,expected",
+    [
+        ("gzip, deflate, br", True, "br"),
+        ("gzip, deflate, br", False, "gzip"),
+        ("br;q=0.5, gzip;q=0.8", True, "gzip"),
+        ("identity", True, None),
+        ("gzip;q=0", False, None),
+        ("*", False, "gzip"),
+        ("", True, None),
+    ],
+)
+def test_negotiate(header, brotli_available, expected):
+    assert negotiate(header, brotli_available) == expected
+
+
+@pytest.mark.asyncio
+async def test_compresses_large_and_streamed_responses_only():
+    transport = httpx.ASGITransport(app=_app())
+    headers = {"Accept-Encoding": "gzip"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/big", headers=headers)
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < 100
+        assert response.text == BODY
+
+        response = await client.get("/small", headers=headers)
+        assert "content-encoding" not in response.headers
+        assert response.text == "ok"
+
+        response = await client.get("/big", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+
+        response = await client.get("/stream", headers=headers)
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert response.text.splitlines() == ['{"n":0}', '{"n":1}', '{"n":2}']
+
+
+def test_streamed_chunks_are_flushed():
+    compressor = _Compressor("gzip")
+    decoder = zlib.decompressobj(31)
+    # Each chunk decodes on its own, so clients see lines as they are produced
+    assert decoder.decompress(compressor.compress(b"line 1\n")) == b"line 1\n"
+    assert decoder.decompress(compressor.compress(b"line 2\n")) == b"line 2\n"
+    assert decoder.decompress(compressor.compress(b"", final=True)) == b""
+    assert decoder.eof
@@ -0,0 +1,208 @@
+"""
+Tests for the shared /ws/ditto upstream sessions
+"""
+
+import asyncio
+import json
+
+import pytest
+from ditto_ws import (
+    DittoWebSocketPool,
+    classify_topic,
+    event_to_thing,
+    parse_stream_request,
+)
+
+
+class FakeUpstream:
+    """Stand-in for a Ditto /ws/2 connection"""
+
+    def __init__(self):
+        self.sent = []
+        self.inbox: asyncio.Queue = asyncio.Queue()
+
+    async def send(self, frame: str) -> None:
+        self.sent.append(frame)
+
+    def emit(self, message) -> None:
+        self.inbox.put_nowait(message if isinstance(message, str) else json.dumps(message))
+
+    async def close(self) -> None:
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        return await self.inbox.get()
+
+
+class Browser:
+    """Collects frames the proxy sends to one client"""
+
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, frame: str) -> None:
+        self.frames.append(frame)
+
+    def messages(self):
+        return [json.loads(f) for f in self.frames if f.startswith("{")]
+
+
+@pytest.fixture
+def upstreams():
+    return []
+
+
+@pytest.fixture
+def pool(upstreams):
+    async def connect():
+        upstream = FakeUpstream()
+        upstreams.append(upstream)
+        return upstream
+
+    return DittoWebSocketPool(connect, size=1)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def _event(namespace: str, name: str, path: str, value):
+    return {
+        "topic": f"{namespace}/{name}/things/twin/events/modified",
+        "headers": {},
+        "path": path,
+        "value": value,
+    }
+
+
+def test_parse_stream_request():
+    assert parse_stream_request("START-SEND-EVENTS?namespaces=a,b&filter=exists(x)") == (
+        "START",
+        "events",
+        {"namespaces": "a,b", "filter": "exists(x)"},
+    )
+    assert parse_stream_request("STOP-SEND-LIVE-EVENTS") == ("STOP", "live-events", {})
+    assert parse_stream_request('{"topic": "x"}') is None
+
+
+def test_classify_and_rebuild_event():
+    message = _event("plant", "pump-1", "/features/pressure/properties/value", 4.2)
+    assert classify_topic(message["topic"]) == "events"
+    assert classify_topic("plant/pump-1/things/live/messages/start") == "messages"
+    assert event_to_thing(message) == {
+        "thingId": "plant:pump-1",
+        "features": {"pressure": {"properties": {"value": 4.2}}},
+    }
+
+
+@pytest.mark.asyncio
+async def test_clients_share_one_upstream_with_merged_subscription(pool, upstreams):
+    browsers = [Browser() for _ in range(3)]
+    clients = [await pool.attach(b.send) for b in browsers]
+    await _settle()
+
+    await clients[0].handle("START-SEND-EVENTS?namespaces=plant")
+    await clients[1].handle("START-SEND-EVENTS?namespaces=office&extraFields=attributes")
+    await _settle()
+
+    assert len(upstreams) == 1
+    upstream = upstreams[0]
+    assert upstream.sent[-1] == "START-SEND-EVENTS?namespaces=office,plant&extraFields=attributes"
+    assert browsers[0].frames == ["START-SEND-EVENTS:ACK"]
+
+    # A client without a namespace restriction widens the upstream request
+    await clients[2].handle("START-SEND-EVENTS?filter=gt(features/pressure/properties/value,5)")
+    assert upstream.sent[-1] == "START-SEND-EVENTS?extraFields=attributes"
+    await _settle()
+
+    upstream.emit("START-SEND-EVENTS:ACK")
+    upstream.emit(_event("plant", "p1", "/features/pressure/properties/value", 7))
+    upstream.emit(_event("office", "o1", "/features/pressure/properties/value", 1))
+    await _settle()
+
+    assert [m["topic"] for m in browsers[0].messages()] == ["plant/p1/things/twin/events/modified"]
+    assert [m["topic"] for m in browsers[1].messages()] == ["office/o1/things/twin/events/modified"]
+    assert [m["topic"] for m in browsers[2].messages()] == ["plant/p1/things/twin/events/modified"]
+
+    for client in clients:
+        await pool.detach(client)
+    assert upstream.sent[-1] == "STOP-SEND-EVENTS"
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_command_responses_are_routed_by_correlation_id(pool, upstreams):
+    alice, bob = Browser(), Browser()
+    client_a = await pool.attach(alice.send)
+    await pool.attach(bob.send)
+
+    command = {
+        "topic": "plant/p1/things/twin/commands/retrieve",
+        "headers": {"correlation-id": "mine"},
+        "path": "/",
+    }
+    await client_a.handle(json.dumps(command))
+    await client_a.handle(json.dumps({**command, "headers": {}}))
+
+    upstream = upstreams[0]
+    forwarded = [json.loads(f) for f in upstream.sent]
+    ids = [f["headers"]["correlation-id"] for f in forwarded]
+    assert len(set(ids)) == 2 and "mine" not in ids
+
+    for correlation_id in ids:
+        upstream.emit(
+            {
+                "topic": "plant/p1/things/twin/commands/retrieve",
+                "headers": {"correlation-id": correlation_id},
+                "path": "/",
+                "status": 200,
+                "value": {"thingId": "plant:p1"},
+            }
+        )
+    await _settle()
+
+    responses = alice.messages()
+    assert [r["headers"].get("correlation-id") for r in responses] == ["mine", None]
+    assert bob.frames == []
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_invalid_filter_is_rejected_locally(pool, upstreams):
+    browser = Browser()
+    client = await pool.attach(browser.send)
+    await client.handle("START-SEND-EVENTS?filter=eq(")
+    await _settle()
+    assert browser.frames[0].startswith("START-SEND-EVENTS:NACK")
+    assert upstreams[0].sent == []
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_command_gets_error_when_upstream_is_down():
+    async def connect():
+        raise ConnectionError("refused")
+
+    pool = DittoWebSocketPool(connect, size=1, connect_timeout=0.01)
+    browser = Browser()
+    client = await pool.attach(browser.send)
+    command = {
+        "topic": "plant/p1/things/twin/commands/modify",
+        "headers": {"correlation-id": "mine"},
+        "path": "/attributes/x",
+        "value": 1,
+    }
+    await client.handle(json.dumps(command))
+    await _settle()
+
+    [error] = browser.messages()
+    assert error["topic"] == "plant/p1/things/twin/errors"
+    assert error["headers"] == {"correlation-id": "mine"}
+    assert error["status"] == 503
+    assert error["value"]["error"] == "gateway:service.unavailable"
+    assert client.session._pending == {}
+    await pool.close()
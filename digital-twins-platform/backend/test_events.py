@@ -0,0 +1,248 @@
+"""
+Tests for RQL filters and /ws/events fan-out
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from events import ChangeStream, ConflatingQueue, EventHub, Subscription, change_to_event
+from main import DittoClient
+from rql import RQLError, compile_filter, parse, parse_fields, project
+
+THING = {
+    "thingId": "plant:pump-1",
+    "attributes": {"type": "pump", "floor": 2, "name": "Pump North"},
+    "features": {"pressure": {"properties": {"value": 4.2}}},
+}
+
+
+class TestRQL:
+    """Tests for parsing and evaluating RQL filters"""
+
+    @pytest.mark.parametrize(
+        "expression,expected",
+        [
+            ('eq(attributes/type,"pump")', True),
+            ("ne(attributes/type,'pump')", False),
+            ("gt(features/pressure/properties/value,4)", True),
+            ("le(attributes/floor,1)", False),
+            ('like(attributes/name,"Pump*")', True),
+            ('ilike(attributes/name,"pump n?rth")', True),
+            ('in(attributes/type,"valve","pump")', True),
+            ("exists(features/pressure)", True),
+            ("exists(features/flow)", False),
+            ('eq(_namespace,"plant")', True),
+            ('and(eq(attributes/type,"pump"),not(lt(attributes/floor,2)))', True),
+            ('or(eq(attributes/type,"valve"),gt(attributes/floor,5))', False),
+            ('gt(attributes/name,3)', False),
+        ],
+    )
+    def test_evaluate(self, expression, expected):
+        assert compile_filter(expression)(THING) is expected
+
+    def test_parse_tree(self):
+        node = parse('and(eq(thingId,"a:b"),gt(attributes/n,1.5))')
+        assert node.op == "and"
+        assert [(c.op, c.path, c.value) for c in node.children] == [
+            ("eq", "thingId", "a:b"),
+            ("gt", "attributes/n", 1.5),
+        ]
+
+    @pytest.mark.parametrize(
+        "expression",
+        ["", "eq(thingId)", "foo(thingId,1)", 'eq(thingId,"a"', "not(exists(a),exists(b))"],
+    )
+    def test_rejects_invalid(self, expression):
+        with pytest.raises(RQLError):
+            parse(expression)
+
+    def test_field_selectors(self):
+        assert parse_fields("thingId, features/pressure(properties/value,properties/unit)") == [
+            "thingId",
+            "features/pressure/properties/value",
+            "features/pressure/properties/unit",
+        ]
+        assert project(THING, "thingId,attributes(type,missing),features/pressure") == {
+            "thingId": "plant:pump-1",
+            "attributes": {"type": "pump"},
+            "features": {"pressure": {"properties": {"value": 4.2}}},
+        }
+        with pytest.raises(RQLError):
+            parse_fields("attributes(type")
+
+    def test_projection_copies_and_merges_overlapping_fields(self):
+        projected = project(THING, "attributes,attributes/type,features/pressure/properties")
+        assert projected == {
+            "attributes": THING["attributes"],
+            "features": {"pressure": {"properties": {"value": 4.2}}},
+        }
+        projected["attributes"]["floor"] = 3
+        projected["features"]["pressure"]["properties"]["value"] = 0
+        assert THING["attributes"]["floor"] == 2
+        assert THING["features"]["pressure"]["properties"]["value"] == 4.2
+        assert project(THING, "attributes/type,attributes") == {"attributes": THING["attributes"]}
+
+
+class TestConflatingQueue:
+    """Tests for bounded per-client queues"""
+
+    @pytest.mark.asyncio
+    async def test_merges_pending_changes_per_thing(self):
+        queue = ConflatingQueue(maxsize=10)
+        first = change_to_event({"thingId": "ns:a", "features": {"t": {"properties": {"value": 1}}}})
+        queue.put("ns:a", first)
+        queue.put("ns:b", change_to_event({"thingId": "ns:b"}))
+        queue.put(
+            "ns:a",
+            change_to_event(
+                {"thingId": "ns:a", "features": {"h": {"properties": {"value": 9}}}, "_revision": 7}
+            ),
+        )
+
+        merged = await queue.get()
+        assert merged["thingId"] == "ns:a"
+        assert merged["revision"] == 7
+        assert merged["data"]["features"] == {
+            "t": {"properties": {"value": 1}},
+            "h": {"properties": {"value": 9}},
+        }
+        # The event shared with other clients was not mutated
+        assert "h" not in first["data"]["features"]
+        assert queue.stats["conflated"] == 1
+
+    @pytest.mark.asyncio
+    async def test_overflow_drops_oldest_and_reports(self):
+        queue = ConflatingQueue(maxsize=2)
+        for name in ("a", "b", "c"):
+            queue.put(f"ns:{name}", change_to_event({"thingId": f"ns:{name}"}))
+        assert await queue.get() == {"type": "dropped", "count": 1}
+        assert (await queue.get())["thingId"] == "ns:b"
+
+
+class TestSubscription:
+    """Tests for client subscription matching"""
+
+    def test_matches_by_id_namespace_and_filter(self):
+        event = change_to_event(THING)
+        assert Subscription().matches(event)
+        assert Subscription(thing_ids=["plant:pump-1"]).matches(event)
+        assert not Subscription(namespaces=["office"]).matches(event)
+        assert Subscription(filter_str='eq(attributes/type,"pump")').matches(event)
+        assert not Subscription(filter_str="gt(attributes/floor,3)").matches(event)
+        assert not Subscription(active=False).matches(event)
+
+    def test_invalid_subscribe_message(self):
+        with pytest.raises(ValueError):
+            Subscription.from_message({"type": "subscribe", "thingIds": "ns:a"})
+        with pytest.raises(RQLError):
+            Subscription.from_message({"type": "subscribe", "filter": "eq(x"})
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_block_others():
+    hub = EventHub(queue_size=100)
+    fast_received = []
+    release = asyncio.Event()
+
+    async def slow_send(message):
+        await release.wait()
+
+    async def fast_send(message):
+        fast_received.append(message)
+
+    slow = hub.register(slow_send)
+    hub.register(fast_send)
+    for i in range(50):
+        hub.publish(change_to_event({"thingId": "ns:a", "attributes": {"n": i}}))
+        await asyncio.sleep(0)
+
+    assert len(fast_received) == 50
+    # The slow client holds at most one pending event for the thing
+    assert len(slow.queue) <= 1
+    release.set()
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_changes_parses_sse():
+    body = (
+        b": keep-alive\n\n"
+        b'data:{"thingId":"ns:a","attributes":{"x":1},"_revision":1}\n\n'
+        b"data:\n\n"
+        b'data: {"thingId":"ns:a","features":{"t":{"properties":{"value":2}}}}\n\n'
+    )
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["accept"] == "text/event-stream"
+        assert request.url.params["extraFields"] == "_revision"
+        return httpx.Response(200, content=body, headers={"Content-Type": "text/event-stream"})
+
+    ditto = DittoClient("http://ditto", "u", "p")
+    ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    stream = ChangeStream(lambda: ditto.stream_changes(extra_fields="_revision"))
+    events = []
+    stream.add_listener(events.append)
+    await stream._consume()
+
+    assert [e["event"] for e in events] == ["thing.created", "thing.updated"]
+    assert events[1]["data"]["features"]["t"]["properties"]["value"] == 2
+
+
+@pytest.mark.asyncio
+async def test_idle_stream_is_connected_once_open():
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b": keep-alive\n\n")
+
+    ditto = DittoClient("http://ditto", "u", "p")
+    ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    stream = ChangeStream(lambda: ditto.stream_changes(on_open=stream.opened))
+    await stream._consume()
+    assert stream.stats["changes"] == 0
+    assert stream.connected
+
+
+@pytest.mark.asyncio
+async def test_failing_disconnect_listener_keeps_reconnecting():
+    async def source():
+        raise ConnectionError("stream closed")
+        yield
+
+    def failing():
+        raise RuntimeError("listener bug")
+
+    called = []
+    stream = ChangeStream(source)
+    stream.add_disconnect_listener(failing)
+    stream.add_disconnect_listener(lambda: called.append(1))
+    stream.start()
+    async with asyncio.timeout(5):
+        while not called:
+            await asyncio.sleep(0.001)
+    # Later listeners still ran and the reconnect loop is waiting to retry
+    assert not stream._task.done()
+    assert stream.stats["reconnects"] == 1
+    await stream.stop()
+
+
+def test_websocket_subscribe_and_receive():
+    client = TestClient(main.app)
+    with client.websocket_connect("/ws/events") as ws:
+        ws.send_text("ping")
+        assert ws.receive_json() == {"type": "pong"}
+
+        ws.send_text(json.dumps({"type": "subscribe", "filter": "eq(attributes/type,'pump')"}))
+        assert ws.receive_json()["type"] == "subscribed"
+
+        # Publish on the app's event loop, as the change stream would
+        publish = main.change_stream.publish
+        ws.portal.call(publish, change_to_event({"thingId": "ns:v", "attributes": {"type": "valve"}}))
+        ws.portal.call(publish, change_to_event({"thingId": "ns:p", "attributes": {"type": "pump"}}))
+        assert ws.receive_json()["thingId"] == "ns:p"
+
+        ws.send_text(json.dumps({"type": "subscribe", "filter": "bogus("}))
+        assert ws.receive_json()["type"] == "error"
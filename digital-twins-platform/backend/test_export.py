@@ -0,0 +1,81 @@
+"""
+Tests for cursor-following search and NDJSON export
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+import main
+from main import DittoClient
+
+
+class PagedDitto:
+    """Serves ``total`` things through Ditto-style search cursors"""
+
+    def __init__(self, total: int):
+        self.things = [{"thingId": f"ns:t{i}"} for i in range(total)]
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/api/2/search/things"
+        options = dict(
+            part[:-1].split("(", 1) for part in request.url.params["option"].split(",")
+        )
+        self.requests.append(options)
+        size = int(options["size"])
+        start = int(options.get("cursor", 0))
+        body = {"items": self.things[start : start + size]}
+        if start + size < len(self.things):
+            body["nextPageCursor"] = str(start + size)
+        return httpx.Response(200, json=body)
+
+
+def _client(fake: PagedDitto) -> DittoClient:
+    ditto = DittoClient("http://ditto", "u", "p")
+    ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler))
+    return ditto
+
+
+@pytest.mark.asyncio
+async def test_list_things_passes_cursor():
+    fake = PagedDitto(5)
+    page = await _client(fake).list_things(limit=2, cursor="2")
+    assert [t["thingId"] for t in page["items"]] == ["ns:t2", "ns:t3"]
+    assert page["nextPageCursor"] == "4"
+
+
+@pytest.mark.asyncio
+async def test_iter_things_follows_cursors_and_prefetches():
+    fake = PagedDitto(7)
+    ditto = _client(fake)
+    things = ditto.iter_things(filter_str='eq(attributes/type,"pump")', page_size=3)
+
+    first = await things.__anext__()
+    await asyncio.sleep(0.01)
+    # The second page was requested while the first is still being consumed
+    assert len(fake.requests) == 2
+    rest = [t async for t in things]
+
+    assert [first] + rest == fake.things
+    assert [r.get("cursor") for r in fake.requests] == [None, "3", "6"]
+
+
+@pytest.mark.asyncio
+async def test_export_endpoint_streams_ndjson():
+    fake = PagedDitto(250)
+    main.ditto_client._client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler))
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/things/export?page_size=100")
+            search = await client.get("/search/things/export", params={"q": "exists(thingId)"})
+    finally:
+        main.ditto_client._client = None
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == fake.things
+    assert len(search.text.splitlines()) == 250
@@ -0,0 +1,415 @@
+"""
+Tests for the memory-mapped feature property history
+"""
+
+import shutil
+
+import numpy as np
+import pytest
+
+import main
+from history import (
+    HistoryStore,
+    aggregate,
+    choose_resolution,
+    decode_block,
+    encode_block,
+    extract_samples,
+    parse_time,
+)
+from telemetry import TelemetryBatcher
+
+
+def _store(tmp_path, **kwargs) -> HistoryStore:
+    return HistoryStore(str(tmp_path / "history"), **{"segment_points": 4, **kwargs})
+
+
+def _fill(store: HistoryStore, times, prop="value"):
+    for t in times:
+        store.record("ns:pump", "temp", prop, float(t), float(t) * 10)
+    store.flush()
+
+
+class TestSamples:
+    """Tests for timestamps and sample extraction"""
+
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            (1700000000, 1700000000.0),
+            (1700000000500, 1700000000.5),
+            ("1700000000", 1700000000.0),
+            ("2023-11-14T22:13:20Z", 1700000000.0),
+            ("2023-11-14T22:13:20", 1700000000.0),
+            ("yesterday", None),
+            (True, None),
+            (None, None),
+        ],
+    )
+    def test_parse_time(self, value, expected):
+        assert parse_time(value) == expected
+
+    def test_extract_numeric_properties(self):
+        patch = {
+            "attributes": {"status": 1},
+            "features": {
+                "temp": {
+                    "properties": {
+                        "value": 21.5,
+                        "unit": "C",
+                        "ok": True,
+                        "limits": {"max": 80},
+                        "timestamp": "2023-11-14T22:13:20Z",
+                    }
+                },
+                "flow": {"properties": {"value": 3}},
+                "broken": None,
+            },
+        }
+        assert sorted(extract_samples(patch, now=5.0)) == [
+            ("flow", "value", 5.0, 3.0),
+            ("temp", "limits/max", 1700000000.0, 80.0),
+            ("temp", "value", 1700000000.0, 21.5),
+        ]
+
+
+class TestHistoryStore:
+    """Tests for segments, range queries and downsampling"""
+
+    def test_range_query_across_segments(self, tmp_path):
+        store = _store(tmp_path)
+        _fill(store, range(10))
+        series = store.series(("ns:pump", "temp", "value"))
+        assert [s.start for s in series.raw.segments] == [0.0, 4.0, 8.0]
+
+        result = store.query("ns:pump", "temp", 3, 8.5)
+        values = result["properties"]["value"]
+        assert list(values["t"]) == [3, 4, 5, 6, 7, 8]
+        assert list(values["v"]) == [30, 40, 50, 60, 70, 80]
+        assert result["step"] is None
+
+        # Inside one segment the result is a view of the mapped file; only
+        # the segment being appended to stays mapped
+        inside = store.query("ns:pump", "temp", 8, 9)["properties"]["value"]
+        assert np.shares_memory(inside["t"], series.raw.segments[2].ts)
+        sealed = store.query("ns:pump", "temp", 4, 6)["properties"]["value"]
+        assert isinstance(sealed["t"].base, np.memmap)
+        assert [s._columns is None for s in series.raw.segments] == [True, True, False]
+
+    def test_rollup_segments_are_sized_per_resolution(self, tmp_path):
+        store = _store(tmp_path, segment_points=65536)
+        _fill(store, [0, 90000])
+        history = store.series(("ns:pump", "temp", "value"))
+        capacities = {name: r.segments[-1].capacity for name, r in history.rollups.items()}
+        assert capacities == {"1m": 10080, "1h": 2208, "1d": 1461}
+
+    def test_reopen_late_and_unflushed_samples(self, tmp_path):
+        store = _store(tmp_path)
+        _fill(store, [1, 2, 3, 5, 6])
+        store.record("ns:pump", "temp", "value", 4.0, 0.0)
+        store.record("ns:pump", "temp", "value", 7.0, 70.0)
+        store.record("ns:pump", "temp", "pressure", 7.0, 1.5)
+
+        # Queries see buffered samples without waiting for the flush loop
+        result = store.query("ns:pump", "temp", 0, 100)
+        assert list(result["properties"]) == ["pressure", "value"]
+        assert list(result["properties"]["value"]["t"]) == [1, 2, 3, 5, 6, 7]
+        assert store.stats["late"] == 1
+
+        reopened = _store(tmp_path)
+        assert reopened.properties("ns:pump", "temp") == ["pressure", "value"]
+        values = reopened.query("ns:pump", "temp", 0, 100, properties=["value"])
+        assert list(values["properties"]["value"]["v"]) == [10, 20, 30, 50, 60, 70]
+        _fill(reopened, [8])
+        assert reopened.series(("ns:pump", "temp", "value")).raw.segments[-1].count == 3
+
+    def test_step_and_automatic_downsampling(self, tmp_path):
+        store = _store(tmp_path, segment_points=64, max_points=10)
+        _fill(store, range(100))
+
+        stepped = store.query("ns:pump", "temp", 0, 99, step=25)
+        assert stepped["step"] == 25
+        assert list(stepped["properties"]["value"]["t"]) == [0, 25, 50, 75]
+        assert list(stepped["properties"]["value"]["v"]) == [120, 370, 620, 870]
+
+        automatic = store.query("ns:pump", "temp", 0, 99)
+        assert len(automatic["properties"]["value"]["t"]) <= 11
+        assert automatic["step"] == pytest.approx(9.9)
+
+        with pytest.raises(ValueError):
+            store.query("ns:pump", "temp", 0, 99, step=1e-6)
+
+    def test_aggregate_skips_empty_buckets(self):
+        rows = aggregate({"t": np.array([0.0, 1.0, 11.0]), "v": np.array([2.0, 4.0, 6.0])}, 5)
+        assert {name: list(values) for name, values in rows.items()} == {
+            "t": [0, 10],
+            "min": [2, 6],
+            "max": [4, 6],
+            "sum": [6, 6],
+            "count": [2, 1],
+            "last": [4, 6],
+        }
+        # Rollup rows combine into coarser ones
+        coarser = aggregate(rows, 20)
+        assert list(coarser["count"]) == [3]
+        assert list(coarser["last"]) == [6]
+
+    def test_batcher_listener_records_telemetry(self, tmp_path):
+        async def apply(thing_id, patch):
+            pass
+
+        store = _store(tmp_path)
+        batcher = TelemetryBatcher(apply)
+        batcher.add_listener(store.record_patch)
+        for value, at in [(1, 10), (2, 20)]:
+            reading = {"value": value, "timestamp": at}
+            batcher.submit("ns:pump", {"features": {"temp": {"properties": reading}}})
+        values = store.query("ns:pump", "temp", 0, 30)["properties"]["value"]
+        assert list(values["v"]) == [1, 2]
+
+    def test_only_recorded_properties_are_stored(self, tmp_path):
+        reading = {"value": 21.5, "min": 0, "max": 100, "warning_threshold": 80}
+        patch = {"features": {"temp": {"properties": reading}}}
+        store = _store(tmp_path)
+        store.record_patch("ns:pump", patch)
+        store.flush()
+        assert store.properties("ns:pump", "temp") == ["value"]
+
+        everything = _store(tmp_path / "all", recorded_properties=None)
+        everything.record_patch("ns:pump", patch)
+        assert everything.properties("ns:pump", "temp") == [
+            "max", "min", "value", "warning_threshold"
+        ]
+
+    def test_idle_series_are_closed(self, tmp_path):
+        store = _store(tmp_path, max_open_series=2)
+        for prop in ("a", "b", "c"):
+            _fill(store, [1, 2], prop=prop)
+        assert list(store._series) == [("ns:pump", "temp", p) for p in ("b", "c")]
+        assert store.stats["closed"] == 1
+
+        # A closed series is reopened from disk on demand
+        result = store.query("ns:pump", "temp", 0, 10, properties=["a"])
+        assert list(result["properties"]["a"]["v"]) == [10, 20]
+        assert ("ns:pump", "temp", "b") not in store._series
+
+    @pytest.mark.parametrize("name", [".", "..", ".hidden", "a/../..", "%2E"])
+    def test_names_stay_inside_the_root(self, tmp_path, name):
+        store = _store(tmp_path)
+        patch = {"features": {name: {"properties": {name: 5, "value": 1}}}}
+        store.record_patch(name, patch)
+        store.record(name, name, name, 1.0, 2.0)
+        store.flush()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["history"]
+        assert [key[0] for key in store._stored_keys()] == [name, name]
+        assert store.properties(name, name) == sorted({name, "value"})
+
+        # Reads neither escape nor create directories
+        before = sorted(tmp_path.rglob("*"))
+        store.query("..", "..", 0, 10, properties=[".."])
+        store.query(name, "missing", 0, 10, properties=["value"])
+        assert sorted(tmp_path.rglob("*")) == before
+        assert store.query(name, name, 0, 10)["properties"][name]["v"].tolist() == [2]
+
+    def test_empty_names_are_rejected(self, tmp_path):
+        store = _store(tmp_path)
+        store.record_patch("ns:pump", {"features": {"": {"properties": {"value": 1}}}})
+        store.flush()
+        assert store.stats["rejected"] == 1
+        assert not (tmp_path / "history").exists()
+        with pytest.raises(ValueError):
+            store.query("ns:pump", "temp", 0, 10, properties=[""])
+
+
+@pytest.mark.asyncio
+async def test_history_route(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "history_store", _store(tmp_path))
+    reading = {"sensor_id": "temp", "value": 21.5, "timestamp": "2023-11-14T22:13:20Z"}
+    main.history_store.record_patch("ns:pump", main.telemetry_to_patch({"sensors": [reading]}))
+
+    response = await client.get(
+        "/things/ns:pump/features/temp/history",
+        params={"from": "2023-11-14T00:00:00Z", "to": "1700003600"},
+    )
+    assert response.status_code == 200
+    assert response.json()["properties"]["value"] == {"t": [1700000000.0], "v": [21.5]}
+
+    for params in ({"from": "x"}, {"from": 10, "to": 5}, {"step": 1e-6}):
+        response = await client.get("/things/ns:pump/features/temp/history", params=params)
+        assert response.status_code == 400
+
+
+class TestRollups:
+    """Tests for incrementally maintained 1m/1h/1d rollups"""
+
+    @pytest.mark.parametrize(
+        "span, step, raw_points, expected",
+        [
+            (3600, None, 500, ("raw", None)),
+            (3600, None, 5000, ("raw", 1.8)),
+            (30 * 86400, None, 10**6, ("1h", 3600.0)),
+            (86400, None, 10**6, ("1m", 60.0)),
+            (36 * 3600, None, 10**6, ("1m", 120.0)),
+            (20 * 365 * 86400, None, 10**8, ("1d", 4 * 86400.0)),
+            (86400, 300, 0, ("1m", 300)),
+            (86400, 7200, 0, ("1h", 7200)),
+            (86400, 90, 0, ("raw", 90)),
+        ],
+    )
+    def test_choose_resolution(self, span, step, raw_points, expected):
+        assert choose_resolution(0, span, step, raw_points, 2000) == expected
+
+    def test_choose_resolution_skips_expired_tiers(self):
+        assert choose_resolution(0, 3600, None, 0, 2000, {"1m", "1h"}) == ("1m", 60.0)
+        assert choose_resolution(0, 3600, None, 0, 2000, {"1h"}) == ("1h", 3600.0)
+        assert choose_resolution(0, 86400, 90, 0, 2000, {"1m", "1h"}) == ("1m", 90)
+
+    def test_incremental_rollups_match_raw(self, tmp_path):
+        rng = np.random.default_rng(7)
+        times = np.sort(rng.uniform(0, 3 * 86400, 20000))
+        values = rng.normal(size=len(times))
+        store = _store(tmp_path, segment_points=1024)
+        for chunk in np.array_split(np.arange(len(times)), 37):
+            for i in chunk:
+                store.record("ns:pump", "temp", "value", times[i], values[i])
+            store.flush()
+
+        history = store.series(("ns:pump", "temp", "value"))
+        rows = aggregate({"t": times, "v": values}, 1)
+        for name, width in (("1m", 60), ("1h", 3600), ("1d", 86400)):
+            expected = aggregate(rows, width)
+            stored = history.rollups[name].views(-np.inf, np.inf)
+            actual = {c: np.concatenate([view[c] for view in stored]) for c in expected}
+            for column in expected:
+                np.testing.assert_allclose(actual[column], expected[column])
+
+    def test_long_range_reads_hourly_rollup(self, tmp_path):
+        store = _store(tmp_path, segment_points=65536)
+        times = np.arange(0, 30 * 86400, 10.0)
+        for t in times:
+            store.record("ns:pump", "temp", "value", t, t % 3600)
+        store.flush()
+
+        result = store.query("ns:pump", "temp", 0, 30 * 86400 - 1)
+        assert (result["resolution"], result["step"]) == ("1h", 3600.0)
+        hourly = result["properties"]["value"]
+        assert len(hourly["t"]) == 720
+        assert hourly["min"][0] == 0 and hourly["max"][0] == 3590
+        assert hourly["last"][0] == 3590 and hourly["count"][0] == 360
+        assert hourly["v"][0] == pytest.approx(1795)
+
+        daily = store.query("ns:pump", "temp", 0, 30 * 86400, step=2 * 86400)
+        assert daily["resolution"] == "1d"
+        assert list(daily["properties"]["value"]["count"]) == [17280] * 15
+
+    def test_rollups_backfilled_from_raw(self, tmp_path):
+        store = _store(tmp_path)
+        _fill(store, range(0, 600, 30))
+        directory = store._directory(("ns:pump", "temp", "value"))
+        for name in ("1m", "1h", "1d"):
+            shutil.rmtree(directory / name)
+
+        reopened = _store(tmp_path)
+        result = reopened.query("ns:pump", "temp", 0, 600, step=60)
+        assert result["resolution"] == "1m"
+        assert list(result["properties"]["value"]["count"]) == [2] * 10
+
+
+class TestRetention:
+    """Tests for compressed blocks, compaction and retention"""
+
+    @pytest.mark.parametrize(
+        "times, values",
+        [
+            (1.7e9 + np.arange(1000.0), np.round(np.sin(np.arange(1000) / 50), 2)),
+            (1.7e9 + np.cumsum(np.random.default_rng(3).uniform(0.001, 5, 500)), np.arange(500.0)),
+            (np.array([1.7e9]), np.array([-0.0])),
+            (np.array([-5.0, 0.0, 2.5e9]), np.array([1e300, -1e-300, 7.0])),
+        ],
+    )
+    def test_block_round_trip(self, times, values):
+        ts, vs = decode_block(encode_block(times, values))
+        assert ts.tobytes() == times.tobytes()
+        assert vs.tobytes() == values.tobytes()
+
+    def test_regular_samples_compress(self):
+        times = 1.7e9 + np.arange(65536.0)
+        values = np.full(65536, 21.5)
+        assert len(encode_block(times, values)) < 65536 * 16 / 100
+
+    @pytest.mark.asyncio
+    async def test_compaction_is_transparent(self, tmp_path):
+        day = 86400.0
+        store = _store(tmp_path, raw_retention=day)
+        _fill(store, np.arange(0, 10 * day, 3600))
+        before = store.query("ns:pump", "temp", 0, 10 * day, properties=["value"])
+
+        result = await store.compact(now=10 * day)
+        assert result == {"compacted": 54, "expired": 0}
+        directory = store._directory(("ns:pump", "temp", "value"))
+        assert len(list((directory / "cold").glob("*.blk"))) == 54
+        assert len(list(directory.glob("*.t"))) == 6
+
+        for reader in (store, _store(tmp_path)):
+            after = reader.query("ns:pump", "temp", 0, 10 * day, properties=["value"])
+            for column in ("t", "v"):
+                assert list(after["properties"]["value"][column]) == list(
+                    before["properties"]["value"][column]
+                )
+        # Appending after compaction still rejects samples older than the blocks
+        store.record("ns:pump", "temp", "value", day, 0.0)
+        store.flush()
+        assert store.stats["late"] == 1
+
+    @pytest.mark.asyncio
+    async def test_count_decodes_only_edge_blocks(self, tmp_path, monkeypatch):
+        day = 86400.0
+        times = np.arange(0, 10 * day, 600)
+        store = _store(tmp_path, raw_retention=day)
+        _fill(store, times)
+        await store.compact(now=10 * day)
+        history = store.series(("ns:pump", "temp", "value"))
+        assert len(history.cold.blocks) > 4
+
+        decode = history.cold._decode
+        decoded = []
+
+        def counting_decode(block):
+            decoded.append(block)
+            return decode(block)
+
+        monkeypatch.setattr(history.cold, "_decode", counting_decode)
+        for start, end in ((0, 10 * day), (1, 10 * day - 1), (3000, 5 * day + 1), (7 * day, 7 * day)):
+            decoded.clear()
+            assert history.count(start, end) == np.count_nonzero((times >= start) & (times <= end))
+            assert len(decoded) <= 2
+
+    @pytest.mark.asyncio
+    async def test_expired_raw_falls_back_to_rollups(self, tmp_path):
+        day = 86400.0
+        store = _store(tmp_path, raw_retention=day, compressed_retention=3 * day)
+        _fill(store, np.arange(0, 10 * day, 600))
+        result = await store.compact(now=10 * day)
+        assert result["expired"] > 0
+
+        old = store.query("ns:pump", "temp", 0, 3599)
+        assert old["resolution"] == "1m"
+        assert list(old["properties"]["value"]["count"]) == [1] * 6
+        recent = store.query("ns:pump", "temp", 9 * day, 9 * day + 3600)
+        assert recent["resolution"] == "raw"
+        assert len(recent["properties"]["value"]["t"]) == 7
+
+        reopened = _store(tmp_path, raw_retention=day, compressed_retention=3 * day)
+        assert reopened.query("ns:pump", "temp", 0, 3599)["resolution"] == "1m"
+
+    def test_interrupted_compaction_is_resolved_on_open(self, tmp_path):
+        store = _store(tmp_path)
+        _fill(store, range(10))
+        history = store.series(("ns:pump", "temp", "value"))
+        segment = history.raw.segments[0]
+        view = segment.view(-np.inf, np.inf)
+        history.cold.write(view["t"], view["v"])
+
+        reopened = _store(tmp_path)
+        values = reopened.query("ns:pump", "temp", 0, 100)["properties"]["value"]
+        assert list(values["t"]) == list(range(10))
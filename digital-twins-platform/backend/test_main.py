@@ -2,21 +2,14 @@
 Tests for the Digital Twins Platform API
 """
 
+import asyncio
+
+import httpx
 import pytest
+from fastapi import HTTPException
 from httpx import AsyncClient
-from main import app, ditto_client
-
-
-@pytest.fixture
-def anyio_backend():
-    return "asyncio"
-
-
-@pytest.fixture
-async def client():
-    """Create a test client"""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        yield ac
+from fake_ditto import FakeDitto
+from main import DittoClient
 
 
 class TestHealthEndpoint:
@@ -38,11 +31,145 @@ class TestThingsEndpoints:
     @pytest.mark.asyncio
     async def test_list_things(self, client: AsyncClient):
         """Test listing things"""
-        # This will fail if Ditto is not available, which is expected in unit tests
-        # In integration tests, Ditto should be running
         response = await client.get("/things")
-        # Either success or connection error
-        assert response.status_code in [200, 500, 503]
+        assert response.status_code == 200
+        assert response.json()["items"] == []
+
+    @pytest.mark.asyncio
+    async def test_thing_lifecycle(self, client: AsyncClient, fake_ditto: FakeDitto):
+        """Test create, read, update and delete of a thing"""
+        response = await client.post(
+            "/things/",
+            json={"thing_id": "plant:pump-1", "attributes": {"type": "pump"}},
+        )
+        assert response.status_code == 201
+        assert fake_ditto.things["plant:pump-1"]["policyId"] == "plant:pump-1:policy"
+
+        response = await client.patch(
+            "/things/plant:pump-1",
+            json={"features": {"pressure": {"properties": {"value": 4.2}}}},
+        )
+        assert response.status_code == 200
+
+        thing = (await client.get("/things/plant:pump-1")).json()
+        assert thing["attributes"] == {"type": "pump"}
+        assert thing["features"]["pressure"]["properties"]["value"] == 4.2
+
+        response = await client.delete("/things/plant:pump-1")
+        assert response.status_code == 204
+        response = await client.get("/things/plant:pump-1")
+        assert response.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_property_patches_are_coalesced(self, client: AsyncClient, fake_ditto: FakeDitto):
+        """Test JSON-pointer property patches sharing one Ditto write"""
+        await client.post(
+            "/things/",
+            json={
+                "thing_id": "plant:pump-2",
+                "features": {"motor": {"properties": {"rpm": 0, "mode": "off"}}},
+            },
+        )
+        revision = fake_ditto.revisions["plant:pump-2"]
+        responses = await asyncio.gather(
+            client.patch("/things/plant:pump-2/features/motor/properties/rpm", json=1450),
+            client.patch("/things/plant:pump-2/features/motor/properties/status/temp", json=61.5),
+            client.patch("/things/plant:pump-2/features/motor/properties", json={"mode": None}),
+        )
+        assert [r.status_code for r in responses] == [204, 204, 204]
+        assert fake_ditto.revisions["plant:pump-2"] == revision + 1
+
+        feature = (await client.get("/things/plant:pump-2/features/motor")).json()
+        assert feature == {"properties": {"rpm": 1450, "status": {"temp": 61.5}}}
+
+        response = await client.patch("/things/plant:missing/features/motor/properties/rpm", json=1)
+        assert response.status_code == 404
+        response = await client.patch("/things/plant:pump-2/features/motor/properties", json=[1])
+        assert response.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_missing_feature_is_not_reported_as_missing_thing(self):
+        """Test Ditto's error code telling a missing feature from a missing thing"""
+        errors = {"ns:a": "things:feature.notfound", "ns:b": "things:thing.notfound"}
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            thing_id = request.url.path.split("/")[4]
+            return httpx.Response(404, json={"status": 404, "error": errors[thing_id]})
+
+        ditto = DittoClient("http://ditto", "u", "p", cache_ttl=0)
+        ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with pytest.raises(HTTPException) as feature_missing:
+            await ditto.merge_feature_properties("ns:a", "motor", {"rpm": 1})
+        assert feature_missing.value.detail == "Feature motor not found on thing ns:a"
+        with pytest.raises(HTTPException) as thing_missing:
+            await ditto.merge_feature_properties("ns:b", "motor", {"rpm": 1})
+        assert thing_missing.value.detail == "Thing ns:b not found"
+
+    @pytest.mark.asyncio
+    async def test_fields_projection_and_compression(
+        self, client: AsyncClient, fake_ditto: FakeDitto
+    ):
+        """Test fields pass-through, local projection and gzip"""
+        wide = {f"p{i}": "x" * 20 for i in range(100)}
+        for i in range(3):
+            await client.post(
+                "/things/",
+                json={
+                    "thing_id": f"plant:w{i}",
+                    "attributes": {"site": "north", **wide},
+                    "features": {"temp": {"properties": {"value": i, "unit": "C"}}},
+                },
+            )
+        fields = "thingId,features/temp(properties/value)"
+
+        response = await client.get("/things/", params={"fields": fields})
+        assert response.json()["items"][0] == {
+            "thingId": "plant:w0",
+            "features": {"temp": {"properties": {"value": 0}}},
+        }
+
+        response = await client.get("/things/plant:w1", params={"fields": "attributes/site"})
+        assert response.json() == {"attributes": {"site": "north"}}
+
+        # A fresh cached copy is projected without asking Ditto
+        await client.get("/things/plant:w2")
+        fake_ditto.things.pop("plant:w2")
+        response = await client.get("/things/plant:w2", params={"fields": "thingId"})
+        assert response.json() == {"thingId": "plant:w2"}
+        # ...but special fields only Ditto knows are always fetched
+        await client.get("/things/plant:w1")
+        response = await client.get("/things/plant:w1", params={"fields": "thingId,_revision"})
+        assert response.json() == {
+            "thingId": "plant:w1",
+            "_revision": fake_ditto.revisions["plant:w1"],
+        }
+
+        response = await client.get("/things/plant:w1", params={"fields": "attributes(site"})
+        assert response.status_code == 400
+
+        response = await client.get("/things/", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert int(response.headers["content-length"]) < len(response.content) / 5
+
+    @pytest.mark.asyncio
+    async def test_search_things(self, client: AsyncClient):
+        """Test RQL search through the fake"""
+        for i, kind in enumerate(("pump", "valve", "pump")):
+            await client.post(
+                "/things/", json={"thing_id": f"plant:t{i}", "attributes": {"type": kind}}
+            )
+        response = await client.get(
+            "/search/things", params={"q": 'eq(attributes/type,"pump")', "limit": 1}
+        )
+        assert response.status_code == 200
+        page = response.json()
+        assert [t["thingId"] for t in page["items"]] == ["plant:t0"]
+
+        response = await client.get(
+            "/search/things",
+            params={"q": 'eq(attributes/type,"pump")', "cursor": page["nextPageCursor"]},
+        )
+        assert [t["thingId"] for t in response.json()["items"]] == ["plant:t2"]
 
 
 class TestPoliciesEndpoints:
@@ -52,7 +179,7 @@ class TestPoliciesEndpoints:
     async def test_get_nonexistent_policy(self, client: AsyncClient):
         """Test getting a non-existent policy"""
         response = await client.get("/policies/nonexistent:policy")
-        assert response.status_code in [404, 500, 503]
+        assert response.status_code == 404
 
 
 # Run tests with: pytest test_main.py -v
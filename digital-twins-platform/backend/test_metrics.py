@@ -0,0 +1,58 @@
+"""
+Tests for the Prometheus /metrics endpoint
+"""
+
+import httpx
+import pytest
+from httpx import AsyncClient
+from metrics import httpx_pool_state
+from prometheus_client.parser import text_string_to_metric_families
+
+
+def _samples(text: str):
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+@pytest.mark.asyncio
+async def test_metrics_cover_routes_upstream_and_components(client: AsyncClient):
+    await client.post("/things/", json={"thing_id": "plant:m1"})
+    await client.get("/things/plant:m1")
+    await client.get("/things/plant:missing")
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    samples = _samples(response.text)
+
+    route = (("method", "GET"), ("route", "/things/{thing_id:path}"))
+    assert samples[("http_request_duration_seconds_count", route)] >= 2
+    # Only the scrape itself is still being served
+    assert samples[("http_requests_in_flight", (("method", "GET"),))] == 1
+    assert samples[("http_requests_in_flight", (("method", "POST"),))] == 0
+    assert samples[("http_requests_total", route + (("status", "404"),))] >= 1
+    # Thing ids never become label values
+    assert not any("plant:m1" in str(labels) for _, labels in samples)
+
+    assert samples[("ditto_request_duration_seconds_count", (("operation", "put_thing"),))] >= 1
+    assert samples[("ditto_responses_total", (("operation", "get_thing"), ("status", "404")))] >= 1
+
+    unmatched = (("method", "GET"), ("route", "unmatched"))
+    await client.get("/no/such/route")
+    samples = _samples((await client.get("/metrics")).text)
+    assert samples[("http_requests_total", unmatched + (("status", "404"),))] >= 1
+
+    for name in ("ditto_cache_hits", "telemetry_pending", "ws_events_clients", "ws_ditto_clients"):
+        assert (name, ()) in samples
+
+
+@pytest.mark.asyncio
+async def test_httpx_pool_state():
+    limits = httpx.Limits(max_connections=7)
+    async with httpx.AsyncClient(limits=limits) as real_client:
+        assert httpx_pool_state(real_client) == {"active": 0, "idle": 0, "waiting": 0, "max": 7}
+    in_process = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(200)))
+    assert httpx_pool_state(in_process) is None
@@ -0,0 +1,175 @@
+"""
+Tests for the Ditto circuit breaker, timeouts and background readiness
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from main import DittoClient
+from resilience import CircuitBreaker, CircuitOpenError, ReadinessProbe
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _client(handler, clock=None) -> DittoClient:
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0, clock=clock or FakeClock())
+    ditto = DittoClient("http://ditto", "u", "p", cache_ttl=0, breaker=breaker)
+    ditto._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return ditto
+
+
+class TestCircuitBreaker:
+    """Tests for breaker state transitions"""
+
+    def test_opens_after_consecutive_failures(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=5.0, clock=clock)
+        breaker.record(False)
+        breaker.record(True)
+        breaker.record(False)
+        assert breaker.state == "closed"
+        breaker.record(False)
+        assert breaker.state == "open"
+
+        clock.now += 2
+        with pytest.raises(CircuitOpenError) as error:
+            breaker.before_call()
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "3"
+
+    def test_half_open_admits_one_probe(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5.0, clock=clock)
+        breaker.record(False)
+        clock.now += 5
+        assert breaker.state == "half_open"
+        breaker.before_call()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+        # A cancelled probe frees its slot
+        breaker.record(None)
+        breaker.before_call()
+        breaker.record(False)
+        assert breaker.state == "open"
+
+        clock.now += 5
+        breaker.before_call()
+        breaker.record(True)
+        assert breaker.state == "closed"
+        assert breaker.stats == {"opened": 2, "rejected": 1}
+
+
+class TestDittoClientBreaker:
+    """Tests for fast-fail and timeouts in DittoClient"""
+
+    @pytest.mark.asyncio
+    async def test_outage_fails_fast_then_recovers(self):
+        clock = FakeClock()
+        calls = []
+        healthy = False
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            calls.append(request.url.path)
+            if not healthy:
+                raise httpx.ConnectError("connection refused")
+            return httpx.Response(200, json={"thingId": "ns:a"})
+
+        ditto = _client(handler, clock)
+        for _ in range(3):
+            with pytest.raises(httpx.ConnectError):
+                await ditto.get_thing("ns:a")
+        with pytest.raises(CircuitOpenError):
+            await ditto.get_thing("ns:a")
+        assert len(calls) == 3
+
+        clock.now += 10
+        healthy = True
+        assert await ditto.get_thing("ns:a") == {"thingId": "ns:a"}
+        assert ditto.breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_client_errors_do_not_open_the_circuit(self):
+        ditto = _client(lambda request: httpx.Response(404, json={}))
+        for _ in range(5):
+            with pytest.raises(Exception):
+                await ditto.get_thing("ns:missing")
+        assert ditto.breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_per_operation_timeouts(self):
+        seen = {}
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            seen[request.method] = request.extensions["timeout"]["read"]
+            return httpx.Response(200 if request.method == "GET" else 204, json={})
+
+        ditto = _client(handler)
+        ditto.read_timeout, ditto.timeout = 1.5, 8.0
+        await ditto.get_feature("ns:a", "t")
+        await ditto.merge_thing("ns:a", {"attributes": {"x": 1}})
+        assert seen == {"GET": 1.5, "PATCH": 8.0}
+
+
+@pytest.mark.asyncio
+async def test_readiness_probe_retries_until_healthy():
+    results = iter([RuntimeError("down"), False, True])
+
+    async def check():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    probe = ReadinessProbe(check, interval=0.001, recheck_interval=60)
+    probe.start()
+    for _ in range(100):
+        if probe.ready:
+            break
+        await asyncio.sleep(0.005)
+    await probe.stop()
+    assert probe.ready
+    assert probe.stats == {"checks": 3, "failures": 2}
+
+
+def test_startup_does_not_wait_for_ditto(monkeypatch):
+    async def hung_check():
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(main.readiness, "check", hung_check)
+    monkeypatch.setattr(main.readiness, "ready", False)
+    monkeypatch.setattr(main.settings, "mqtt_bridge_enabled", False)
+    monkeypatch.setattr(main.settings, "ditto_events_enabled", False)
+
+    started = time.perf_counter()
+    with TestClient(main.app) as client:
+        assert time.perf_counter() - started < 2
+        assert client.get("/health").status_code == 200
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "not_ready"
+
+        main.readiness.ready = True
+        assert client.get("/ready").status_code == 200
+
+
+def test_open_circuit_returns_503_with_retry_after(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+    breaker.record(False)
+    monkeypatch.setattr(main.ditto_client, "breaker", breaker)
+    monkeypatch.setattr(main.ditto_client, "_client", httpx.AsyncClient())
+
+    response = TestClient(main.app).get("/things/ns:a")
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) <= 30
@@ -0,0 +1,284 @@
+"""
+Tests for the local secondary search index
+"""
+
+import asyncio
+import random
+
+import pytest
+from httpx import AsyncClient
+
+import main
+from events import ChangeStream
+from rql import compile_filter
+from search_index import SearchIndex, ThingIndex, cursor_filter
+
+PATHS = ["attributes/type", "attributes/floor", "features/temp/properties/value"]
+
+
+def _thing(i: int, rng: random.Random):
+    return {
+        "thingId": f"{rng.choice(['plant', 'lab'])}:t{i:03d}",
+        "attributes": {
+            "type": rng.choice(["pump", "valve", "pump-x", "sensor"]),
+            "floor": rng.choice([0, 1, 2, 2.5, "2", True]),
+        },
+        "features": {"temp": {"properties": {"value": rng.uniform(-5, 40)}}},
+    }
+
+
+def _ids(result):
+    return [t["thingId"] for t in result["items"]]
+
+
+class TestThingIndex:
+    """Tests for answering queries from the index"""
+
+    @pytest.mark.parametrize(
+        "expression",
+        [
+            'eq(attributes/type,"pump")',
+            "eq(attributes/floor,2)",
+            'eq(attributes/floor,"2")',
+            "gt(attributes/floor,1)",
+            "le(attributes/floor,2)",
+            'lt(attributes/type,"sensor")',
+            'like(attributes/type,"pump*")',
+            'like(attributes/type,"?alve")',
+            'eq(_namespace,"lab")',
+            'and(like(attributes/type,"pump*"),ge(features/temp/properties/value,10.5))',
+            'and(eq(attributes/type,"valve"),lt(features/temp/properties/value,0),gt(attributes/floor,0))',
+        ],
+    )
+    def test_matches_rql_evaluation(self, expression):
+        rng = random.Random(7)
+        things = [_thing(i, rng) for i in range(300)]
+        index = ThingIndex(PATHS)
+        for thing in things:
+            index.put(thing)
+
+        expected = sorted(t["thingId"] for t in things if compile_filter(expression)(t))
+        assert expected
+        assert _ids(index.search(expression, limit=1000)) == expected
+
+        # Small pages take the in-order scan for unselective queries
+        paged, cursor = [], None
+        while True:
+            page = index.search(expression, limit=7, cursor=cursor)
+            paged += _ids(page)
+            cursor = page.get("nextPageCursor")
+            if cursor is None:
+                break
+        assert paged == expected
+
+    def test_uncovered_queries_return_none(self):
+        index = ThingIndex(PATHS)
+        for expression in (
+            'or(eq(attributes/type,"a"),eq(attributes/type,"b"))',
+            'eq(attributes/name,"x")',
+            'ne(attributes/type,"pump")',
+            "gt(attributes/floor,true)",
+            "eq(attributes/type",
+        ):
+            assert index.search(expression) is None
+        assert index.search(None, cursor="ditto-cursor") is None
+
+    def test_paging_and_fields(self):
+        index = ThingIndex(PATHS)
+        for i in range(5):
+            index.put({"thingId": f"ns:t{i}", "attributes": {"type": "pump"}})
+        page = index.search('eq(attributes/type,"pump")', limit=2, fields="thingId")
+        assert page == {
+            "items": [{"thingId": "ns:t0"}, {"thingId": "ns:t1"}],
+            "nextPageCursor": "idx:ns:t1",
+        }
+        page = index.search('eq(attributes/type,"pump")', limit=3, cursor=page["nextPageCursor"])
+        assert _ids(page) == ["ns:t2", "ns:t3", "ns:t4"]
+        assert "nextPageCursor" not in page
+
+        assert cursor_filter('eq(a,1)', "idx:ns:t1") == 'and(eq(a,1),gt(thingId,"ns:t1"))'
+        assert compile_filter(cursor_filter(None, "idx:ns:t3"))({"thingId": "ns:t4"})
+
+    def test_applies_change_events(self):
+        index = ThingIndex(PATHS)
+        def event(kind, revision, attributes):
+            return {
+                "event": kind,
+                "thingId": "ns:a",
+                "revision": revision,
+                "data": {"attributes": attributes},
+            }
+
+        index.apply(event("thing.created", 1, {"type": "pump", "floor": 1}))
+        index.apply(event("thing.updated", 3, {"type": "valve", "floor": None}))
+        # Stale events are ignored
+        index.apply(event("thing.updated", 2, {"type": "pump"}))
+        assert index.things["ns:a"] == {"thingId": "ns:a", "attributes": {"type": "valve"}}
+        assert _ids(index.search('eq(attributes/type,"valve")')) == ["ns:a"]
+        assert index.search("gt(attributes/floor,0)")["items"] == []
+
+        index.apply({"event": "thing.deleted", "thingId": "ns:a", "revision": None, "data": {}})
+        assert len(index) == 0
+        assert index.search('eq(attributes/type,"valve")')["items"] == []
+
+    def test_update_to_unknown_thing_marks_it_stale(self):
+        index = ThingIndex(PATHS)
+        partial = {
+            "event": "thing.updated",
+            "thingId": "ns:a",
+            "revision": 7,
+            "data": {"attributes": {"floor": 3}},
+        }
+        assert index.apply(partial) is False
+        assert "ns:a" not in index.things
+        assert index.search("gt(attributes/floor,2)") is None
+
+        index.put({"thingId": "ns:a", "attributes": {"type": "pump", "floor": 3}}, 8)
+        assert not index.stale
+        assert _ids(index.search("gt(attributes/floor,2)")) == ["ns:a"]
+
+    def test_possible_replacement_marks_thing_stale(self):
+        index = ThingIndex(PATHS)
+        index.put({"thingId": "ns:a", "attributes": {"type": "pump", "floor": 3}}, 4)
+        # A PUT that dropped the floor: merging would keep it searchable
+        replaced = {
+            "event": "thing.updated",
+            "thingId": "ns:a",
+            "revision": 5,
+            "data": {"policyId": "ns:a", "attributes": {"type": "valve"}},
+        }
+        # Already reflected in the copy, e.g. replayed after a rebuild
+        assert index.apply({**replaced, "revision": 4}) is True
+        assert not index.stale
+
+        assert index.apply(replaced) is False
+        assert index.stale == {"ns:a"}
+        assert index.search("gt(attributes/floor,2)") is None
+
+        index.put({"thingId": "ns:a", "attributes": {"type": "valve"}}, 5)
+        assert index.search("gt(attributes/floor,2)")["items"] == []
+
+
+@pytest.mark.asyncio
+async def test_rebuild_replays_changes_made_during_bootstrap():
+    search_index = None
+
+    async def source():
+        yield {"thingId": "ns:a", "attributes": {"type": "pump"}, "_revision": 4}
+        # Arrives while the rebuild is paging through Ditto's search
+        search_index.apply(
+            {
+                "event": "thing.created",
+                "thingId": "ns:b",
+                "revision": 1,
+                "data": {"attributes": {"type": "pump"}},
+            }
+        )
+        yield {"thingId": "ns:c", "attributes": {"type": "valve"}, "_revision": 2}
+
+    search_index = SearchIndex(source, paths=["attributes/type"])
+    assert search_index.search('eq(attributes/type,"pump")') is None
+    await search_index.rebuild()
+    assert _ids(search_index.search('eq(attributes/type,"pump")')) == ["ns:a", "ns:b"]
+    assert search_index.snapshot() == {
+        "hits": 1,
+        "fallbacks": 1,
+        "rebuilds": 1,
+        "rebuild_failures": 0,
+        "ready": True,
+        "things": 3,
+        "stale": 0,
+    }
+
+    search_index.invalidate()
+    assert search_index.search('eq(attributes/type,"pump")') is None
+
+
+@pytest.mark.asyncio
+async def test_stale_thing_falls_back_until_rebuild():
+    things = [{"thingId": "ns:a", "attributes": {"type": "pump"}, "_revision": 1}]
+
+    async def source():
+        for thing in things:
+            yield thing
+
+    search_index = SearchIndex(source, paths=["attributes/type"])
+    await search_index.rebuild()
+    # Created through another client, so only its later update is seen here
+    search_index.apply(
+        {
+            "event": "thing.updated",
+            "thingId": "ns:b",
+            "revision": 2,
+            "data": {"attributes": {"type": "valve"}},
+        }
+    )
+    assert search_index.search('eq(attributes/type,"pump")') is None
+    assert search_index._wakeup.is_set()
+
+    things.append({"thingId": "ns:b", "attributes": {"type": "pump"}, "_revision": 2})
+    await search_index.rebuild()
+    assert _ids(search_index.search('eq(attributes/type,"pump")')) == ["ns:a", "ns:b"]
+
+    # A thing the search no longer returns is dropped, not left stale
+    del things[1]
+    await search_index.rebuild()
+    assert _ids(search_index.search('eq(attributes/type,"pump")')) == ["ns:a"]
+
+
+@pytest.mark.asyncio
+async def test_change_stream_drop_invalidates_index():
+    async def empty():
+        return
+        yield
+
+    async def broken():
+        raise ConnectionError("stream closed")
+        yield
+
+    search_index = SearchIndex(empty, paths=["attributes/type"])
+    await search_index.rebuild()
+    stream = ChangeStream(broken)
+    stream.add_disconnect_listener(search_index.invalidate)
+    stream.start()
+    await asyncio.sleep(0.01)
+    await stream.stop()
+    assert not search_index.ready
+
+
+@pytest.mark.asyncio
+async def test_search_routes_use_index_and_fall_back(client: AsyncClient, monkeypatch):
+    for i, kind in enumerate(("pump", "valve", "pump", "pump")):
+        await client.post(
+            "/things/", json={"thing_id": f"plant:s{i}", "attributes": {"type": kind}}
+        )
+
+    index = SearchIndex(
+        lambda: main.ditto_client.iter_things(fields="thingId,policyId,attributes,features"),
+        paths=["attributes/type"],
+    )
+    await index.rebuild()
+    monkeypatch.setattr(main, "search_index", index)
+
+    searches = []
+    list_things = main.ditto_client.list_things
+
+    async def counting_list_things(**kwargs):
+        searches.append(kwargs["filter_str"])
+        return await list_things(**kwargs)
+
+    monkeypatch.setattr(main.ditto_client, "list_things", counting_list_things)
+
+    params = {"q": 'eq(attributes/type,"pump")', "limit": 2}
+    page = (await client.get("/search/things", params=params)).json()
+    assert _ids(page) == ["plant:s0", "plant:s2"]
+    assert searches == []
+
+    # Later pages continue in Ditto if the index can no longer answer
+    index.invalidate()
+    response = await client.get(
+        "/search/things",
+        params={"q": 'eq(attributes/type,"pump")', "cursor": page["nextPageCursor"]},
+    )
+    assert _ids(response.json()) == ["plant:s3"]
+    assert searches == ['and(eq(attributes/type,"pump"),gt(thingId,"plant:s2"))']
@@ -0,0 +1,181 @@
+"""
+Tests for fleet snapshot export and import
+"""
+
+import asyncio
+import gzip
+import io
+
+import orjson
+import pytest
+from snapshot import export_batches, import_documents, ndjson_lines
+
+
+def _fleet(fake_ditto, things: int = 5, policies: int = 2) -> None:
+    for p in range(policies):
+        policy_id = f"org.example:policy-{p}"
+        fake_ditto.policies[policy_id] = {"policyId": policy_id, "entries": {"owner": {}}}
+    for t in range(things):
+        thing_id = f"org.example:pump-{t}"
+        fake_ditto.things[thing_id] = {
+            "thingId": thing_id,
+            "policyId": f"org.example:policy-{t % policies}",
+            "attributes": {"type": "pump"},
+            "features": {"flow": {"properties": {"value": t}}},
+        }
+        fake_ditto.revisions[thing_id] = 1
+
+
+def _lines(body: bytes):
+    return [orjson.loads(line) for line in body.splitlines()]
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_export_emits_each_policy_once_before_its_things():
+    things = [{"thingId": f"ns:t{i}", "policyId": f"ns:p{i % 2}"} for i in range(5)]
+    fetched = []
+
+    async def get_policy(policy_id):
+        fetched.append(policy_id)
+        return {"policyId": policy_id, "entries": {}}
+
+    batches = [b async for b in export_batches(_aiter(things), get_policy, batch_size=2)]
+    assert [len(b) for b in batches] == [4, 2, 1]
+    assert [d.get("policyId") for d in batches[0][:2]] == ["ns:p0", "ns:p1"]
+    assert "entries" not in batches[1][0]
+    assert fetched == ["ns:p0", "ns:p1"]
+
+
+@pytest.mark.asyncio
+async def test_export_skips_missing_policies():
+    async def get_policy(policy_id):
+        return None
+
+    things = [{"thingId": "ns:t0", "policyId": "ns:gone"}]
+    batches = [b async for b in export_batches(_aiter(things), get_policy)]
+    assert batches == [things]
+
+
+@pytest.mark.asyncio
+async def test_import_waits_for_policy_and_bounds_parallelism():
+    written, in_flight, peak = [], [0], [0]
+
+    async def put_policy(policy_id, policy):
+        await asyncio.sleep(0.01)
+        written.append(policy_id)
+
+    async def put_thing(thing):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        assert thing["policyId"] in written
+        await asyncio.sleep(0.001)
+        in_flight[0] -= 1
+
+    lines = [orjson.dumps({"policyId": "ns:p", "entries": {}})] + [
+        orjson.dumps({"thingId": f"ns:t{i}", "policyId": "ns:p"}) for i in range(20)
+    ]
+    result = await import_documents(_aiter(lines), put_policy, put_thing, concurrency=4)
+    assert result == {"policies": 1, "things": 20, "failed": 0, "errors": []}
+    assert peak[0] <= 4
+
+
+@pytest.mark.asyncio
+async def test_import_fails_things_with_their_policy():
+    async def put_policy(policy_id, policy):
+        raise RuntimeError("denied")
+
+    async def put_thing(thing):
+        pass
+
+    lines = [
+        b'{"policyId": "ns:p", "entries": {}}',
+        b'{"thingId": "ns:t", "policyId": "ns:p"}',
+        b"not json",
+    ]
+    result = await import_documents(_aiter(lines), put_policy, put_thing)
+    assert (result["policies"], result["things"], result["failed"]) == (0, 0, 3)
+    assert {"policyId": "ns:p", "error": "denied"} in result["errors"]
+    assert {"thingId": "ns:t", "error": "denied"} in result["errors"]
+    assert any(error.get("line") == 3 for error in result["errors"])
+
+
+@pytest.mark.asyncio
+async def test_ndjson_lines_across_chunks_and_gzip():
+    body = gzip.compress(b'{"a": 1}\n\n{"b": 2}\n{"c": 3}')
+    chunks = [body[i : i + 7] for i in range(0, len(body), 7)]
+    lines = [line async for line in ndjson_lines(_aiter(chunks), "gzip")]
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+@pytest.mark.asyncio
+async def test_ndjson_lines_cap_line_length():
+    bomb = gzip.compress(b"0" * (64 * 1024 * 1024))
+    with pytest.raises(ValueError, match="exceeds"):
+        async for _ in ndjson_lines(_aiter([bomb]), "gzip", max_line_size=1024 * 1024):
+            pass
+
+    body = b'{"a": 1}\n' + b"x" * 100 + b'\n{"b": 2}'
+    with pytest.raises(ValueError):
+        [line async for line in ndjson_lines(_aiter([body]), max_line_size=50)]
+    lines = [line async for line in ndjson_lines(_aiter([body[:30], body[30:]]), max_line_size=100)]
+    assert lines == [b'{"a": 1}', b"x" * 100, b'{"b": 2}']
+
+
+@pytest.mark.asyncio
+async def test_ndjson_snapshot_round_trip(client, fake_ditto):
+    _fleet(fake_ditto)
+    response = await client.get("/snapshot/export", params={"page_size": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    documents = _lines(response.content)
+    assert len(documents) == 7
+    assert documents[0]["policyId"] == "org.example:policy-0" and "entries" in documents[0]
+
+    things, policies = dict(fake_ditto.things), dict(fake_ditto.policies)
+    fake_ditto.things.clear()
+    fake_ditto.policies.clear()
+    response = await client.post(
+        "/snapshot/import",
+        content=gzip.compress(response.content),
+        headers={"Content-Encoding": "gzip"},
+    )
+    assert response.json() == {"policies": 2, "things": 5, "failed": 0, "errors": []}
+    assert fake_ditto.things == things
+    assert fake_ditto.policies == policies
+
+
+@pytest.mark.asyncio
+async def test_parquet_snapshot_round_trip(client, fake_ditto):
+    pq = pytest.importorskip("pyarrow.parquet")
+    _fleet(fake_ditto, things=450, policies=3)
+    response = await client.get("/snapshot/export", params={"format": "parquet"})
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 453
+    assert table.column("kind").to_pylist()[:4] == ["policy", "policy", "policy", "thing"]
+
+    things = dict(fake_ditto.things)
+    fake_ditto.things.clear()
+    fake_ditto.policies.clear()
+    response = await client.post(
+        "/snapshot/import",
+        content=response.content,
+        headers={"Content-Type": "application/vnd.apache.parquet"},
+    )
+    assert response.json()["things"] == 450
+    assert fake_ditto.things == things
+
+
+@pytest.mark.asyncio
+async def test_import_reports_missing_policy(client, fake_ditto):
+    body = b'{"thingId": "org.example:orphan", "policyId": "org.example:none"}\n'
+    response = await client.post("/snapshot/import", content=body)
+    result = response.json()
+    assert result["failed"] == 1
+    assert result["errors"][0]["thingId"] == "org.example:orphan"
+    assert result["errors"][0]["status"] == 400
@@ -0,0 +1,289 @@
+"""
+Tests for telemetry ingest and micro-batching
+"""
+
+import asyncio
+import gzip
+import json
+
+import main
+import pytest
+from telemetry import (
+    BacklogFull,
+    PayloadTooLarge,
+    TelemetryBatcher,
+    WriteCoalescer,
+    can_merge,
+    decode_body,
+    parse_payloads,
+    pointer_to_patch,
+    telemetry_to_patch,
+    to_thing_id,
+)
+
+
+class RecordingApply:
+    """Collects the patches a batcher would send to Ditto"""
+
+    def __init__(self, fail_for=()):
+        self.calls = []
+        self.fail_for = set(fail_for)
+
+    async def __call__(self, thing_id, patch):
+        if thing_id in self.fail_for:
+            raise RuntimeError("upstream error")
+        self.calls.append((thing_id, patch))
+
+
+class TestPayloadDecoding:
+    """Tests for body decoding and patch conversion"""
+
+    def test_parse_single_array_and_ndjson(self):
+        assert parse_payloads(b'{"twin_id": "a"}') == [{"twin_id": "a"}]
+        assert len(parse_payloads(b'[{"a": 1}, {"a": 2}]')) == 2
+        assert len(parse_payloads(b'{"a": 1}\n\n{"a": 2}\n')) == 2
+        assert parse_payloads(b"  ") == []
+
+    def test_parse_rejects_non_objects(self):
+        with pytest.raises(ValueError):
+            parse_payloads(b"[1, 2]")
+
+    def test_gzip_body(self):
+        body = gzip.compress(b'{"a": 1}')
+        assert parse_payloads(decode_body(body, "gzip")) == [{"a": 1}]
+
+    def test_gzip_body_is_capped(self):
+        bomb = gzip.compress(b" " * (10 * 1024 * 1024))
+        assert len(bomb) < 20000
+        with pytest.raises(PayloadTooLarge):
+            decode_body(bomb, "gzip", max_size=1024 * 1024)
+        two_members = gzip.compress(b'{"a": 1}\n') + gzip.compress(b'{"a": 2}')
+        assert len(parse_payloads(decode_body(two_members, "gzip", max_size=100))) == 2
+        for broken in (b"not gzip", gzip.compress(b'{"a": 1}')[:-4]):
+            with pytest.raises(ValueError):
+                decode_body(broken, "gzip")
+
+    def test_thing_id_namespace(self):
+        assert to_thing_id("twin-001", "plant") == "plant:twin-001"
+        assert to_thing_id("acme:twin-001", "plant") == "acme:twin-001"
+        for twin_id in (None, "", 123, ["twin-001"]):
+            with pytest.raises(ValueError):
+                to_thing_id(twin_id, "plant")
+
+    def test_pointer_to_patch(self):
+        assert pointer_to_patch("/status/rpm", 1450) == {"status": {"rpm": 1450}}
+        assert pointer_to_patch("a~1b/c~0d", None) == {"a/b": {"c~d": None}}
+        assert pointer_to_patch("", {"x": 1}) == {"x": 1}
+
+    def test_simulator_payload_to_patch(self):
+        payload = {
+            "twin_id": "twin-001",
+            "status": "warning",
+            "timestamp": "2025-01-01T00:00:00+00:00",
+            "sensors": [
+                {"sensor_id": "s001-temp", "name": "Temp", "unit": "°C", "value": 81.0},
+            ],
+        }
+        patch = telemetry_to_patch(payload)
+        assert patch["attributes"] == {"status": "warning"}
+        props = patch["features"]["s001-temp"]["properties"]
+        assert props["value"] == 81.0
+        assert props["timestamp"] == payload["timestamp"]
+        assert "name" not in props
+
+    def test_malformed_sensors_are_rejected(self):
+        for sensors in ([1], {"a": 1}, "temp", [{"sensor_id": 7, "value": 1}]):
+            with pytest.raises(ValueError):
+                telemetry_to_patch({"sensors": sensors})
+        assert telemetry_to_patch({"sensors": None}) == {}
+        assert telemetry_to_patch({"sensors": [{"value": 1}]}) == {}
+
+
+class TestTelemetryBatcher:
+    """Tests for per-thing coalescing and flushing"""
+
+    @pytest.mark.asyncio
+    async def test_coalesces_per_thing(self):
+        apply = RecordingApply()
+        batcher = TelemetryBatcher(apply)
+        for value in (1, 2, 3):
+            batcher.submit("ns:a", {"features": {"t": {"properties": {"value": value}}}})
+        batcher.submit("ns:a", {"attributes": {"status": "ok"}})
+        batcher.submit("ns:b", {"features": {"t": {"properties": {"value": 9}}}})
+
+        assert await batcher.flush() == 2
+        sent = dict(apply.calls)
+        assert sent["ns:a"] == {
+            "features": {"t": {"properties": {"value": 3}}},
+            "attributes": {"status": "ok"},
+        }
+        assert batcher.stats == {"received": 5, "flushed": 2, "failed": 0, "shed": 0}
+        assert await batcher.flush() == 0
+
+    @pytest.mark.asyncio
+    async def test_unmergeable_patch_is_sent_after_pending_one(self):
+        apply = RecordingApply()
+        batcher = TelemetryBatcher(apply)
+        batcher.submit("ns:a", {"features": {"x": None}})
+        batcher.submit("ns:a", {"features": {"x": {"properties": {"v": 1}}}})
+        batcher.submit("ns:a", {"features": {"x": {"properties": {"w": 2}}}})
+        assert batcher.pending == 1
+
+        assert await batcher.flush() == 2
+        assert apply.calls == [
+            ("ns:a", {"features": {"x": None}}),
+            ("ns:a", {"features": {"x": {"properties": {"v": 1, "w": 2}}}}),
+        ]
+        assert batcher.stats == {"received": 3, "flushed": 2, "failed": 0, "shed": 0}
+
+    @pytest.mark.asyncio
+    async def test_failures_do_not_fail_batch(self):
+        apply = RecordingApply(fail_for={"ns:bad"})
+        batcher = TelemetryBatcher(apply)
+        batcher.submit("ns:bad", {"attributes": {"x": 1}})
+        batcher.submit("ns:good", {"attributes": {"x": 1}})
+        assert await batcher.flush() == 1
+        assert batcher.stats["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_background_flush_and_stop(self):
+        apply = RecordingApply()
+        batcher = TelemetryBatcher(apply, flush_interval=0.01)
+        batcher.start()
+        batcher.submit("ns:a", {"attributes": {"x": 1}})
+        await asyncio.sleep(0.05)
+        assert apply.calls == [("ns:a", {"attributes": {"x": 1}})]
+
+        batcher.submit("ns:a", {"attributes": {"x": 2}})
+        await batcher.stop()
+        assert apply.calls[-1] == ("ns:a", {"attributes": {"x": 2}})
+        assert batcher.pending == 0
+
+    @pytest.mark.asyncio
+    async def test_max_pending_triggers_early_flush(self):
+        apply = RecordingApply()
+        batcher = TelemetryBatcher(apply, flush_interval=60, max_pending=2)
+        batcher.start()
+        batcher.submit("ns:a", {"attributes": {"x": 1}})
+        batcher.submit("ns:b", {"attributes": {"x": 1}})
+        # Long before the 60 s flush interval
+        async with asyncio.timeout(5):
+            while len(apply.calls) < 2:
+                await asyncio.sleep(0.001)
+        await batcher.stop()
+
+    @pytest.mark.asyncio
+    async def test_backlog_sheds_new_things(self):
+        apply = RecordingApply()
+        batcher = TelemetryBatcher(apply, max_pending=1, max_backlog=2)
+        recorded = []
+        batcher.add_listener(lambda thing_id, patch: recorded.append(thing_id))
+        batcher.submit("ns:a", {"attributes": {"x": 1}})
+        batcher.submit("ns:b", {"attributes": {"x": 1}})
+        with pytest.raises(BacklogFull):
+            batcher.submit("ns:c", {"attributes": {"x": 1}})
+        # Things already buffered still take updates
+        batcher.submit("ns:a", {"attributes": {"x": 2}})
+        assert recorded == ["ns:a", "ns:b", "ns:a"]
+        assert batcher.stats["shed"] == 1
+
+        await batcher.flush()
+        batcher.submit("ns:c", {"attributes": {"x": 1}})
+        assert batcher.pending == 1
+
+
+class TestWriteCoalescer:
+    """Tests for coalescing synchronous writes"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_writes_share_one_upstream_write(self):
+        apply = RecordingApply()
+        coalescer = WriteCoalescer(apply, window=0.01)
+        await asyncio.gather(
+            coalescer.write("k", {"status": {"rpm": 1}}),
+            coalescer.write("k", {"status": {"rpm": 2, "temp": 40}}),
+            coalescer.write("k", {"mode": "auto"}),
+            coalescer.write("other", {"mode": "manual"}),
+        )
+        assert sorted(apply.calls) == [
+            ("k", {"status": {"rpm": 2, "temp": 40}, "mode": "auto"}),
+            ("other", {"mode": "manual"}),
+        ]
+        assert coalescer.snapshot() == {"received": 4, "flushed": 2, "failed": 0, "pending": 0}
+
+    @pytest.mark.asyncio
+    async def test_unmergeable_write_starts_ordered_batch(self):
+        assert not can_merge({"status": None}, {"status": {"rpm": 1}})
+        assert can_merge({"status": {"rpm": 1}}, {"status": {"temp": 2}, "x": None})
+
+        apply = RecordingApply()
+        coalescer = WriteCoalescer(apply, window=0.01)
+        await asyncio.gather(
+            coalescer.write("k", {"status": None}),
+            coalescer.write("k", {"status": {"rpm": 1}}),
+        )
+        assert apply.calls == [("k", {"status": None}), ("k", {"status": {"rpm": 1}})]
+
+    @pytest.mark.asyncio
+    async def test_failure_reaches_every_caller(self):
+        coalescer = WriteCoalescer(RecordingApply(fail_for={"bad"}), window=0.01)
+        results = await asyncio.gather(
+            coalescer.write("bad", {"a": 1}),
+            coalescer.write("bad", {"b": 1}),
+            return_exceptions=True,
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert coalescer.stats["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stop_flushes_pending_writes(self):
+        apply = RecordingApply()
+        coalescer = WriteCoalescer(apply, window=60)
+        write = asyncio.ensure_future(coalescer.write("k", {"a": 1}))
+        await asyncio.sleep(0)
+        await coalescer.stop()
+        await write
+        assert apply.calls == [("k", {"a": 1})]
+
+
+@pytest.mark.asyncio
+async def test_telemetry_routes_reject_bombs_and_shed_load(client, monkeypatch):
+    monkeypatch.setattr(main.settings, "telemetry_max_body_size", 1024)
+    response = await client.post(
+        "/api/v1/telemetry",
+        content=gzip.compress(b" " * 4096),
+        headers={"Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 413
+
+    batcher = TelemetryBatcher(RecordingApply(), max_pending=1, max_backlog=1)
+    monkeypatch.setattr(main, "telemetry_batcher", batcher)
+    readings = [{"status": "ok"}] + [{"twin_id": f"twin-{i}", "status": "ok"} for i in range(3)]
+    body = "\n".join(json.dumps(r) for r in readings)
+    response = await client.post("/api/v1/telemetry", content=body)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    detail = response.json()["detail"]
+    assert (detail["index"], detail["accepted"], detail["rejected"]) == (2, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_telemetry_routes_count_rejected_readings(client, monkeypatch):
+    batcher = TelemetryBatcher(RecordingApply())
+    monkeypatch.setattr(main, "telemetry_batcher", batcher)
+    readings = [
+        {"twin_id": "twin-1", "sensors": [{"sensor_id": "t", "value": 1}]},
+        {"twin_id": 123, "status": "ok"},
+        {"twin_id": "twin-2", "sensors": [1]},
+        {"twin_id": "twin-3", "sensors": {"t": 1}},
+        {"status": "ok"},
+    ]
+    body = "\n".join(json.dumps(r) for r in readings)
+    response = await client.post("/api/v1/telemetry", content=body)
+    assert response.status_code == 202
+    assert response.json() == {"accepted": 1, "rejected": 4}
+
+    response = await client.post("/api/v1/twins/twin-4/telemetry", content=json.dumps(readings[1:]))
+    assert response.status_code == 202
+    assert response.json() == {"accepted": 2, "rejected": 2}
+    assert sorted(batcher._pending) == ["digitaltwins:twin-1", "digitaltwins:twin-4"]
@@ -448,7 +448,7 @@ class RESTPublisher(Publisher):
             url = f"{self.base_url}/api/v1/twins/{twin_data['twin_id']}/telemetry"
             response = self.session.post(url, json=twin_data, timeout=5)
             
-            if response.status_code == 200:
+            if response.status_code in (200, 202):
                 logger.debug(f"Published to REST: {twin_data['twin_id']}")
                 return True
             else: